@@ -1,27 +1,140 @@
 # Copyright (c) 2019. All rights reserved.
 
 from abc import ABCMeta, abstractmethod
+import asyncio
+import functools
+import heapq
+import itertools
 import json
 import jsonschema  # type: ignore
 import logging
-from typing import Any, Dict
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Collection,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+from urllib.parse import urlencode
 import uuid
 
+from tornado.escape import url_escape
+from tornado.httpclient import AsyncHTTPClient, HTTPResponse
+
 from addrservice import ADDRESS_BOOK_SCHEMA, LOGGER_NAME
+from addrservice.aggregates import (
+    aggregate_counts,
+    aggregates_dict,
+    Aggregates,
+    entry_counts,
+)
+from addrservice.cache import TinyLFUCache
+from addrservice.changelog import (
+    ChangeLog,
+    DEFAULT_RETENTION,
+    OP_CREATE,
+    OP_DELETE,
+    OP_UPDATE,
+    ResyncRequiredError,
+)
+from addrservice.pincode_index import entry_pincodes, Pincode, PincodeIndex
+from addrservice.sharding import DEFAULT_VIRTUAL_NODES, HashRing
+from addrservice.snapshot import Snapshot
+import addrservice.tracing as tracing
+from addrservice.workers import entry_size, WorkerPool
+from addrservice.write_batch import Write, WriteBatcher
+
+
+# Top level fields of an entry, which reads may be limited to
+ENTRY_FIELDS = frozenset(
+    ADDRESS_BOOK_SCHEMA['definitions']['addressEntry']['properties']
+)
+
+Fields = Optional[Collection[str]]
+
+
+def project_address(addr: Dict, fields: Fields) -> Dict:
+    '''Entry with only the given top level fields (all if None).'''
+    if fields is None:
+        return addr
+    return {k: v for k, v in addr.items() if k in fields}
+
+
+def validate_address(addr: Dict) -> None:
+    # Module level function, so that it can be sent to a process pool.
+    try:
+        jsonschema.validate(addr, ADDRESS_BOOK_SCHEMA)
+    except jsonschema.exceptions.ValidationError:
+        raise ValueError('JSON Schema validation failed')
+
+
+# Called after each mutation with: op, nickname, old entry, new entry.
+# Old entry is None on create, and also when a backend can't know it.
+MutationListener = Callable[[str, str, Optional[Dict], Optional[Dict]], None]
 
 
 class AbstractAddressBookDB(metaclass=ABCMeta):
+    # Set by the service to offload validation of large entries, see
+    # set_worker_pool()
+    worker_pool: Optional[WorkerPool] = None
+    # Whether all changes of the entries are in the change log, i.e. none
+    # are made by others, e.g. other processes, so that its seq versions them
+    complete_changelog = True
+
+    def __init__(self, changelog_retention: int = DEFAULT_RETENTION) -> None:
+        self.changelog = ChangeLog(changelog_retention)
+        self.listeners: List[MutationListener] = []
+
+    def add_listener(self, listener: MutationListener) -> None:
+        self.listeners.append(listener)
+
+    def set_worker_pool(self, worker_pool: Optional[WorkerPool]) -> None:
+        self.worker_pool = worker_pool
+
+    def _notify(
+        self,
+        op: str,
+        nickname: str,
+        old: Optional[Dict],
+        new: Optional[Dict]
+    ) -> None:
+        self.changelog.append(op, nickname, new)
+        self._notify_listeners(op, nickname, old, new)
+
+    def _notify_listeners(
+        self,
+        op: str,
+        nickname: str,
+        old: Optional[Dict],
+        new: Optional[Dict]
+    ) -> None:
+        for listener in self.listeners:
+            listener(op, nickname, old, new)
+
     def start(self):
         pass
 
     def stop(self):
         pass
 
+    def stats(self) -> Optional[Dict[str, Any]]:
+        return None
+
     def validate_address(self, addr: Dict) -> None:
-        try:
-            jsonschema.validate(addr, ADDRESS_BOOK_SCHEMA)
-        except jsonschema.exceptions.ValidationError:
-            raise ValueError('JSON Schema validation failed')
+        validate_address(addr)
+
+    async def _validate_address(self, addr: Dict) -> None:
+        if self.worker_pool is None:
+            self.validate_address(addr)
+        else:
+            await self.worker_pool.run(
+                'validate', entry_size(addr), validate_address, addr
+            )
 
     # CRUD
 
@@ -30,7 +143,12 @@ class AbstractAddressBookDB(metaclass=ABCMeta):
         raise NotImplementedError()
 
     @abstractmethod
-    async def read_address(self, nickname: str) -> Dict:
+    async def read_address(
+        self,
+        nickname: str,
+        fields: Fields = None
+    ) -> Dict:
+        '''Entry, with only the given fields if any (see project_address).'''
         raise NotImplementedError()
 
     @abstractmethod
@@ -42,45 +160,173 @@ class AbstractAddressBookDB(metaclass=ABCMeta):
         raise NotImplementedError()
 
     @abstractmethod
-    async def read_all_addresses(self) -> Dict[str, Dict]:
+    async def read_all_addresses(
+        self,
+        fields: Fields = None
+    ) -> Dict[str, Dict]:
+        raise NotImplementedError()
+
+    # Queries
+
+    async def search_addresses(
+        self,
+        query: str,
+        k: int
+    ) -> Optional[List[Tuple[str, float, Dict]]]:
+        '''
+        Top k (nickname, score, entry) fuzzy matches of the query, best
+        first; None if the store does not search itself.
+        '''
+        return None
+
+    @abstractmethod
+    async def read_addresses_by_pincode(
+        self,
+        low: Pincode,
+        high: Pincode,
+        limit: Optional[int] = None
+    ) -> Dict[str, Dict]:
+        '''Entries with any pincode in [low, high], in pincode order.'''
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def nearest_pincodes(
+        self,
+        pincode: Pincode,
+        k: int
+    ) -> List[Tuple[Pincode, str]]:
+        '''k (pincode, nickname) pairs closest to the pincode.'''
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def read_aggregates(self) -> Dict:
+        '''Aggregates over all entries (see addrservice.aggregates).'''
         raise NotImplementedError()
 
 
 class InMemoryAddressBookDB(AbstractAddressBookDB):
-    def __init__(self):
-        self.db = {}
+    def __init__(self, changelog_retention: int = DEFAULT_RETENTION) -> None:
+        super().__init__(changelog_retention)
+        self.db: Dict[str, Dict] = {}
+        self.pincode_index = PincodeIndex()
+        self.add_listener(self.pincode_index.on_mutation)
+        self.aggregates = Aggregates()
+        self.add_listener(self.aggregates.on_mutation)
+
+    def _check_write(self, nickname: str, addr: Dict) -> None:
+        '''Called after validation, right before an entry is written.'''
+        pass
 
+    @tracing.trace()
     async def create_address(self, addr: Dict, nickname: str = None) -> str:
         if nickname is None:
             nickname = uuid.uuid4().hex
 
+        # Validated first: a concurrent create may finish while validating
+        await self._validate_address(addr)
+
         if nickname in self.db:
             raise KeyError('{} already exists'.format(nickname))
-
-        self.validate_address(addr)
+        self._check_write(nickname, addr)
 
         self.db[nickname] = addr
+        self._notify(OP_CREATE, nickname, None, addr)
         return nickname
 
-    async def read_address(self, nickname: str) -> Dict:
-        return self.db[nickname]
+    @tracing.trace()
+    async def read_address(
+        self,
+        nickname: str,
+        fields: Fields = None
+    ) -> Dict:
+        return project_address(self.db[nickname], fields)
 
+    @tracing.trace()
     async def update_address(self, nickname: str, addr: Dict) -> None:
         if nickname is None or nickname not in self.db:
             raise KeyError('{} does not exist'.format(nickname))
 
-        self.validate_address(addr)
+        await self._validate_address(addr)
+        self._check_write(nickname, addr)
 
+        old = self.db[nickname]
         self.db[nickname] = addr
+        self._notify(OP_UPDATE, nickname, old, addr)
 
+    @tracing.trace()
     async def delete_address(self, nickname: str) -> None:
         if nickname is None or nickname not in self.db:
             raise KeyError('{} does not exist'.format(nickname))
 
-        del self.db[nickname]
+        old = self.db.pop(nickname)
+        self._notify(OP_DELETE, nickname, old, None)
+
+    @tracing.trace()
+    async def read_all_addresses(
+        self,
+        fields: Fields = None
+    ) -> Dict[str, Dict]:
+        if fields is None:
+            return self.db
+        return {
+            nickname: project_address(addr, fields)
+            for nickname, addr in self.db.items()
+        }
+
+    @tracing.trace()
+    async def read_addresses_by_pincode(
+        self,
+        low: Pincode,
+        high: Pincode,
+        limit: Optional[int] = None
+    ) -> Dict[str, Dict]:
+        nicknames = self.pincode_index.range(low, high, limit)
+        return {nickname: self.db[nickname] for nickname in nicknames}
+
+    @tracing.trace()
+    async def nearest_pincodes(
+        self,
+        pincode: Pincode,
+        k: int
+    ) -> List[Tuple[Pincode, str]]:
+        return self.pincode_index.nearest(pincode, k)
+
+    @tracing.trace()
+    async def read_aggregates(self) -> Dict:
+        return self.aggregates.to_dict()
+
+    def load(self, entries: Iterable[Tuple[str, Dict]], seq: int) -> None:
+        '''
+        Replaces all entries, e.g. with a snapshot of a primary, as of its
+        change log seq. Entries are trusted, and not validated. Listeners
+        see the removal of each old entry and the creation of each new one.
+        '''
+        old_db, self.db = self.db, dict(entries)
+        for nickname, old in old_db.items():
+            self._notify_listeners(OP_DELETE, nickname, old, None)
+        for nickname, addr in self.db.items():
+            self._notify_listeners(OP_CREATE, nickname, None, addr)
+        self.changelog.reset(seq)
 
-    async def read_all_addresses(self) -> Dict[str, Dict]:
-        return self.db
+    def apply_change(
+        self,
+        op: str,
+        nickname: str,
+        addr: Optional[Dict]
+    ) -> None:
+        '''
+        Applies a change of a primary: a delete, or else an upsert of the
+        entry. Entries are trusted, and not validated.
+        '''
+        old = self.db.get(nickname)
+        if op == OP_DELETE or addr is None:
+            if nickname in self.db:
+                del self.db[nickname]
+            self._notify(OP_DELETE, nickname, old, None)
+        else:
+            self.db[nickname] = addr
+            op = OP_CREATE if old is None else OP_UPDATE
+            self._notify(op, nickname, old, addr)
 
 
 class SomeSQLdbConnector:
@@ -96,61 +342,1161 @@ class SomeSQLdbConnector:
         raise NotImplementedError()
 
 
+SQL_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS ADDRESSES (
+    NICKNAME VARCHAR(64) PRIMARY KEY,
+    ADDRESS JSONB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ADDRESS_PINCODES (
+    NICKNAME VARCHAR(64) NOT NULL REFERENCES ADDRESSES ON DELETE CASCADE,
+    PINCODE NUMERIC NOT NULL,
+    PRIMARY KEY (NICKNAME, PINCODE)
+);
+CREATE INDEX IF NOT EXISTS ADDRESS_PINCODES_PINCODE_IDX
+    ON ADDRESS_PINCODES (PINCODE, NICKNAME);
+CREATE TABLE IF NOT EXISTS ADDRESS_COUNTS (
+    NICKNAME VARCHAR(64) NOT NULL REFERENCES ADDRESSES ON DELETE CASCADE,
+    AGG VARCHAR(32) NOT NULL,
+    VAL TEXT NOT NULL,
+    N INTEGER NOT NULL,
+    PRIMARY KEY (NICKNAME, AGG, VAL)
+);
+CREATE TABLE IF NOT EXISTS ADDRESS_AGGREGATES (
+    AGG VARCHAR(32) NOT NULL,
+    VAL TEXT NOT NULL,
+    N INTEGER NOT NULL,
+    PRIMARY KEY (AGG, VAL)
+);
+'''
+
+
+def _insert_pincodes_query(nickname: str, addr: Dict) -> str:
+    pincodes = entry_pincodes(addr)
+    if not pincodes:
+        return ''
+    return '''INSERT INTO
+              ADDRESS_PINCODES (NICKNAME, PINCODE)
+              VALUES {};
+           '''.format(', '.join(
+               "('{}', {})".format(nickname, p) for p in pincodes
+           ))
+
+
+def _insert_counts_query(nickname: str, addr: Dict) -> str:
+    rows = [
+        "('{}', '{}', {:d})".format(agg, val.replace("'", "''"), n)
+        for (agg, val), n in entry_counts(addr).items()
+    ]
+    return '''INSERT INTO
+              ADDRESS_COUNTS (NICKNAME, AGG, VAL, N)
+              SELECT '{n}', * FROM (VALUES {rows}) C;
+              INSERT INTO
+              ADDRESS_AGGREGATES (AGG, VAL, N)
+              VALUES {rows}
+              ON CONFLICT (AGG, VAL)
+              DO UPDATE SET N = ADDRESS_AGGREGATES.N + EXCLUDED.N;
+           '''.format(n=nickname, rows=', '.join(rows))
+
+
+def _delete_counts_query(nickname: str) -> str:
+    return '''UPDATE ADDRESS_AGGREGATES A
+              SET N = A.N - C.N
+              FROM ADDRESS_COUNTS C
+              WHERE C.NICKNAME = '{n}' AND A.AGG = C.AGG AND A.VAL = C.VAL;
+              DELETE FROM ADDRESS_COUNTS
+              WHERE NICKNAME = '{n}';
+           '''.format(n=nickname)
+
+
+def _write_query(op: str, nickname: str, addr: Optional[Dict]) -> str:
+    if op == OP_CREATE:
+        query = '''INSERT INTO
+                   ADDRESSES (NICKNAME, ADDRESS)
+                   VALUES ('{}' ,'{}');
+                '''.format(nickname, json.dumps(addr))
+    elif op == OP_UPDATE:
+        query = _delete_counts_query(nickname) + '''UPDATE ADDRESSES
+                   SET ADDRESS = '{}'
+                   WHERE NICKNAME = '{}';
+                   DELETE FROM ADDRESS_PINCODES
+                   WHERE NICKNAME = '{}';
+                '''.format(json.dumps(addr), nickname, nickname)
+    else:
+        return _delete_counts_query(nickname) + ''' DELETE FROM ADDRESSES
+                   WHERE NICKNAME = '{}';
+                '''.format(nickname)
+
+    assert addr is not None
+    return (
+        query +
+        _insert_pincodes_query(nickname, addr) +
+        _insert_counts_query(nickname, addr)
+    )
+
+
+def _select_fields(fields: Fields) -> str:
+    if fields is None:
+        return '*'
+    # Only the fields selected are read from the JSONB column and sent
+    return 'JSONB_STRIP_NULLS(JSONB_BUILD_OBJECT({}))'.format(', '.join(
+        "'{f}', ADDRESS->'{f}'".format(f=f)
+        for f in sorted(ENTRY_FIELDS.intersection(fields))
+    ))
+
+
 class SQLAddressBookDB(AbstractAddressBookDB):
-    def __init__(self):
+    '''
+    Mutations are recorded in the change log of this process only, and old
+    entries are not known to mutation listeners on update and delete.
+
+    Pincodes of an entry are kept in the indexed ADDRESS_PINCODES table, in
+    the same statement batch as the entry itself (see SQL_SCHEMA).
+
+    Aggregates are materialized in the ADDRESS_AGGREGATES table: writes of
+    an entry subtract its counts kept in ADDRESS_COUNTS, if any, and add
+    those of the new entry, in the same statement batch.
+
+    With write-batch configured, writes of concurrent requests are applied
+    together in one transaction (see WriteBatcher), and reads of an entry
+    wait for its queued writes.
+    '''
+
+    complete_changelog = False
+
+    def __init__(
+        self,
+        changelog_retention: int = DEFAULT_RETENTION,
+        write_batch: Optional[Dict] = None
+    ) -> None:
+        super().__init__(changelog_retention)
         self.db_connector = SomeSQLdbConnector()
         self.logger = logging.getLogger(LOGGER_NAME)
+        self.write_batcher: Optional[WriteBatcher] = None
+        if write_batch is not None:
+            self.write_batcher = WriteBatcher.from_config(
+                write_batch, self._execute_batch, self._execute_write
+            )
+
+    def stop(self):
+        if self.write_batcher is not None:
+            self.write_batcher.stop()
+
+    def stats(self) -> Optional[Dict[str, Any]]:
+        if self.write_batcher is None:
+            return None
+        return {'write-batch': self.write_batcher.stats()}
+
+    async def _execute(self, query: str) -> Any:
+        # Propagate trace context to the DB as an sqlcommenter style comment.
+        traceparent = tracing.current_traceparent()
+        if traceparent is not None:
+            query = "{q} /*traceparent='{t}'*/".format(
+                q=query.rstrip(),
+                t=traceparent
+            )
+
+        self.logger.debug('Sending DB query: {}'.format(query))
+        return await self.db_connector.execute(query)
 
+    async def _execute_write(
+        self,
+        op: str,
+        nickname: str,
+        addr: Optional[Dict]
+    ) -> None:
+        await self._execute(_write_query(op, nickname, addr))
+
+    async def _execute_batch(self, writes: List[Write]) -> None:
+        query = 'BEGIN;\n{}COMMIT;'.format(''.join(
+            _write_query(op, nickname, addr) for op, nickname, addr in writes
+        ))
+        try:
+            await self._execute(query)
+        except Exception:
+            # End the failed transaction before its writes are applied again
+            # one by one on the same connection.
+            try:
+                await self._execute('ROLLBACK;')
+            except Exception:
+                self.logger.exception('Rollback of write batch failed')
+            raise
+
+    async def _write(
+        self,
+        op: str,
+        nickname: str,
+        addr: Optional[Dict]
+    ) -> None:
+        if self.write_batcher is None:
+            await self._execute_write(op, nickname, addr)
+            self._notify(op, nickname, None, addr)
+        else:
+            # Buffered writes may still fail once queued: listeners and the
+            # change log only learn of them once applied.
+            await self.write_batcher.write(
+                op, nickname, addr,
+                functools.partial(self._notify, op, nickname, None, addr)
+            )
+
+    @tracing.trace()
     async def create_address(self, addr: Dict, nickname: str = None) -> str:
         if nickname is None:
             nickname = uuid.uuid4().hex
 
-        self.validate_address(addr)
-
-        query = '''INSERT INTO
-                   ADDRESSES (NICKNAME, ADDRESS)
-                   VALUES ('{}' ,'{}')
-                '''.format(nickname, json.dumps(addr))
-        self.logger.debug('Sending DB query: {}'.format(query))
-        await self.db_connector.execute(query)
+        await self._validate_address(addr)
+        await self._write(OP_CREATE, nickname, addr)
         return nickname
 
-    async def read_address(self, nickname: str) -> Dict:
-        query = '''SELECT * FROM ADDRESSES
+    @tracing.trace()
+    async def read_address(
+        self,
+        nickname: str,
+        fields: Fields = None
+    ) -> Dict:
+        if self.write_batcher is not None:
+            await self.write_batcher.wait(nickname)
+        query = '''SELECT {} FROM ADDRESSES
                    WHERE NICKNAME = '{}'
-                '''.format(nickname)
-        self.logger.debug('Sending DB query: {}'.format(query))
-        addr_json_str = await self.db_connector.execute(query)
+                '''.format(_select_fields(fields), nickname)
+        addr_json_str = await self._execute(query)
         return json.loads(addr_json_str)
 
+    @tracing.trace()
     async def update_address(self, nickname: str, addr: Dict) -> None:
-        self.validate_address(addr)
-
-        query = '''UPDATE ADDRESSES
-                   SET ADDRESS = '{}'
-                   WHERE NICKNAME = '{}'
-                '''.format(json.dumps(addr), nickname)
-        self.logger.debug('Sending DB query: {}'.format(query))
-        await self.db_connector.execute(query)
+        await self._validate_address(addr)
+        await self._write(OP_UPDATE, nickname, addr)
 
+    @tracing.trace()
     async def delete_address(self, nickname: str) -> None:
-        query = ''' DELETE FROM ADDRESS
-                   WHERE NICKNAME = '{}'
-                '''.format(nickname)
-        self.logger.debug('Sending DB query: {}'.format(query))
-        await self.db_connector.execute(query)
+        await self._write(OP_DELETE, nickname, None)
 
-    async def read_all_addresses(self) -> Dict[str, Dict]:
+    @tracing.trace()
+    async def read_all_addresses(
+        self,
+        fields: Fields = None
+    ) -> Dict[str, Dict]:
         # TODO: Exercise: implement suitable query/abstraction and update
         # the SQLAddressBookDBTest.test_read_all_addresses to test this.
         raise NotImplementedError()
 
+    @tracing.trace()
+    async def read_addresses_by_pincode(
+        self,
+        low: Pincode,
+        high: Pincode,
+        limit: Optional[int] = None
+    ) -> Dict[str, Dict]:
+        # Index range scan on ADDRESS_PINCODES_PINCODE_IDX
+        limit_clause = '' if limit is None else 'LIMIT {:d}'.format(limit)
+        query = '''SELECT JSON_OBJECT_AGG(A.NICKNAME, A.ADDRESS
+                                         ORDER BY P.PINCODE)
+                   FROM ADDRESSES A JOIN (
+                       SELECT NICKNAME, MIN(PINCODE) AS PINCODE
+                       FROM ADDRESS_PINCODES
+                       WHERE PINCODE BETWEEN {} AND {}
+                       GROUP BY NICKNAME
+                       ORDER BY PINCODE
+                       {}
+                   ) P ON A.NICKNAME = P.NICKNAME
+                '''.format(low, high, limit_clause)
+        addrs_json_str = await self._execute(query)
+        return json.loads(addrs_json_str) if addrs_json_str else {}
+
+    @tracing.trace()
+    async def nearest_pincodes(
+        self,
+        pincode: Pincode,
+        k: int
+    ) -> List[Tuple[Pincode, str]]:
+        # Two index range scans, one on each side of the pincode
+        query = '''SELECT JSON_AGG(JSON_BUILD_ARRAY(PINCODE, NICKNAME)
+                                   ORDER BY ABS(PINCODE - {p}))
+                   FROM (
+                       (SELECT PINCODE, NICKNAME FROM ADDRESS_PINCODES
+                        WHERE PINCODE < {p} ORDER BY PINCODE DESC LIMIT {k})
+                       UNION ALL
+                       (SELECT PINCODE, NICKNAME FROM ADDRESS_PINCODES
+                        WHERE PINCODE >= {p} ORDER BY PINCODE LIMIT {k})
+                   ) NEAREST
+                '''.format(p=pincode, k=k)
+        pairs_json_str = await self._execute(query)
+        pairs = json.loads(pairs_json_str) if pairs_json_str else []
+        return [(p, nickname) for p, nickname in pairs[:k]]
+
+    @tracing.trace()
+    async def read_aggregates(self) -> Dict:
+        query = '''SELECT JSON_AGG(JSON_BUILD_ARRAY(AGG, VAL, N))
+                   FROM ADDRESS_AGGREGATES
+                   WHERE N <> 0
+                '''
+        rows_json_str = await self._execute(query)
+        rows = json.loads(rows_json_str) if rows_json_str else []
+        return aggregates_dict(((agg, val), n) for agg, val, n in rows)
+
+
+class SnapshotAddressBookDB(AbstractAddressBookDB):
+    '''
+    Read-only address book served from a snapshot file (see snapshot.py).
+
+    The file is memory mapped, so startup takes constant time and memory for
+    any size, and an entry is decoded only when read. Entries were validated
+    when the snapshot was exported. Mutations raise PermissionError, and the
+    change log continues from the sequence number of the snapshot.
+
+    The pincode index and aggregates are built on their first query, as they
+    need every entry decoded.
+    '''
+
+    def __init__(
+        self,
+        path: str,
+        changelog_retention: int = DEFAULT_RETENTION
+    ) -> None:
+        super().__init__(changelog_retention)
+        self.snapshot = Snapshot(path)
+        self.changelog.last_seq = self.snapshot.seq
+        self._pincode_index: Optional[PincodeIndex] = None
+        self._aggregates: Optional[Aggregates] = None
+
+    def stop(self):
+        self.snapshot.close()
+
+    def _read_only(self) -> PermissionError:
+        return PermissionError(
+            'Address book snapshot {} is read-only'.format(self.snapshot.path)
+        )
+
+    @property
+    def pincode_index(self) -> PincodeIndex:
+        if self._pincode_index is None:
+            self._pincode_index = PincodeIndex()
+            for nickname, addr in self.snapshot.items():
+                self._pincode_index.add(nickname, addr)
+        return self._pincode_index
+
+    @property
+    def aggregates(self) -> Aggregates:
+        if self._aggregates is None:
+            self._aggregates = Aggregates()
+            for _, addr in self.snapshot.items():
+                self._aggregates.add(entry_counts(addr))
+        return self._aggregates
+
+    @tracing.trace()
+    async def create_address(self, addr: Dict, nickname: str = None) -> str:
+        raise self._read_only()
+
+    @tracing.trace()
+    async def read_address(
+        self,
+        nickname: str,
+        fields: Fields = None
+    ) -> Dict:
+        addr = self.snapshot.get(nickname)
+        if addr is None:
+            raise KeyError('{} does not exist'.format(nickname))
+        return project_address(addr, fields)
+
+    @tracing.trace()
+    async def update_address(self, nickname: str, addr: Dict) -> None:
+        raise self._read_only()
+
+    @tracing.trace()
+    async def delete_address(self, nickname: str) -> None:
+        raise self._read_only()
+
+    @tracing.trace()
+    async def read_all_addresses(
+        self,
+        fields: Fields = None
+    ) -> Dict[str, Dict]:
+        return {
+            nickname: project_address(addr, fields)
+            for nickname, addr in self.snapshot.items()
+        }
+
+    @tracing.trace()
+    async def read_addresses_by_pincode(
+        self,
+        low: Pincode,
+        high: Pincode,
+        limit: Optional[int] = None
+    ) -> Dict[str, Dict]:
+        nicknames = self.pincode_index.range(low, high, limit)
+        return {
+            nickname: await self.read_address(nickname)
+            for nickname in nicknames
+        }
+
+    @tracing.trace()
+    async def nearest_pincodes(
+        self,
+        pincode: Pincode,
+        k: int
+    ) -> List[Tuple[Pincode, str]]:
+        return self.pincode_index.nearest(pincode, k)
+
+    @tracing.trace()
+    async def read_aggregates(self) -> Dict:
+        return self.aggregates.to_dict()
+
+
+WRITE_THROUGH = 'write-through'
+WRITE_BACK = 'write-back'
+
+# Queued op, then a newer op on the same entry -> op that has the same effect
+_COALESCED_OPS: Dict[Tuple[str, str], Optional[str]] = {
+    (OP_CREATE, OP_UPDATE): OP_CREATE,
+    (OP_CREATE, OP_DELETE): None,
+    (OP_UPDATE, OP_UPDATE): OP_UPDATE,
+    (OP_UPDATE, OP_DELETE): OP_DELETE,
+    (OP_DELETE, OP_CREATE): OP_UPDATE,
+}
+
+# Nickname -> (op, new entry) of changes not yet applied to the cold DB
+PendingChanges = Dict[str, Tuple[str, Optional[Dict]]]
+
+
+def _coalesce(older: PendingChanges, newer: PendingChanges) -> PendingChanges:
+    changes = dict(older)
+    for nickname, (op, addr) in newer.items():
+        if nickname not in changes:
+            changes[nickname] = (op, addr)
+            continue
+        coalesced_op = _COALESCED_OPS[(changes[nickname][0], op)]
+        if coalesced_op is None:
+            del changes[nickname]
+        else:
+            changes[nickname] = (coalesced_op, addr)
+    return changes
+
+
+class TieredAddressBookDB(AbstractAddressBookDB):
+    '''
+    Size-bounded hot tier of entries in memory, over a cold (e.g. SQL) DB.
+
+    Reads are served from the hot tier when possible, and entries read from
+    the cold DB are promoted to it, subject to TinyLFU admission (see
+    cache.py). Concurrent misses of an entry share one cold read, read
+    again if the entry is written meanwhile.
+
+    With write-through, a mutation is applied to (and validated by) the cold
+    DB before it returns. With write-back, it is validated and queued, and
+    queued changes are applied to the cold DB every flush-interval seconds,
+    or once max-dirty entries are queued. Changes to an entry are coalesced
+    while queued, e.g. an update of a created entry is a create. Listing,
+    pincode and aggregate queries, answered by the cold DB, flush first.
+    '''
+
+    def __init__(
+        self,
+        cold: AbstractAddressBookDB,
+        capacity: int = 10000,
+        write_policy: str = WRITE_THROUGH,
+        flush_interval: float = 1.0,
+        max_dirty: int = 1000,
+        changelog_retention: int = DEFAULT_RETENTION
+    ) -> None:
+        if write_policy not in (WRITE_THROUGH, WRITE_BACK):
+            raise ValueError('Unknown write policy: {}'.format(write_policy))
+
+        super().__init__(changelog_retention)
+        self.cold = cold
+        self.complete_changelog = cold.complete_changelog
+        self.hot: TinyLFUCache[str, Dict] = TinyLFUCache(capacity)
+        self.write_policy = write_policy
+        self.flush_interval = flush_interval
+        self.max_dirty = max_dirty
+        self.logger = logging.getLogger(LOGGER_NAME)
+
+        self.dirty: PendingChanges = {}
+        self.flushing: PendingChanges = {}
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._flush_task: Optional[asyncio.Future] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+        # Cold reads in progress, and those of entries written meanwhile,
+        # which must not be promoted.
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._stale: Set[str] = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.promotions = 0
+        self.flushes = 0
+        self.flush_errors = 0
+
+    def set_worker_pool(self, worker_pool: Optional[WorkerPool]) -> None:
+        # Cold DB validates with write-through, this one with write-back
+        super().set_worker_pool(worker_pool)
+        self.cold.set_worker_pool(worker_pool)
+
+    def start(self):
+        self.cold.start()
+        if self.write_policy == WRITE_BACK and self._timer is None:
+            self._schedule()
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if self.dirty or self.flushing:
+            loop = asyncio.get_event_loop()
+            if loop.is_running():
+                # Cold DB is stopped once they are flushed
+                self.logger.warning('Stopping with unflushed changes')
+                self._flush_task = asyncio.ensure_future(
+                    self._flush_and_stop()
+                )
+                return
+            loop.run_until_complete(self.flush())
+
+        self.cold.stop()
+
+    async def _flush_and_stop(self) -> None:
+        try:
+            await self.flush()
+        except Exception:
+            self.logger.exception('Flush to cold DB failed, changes lost')
+        finally:
+            self.cold.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        stats: Dict[str, Any] = {
+            'write-policy': self.write_policy,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit-ratio': self.hits / lookups if lookups else 0.0,
+            'promotions': self.promotions,
+            'dirty': len(self.dirty),
+            'flushes': self.flushes,
+            'flush-errors': self.flush_errors,
+        }
+        stats.update(self.hot.stats())
+        return stats
+
+    def tune(
+        self,
+        capacity: int,
+        flush_interval: float,
+        max_dirty: int
+    ) -> None:
+        '''Changes the settings while running, keeping the hot entries.'''
+        self.hot.resize(capacity)
+        self.flush_interval = flush_interval
+        self.max_dirty = max_dirty
+        if self._timer is not None:
+            self._timer.cancel()
+            self._schedule()
+        if len(self.dirty) >= max_dirty:
+            self._start_flush()
+
+    # Write-back flush
+
+    def _schedule(self) -> None:
+        # A timer rather than a long running task, see SpanCollector.
+        self._timer = asyncio.get_event_loop().call_later(
+            self.flush_interval, self._tick
+        )
+
+    def _tick(self) -> None:
+        if self.dirty:
+            self._start_flush()
+        self._schedule()
+
+    def _start_flush(self) -> None:
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._background_flush())
+
+    async def _background_flush(self) -> None:
+        try:
+            await self.flush()
+        except Exception:
+            self.logger.exception('Flush to cold DB failed')
+
+    async def flush(self) -> None:
+        '''Applies queued changes to the cold DB.'''
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        async with self._flush_lock:
+            if not self.dirty:
+                return
+
+            self.flushing, self.dirty = self.dirty, {}
+            self.flushes += 1
+            try:
+                for nickname, (op, addr) in list(self.flushing.items()):
+                    await self._apply(op, nickname, addr)
+                    del self.flushing[nickname]
+            except Exception:
+                # Retry in the next flush, along with changes made meanwhile
+                self.flush_errors += 1
+                self.dirty = _coalesce(self.flushing, self.dirty)
+                raise
+            finally:
+                self.flushing = {}
+
+    async def _apply(
+        self,
+        op: str,
+        nickname: str,
+        addr: Optional[Dict]
+    ) -> None:
+        if op == OP_CREATE:
+            assert addr is not None
+            await self.cold.create_address(addr, nickname)
+        elif op == OP_UPDATE:
+            assert addr is not None
+            await self.cold.update_address(nickname, addr)
+        else:
+            await self.cold.delete_address(nickname)
+
+    def _queue(self, op: str, nickname: str, addr: Optional[Dict]) -> None:
+        self.dirty = _coalesce(self.dirty, {nickname: (op, addr)})
+        if len(self.dirty) >= self.max_dirty:
+            self._start_flush()
+
+    def _pending(self, nickname: str) -> Optional[Tuple[str, Optional[Dict]]]:
+        return self.dirty.get(nickname) or self.flushing.get(nickname)
+
+    # Hot tier
+
+    def _cache(self, nickname: str, addr: Optional[Dict]) -> None:
+        if nickname in self._loading:
+            self._stale.add(nickname)
+        if addr is None:
+            self.hot.pop(nickname)
+        else:
+            self.hot.put(nickname, addr)
+
+    async def _load(self, nickname: str) -> Tuple[Optional[Dict], bool]:
+        '''Entry in the cold DB, if any, and whether written meanwhile.'''
+        addr: Optional[Dict] = None
+        try:
+            addr = await self.cold.read_address(nickname)
+        except KeyError:
+            pass
+        finally:
+            del self._loading[nickname]
+            stale = nickname in self._stale
+            self._stale.discard(nickname)
+
+        if addr is not None and not stale and self.hot.put(nickname, addr):
+            self.promotions += 1
+        return addr, stale
+
+    async def _read(self, nickname: str) -> Optional[Dict]:
+        pending = self._pending(nickname)
+        if pending is not None:
+            self.hits += 1
+            return pending[1]
+
+        addr = self.hot.get(nickname)
+        if addr is not None:
+            self.hits += 1
+            return addr
+
+        self.misses += 1
+        loading = self._loading.get(nickname)
+        if loading is None:
+            loading = asyncio.ensure_future(self._load(nickname))
+            self._loading[nickname] = loading
+        seq = self.changelog.last_seq
+        addr, stale = await asyncio.shield(loading)
+        if stale or self._written_since(nickname, seq):
+            # e.g. created, and flushed, while loading: read again
+            return await self._read(nickname)
+        return addr
+
+    def _written_since(self, nickname: str, seq: int) -> bool:
+        try:
+            changes = self.changelog.since(seq)
+        except ResyncRequiredError:
+            return True
+        return any(c.nickname == nickname for c in changes)
+
+    async def _exists(self, nickname: str) -> bool:
+        pending = self._pending(nickname)
+        if pending is not None:
+            return pending[1] is not None
+        if nickname in self.hot:
+            return True
+        return await self._read(nickname) is not None
+
+    # CRUD
+
+    @tracing.trace()
+    async def create_address(self, addr: Dict, nickname: str = None) -> str:
+        if self.write_policy == WRITE_THROUGH:
+            nickname = await self.cold.create_address(addr, nickname)
+        else:
+            if nickname is None:
+                nickname = uuid.uuid4().hex
+            # Validated first: a concurrent write may finish while validating
+            await self._validate_address(addr)
+            if await self._exists(nickname):
+                raise KeyError('{} already exists'.format(nickname))
+            self._queue(OP_CREATE, nickname, addr)
+
+        self._cache(nickname, addr)
+        self._notify(OP_CREATE, nickname, None, addr)
+        return nickname
+
+    @tracing.trace()
+    async def read_address(
+        self,
+        nickname: str,
+        fields: Fields = None
+    ) -> Dict:
+        # Whole entries are cached, and projected when read
+        addr = await self._read(nickname)
+        if addr is None:
+            raise KeyError('{} does not exist'.format(nickname))
+        return project_address(addr, fields)
+
+    @tracing.trace()
+    async def update_address(self, nickname: str, addr: Dict) -> None:
+        if self.write_policy == WRITE_THROUGH:
+            old = self.hot.peek(nickname)
+            await self.cold.update_address(nickname, addr)
+        else:
+            await self._validate_address(addr)
+            old = await self._read(nickname)
+            if old is None:
+                raise KeyError('{} does not exist'.format(nickname))
+            self._queue(OP_UPDATE, nickname, addr)
+
+        self._cache(nickname, addr)
+        self._notify(OP_UPDATE, nickname, old, addr)
+
+    @tracing.trace()
+    async def delete_address(self, nickname: str) -> None:
+        if self.write_policy == WRITE_THROUGH:
+            old = self.hot.peek(nickname)
+            await self.cold.delete_address(nickname)
+        else:
+            old = await self._read(nickname)
+            if old is None:
+                raise KeyError('{} does not exist'.format(nickname))
+            self._queue(OP_DELETE, nickname, None)
+
+        self._cache(nickname, None)
+        self._notify(OP_DELETE, nickname, old, None)
+
+    @tracing.trace()
+    async def read_all_addresses(
+        self,
+        fields: Fields = None
+    ) -> Dict[str, Dict]:
+        await self.flush()
+        return await self.cold.read_all_addresses(fields)
+
+    @tracing.trace()
+    async def read_addresses_by_pincode(
+        self,
+        low: Pincode,
+        high: Pincode,
+        limit: Optional[int] = None
+    ) -> Dict[str, Dict]:
+        await self.flush()
+        return await self.cold.read_addresses_by_pincode(low, high, limit)
+
+    @tracing.trace()
+    async def nearest_pincodes(
+        self,
+        pincode: Pincode,
+        k: int
+    ) -> List[Tuple[Pincode, str]]:
+        await self.flush()
+        return await self.cold.nearest_pincodes(pincode, k)
+
+    @tracing.trace()
+    async def read_aggregates(self) -> Dict:
+        await self.flush()
+        return await self.cold.read_aggregates()
+
+
+def _fields_query(fields: Fields) -> str:
+    if fields is None:
+        return ''
+    return '?' + urlencode({'fields': ','.join(fields)})
+
+
+class ShardedAddressBookDB(AbstractAddressBookDB):
+    '''
+    Router over addrservice nodes, each with a part of the address book:
+    entries are placed on a consistent hash ring of nicknames (see HashRing).
+
+    Entry operations are proxied to the node of the entry. Listings and
+    queries are sent to all nodes concurrently, and their results merged as
+    they arrive: list and pincode range by entry, search by score, nearest
+    pincodes by distance, and aggregates by sum.
+
+    Adding a node moves the entries it now owns from other nodes: each is
+    created on the new node (unless written there meanwhile) and deleted
+    from the old one. Until done, reads and writes of an entry missing on
+    its new node go to its old node.
+
+    Mutations are recorded in the change log of this process only. The
+    trace context of the request is propagated to the nodes.
+
+    Listings and queries are all or nothing: if any node fails, so does the
+    request, rather than return partial results.
+
+    Config:
+        nodes:           base URLs of the nodes, e.g. http://host:8080
+        virtual-nodes:   points per node on the ring, default: 64
+        max-clients:     concurrent requests to nodes, default: 100
+        request-timeout: seconds, default: 20
+    '''
+
+    complete_changelog = False
+
+    # Entries moved concurrently by a rebalance
+    MOVE_CONCURRENCY = 10
+
+    def __init__(
+        self,
+        nodes: List[str],
+        vnodes: int = DEFAULT_VIRTUAL_NODES,
+        max_clients: int = 100,
+        request_timeout: float = 20,
+        changelog_retention: int = DEFAULT_RETENTION
+    ) -> None:
+        super().__init__(changelog_retention)
+        if not nodes:
+            raise ValueError('Sharded address book needs at least one node')
+
+        self.ring = HashRing([n.rstrip('/') for n in nodes], vnodes)
+        self.max_clients = max_clients
+        self.request_timeout = request_timeout
+        self.logger = logging.getLogger(LOGGER_NAME)
+        self._client: Optional[AsyncHTTPClient] = None
+        # Ring before the node being added, while its entries are moved
+        self._previous_ring: Optional[HashRing] = None
+        self._rebalance_lock: Optional[asyncio.Lock] = None
+        self.moved = 0
+
+    def stop(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def stats(self) -> Optional[Dict[str, Any]]:
+        return {
+            'nodes': list(self.ring.nodes),
+            'rebalancing': self._previous_ring is not None,
+            'moved': self.moved,
+        }
+
+    @property
+    def client(self) -> AsyncHTTPClient:
+        if self._client is None:
+            # Own instance, with its own pool of connections to the nodes
+            self._client = AsyncHTTPClient(
+                force_instance=True, max_clients=self.max_clients
+            )
+        return self._client
+
+    async def _fetch(
+        self,
+        node: str,
+        path: str,
+        method: str = 'GET',
+        body: Optional[Dict] = None
+    ) -> HTTPResponse:
+        headers = {'Content-Type': 'application/json; charset=UTF-8'}
+        traceparent = tracing.current_traceparent()
+        if traceparent is not None:
+            headers[tracing.TRACEPARENT_HEADER] = traceparent
+
+        r = await self.client.fetch(
+            node + path,
+            method=method,
+            body=None if body is None else json.dumps(body),
+            headers=headers,
+            request_timeout=self.request_timeout,
+            follow_redirects=False,
+            raise_error=False,
+        )
+        if r.code in (404, 409):
+            raise KeyError(r.reason)
+        if r.code == 400:
+            raise ValueError(r.reason)
+        if r.code == 405:
+            raise PermissionError(r.reason)
+        r.rethrow()
+        return r
+
+    async def _fetch_json(self, node: str, path: str) -> Any:
+        r = await self._fetch(node, path)
+        return json.loads(r.body.decode('utf-8'))
+
+    async def _fetch_all(self, path: str) -> AsyncIterator[Any]:
+        '''
+        Responses of all nodes to a GET of path, as they arrive. Raises the
+        first error of a node, and cancels the requests still in progress.
+        '''
+        fetches = [
+            asyncio.ensure_future(self._fetch_json(node, path))
+            for node in self.ring.nodes
+        ]
+        try:
+            for response in asyncio.as_completed(fetches):
+                yield await response
+        finally:
+            for f in fetches:
+                f.cancel()
+
+    def _entry_path(self, nickname: str) -> str:
+        return '/addressbook/{}'.format(url_escape(nickname))
+
+    def _previous_node(self, nickname: str, node: str) -> Optional[str]:
+        '''Node of an entry before the rebalance in progress, if other.'''
+        if self._previous_ring is None:
+            return None
+        previous = self._previous_ring.node_for(nickname)
+        return None if previous == node else previous
+
+    @tracing.trace()
+    async def create_address(self, addr: Dict, nickname: str = None) -> str:
+        if nickname is None:
+            nickname = uuid.uuid4().hex
+
+        await self._validate_address(addr)
+
+        node = self.ring.node_for(nickname)
+        await self._fetch(node, self._entry_path(nickname), 'POST', addr)
+        self._notify(OP_CREATE, nickname, None, addr)
+        return nickname
+
+    @tracing.trace()
+    async def read_address(
+        self,
+        nickname: str,
+        fields: Fields = None
+    ) -> Dict:
+        node = self.ring.node_for(nickname)
+        path = self._entry_path(nickname) + _fields_query(fields)
+        try:
+            return await self._fetch_json(node, path)
+        except KeyError:
+            previous = self._previous_node(nickname, node)
+            if previous is None:
+                raise
+            return await self._fetch_json(previous, path)
+
+    @tracing.trace()
+    async def update_address(self, nickname: str, addr: Dict) -> None:
+        await self._validate_address(addr)
+
+        node = self.ring.node_for(nickname)
+        path = self._entry_path(nickname)
+        try:
+            await self._fetch(node, path, 'PUT', addr)
+        except KeyError:
+            previous = self._previous_node(nickname, node)
+            if previous is None:
+                raise
+            await self._fetch(previous, path, 'PUT', addr)
+        self._notify(OP_UPDATE, nickname, None, addr)
+
+    @tracing.trace()
+    async def delete_address(self, nickname: str) -> None:
+        node = self.ring.node_for(nickname)
+        path = self._entry_path(nickname)
+        nodes = [node]
+        previous = self._previous_node(nickname, node)
+        if previous is not None:
+            nodes.append(previous)
+
+        deleted = False
+        for n in nodes:
+            try:
+                await self._fetch(n, path, 'DELETE')
+                deleted = True
+            except KeyError:
+                pass
+        if not deleted:
+            raise KeyError('{} does not exist'.format(nickname))
+        self._notify(OP_DELETE, nickname, None, None)
+
+    @tracing.trace()
+    async def read_all_addresses(
+        self,
+        fields: Fields = None
+    ) -> Dict[str, Dict]:
+        addrs: Dict[str, Dict] = {}
+        path = '/addressbook' + _fields_query(fields)
+        async for node_addrs in self._fetch_all(path):
+            addrs.update(node_addrs)
+        return addrs
+
+    @tracing.trace()
+    async def read_addresses_by_pincode(
+        self,
+        low: Pincode,
+        high: Pincode,
+        limit: Optional[int] = None
+    ) -> Dict[str, Dict]:
+        query = {'min': str(low), 'max': str(high)}
+        if limit is not None:
+            query['limit'] = str(limit)
+
+        def first_pincode(entry: Tuple[str, Dict]) -> Pincode:
+            return min(
+                p for p in entry_pincodes(entry[1]) if low <= p <= high
+            )
+
+        # Each node's entries are in pincode order already
+        node_entries = [
+            list(node_addrs.items())
+            async for node_addrs in self._fetch_all(
+                '/addressbook/_pincodes?' + urlencode(query)
+            )
+        ]
+        merged = heapq.merge(*node_entries, key=first_pincode)
+        return dict(itertools.islice(merged, limit))
+
+    @tracing.trace()
+    async def nearest_pincodes(
+        self,
+        pincode: Pincode,
+        k: int
+    ) -> List[Tuple[Pincode, str]]:
+        query = urlencode({'near': str(pincode), 'k': str(k)})
+        node_results = [
+            [(r['pincode'], r['nickname']) for r in node_result['results']]
+            async for node_result in self._fetch_all(
+                '/addressbook/_pincodes?' + query
+            )
+        ]
+        merged = heapq.merge(
+            *node_results, key=lambda r: abs(r[0] - pincode)
+        )
+        return list(itertools.islice(merged, k))
+
+    @tracing.trace()
+    async def search_addresses(
+        self,
+        query: str,
+        k: int
+    ) -> Optional[List[Tuple[str, float, Dict]]]:
+        try:
+            node_results = [
+                [
+                    (r['nickname'], r['score'], r['address'])
+                    for r in node_result['results']
+                ]
+                async for node_result in self._fetch_all(
+                    '/addressbook/_search?' + urlencode({'q': query, 'k': k})
+                )
+            ]
+        except KeyError:
+            raise NotImplementedError('Search is not enabled') from None
+
+        merged = heapq.merge(*node_results, key=lambda r: -r[1])
+        return list(itertools.islice(merged, k))
+
+    @tracing.trace()
+    async def read_aggregates(self) -> Dict:
+        # Entries being moved by a rebalance may be counted on both nodes
+        aggregates = Aggregates()
+        async for node_aggregates in self._fetch_all('/addressbook/_stats'):
+            aggregates.add(aggregate_counts(node_aggregates))
+        return aggregates.to_dict()
+
+    async def add_node(self, node: str) -> int:
+        '''
+        Adds a node to the ring, and moves the entries it now owns to it.
+        Returns the number of entries moved.
+        '''
+        node = node.rstrip('/')
+        if self._rebalance_lock is None:
+            self._rebalance_lock = asyncio.Lock()
+
+        async with self._rebalance_lock:
+            ring = self.ring.copy()
+            ring.add_node(node)
+            self._previous_ring, self.ring = self.ring, ring
+            try:
+                moved = 0
+                for source in self._previous_ring.nodes:
+                    moved += await self._move_entries(source, node)
+            finally:
+                self._previous_ring = None
+
+        self.logger.info('Added node {}, moved {} entries'.format(
+            node, moved
+        ))
+        return moved
+
+    async def _move_entries(self, source: str, target: str) -> int:
+        addrs = await self._fetch_json(source, '/addressbook')
+        moving = [
+            (nickname, addr) for nickname, addr in addrs.items()
+            if self.ring.node_for(nickname) == target
+        ]
+        semaphore = asyncio.Semaphore(self.MOVE_CONCURRENCY)
+
+        async def move(nickname: str, addr: Dict) -> None:
+            path = self._entry_path(nickname)
+            async with semaphore:
+                try:
+                    await self._fetch(target, path, 'POST', addr)
+                except KeyError:
+                    pass  # Written on the target since, keep that
+                try:
+                    await self._fetch(source, path, 'DELETE')
+                except KeyError:
+                    pass  # Deleted meanwhile
+                self.moved += 1
+
+        await asyncio.gather(*[move(n, a) for n, a in moving])
+        return len(moving)
+
+
+# Keys of a tiered config that can be changed while running
+TIERED_TUNABLE_KEYS = ('capacity', 'flush-interval', 'max-dirty')
+
+
+def tiered_settings(tiered_config: Dict) -> Dict[str, Any]:
+    '''Settings of a tiered address book config that can be tuned.'''
+    settings = {
+        'capacity': int(tiered_config.get('capacity', 10000)),
+        'flush_interval': float(tiered_config.get('flush-interval', 1.0)),
+        'max_dirty': int(tiered_config.get('max-dirty', 1000)),
+    }
+    if settings['capacity'] < 1:
+        raise ValueError('capacity must be at least 1')
+    return settings
+
 
 def create_addressbook_db(addr_db_config: Dict) -> AbstractAddressBookDB:
     db_type = list(addr_db_config.keys())[0]
-    db_config = addr_db_config[db_type]
+    db_config = addr_db_config[db_type] or {}
+    retention = int(db_config.get('changelog-retention', DEFAULT_RETENTION))
 
     return {
-        'memory': lambda cfg: InMemoryAddressBookDB(),
-        'sql': lambda cfg: SQLAddressBookDB()
+        'memory': lambda cfg: InMemoryAddressBookDB(retention),
+        'sql': lambda cfg: SQLAddressBookDB(
+            retention, write_batch=cfg.get('write-batch')
+        ),
+        'snapshot': lambda cfg: SnapshotAddressBookDB(cfg['path'], retention),
+        'tiered': lambda cfg: TieredAddressBookDB(
+            create_addressbook_db(cfg['cold']),
+            write_policy=cfg.get('write-policy', WRITE_THROUGH),
+            changelog_retention=retention,
+            **tiered_settings(cfg)
+        ),
+        'sharded': lambda cfg: ShardedAddressBookDB(
+            cfg['nodes'],
+            vnodes=int(cfg.get('virtual-nodes', DEFAULT_VIRTUAL_NODES)),
+            max_clients=int(cfg.get('max-clients', 100)),
+            request_timeout=float(cfg.get('request-timeout', 20)),
+            changelog_retention=retention
+        ),
     }[db_type](db_config)
@@ -0,0 +1,100 @@
+# Copyright (c) 2019. All rights reserved.
+
+import collections
+from typing import Any, Counter, Dict, Iterable, Optional, Tuple
+
+ENTRIES = 'entries'
+# Aggregate -> items in the entry field of the same name
+TOTALS = ('addresses', 'phoneNumbers', 'faxNumbers', 'emails')
+# Aggregate -> address field; entries are counted by each of its values
+GROUPS = {'countries': 'country', 'cities': 'city', 'kinds': 'kind'}
+
+# (aggregate, value); value is '' for ENTRIES and TOTALS
+AggregateKey = Tuple[str, str]
+
+
+def entry_counts(addr: Dict) -> Counter[AggregateKey]:
+    '''Contribution of an entry to each aggregate.'''
+    counts: Counter[AggregateKey] = collections.Counter()
+    counts[(ENTRIES, '')] = 1
+    for name in TOTALS:
+        if addr.get(name):
+            counts[(name, '')] = len(addr[name])
+
+    addresses = addr.get('addresses', [])
+    for name, field in GROUPS.items():
+        for value in {a[field] for a in addresses if field in a}:
+            counts[(name, value)] = 1
+    return counts
+
+
+def count_changes(
+    old: Optional[Dict],
+    new: Optional[Dict]
+) -> Dict[AggregateKey, int]:
+    '''Non-zero changes of aggregates when entry old is replaced by new.'''
+    changes: Counter[AggregateKey] = collections.Counter()
+    if new is not None:
+        changes.update(entry_counts(new))
+    if old is not None:
+        changes.subtract(entry_counts(old))
+    return {key: n for key, n in changes.items() if n}
+
+
+def aggregates_dict(counts: Iterable[Tuple[AggregateKey, int]]) -> Dict:
+    '''
+    Aggregates as JSON: counts of entries and items, and counts of entries
+    by each value of an address field, e.g. {'countries': {'India': 2}}.
+    '''
+    aggregates: Dict[str, Any] = {ENTRIES: 0}
+    aggregates.update({name: 0 for name in TOTALS})
+    aggregates.update({name: {} for name in GROUPS})
+    for (name, value), n in counts:
+        if name in GROUPS:
+            aggregates[name][value] = n
+        else:
+            aggregates[name] = n
+    return aggregates
+
+
+def aggregate_counts(aggregates: Dict) -> Dict[AggregateKey, int]:
+    '''Inverse of aggregates_dict.'''
+    counts: Dict[AggregateKey, int] = {}
+    for name, n in aggregates.items():
+        if name in GROUPS:
+            counts.update({(name, value): c for value, c in n.items()})
+        else:
+            counts[(name, '')] = n
+    return counts
+
+
+class Aggregates:
+    '''
+    Aggregates over all entries, e.g. entries per country, kept up to date
+    as a mutation listener: only the aggregates that differ between the old
+    and the new entry are changed. Reading them takes time independent of
+    the number of entries.
+    '''
+
+    def __init__(self) -> None:
+        self.counts: Dict[AggregateKey, int] = {}
+
+    def add(self, changes: Dict[AggregateKey, int]) -> None:
+        for key, n in changes.items():
+            n += self.counts.get(key, 0)
+            if n:
+                self.counts[key] = n
+            else:
+                self.counts.pop(key, None)
+
+    def on_mutation(
+        self,
+        op: str,
+        nickname: str,
+        old: Optional[Dict],
+        new: Optional[Dict]
+    ) -> None:
+        self.add(count_changes(old, new))
+
+    def to_dict(self) -> Dict:
+        return aggregates_dict(self.counts.items())
@@ -1,35 +1,88 @@
 # Copyright (c) 2019. All rights reserved.
 
+import asyncio
+import hmac
 import json
 import logging
+import math
+import re
 from typing import (
     Any,
     Awaitable,
     Dict,
+    List,
     Optional,
     Tuple,
 )
 
+import tornado.http1connection
+import tornado.iostream
 import tornado.web
+import yaml
 
 from addrservice import LOGGER_NAME
+from addrservice.addressbook_db import ENTRY_FIELDS, Fields
+from addrservice.changelog import Change, ResyncRequiredError
+from addrservice.dedup import DuplicateEntryError
+from addrservice.idempotency import (
+    IDEMPOTENCY_KEY_HEADER,
+    IdempotencyKeyReusedError,
+)
+from addrservice.pincode_index import Pincode
+from addrservice.profiler import ProfilerBusyError, SamplingProfiler
+from addrservice.ratelimit import API_KEY_HEADER, RateLimitedError
+from addrservice.replication import StaleReplicaError
 from addrservice.service import AddressBookService
+from addrservice.tenants import QuotaExceededError, TenantManager
+import addrservice.tracing as tracing
+
+# Nicknames of entries, as addressed by their URI
+NICKNAME_REGEX = r'[a-zA-Z0-9-]+'
+_NICKNAME_PATTERN = re.compile(NICKNAME_REGEX + '$')
 
 ADDRESSBOOK_REGEX = r'/addressbook/?'
-ADDRESSBOOK_ENTRY_REGEX = r'/addressbook/(?P<id>[a-zA-Z0-9-]+)/?'
+ADDRESSBOOK_ENTRY_REGEX = r'/addressbook/(?P<id>' + NICKNAME_REGEX + ')/?'
 ADDRESSBOOK_ENTRY_URI_FORMAT_STR = r'/addressbook/{id}'
+ADDRESSBOOK_CHANGES_REGEX = r'/addressbook/_changes/?'
+ADDRESSBOOK_SEARCH_REGEX = r'/addressbook/_search/?'
+ADDRESSBOOK_PINCODES_REGEX = r'/addressbook/_pincodes/?'
+ADDRESSBOOK_SNAPSHOT_REGEX = r'/addressbook/_snapshot/?'
+ADDRESSBOOK_STATS_REGEX = r'/addressbook/_stats/?'
+ADDRESSBOOK_BULK_REGEX = r'/addressbook/_bulk/?'
+ADDRESSBOOK_DEDUP_REGEX = r'/addressbook/_dedup/?'
+# Prefix of address book routes of a tenant
+TENANT_REGEX = r'/t/(?P<tenant>[a-zA-Z0-9-]+)'
+TENANT_URI_FORMAT_STR = r'/t/{tenant}'
+
+ADMIN_TOKEN_HEADER = 'X-Admin-Token'
 
 
 class BaseRequestHandler(tornado.web.RequestHandler):
+    span: Optional[tracing.Span] = None
+    # Address book data, served by followers if in sync, and else written
+    # by the primary only
+    replicated = False
+    # Tenant of the request, on tenant routes
+    tenant: Optional[str] = None
+    uri_prefix = ''
+
     def initialize(
         self,
         service: AddressBookService,
         config: Dict,
-        logger: logging.Logger
+        logger: logging.Logger,
+        tenants: Optional[TenantManager] = None
     ) -> None:
         self.service = service
         self.config = config
         self.logger = logger
+        self.tenants = tenants
+
+    def set_default_headers(self) -> None:
+        # Also called by clear() when sending errors, so keep traceparent.
+        if self.span is not None:
+            traceparent = self.span.context.traceparent()
+            self.set_header(tracing.TRACEPARENT_HEADER, traceparent)
 
     def prepare(self) -> Optional[Awaitable[None]]:
         msg = 'REQUEST: {method} {uri} ({ip})'.format(
@@ -39,9 +92,87 @@ class BaseRequestHandler(tornado.web.RequestHandler):
         )
         self.logger.debug(msg)
 
+        self.span = tracing.start_request_span(
+            '{} {}'.format(self.request.method, self.__class__.__name__),
+            self.request.headers.get(tracing.TRACEPARENT_HEADER)
+        )
+        if self.span is not None:
+            self.span.attributes['http.method'] = self.request.method
+            self.span.attributes['http.target'] = self.request.uri
+            self.set_default_headers()
+
+        if not self._check_rate_limit():
+            return None
+        if self.tenants is not None and not self._acquire_tenant():
+            return None
+
+        if self.replicated:
+            self._check_replica()
+
         return super().prepare()
 
+    def _too_many_requests(self, e: RateLimitedError) -> None:
+        # Not an HTTPError, which would clear the Retry-After header
+        self.set_status(429)
+        self.set_header('Retry-After', str(math.ceil(e.retry_after)))
+        self.finish()
+
+    def _check_rate_limit(self) -> bool:
+        '''Whether the client of the request is within its rate limit.'''
+        limiter = self.service.rate_limiter
+        if limiter is None:
+            return True
+
+        client_key = limiter.client_key(
+            self.request.remote_ip or '',
+            self.request.headers.get(API_KEY_HEADER)
+        )
+        try:
+            limiter.check(
+                self.request.method or '', self.request.path, client_key
+            )
+        except RateLimitedError as e:
+            self._too_many_requests(e)
+            return False
+        return True
+
+    def _acquire_tenant(self) -> bool:
+        '''Serves the request from its tenant's service, if not limited.'''
+        assert self.tenants is not None
+        # Not an argument of the handler methods
+        tenant = self.path_kwargs.pop('tenant')
+        try:
+            self.service = self.tenants.acquire(tenant)
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, reason=str(e)) from None
+        except RateLimitedError as e:
+            self._too_many_requests(e)
+            return False
+
+        self.tenant = tenant
+        self.uri_prefix = TENANT_URI_FORMAT_STR.format(tenant=tenant)
+        return True
+
+    def _check_replica(self) -> None:
+        follower = self.service.follower
+        if follower is None:
+            return
+
+        if self.request.method not in ('GET', 'HEAD'):
+            self.redirect(
+                follower.primary + (self.request.uri or ''), status=307
+            )
+            return
+
+        try:
+            follower.check_staleness()
+        except StaleReplicaError as e:
+            raise tornado.web.HTTPError(503, reason=str(e)) from None
+
     def on_finish(self) -> None:
+        if self.tenants is not None and self.tenant is not None:
+            self.tenants.release(self.tenant)
+        tracing.end_request_span(self.span, self.get_status())
         super().on_finish()
 
     def write_error(self, status_code: int, **kwargs: Any) -> None:
@@ -77,17 +208,34 @@ class ReadinessRequestHandler(BaseRequestHandler):
         self.finish(info)
 
 
-class AddressBookRequestHandler(BaseRequestHandler):
-    async def get(self):
-        all_addrs = await self.service.get_all_addresses()
-        self.set_status(200)
-        self.finish(all_addrs)
+class AddressBookBaseRequestHandler(BaseRequestHandler):
+    replicated = True
 
-    async def post(self):
+    def _fields(self) -> Fields:
+        '''Fields of entries to return: ?fields=name,emails (default: all)'''
+        arg = self.get_argument('fields', None)
+        if arg is None:
+            return None
+        fields = {f for f in arg.split(',') if f}
+        if not fields <= ENTRY_FIELDS:
+            raise tornado.web.HTTPError(
+                400, reason='Unknown fields: {}'.format(
+                    ','.join(sorted(fields - ENTRY_FIELDS))
+                )
+            )
+        return fields
+
+    async def _post_address(self, nickname: str = None) -> None:
         try:
             addr = json.loads(self.request.body.decode('utf-8'))
-            id = await self.service.post_address(addr)
-            addr_uri = ADDRESSBOOK_ENTRY_URI_FORMAT_STR.format(id=id)
+            id = await self.service.post_address(
+                addr,
+                self.request.headers.get(IDEMPOTENCY_KEY_HEADER),
+                nickname
+            )
+            addr_uri = self.uri_prefix + (
+                ADDRESSBOOK_ENTRY_URI_FORMAT_STR.format(id=id)
+            )
             self.set_status(201)
             self.set_header('Location', addr_uri)
             self.finish()
@@ -95,24 +243,84 @@ class AddressBookRequestHandler(BaseRequestHandler):
             raise tornado.web.HTTPError(
                 400, reason='Invalid JSON body'
             ) from None
+        except IdempotencyKeyReusedError:
+            raise tornado.web.HTTPError(
+                422, reason='Idempotency-Key reused with different request'
+            ) from None
+        except DuplicateEntryError as e:
+            # Not an HTTPError, which would clear the Location header
+            self.set_status(409, reason=str(e))
+            self.set_header('Location', self.uri_prefix + (
+                ADDRESSBOOK_ENTRY_URI_FORMAT_STR.format(id=e.nickname)
+            ))
+            self.finish()
+        except KeyError as e:
+            raise tornado.web.HTTPError(409, reason=str(e)) from None
+        except QuotaExceededError as e:
+            raise tornado.web.HTTPError(403, reason=str(e)) from None
         except ValueError as e:
             raise tornado.web.HTTPError(400, reason=str(e)) from None
+        except PermissionError as e:
+            raise tornado.web.HTTPError(405, reason=str(e)) from None
+
+
+class AddressBookRequestHandler(AddressBookBaseRequestHandler):
+    async def get(self):
+        fields = self._fields()
+
+        async def make_body() -> bytes:
+            all_addrs = await self.service.get_all_addresses(fields)
+            body = await self.service.encode_json(all_addrs)
+            return body.encode('utf-8')
+
+        # Compressed once per version of the address book, see Compression
+        encoding, body = await self.service.compression.encode(
+            self.request,
+            self.service.content_version(),
+            make_body,
+            self.service.worker_pool
+        )
+        self.set_status(200)
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        if encoding is not None:
+            self.set_header('Content-Encoding', encoding)
+        self.finish(body)
+
+    async def post(self):
+        await self._post_address()
 
 
-class AddressBookEntryRequestHandler(BaseRequestHandler):
+class AddressBookEntryRequestHandler(AddressBookBaseRequestHandler):
     async def get(self, id):
         try:
-            addr = await self.service.get_address(id)
+            addr = await self.service.get_address(id, self._fields())
             self.set_status(200)
             self.finish(addr)
         except KeyError as e:
             raise tornado.web.HTTPError(404, reason=str(e)) from None
 
+    async def post(self, id):
+        # Creates the entry with the given nickname, e.g. sent by a router
+        await self._post_address(id)
+
     async def put(self, id):
-        # TODO: Exercise: implement this method. Remove 'no_' from
-        # the 'no_test_address_book_endpoints' function in file
-        # 'tests/integration/app_test.py', and all tests should pass.
-        pass
+        try:
+            addr = json.loads(self.request.body.decode('utf-8'))
+            await self.service.put_address(id, addr)
+            self.set_status(204)
+            self.finish()
+        except (json.decoder.JSONDecodeError, TypeError):
+            raise tornado.web.HTTPError(
+                400, reason='Invalid JSON body'
+            ) from None
+        except KeyError as e:
+            raise tornado.web.HTTPError(404, reason=str(e)) from None
+        except QuotaExceededError as e:
+            raise tornado.web.HTTPError(403, reason=str(e)) from None
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, reason=str(e)) from None
+        except PermissionError as e:
+            raise tornado.web.HTTPError(405, reason=str(e)) from None
 
     async def delete(self, id):
         try:
@@ -121,6 +329,495 @@ class AddressBookEntryRequestHandler(BaseRequestHandler):
             self.finish()
         except KeyError as e:
             raise tornado.web.HTTPError(404, reason=str(e)) from None
+        except PermissionError as e:
+            raise tornado.web.HTTPError(405, reason=str(e)) from None
+
+
+@tornado.web.stream_request_body
+class AddressBookBulkRequestHandler(BaseRequestHandler):
+    '''
+    POST /addressbook/_bulk: imports newline delimited JSON, a line per
+    entry: {"nickname": ..., "address": {...}}, nickname optional. Lines
+    are parsed and created as the body arrives, instead of buffering it
+    whole, and the next chunk is read only when they are done. Responds
+    with the number of entries created and failed, and the first errors.
+
+    The bulk-max-body-size of the server section of the config, if any,
+    overrides its max-body-size.
+    '''
+
+    MAX_ERRORS = 100
+    replicated = True
+
+    def prepare(self) -> Optional[Awaitable[None]]:
+        self._partial_line = b''
+        self.line_number = 0
+        self.created = 0
+        self.failed = 0
+        self.errors: List[Dict[str, Any]] = []
+
+        server_config = self.config.get('server') or {}
+        max_body_size = server_config.get('bulk-max-body-size')
+        connection = self.request.connection
+        if max_body_size is not None and isinstance(
+            connection, tornado.http1connection.HTTP1Connection
+        ):
+            connection.set_max_body_size(int(max_body_size))
+        return super().prepare()
+
+    async def data_received(self, chunk: bytes) -> None:
+        if self._finished:
+            return
+
+        lines = (self._partial_line + chunk).split(b'\n')
+        self._partial_line = lines.pop()
+        for line in lines:
+            await self._import_line(line)
+
+    async def _import_line(self, line: bytes) -> None:
+        self.line_number += 1
+        if not line.strip():
+            return
+
+        try:
+            item = json.loads(line.decode('utf-8'))
+            if not isinstance(item, dict) or not isinstance(
+                item.get('address'), dict
+            ):
+                raise ValueError('Expected {"nickname": .., "address": {..}}')
+            nickname = item.get('nickname')
+            if nickname is not None and not (
+                isinstance(nickname, str) and _NICKNAME_PATTERN.match(nickname)
+            ):
+                raise ValueError('Invalid nickname: {}'.format(
+                    json.dumps(nickname)
+                ))
+            await self.service.post_address(item['address'], None, nickname)
+            self.created += 1
+        except (
+            DuplicateEntryError,
+            KeyError,
+            ValueError,
+            TypeError,
+            QuotaExceededError,
+            PermissionError,
+        ) as e:
+            self._error(str(e))
+
+    def _error(self, reason: str) -> None:
+        self.failed += 1
+        if len(self.errors) < self.MAX_ERRORS:
+            self.errors.append({'line': self.line_number, 'reason': reason})
+
+    async def post(self):
+        await self._import_line(self._partial_line)
+        self.set_status(200)
+        self.finish({
+            'created': self.created,
+            'failed': self.failed,
+            'errors': self.errors,
+        })
+
+
+class AddressBookSearchRequestHandler(BaseRequestHandler):
+    MAX_RESULTS = 100
+    replicated = True
+
+    async def get(self):
+        query = self.get_argument('q', '')
+        try:
+            k = int(self.get_argument('k', '10'))
+        except ValueError:
+            k = 0
+        if not query or not 0 < k <= self.MAX_RESULTS:
+            raise tornado.web.HTTPError(
+                400, reason='Invalid search parameters'
+            )
+
+        try:
+            results = await self.service.search_addresses(query, k)
+        except NotImplementedError as e:
+            raise tornado.web.HTTPError(404, reason=str(e)) from None
+
+        self.set_status(200)
+        self.finish({
+            'results': [
+                {'nickname': nickname, 'score': score, 'address': addr}
+                for nickname, score, addr in results
+            ]
+        })
+
+
+class AddressBookPincodesRequestHandler(BaseRequestHandler):
+    '''
+    GET /addressbook/_pincodes?min=A&max=B[&limit=N]: entries with any
+    pincode in [A, B], in pincode order.
+    GET /addressbook/_pincodes?near=P[&k=N]: N pincodes closest to P.
+    '''
+
+    MAX_NEAREST = 1000
+    replicated = True
+
+    def _pincode_argument(self, name: str) -> Optional[Pincode]:
+        value = self.get_argument(name, None)
+        if value is None:
+            return None
+        p = float(value)
+        return int(p) if p.is_integer() else p
+
+    async def get(self):
+        try:
+            low = self._pincode_argument('min')
+            high = self._pincode_argument('max')
+            near = self._pincode_argument('near')
+            k = int(self.get_argument('k', '10'))
+            limit = self.get_argument('limit', None)
+            limit = None if limit is None else int(limit)
+        except (ValueError, OverflowError):
+            raise tornado.web.HTTPError(
+                400, reason='Invalid pincode query parameters'
+            ) from None
+
+        if near is not None and low is None and high is None:
+            if not 0 < k <= self.MAX_NEAREST:
+                raise tornado.web.HTTPError(
+                    400, reason='Invalid pincode query parameters'
+                )
+            nearest = await self.service.get_nearest_pincodes(near, k)
+            self.set_status(200)
+            self.finish({
+                'results': [
+                    {'pincode': p, 'nickname': nickname}
+                    for p, nickname in nearest
+                ]
+            })
+            return
+
+        if (
+            near is not None or low is None or high is None or
+            low > high or (limit is not None and limit < 1)
+        ):
+            raise tornado.web.HTTPError(
+                400, reason='Invalid pincode query parameters'
+            )
+
+        addrs = await self.service.get_addresses_by_pincode(low, high, limit)
+        body = await self.service.encode_json(addrs)
+        self.set_status(200)
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.finish(body)
+
+
+class AddressBookChangesRequestHandler(BaseRequestHandler):
+    '''
+    Change feed: GET /addressbook/_changes?since=SEQ&mode=...
+
+    mode=poll (default) returns changes after SEQ right away, mode=longpoll
+    waits up to timeout seconds for some, and mode=sse streams them as
+    server-sent events (with heartbeat events while idle) until the client
+    disconnects or timeout, if given, expires. If changes after SEQ are no
+    longer retained, the response is 410 with resync set, and the consumer
+    must reload the address book.
+    '''
+
+    MAX_TIMEOUT = 300.0
+    replicated = True
+
+    connection_closed = False
+
+    def on_connection_close(self) -> None:
+        self.connection_closed = True
+        super().on_connection_close()
+
+    async def get(self):
+        try:
+            since = int(
+                self.request.headers.get('Last-Event-ID') or
+                self.get_argument('since', '0')
+            )
+            limit = int(self.get_argument('limit', '1000'))
+            timeout = float(self.get_argument('timeout', '30'))
+            heartbeat = float(self.get_argument('heartbeat', '15'))
+        except ValueError:
+            raise tornado.web.HTTPError(
+                400, reason='Invalid change feed parameters'
+            ) from None
+        mode = self.get_argument('mode', 'poll')
+
+        if (
+            mode not in ('poll', 'longpoll', 'sse') or limit < 1 or
+            not 0 <= timeout <= self.MAX_TIMEOUT or heartbeat <= 0
+        ):
+            raise tornado.web.HTTPError(
+                400, reason='Invalid change feed parameters'
+            )
+
+        try:
+            if mode == 'poll':
+                changes = self.service.get_changes(since, limit)
+            else:
+                changes = await self.service.wait_for_changes(
+                    since, 0 if mode == 'sse' else timeout, limit
+                )
+        except ResyncRequiredError as e:
+            self.set_status(410)
+            self.finish({'resync': True, 'last_seq': e.last_seq})
+            return
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, reason=str(e)) from None
+
+        if mode == 'sse':
+            await self._stream(changes, since, limit, timeout, heartbeat)
+            return
+
+        self.set_status(200)
+        self.finish({
+            'last_seq': self.service.last_change_seq(),
+            'next_since': changes[-1].seq if changes else since,
+            'changes': [c.to_dict() for c in changes],
+        })
+
+    def _write_event(
+        self,
+        event: str,
+        data: Any,
+        id: Optional[int] = None
+    ) -> None:
+        msg = '' if id is None else 'id: {}\n'.format(id)
+        msg += 'event: {}\ndata: {}\n\n'.format(event, json.dumps(data))
+        self.write(msg)
+
+    async def _stream(
+        self,
+        changes: List[Change],
+        since: int,
+        limit: int,
+        timeout: float,
+        heartbeat: float
+    ) -> None:
+        self.set_status(200)
+        self.set_header('Content-Type', 'text/event-stream')
+        self.set_header('Cache-Control', 'no-cache')
+
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout if timeout > 0 else None
+
+        while not (self.connection_closed or self.service.draining):
+            for c in changes:
+                self._write_event('change', c.to_dict(), c.seq)
+                since = c.seq
+            if not changes:
+                self._write_event(
+                    'heartbeat', {'last_seq': self.service.last_change_seq()}
+                )
+
+            try:
+                await self.flush()
+            except tornado.iostream.StreamClosedError:
+                return
+
+            wait = heartbeat
+            if deadline is not None:
+                wait = min(wait, deadline - loop.time())
+                if wait <= 0:
+                    break
+
+            try:
+                changes = await self.service.wait_for_changes(
+                    since, wait, limit
+                )
+            except ResyncRequiredError as e:
+                self._write_event('resync', {'last_seq': e.last_seq})
+                break
+
+        if not self.connection_closed:
+            self.finish()
+
+
+class AddressBookSnapshotRequestHandler(BaseRequestHandler):
+    '''
+    GET /addressbook/_snapshot: all entries in snapshot format (see
+    addrservice.snapshot), with the change log seq they are as of, e.g. to
+    bootstrap a follower, which then reads the change feed after that seq.
+    '''
+
+    replicated = True
+
+    async def get(self):
+        body = await self.service.get_snapshot()
+        self.set_status(200)
+        self.set_header('Content-Type', 'application/octet-stream')
+        self.finish(body)
+
+
+class AddressBookStatsRequestHandler(BaseRequestHandler):
+    '''
+    GET /addressbook/_stats: counts of entries, addresses, phone numbers,
+    fax numbers and emails, and of entries by country, city and kind of
+    address, maintained on each mutation.
+    '''
+
+    replicated = True
+
+    async def get(self):
+        aggregates = await self.service.get_aggregates()
+        self.set_status(200)
+        self.finish(aggregates)
+
+
+class AddressBookDedupRequestHandler(BaseRequestHandler):
+    '''
+    GET /addressbook/_dedup: sets of duplicate entries, by the nickname of
+    the one that would be kept.
+    POST /addressbook/_dedup: merges each set into the kept entry, and
+    deletes the others.
+    Only if the dedup section is configured.
+    '''
+
+    replicated = True
+
+    async def _dedup(self, apply: bool) -> None:
+        try:
+            result = await self.service.dedup_addresses(apply)
+        except NotImplementedError as e:
+            raise tornado.web.HTTPError(404, reason=str(e)) from None
+        except PermissionError as e:
+            raise tornado.web.HTTPError(405, reason=str(e)) from None
+        self.set_status(200)
+        self.finish(result)
+
+    async def get(self):
+        await self._dedup(False)
+
+    async def post(self):
+        await self._dedup(True)
+
+
+class AdminRequestHandler(BaseRequestHandler):
+    '''Base for admin-only endpoints, enabled by setting admin.token.'''
+
+    def prepare(self) -> Optional[Awaitable[None]]:
+        # Before the base class, which may already have finished the request
+        token = (self.config.get('admin') or {}).get('token')
+        given = self.request.headers.get(ADMIN_TOKEN_HEADER, '')
+        if not token or not hmac.compare_digest(str(token), given):
+            raise tornado.web.HTTPError(403, reason='Forbidden')
+
+        return super().prepare()
+
+
+class ProfileRequestHandler(AdminRequestHandler):
+    async def get(self):
+        admin_config = self.config.get('admin') or {}
+        max_seconds = float(admin_config.get('max-profile-seconds', 60))
+
+        try:
+            seconds = float(self.get_argument('seconds', '10'))
+            interval = float(self.get_argument('interval', '0.005'))
+        except ValueError:
+            raise tornado.web.HTTPError(
+                400, reason='Invalid profile parameters'
+            ) from None
+        fmt = self.get_argument('format', 'collapsed')
+
+        if not 0 < seconds <= max_seconds or not 0 < interval < seconds:
+            raise tornado.web.HTTPError(
+                400, reason='Invalid profile parameters'
+            )
+        if fmt not in ('collapsed', 'speedscope'):
+            raise tornado.web.HTTPError(400, reason='Unknown profile format')
+        if not SamplingProfiler.is_supported():
+            raise tornado.web.HTTPError(501, reason='Profiler not supported')
+
+        profiler = SamplingProfiler(interval)
+        try:
+            profiler.start()
+        except ProfilerBusyError as e:
+            raise tornado.web.HTTPError(409, reason=str(e)) from None
+
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.stop()
+
+        self.set_status(200)
+        if fmt == 'speedscope':
+            self.finish(profiler.speedscope())
+        else:
+            self.set_header('Content-Type', 'text/plain; charset=UTF-8')
+            self.finish(profiler.collapsed())
+
+
+class ShardsRequestHandler(AdminRequestHandler):
+    '''
+    GET /debug/shards: nodes of a sharded address book.
+    POST /debug/shards with {"node": URL}: adds a node, and moves to it the
+    entries it now owns.
+    '''
+
+    async def get(self):
+        try:
+            nodes = self.service.get_shards()
+        except NotImplementedError as e:
+            raise tornado.web.HTTPError(404, reason=str(e)) from None
+        self.set_status(200)
+        self.finish({'nodes': nodes})
+
+    async def post(self):
+        try:
+            node = json.loads(self.request.body.decode('utf-8'))['node']
+            if not isinstance(node, str):
+                raise TypeError()
+        except (json.decoder.JSONDecodeError, KeyError, TypeError):
+            raise tornado.web.HTTPError(
+                400, reason='Invalid JSON body'
+            ) from None
+
+        try:
+            moved = await self.service.add_shard(node)
+        except NotImplementedError as e:
+            raise tornado.web.HTTPError(404, reason=str(e)) from None
+        except ValueError as e:
+            raise tornado.web.HTTPError(409, reason=str(e)) from None
+
+        self.set_status(200)
+        self.finish({'node': node, 'moved': moved})
+
+
+class TenantsRequestHandler(AdminRequestHandler):
+    '''GET /debug/tenants: entries and memory of each resident tenant.'''
+
+    async def get(self):
+        if self.service.tenants is None:
+            raise tornado.web.HTTPError(404, reason='Tenants not enabled')
+        self.set_status(200)
+        self.finish({
+            'tenants': self.service.tenants.tenant_stats(),
+            'total': self.service.tenants.stats(),
+        })
+
+
+class ConfigRequestHandler(AdminRequestHandler):
+    '''
+    POST /debug/config with a whole config, as YAML or JSON: reloads it,
+    see AddressBookService.reload.
+    '''
+
+    async def post(self):
+        try:
+            config = yaml.safe_load(self.request.body.decode('utf-8'))
+        except (UnicodeDecodeError, yaml.YAMLError):
+            raise tornado.web.HTTPError(
+                400, reason='Invalid config body'
+            ) from None
+
+        try:
+            result = self.service.reload(config)
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, reason=str(e)) from None
+
+        self.set_status(200)
+        self.finish(result)
 
 
 def log_function(handler: tornado.web.RequestHandler) -> None:
@@ -152,16 +849,48 @@ def make_addrservice_app(
 ) -> Tuple[AddressBookService, tornado.web.Application]:
     service = AddressBookService.from_config(config)
 
+    # Address Book endpoints, also served per tenant if tenants are enabled
+    addressbook_routes = [
+        (ADDRESSBOOK_REGEX, AddressBookRequestHandler),
+        (ADDRESSBOOK_CHANGES_REGEX, AddressBookChangesRequestHandler),
+        (ADDRESSBOOK_SEARCH_REGEX, AddressBookSearchRequestHandler),
+        (ADDRESSBOOK_PINCODES_REGEX, AddressBookPincodesRequestHandler),
+        (ADDRESSBOOK_SNAPSHOT_REGEX, AddressBookSnapshotRequestHandler),
+        (ADDRESSBOOK_STATS_REGEX, AddressBookStatsRequestHandler),
+        (ADDRESSBOOK_BULK_REGEX, AddressBookBulkRequestHandler),
+        (ADDRESSBOOK_DEDUP_REGEX, AddressBookDedupRequestHandler),
+        (ADDRESSBOOK_ENTRY_REGEX, AddressBookEntryRequestHandler),
+    ]
+    tenant_routes: List[Tuple[str, Any, Dict[str, Any]]] = []
+    if service.tenants is not None:
+        tenant_args = dict(
+            service=service, config=config, logger=logger,
+            tenants=service.tenants
+        )
+        tenant_routes = [
+            (TENANT_REGEX + regex, handler, tenant_args)
+            for regex, handler in addressbook_routes
+        ]
+
+    routes: List[Tuple[str, Any, Dict[str, Any]]] = [
+        # Heartbeat
+        (r'/healthz/?', LivenessRequestHandler, dict(service=service, config=config, logger=logger)),  # noqa
+        (r'/readiness/?', ReadinessRequestHandler, dict(service=service, config=config, logger=logger)),  # noqa
+        # Admin endpoints
+        (r'/debug/profile/?', ProfileRequestHandler, dict(service=service, config=config, logger=logger)),  # noqa
+        (r'/debug/shards/?', ShardsRequestHandler, dict(service=service, config=config, logger=logger)),  # noqa
+        (r'/debug/tenants/?', TenantsRequestHandler, dict(service=service, config=config, logger=logger)),  # noqa
+        (r'/debug/config/?', ConfigRequestHandler, dict(service=service, config=config, logger=logger)),  # noqa
+    ]
+    routes += [
+        (regex, handler, dict(service=service, config=config, logger=logger))
+        for regex, handler in addressbook_routes
+    ]
+    routes += tenant_routes
+
     app = tornado.web.Application(
-        [
-            # Heartbeat
-            (r'/healthz/?', LivenessRequestHandler, dict(service=service, config=config, logger=logger)),  # noqa
-            (r'/readiness/?', ReadinessRequestHandler, dict(service=service, config=config, logger=logger)),  # noqa
-            # Address Book endpoints
-            (ADDRESSBOOK_REGEX, AddressBookRequestHandler, dict(service=service, config=config, logger=logger)),  # noqa
-            (ADDRESSBOOK_ENTRY_REGEX, AddressBookEntryRequestHandler, dict(service=service, config=config, logger=logger))  # noqa
-        ],
-        compress_response=True,  # compress textual responses
+        list(routes),  # as a list of tornado's rule types, not just tuples
+        transforms=[service.compression.transform_class()],  # compression
         log_function=log_function,  # log_request() uses it to log results
         serve_traceback=debug,  # it is passed on as setting to write_error()
         # TODO: Exercise: add here suitable values for default_handler_class
@@ -0,0 +1,129 @@
+# Copyright (c) 2019. All rights reserved.
+
+import collections
+from typing import Any, Dict, Generic, Hashable, List, Optional, TypeVar
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+class CountMinSketch:
+    '''
+    Approximate access frequency of keys in depth x width small counters.
+
+    Counters saturate at 15, and all are halved after sample_size
+    increments, so that the frequencies favour recent history.
+    '''
+
+    MAX_COUNT = 15
+
+    def __init__(self, width: int, depth: int = 4, sample_size: int = 0):
+        self.width = max(width, 64)
+        self.depth = depth
+        self.sample_size = sample_size or 10 * self.width
+        self.rows: List[List[int]] = [[0] * self.width for _ in range(depth)]
+        self.increments = 0
+
+    def _indexes(self, key: Hashable) -> List[int]:
+        # Row i hashes to h1 + i * h2, from two halves of one hash, mixed
+        # (splitmix64 finalizer) as small ints hash to themselves.
+        h = hash(key) & 0xffffffffffffffff
+        h = ((h ^ (h >> 30)) * 0xbf58476d1ce4e5b9) & 0xffffffffffffffff
+        h = ((h ^ (h >> 27)) * 0x94d049bb133111eb) & 0xffffffffffffffff
+        h ^= h >> 31
+        h1, h2 = h & 0xffffffff, (h >> 32) | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def increment(self, key: Hashable) -> None:
+        for row, i in zip(self.rows, self._indexes(key)):
+            if row[i] < self.MAX_COUNT:
+                row[i] += 1
+
+        self.increments += 1
+        if self.increments >= self.sample_size:
+            self.reset()
+
+    def estimate(self, key: Hashable) -> int:
+        return min(row[i] for row, i in zip(self.rows, self._indexes(key)))
+
+    def reset(self) -> None:
+        self.rows = [[c >> 1 for c in row] for row in self.rows]
+        self.increments //= 2
+
+
+class TinyLFUCache(Generic[K, V]):
+    '''
+    Size-bounded LRU cache with TinyLFU admission.
+
+    When full, a new key is admitted only if it has been accessed more often
+    than the LRU victim it would evict, so that one-off reads, like a scan,
+    don't flush the cache. Accesses are counted in a CountMinSketch: a hit
+    in get, and every put, as a miss is followed by a put of the value.
+    '''
+
+    def __init__(self, capacity: int) -> None:
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1')
+
+        self.capacity = capacity
+        self.items: collections.OrderedDict = collections.OrderedDict()
+        self.sketch = CountMinSketch(width=4 * capacity)
+        self.evictions = 0
+        self.rejections = 0
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.items
+
+    def get(self, key: K) -> Optional[V]:
+        value = self.items.get(key)
+        if value is not None:
+            self.sketch.increment(key)
+            self.items.move_to_end(key)
+        return value
+
+    def peek(self, key: K) -> Optional[V]:
+        '''Value of key, without counting it as an access.'''
+        return self.items.get(key)
+
+    def put(self, key: K, value: V) -> bool:
+        '''Adds or replaces the value of key, returns whether it is cached.'''
+        self.sketch.increment(key)
+        if key in self.items:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            return True
+
+        if len(self.items) >= self.capacity:
+            victim = next(iter(self.items))
+            if self.sketch.estimate(key) <= self.sketch.estimate(victim):
+                self.rejections += 1
+                return False
+            del self.items[victim]
+            self.evictions += 1
+
+        self.items[key] = value
+        return True
+
+    def pop(self, key: K) -> Optional[V]:
+        return self.items.pop(key, None)
+
+    def resize(self, capacity: int) -> None:
+        '''Evicts LRU items down to a smaller capacity. Counts are kept.'''
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1')
+
+        self.capacity = capacity
+        while len(self.items) > capacity:
+            self.items.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'size': len(self.items),
+            'capacity': self.capacity,
+            'evictions': self.evictions,
+            'rejections': self.rejections,
+        }
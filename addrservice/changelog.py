@@ -0,0 +1,130 @@
+# Copyright (c) 2019. All rights reserved.
+
+import asyncio
+import collections
+import itertools
+from typing import Any, Deque, Dict, List, NamedTuple, Optional
+
+from addrservice.utils import unixtime_now_millis
+
+DEFAULT_RETENTION = 10000
+
+OP_CREATE = 'create'
+OP_UPDATE = 'update'
+OP_DELETE = 'delete'
+
+
+class ResyncRequiredError(Exception):
+    '''
+    Requested changes are no longer retained, or are ahead of the log (e.g.
+    of a primary that restarted): consumer must resync.
+    '''
+
+    def __init__(self, since: int, first_seq: int, last_seq: int) -> None:
+        super().__init__(
+            'changes after {} are not available, retained are {} to {}'
+            .format(since, first_seq, last_seq)
+        )
+        self.last_seq = last_seq
+
+
+class Change(NamedTuple):
+    seq: int
+    op: str
+    nickname: str
+    address: Optional[Dict]
+    timestamp: int
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'seq': self.seq,
+            'op': self.op,
+            'nickname': self.nickname,
+            'address': self.address,
+            'timestamp': self.timestamp,
+        }
+
+
+class ChangeLog:
+    '''
+    Monotonically sequenced log of the most recent `retention` mutations.
+
+    Sequence numbers start from 1 and have no gaps, so a consumer that saw
+    changes up to `seq` asks for changes `since(seq)`. If some of those have
+    been dropped already, or seq is ahead of the log, as the log restarts
+    from 0 with the process, it gets ResyncRequiredError and must reload the
+    full address book.
+    '''
+
+    def __init__(self, retention: int = DEFAULT_RETENTION) -> None:
+        if retention < 1:
+            raise ValueError('retention must be at least 1')
+
+        self.changes: Deque[Change] = collections.deque(maxlen=retention)
+        self.last_seq = 0
+        self._new_change: Optional[asyncio.Event] = None
+
+    @property
+    def retention(self) -> int:
+        return self.changes.maxlen or 0
+
+    @property
+    def first_seq(self) -> int:
+        '''Oldest retained sequence number (last_seq + 1 if empty).'''
+        return self.changes[0].seq if self.changes else self.last_seq + 1
+
+    def append(
+        self,
+        op: str,
+        nickname: str,
+        address: Optional[Dict] = None
+    ) -> Change:
+        self.last_seq += 1
+        change = Change(
+            self.last_seq, op, nickname, address, unixtime_now_millis()
+        )
+        self.changes.append(change)
+        self.wake()
+        return change
+
+    def since(self, seq: int, limit: Optional[int] = None) -> List[Change]:
+        if seq < 0:
+            raise ValueError('Invalid sequence number {}'.format(seq))
+        if seq + 1 < self.first_seq or seq > self.last_seq:
+            raise ResyncRequiredError(seq, self.first_seq, self.last_seq)
+
+        start = seq + 1 - self.first_seq
+        stop = None if limit is None else start + limit
+        return list(itertools.islice(self.changes, start, stop))
+
+    def reset(self, seq: int) -> None:
+        '''
+        Drops all changes and continues from seq, e.g. when the address book
+        is replaced with a snapshot. Consumers waiting for changes wake up.
+        '''
+        self.changes.clear()
+        self.last_seq = seq
+        self.wake()
+
+    def wake(self) -> None:
+        '''Wakes consumers waiting for changes, e.g. to end streams.'''
+        if self._new_change is not None:
+            self._new_change.set()
+            self._new_change = None
+
+    async def wait(
+        self,
+        seq: int,
+        timeout: float,
+        limit: Optional[int] = None
+    ) -> List[Change]:
+        '''Changes after seq, waiting up to timeout seconds for any.'''
+        if seq == self.last_seq and timeout > 0:
+            if self._new_change is None:
+                self._new_change = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._new_change.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        return self.since(seq, limit)
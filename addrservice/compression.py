@@ -0,0 +1,327 @@
+# Copyright (c) 2019. All rights reserved.
+
+import re
+from typing import (
+    Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple, Type
+)
+import zlib
+
+from tornado.httputil import HTTPHeaders, HTTPServerRequest
+from tornado.web import GZipContentEncoding, OutputTransform
+
+from addrservice.cache import TinyLFUCache
+from addrservice.workers import WorkerPool
+
+# Optional: Brotli and Zstandard encodings are offered if installed
+try:
+    import brotli  # type: ignore
+except ImportError:
+    brotli = None
+try:
+    import zstandard  # type: ignore
+except ImportError:
+    zstandard = None  # type: ignore
+
+GZIP = 'gzip'
+BROTLI = 'br'
+ZSTD = 'zstd'
+
+DEFAULT_ENCODINGS = [ZSTD, BROTLI, GZIP]
+DEFAULT_LEVELS = {GZIP: 6, BROTLI: 4, ZSTD: 3}
+DEFAULT_MIN_SIZE = 1024
+
+
+def available_encodings() -> List[str]:
+    return [
+        e for e in DEFAULT_ENCODINGS
+        if e == GZIP or
+        (e == BROTLI and brotli is not None) or
+        (e == ZSTD and zstandard is not None)
+    ]
+
+
+class StreamCompressor:
+    '''Compresses a response body chunk by chunk, each flushed.'''
+
+    def __init__(self, encoding: str, level: int) -> None:
+        self.encoding = encoding
+        if encoding == GZIP:
+            self._gzip = zlib.compressobj(level, zlib.DEFLATED, 16 + 15)
+        elif encoding == BROTLI:
+            self._brotli = brotli.Compressor(quality=level)
+        elif encoding == ZSTD:
+            self._zstd = zstandard.ZstdCompressor(level=level).compressobj()
+        else:
+            raise ValueError('Unknown encoding: {}'.format(encoding))
+
+    def compress(self, chunk: bytes, finishing: bool) -> bytes:
+        if self.encoding == GZIP:
+            return self._gzip.compress(chunk) + self._gzip.flush(
+                zlib.Z_FINISH if finishing else zlib.Z_SYNC_FLUSH
+            )
+        if self.encoding == BROTLI:
+            out = self._brotli.process(chunk)
+            return out + (
+                self._brotli.finish() if finishing else self._brotli.flush()
+            )
+        return self._zstd.compress(chunk) + (
+            self._zstd.flush() if finishing else
+            self._zstd.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        )
+
+
+def compress(body: bytes, encoding: str, level: int) -> bytes:
+    # Module level function, so that it can be sent to a process pool.
+    return StreamCompressor(encoding, level).compress(body, True)
+
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    '''Accept-Encoding header -> {coding: q}'''
+    accepted: Dict[str, float] = {}
+    for item in header.split(','):
+        coding, *params = [p.strip() for p in item.split(';')]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.lower()] = q
+    return accepted
+
+
+def compressible_type(content_type: str) -> bool:
+    ctype = content_type.split(';')[0].strip()
+    return (
+        ctype.startswith('text/') or
+        ctype in GZipContentEncoding.CONTENT_TYPES
+    )
+
+
+class CompressionRule:
+    '''Encodings in order of preference, their levels, and minimum size.'''
+
+    def __init__(
+        self,
+        path: str,
+        encodings: List[str],
+        levels: Dict[str, int],
+        min_size: int
+    ) -> None:
+        available = available_encodings()
+        for e in encodings:
+            if e not in DEFAULT_ENCODINGS:
+                raise ValueError('Unknown encoding: {}'.format(e))
+
+        self.path = re.compile(path)
+        self.encodings = [e for e in encodings if e in available]
+        self.levels = levels
+        self.min_size = min_size
+
+    def matches(self, path: str) -> bool:
+        return self.path.match(path) is not None
+
+    def negotiate(self, accept_encoding: str) -> Optional[str]:
+        '''Encoding to respond with, None for identity.'''
+        accepted = parse_accept_encoding(accept_encoding)
+        best, best_q = None, 0.0
+        for e in self.encodings:
+            q = accepted.get(e, accepted.get('*', 0.0))
+            if q > best_q:
+                best, best_q = e, q
+        return best
+
+
+class CompressionTransform(OutputTransform):
+    '''
+    Compresses responses as negotiated by the rule of the request path,
+    unless already encoded, e.g. a cached compressed body (see
+    Compression.encode). Replaces Tornado's GZipContentEncoding.
+    '''
+
+    # Set on the subclass made by Compression.transform_class
+    compression: 'Compression'
+
+    def __init__(self, request: HTTPServerRequest) -> None:
+        self.rule = self.compression.rule_for(request.path)
+        self.encoding = self.rule.negotiate(
+            request.headers.get('Accept-Encoding', '')
+        )
+        self.compressor: Optional[StreamCompressor] = None
+
+    def transform_first_chunk(
+        self,
+        status_code: int,
+        headers: HTTPHeaders,
+        chunk: bytes,
+        finishing: bool
+    ) -> Tuple[int, HTTPHeaders, bytes]:
+        if 'Vary' in headers:
+            headers['Vary'] += ', Accept-Encoding'
+        else:
+            headers['Vary'] = 'Accept-Encoding'
+
+        if (
+            self.encoding is not None and
+            'Content-Encoding' not in headers and
+            compressible_type(headers.get('Content-Type', '')) and
+            (not finishing or len(chunk) >= self.rule.min_size)
+        ):
+            self.compressor = StreamCompressor(
+                self.encoding, self.rule.levels[self.encoding]
+            )
+            headers['Content-Encoding'] = self.encoding
+            chunk = self.transform_chunk(chunk, finishing)
+            if 'Content-Length' in headers:
+                if finishing:
+                    headers['Content-Length'] = str(len(chunk))
+                else:
+                    del headers['Content-Length']
+            self.compression.compressed += 1
+        return status_code, headers, chunk
+
+    def transform_chunk(self, chunk: bytes, finishing: bool) -> bytes:
+        if self.compressor is None:
+            return chunk
+        return self.compressor.compress(chunk, finishing)
+
+
+class Compression:
+    '''
+    Response compression: encoding negotiated by Accept-Encoding among those
+    of the first route rule matching the request path (else the defaults),
+    at the level configured for it, for textual bodies of at least min-size
+    bytes. Streamed responses are compressed chunk by chunk.
+
+    Bodies that are costly to make, like listings, are made through
+    encode(), which caches them compressed by URI and encoding, along with
+    the version of their content (not cached if unknown), and compresses
+    large ones in the worker pool (see the 'compress' offload threshold).
+
+    Config (compression section):
+        encodings:     in order of preference, default: zstd, br, gzip;
+                       br and zstd need the brotli and zstandard packages
+        levels:        encoding -> level, default: gzip 6, br 4, zstd 3
+        min-size:      bytes, default: 1024
+        cache-entries: compressed bodies cached, default: 256 (0: none)
+        routes:        list of rules, each:
+            path:      regex matched at the start of the path
+            encodings, levels, min-size: as above, default: as above
+    '''
+
+    def __init__(
+        self,
+        rules: List[CompressionRule],
+        default_rule: CompressionRule,
+        cache_entries: int = 256
+    ) -> None:
+        self.rules = rules
+        self.default_rule = default_rule
+        self.cache: Optional[TinyLFUCache[Tuple[str, str], Tuple]] = (
+            TinyLFUCache(cache_entries) if cache_entries > 0 else None
+        )
+        self.compressed = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict]) -> 'Compression':
+        config = config or {}
+
+        def make_rule(rule: Dict, defaults: Dict) -> CompressionRule:
+            levels = dict(defaults.get('levels') or DEFAULT_LEVELS)
+            levels.update(rule.get('levels') or {})
+            return CompressionRule(
+                rule.get('path', ''),
+                rule.get('encodings') or defaults.get('encodings') or
+                DEFAULT_ENCODINGS,
+                {e: int(level) for e, level in levels.items()},
+                int(rule.get('min-size', defaults.get(
+                    'min-size', DEFAULT_MIN_SIZE
+                ))),
+            )
+
+        default_rule = make_rule(config, {})
+        return cls(
+            [make_rule(r, config) for r in config.get('routes') or []],
+            default_rule,
+            cache_entries=int(config.get('cache-entries', 256)),
+        )
+
+    def transform_class(self) -> Type[CompressionTransform]:
+        return type(
+            'CompressionTransform',
+            (CompressionTransform,),
+            {'compression': self}
+        )
+
+    def rule_for(self, path: str) -> CompressionRule:
+        for rule in self.rules:
+            if rule.matches(path):
+                return rule
+        return self.default_rule
+
+    async def compress(
+        self,
+        body: bytes,
+        encoding: str,
+        level: int,
+        worker_pool: Optional[WorkerPool]
+    ) -> bytes:
+        self.compressed += 1
+        if worker_pool is None:
+            return compress(body, encoding, level)
+        return await worker_pool.run(
+            'compress', len(body), compress, body, encoding, level
+        )
+
+    async def encode(
+        self,
+        request: HTTPServerRequest,
+        version: Optional[Hashable],
+        make_body: Callable[[], Awaitable[bytes]],
+        worker_pool: Optional[WorkerPool]
+    ) -> Tuple[Optional[str], bytes]:
+        '''
+        (encoding, body) of a response to request, which make_body makes
+        uncompressed when awaited, unless cached at the same version. Not
+        cached if version is None.
+        '''
+        rule = self.rule_for(request.path)
+        encoding = rule.negotiate(request.headers.get('Accept-Encoding', ''))
+        key = (request.uri or '', encoding or '')
+
+        cache = self.cache if version is not None else None
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None and cached[0] == version:
+                self.cache_hits += 1
+                return cached[1], cached[2]
+            self.cache_misses += 1
+
+        body = await make_body()
+        body_encoding = None
+        if encoding is not None and len(body) >= rule.min_size:
+            body = await self.compress(
+                body, encoding, rule.levels[encoding], worker_pool
+            )
+            body_encoding = encoding
+
+        if cache is not None:
+            cache.put(key, (version, body_encoding, body))
+        return body_encoding, body
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {
+            'encodings': available_encodings(),
+            'compressed': self.compressed,
+            'cache-hits': self.cache_hits,
+            'cache-misses': self.cache_misses,
+        }
+        if self.cache is not None:
+            stats['cache'] = self.cache.stats()
+        return stats
@@ -0,0 +1,212 @@
+# Copyright (c) 2019. All rights reserved.
+
+import collections
+import json
+import re
+from typing import Any, Dict, List, Optional, Sequence, Set
+
+from addrservice.changelog import OP_DELETE
+from addrservice.idempotency import request_hash
+from addrservice.search import normalize
+
+POLICY_REJECT = 'reject'
+POLICY_MERGE = 'merge'
+POLICY_EXISTING = 'existing'
+POLICIES = (POLICY_REJECT, POLICY_MERGE, POLICY_EXISTING)
+
+# Entries with the same name, emails and phone numbers are duplicates.
+DEFAULT_FINGERPRINT_FIELDS = ('name', 'emails', 'phoneNumbers')
+
+# Fields canonicalized to lower case, and to numbers (from digits)
+_LOWER_CASE_FIELDS = frozenset(['kind', 'value'])
+_NUMBER_FIELDS = frozenset(['countryCode', 'areaCode', 'number', 'pincode'])
+
+_SPACE_REGEX = re.compile(r'\s+')
+_NON_DIGIT_REGEX = re.compile(r'\D+')
+
+
+class DuplicateEntryError(Exception):
+    '''Entry is a duplicate of an existing one, rejected by the policy.'''
+
+    def __init__(self, nickname: str) -> None:
+        super().__init__('Duplicate of {}'.format(nickname))
+        self.nickname = nickname
+
+
+def _canonical(value: Any, field: str) -> Any:
+    if isinstance(value, str):
+        value = _SPACE_REGEX.sub(' ', value).strip()
+        if field in _LOWER_CASE_FIELDS:
+            value = value.lower()
+        if field in _NUMBER_FIELDS:
+            # e.g. '+91', '(011)', '2301-2345'
+            digits = _NON_DIGIT_REGEX.sub('', value)
+            if digits:
+                return int(digits)
+        return value
+    if isinstance(value, dict):
+        return {k: _canonical(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        items: List[Any] = []
+        seen: Set[str] = set()
+        for v in value:
+            v = _canonical(v, field)
+            key = json.dumps(v, sort_keys=True)
+            if key not in seen:
+                seen.add(key)
+                items.append(v)
+        return items
+    return value
+
+
+def canonicalize(addr: Dict) -> Dict:
+    '''
+    Copy of the entry with whitespace collapsed, kinds and emails in lower
+    case, phone numbers and pincodes given as text made numbers, and exact
+    duplicate items dropped. Left to validation if not an entry.
+    '''
+    if not isinstance(addr, dict):
+        return addr
+    return _canonical(addr, '')
+
+
+def _fingerprint_value(value: Any) -> Any:
+    if isinstance(value, str):
+        return normalize(value)
+    if isinstance(value, dict):
+        return {k: _fingerprint_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        # Order insensitive
+        return sorted(item_key(v) for v in value)
+    return value
+
+
+def item_key(value: Any) -> str:
+    '''Same for items that differ only in case, punctuation or order.'''
+    return json.dumps(_fingerprint_value(value), sort_keys=True)
+
+
+def fingerprint(addr: Dict, fields: Sequence[str]) -> str:
+    return request_hash({f: _fingerprint_value(addr.get(f)) for f in fields})
+
+
+def merge_entries(existing: Dict, new: Dict) -> Dict:
+    '''
+    existing with the fields of new it lacks, and the items of lists of new
+    it lacks (compared by item_key) appended.
+    '''
+    merged = dict(existing)
+    for k, v in new.items():
+        old = merged.get(k)
+        if old is None:
+            merged[k] = v
+        elif isinstance(old, list) and isinstance(v, list):
+            keys = {item_key(x) for x in old}
+            items = list(old)
+            for x in v:
+                key = item_key(x)
+                if key not in keys:
+                    keys.add(key)
+                    items.append(x)
+            merged[k] = items
+    return merged
+
+
+class DedupIndex:
+    '''
+    Index of entries by the fingerprint of their fingerprint fields,
+    insensitive to case, punctuation and order of items, to find the
+    duplicates of an entry in O(1). Kept up to date as a mutation listener.
+
+    Policy, for a new entry that is a duplicate of an existing one:
+        reject:   fail with DuplicateEntryError
+        merge:    merge it into the existing one (see merge_entries)
+        existing: return the nickname of the existing one
+
+    Config (dedup section, all optional):
+        policy: reject, merge or existing (default)
+        fields: entry fields fingerprinted, default: name, emails,
+                phoneNumbers
+    '''
+
+    def __init__(
+        self,
+        policy: str = POLICY_EXISTING,
+        fields: Sequence[str] = DEFAULT_FINGERPRINT_FIELDS
+    ) -> None:
+        if policy not in POLICIES:
+            raise ValueError('Unknown dedup policy: {}'.format(policy))
+
+        self.policy = policy
+        self.fields = tuple(fields)
+        self.nicknames: Dict[str, Set[str]] = collections.defaultdict(set)
+        self.fingerprints: Dict[str, str] = {}
+        self.duplicates = 0
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict]) -> 'DedupIndex':
+        config = config or {}
+        return cls(
+            policy=config.get('policy', POLICY_EXISTING),
+            fields=config.get('fields') or DEFAULT_FINGERPRINT_FIELDS,
+        )
+
+    def __len__(self) -> int:
+        return len(self.fingerprints)
+
+    def fingerprint(self, addr: Dict) -> str:
+        return fingerprint(addr, self.fields)
+
+    def find(self, fp: str) -> Optional[str]:
+        '''Nickname of an entry with fingerprint fp, if any.'''
+        nicknames = self.nicknames.get(fp)
+        if not nicknames:
+            return None
+        return min(nicknames)
+
+    def add(self, nickname: str, addr: Dict) -> None:
+        self.remove(nickname)
+        fp = self.fingerprint(addr)
+        self.fingerprints[nickname] = fp
+        self.nicknames[fp].add(nickname)
+
+    def remove(self, nickname: str) -> None:
+        fp = self.fingerprints.pop(nickname, None)
+        if fp is None:
+            return
+
+        nicknames = self.nicknames[fp]
+        nicknames.discard(nickname)
+        if not nicknames:
+            del self.nicknames[fp]
+
+    def clear(self) -> None:
+        self.nicknames.clear()
+        self.fingerprints.clear()
+
+    def on_mutation(
+        self,
+        op: str,
+        nickname: str,
+        old: Optional[Dict],
+        new: Optional[Dict]
+    ) -> None:
+        if op == OP_DELETE or new is None:
+            self.remove(nickname)
+        else:
+            self.add(nickname, new)
+
+    def groups(self) -> List[List[str]]:
+        '''Sorted nicknames of each set of duplicate entries.'''
+        return sorted(
+            sorted(nicknames) for nicknames in self.nicknames.values()
+            if len(nicknames) > 1
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'policy': self.policy,
+            'entries': len(self.fingerprints),
+            'fingerprints': len(self.nicknames),
+            'duplicates': self.duplicates,
+        }
@@ -0,0 +1,160 @@
+# Copyright (c) 2019. All rights reserved.
+
+from abc import ABCMeta, abstractmethod
+import collections
+import hashlib
+import json
+import logging
+import re
+import time
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+from addrservice import LOGGER_NAME
+from addrservice.addressbook_db import SomeSQLdbConnector
+
+IDEMPOTENCY_KEY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_KEY_REGEX = re.compile(r'^[a-zA-Z0-9._:+/=-]{1,255}$')
+
+
+class IdempotencyKeyReusedError(Exception):
+    '''Same idempotency key sent with a different request.'''
+    pass
+
+
+class IdempotencyRecord(NamedTuple):
+    request_hash: str
+    nickname: str
+    status: int
+
+
+def request_hash(value: Any) -> str:
+    '''Hash of the request content, insensitive to key order and spacing.'''
+    canonical = json.dumps(value, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def validate_idempotency_key(key: str) -> None:
+    if not IDEMPOTENCY_KEY_REGEX.match(key):
+        raise ValueError('Invalid Idempotency-Key')
+
+
+class AbstractIdempotencyStore(metaclass=ABCMeta):
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[IdempotencyRecord]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def put(self, key: str, record: IdempotencyRecord) -> None:
+        raise NotImplementedError()
+
+
+class InMemoryIdempotencyStore(AbstractIdempotencyStore):
+    '''Bounded LRU of records, each expiring ttl seconds after creation.'''
+
+    def __init__(
+        self,
+        max_entries: int = 100000,
+        ttl: float = 86400,
+        clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.records: collections.OrderedDict = collections.OrderedDict()
+
+    async def get(self, key: str) -> Optional[IdempotencyRecord]:
+        item = self.records.get(key)
+        if item is None:
+            return None
+
+        expires_at, record = item
+        if expires_at <= self.clock():
+            del self.records[key]
+            return None
+
+        self.records.move_to_end(key)
+        return record
+
+    async def put(self, key: str, record: IdempotencyRecord) -> None:
+        self.records[key] = (self.clock() + self.ttl, record)
+        self.records.move_to_end(key)
+        while len(self.records) > self.max_entries:
+            self.records.popitem(last=False)
+
+
+class SQLIdempotencyStore(AbstractIdempotencyStore):
+    '''Keeps records in the persistent DB, next to the address book.'''
+
+    def __init__(self, ttl: float = 86400) -> None:
+        self.ttl = ttl
+        self.db_connector = SomeSQLdbConnector()
+        self.logger = logging.getLogger(LOGGER_NAME)
+
+    async def _execute(self, query: str) -> Any:
+        self.logger.debug('Sending DB query: {}'.format(query))
+        return await self.db_connector.execute(query)
+
+    async def get(self, key: str) -> Optional[IdempotencyRecord]:
+        query = '''SELECT REQUEST_HASH, NICKNAME, STATUS
+                   FROM IDEMPOTENCY_KEYS
+                   WHERE IDEMPOTENCY_KEY = '{}' AND EXPIRES_AT > {}
+                '''.format(key, int(time.time()))
+        result = await self._execute(query)
+        if not result:
+            return None
+
+        row = json.loads(result)
+        return IdempotencyRecord(
+            row['REQUEST_HASH'], row['NICKNAME'], int(row['STATUS'])
+        )
+
+    async def put(self, key: str, record: IdempotencyRecord) -> None:
+        query = '''INSERT INTO
+                   IDEMPOTENCY_KEYS (IDEMPOTENCY_KEY, REQUEST_HASH, NICKNAME,
+                                     STATUS, EXPIRES_AT)
+                   VALUES ('{}', '{}', '{}', {}, {})
+                   ON CONFLICT (IDEMPOTENCY_KEY) DO NOTHING
+                '''.format(
+                    key, record.request_hash, record.nickname, record.status,
+                    int(time.time() + self.ttl)
+                )
+        await self._execute(query)
+
+
+class PrefixedIdempotencyStore(AbstractIdempotencyStore):
+    '''
+    Keys prefixed in a store shared with others, e.g. by the services of
+    tenants, so that each has its own keys. The shared store is started
+    and stopped by its owner.
+    '''
+
+    def __init__(self, store: AbstractIdempotencyStore, prefix: str) -> None:
+        self.store = store
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[IdempotencyRecord]:
+        return await self.store.get(self.prefix + key)
+
+    async def put(self, key: str, record: IdempotencyRecord) -> None:
+        await self.store.put(self.prefix + key, record)
+
+
+def create_idempotency_store(config: Dict) -> AbstractIdempotencyStore:
+    store_type = list(config.keys())[0]
+    store_config = config[store_type] or {}
+
+    return {
+        'memory': lambda cfg: InMemoryIdempotencyStore(
+            max_entries=int(cfg.get('max-entries', 100000)),
+            ttl=float(cfg.get('ttl', 86400))
+        ),
+        'sql': lambda cfg: SQLIdempotencyStore(
+            ttl=float(cfg.get('ttl', 86400))
+        )
+    }[store_type](store_config)
@@ -0,0 +1,164 @@
+# Copyright (c) 2019. All rights reserved.
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from types import FrameType
+from typing import Any, Dict, Optional
+
+import tornado.web
+
+from addrservice import LOGGER_NAME
+import addrservice.tracing as tracing
+
+LAG_METRIC = 'event-loop.lag'
+SLOW_CALLBACK_METRIC = 'event-loop.slow-callback'
+
+
+def find_request_handler(frame: Optional[FrameType]) -> Optional[str]:
+    '''Describes the innermost request handler on the stack, if any.'''
+    while frame is not None:
+        try:
+            obj = frame.f_locals.get('self')
+        except Exception:
+            obj = None
+        if isinstance(obj, tornado.web.RequestHandler):
+            return '{m} {u} ({h})'.format(
+                m=obj.request.method,
+                u=obj.request.uri,
+                h=obj.__class__.__name__
+            )
+        frame = frame.f_back
+    return None
+
+
+class LoopMonitor:
+    '''
+    Measures event loop scheduling lag with a periodic timer callback, and
+    reports callbacks that block the loop longer than a threshold.
+
+    Lag is how late the timer fires. A watchdog thread notices when the loop
+    stops ticking, and logs the stack (and request handler, if any) of the
+    blocking callback while it is still running.
+    '''
+
+    def __init__(
+        self,
+        interval: float = 0.1,
+        slow_callback_threshold: float = 0.1,
+        logger: logging.Logger = logging.getLogger(LOGGER_NAME)
+    ) -> None:
+        self.interval = interval
+        self.slow_callback_threshold = slow_callback_threshold
+        self.logger = logger
+
+        self.lag = tracing.Histogram()
+        self.slow_callbacks = 0
+        self.last_slow_callback: Optional[Dict[str, Any]] = None
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._expected = 0.0
+        self._deadline = 0.0
+        self._loop_thread_id = 0
+        self._stalled_handler: Optional[str] = None
+        self._stop_event = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict]) -> 'LoopMonitor':
+        config = config or {}
+        return cls(
+            interval=float(config.get('interval', 0.1)),
+            slow_callback_threshold=float(
+                config.get('slow-callback-threshold', 0.1)
+            ),
+        )
+
+    def tune(self, other: 'LoopMonitor') -> None:
+        '''Takes the settings of other, from the next tick.'''
+        self.interval = other.interval
+        self.slow_callback_threshold = other.slow_callback_threshold
+
+    def start(self) -> None:
+        if self._loop is not None:
+            return
+
+        self._loop = asyncio.get_event_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._schedule()
+
+        self._stop_event.clear()
+        self._watchdog = threading.Thread(
+            target=self._watch,
+            name='addrservice-loop-watchdog',
+            daemon=True
+        )
+        self._watchdog.start()
+
+    def stop(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._loop = None
+
+        self._stop_event.set()
+        if self._watchdog is not None:
+            self._watchdog.join()
+            self._watchdog = None
+
+    def _schedule(self) -> None:
+        assert self._loop is not None
+        self._expected = self._loop.time() + self.interval
+        # Watchdog runs in another thread, so it can't use loop.time()
+        self._deadline = (
+            time.monotonic() + self.interval + self.slow_callback_threshold
+        )
+        self._timer = self._loop.call_at(self._expected, self._tick)
+
+    def _tick(self) -> None:
+        assert self._loop is not None
+        lag_ms = max(self._loop.time() - self._expected, 0) * 1e3
+
+        self.lag.observe(lag_ms)
+        tracing.observe(LAG_METRIC, lag_ms)
+
+        if lag_ms >= self.slow_callback_threshold * 1e3:
+            self.slow_callbacks += 1
+            self.last_slow_callback = {
+                'duration': lag_ms,
+                'handler': self._stalled_handler,
+            }
+            tracing.observe(SLOW_CALLBACK_METRIC, lag_ms)
+        self._stalled_handler = None
+
+        self._schedule()
+
+    def _watch(self) -> None:
+        reported = 0.0
+        while not self._stop_event.wait(self.slow_callback_threshold / 4):
+            deadline = self._deadline
+            if deadline == reported or time.monotonic() < deadline:
+                continue
+
+            # Loop is blocked right now: report once per stall.
+            reported = deadline
+            frame = sys._current_frames().get(self._loop_thread_id)
+            self._stalled_handler = find_request_handler(frame)
+            self.logger.warning(
+                'Event loop blocked for more than {t}s in {h}:\n{s}'.format(
+                    t=self.slow_callback_threshold,
+                    h=self._stalled_handler or 'unknown callback',
+                    s=''.join(traceback.format_stack(frame)),
+                )
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'lag': self.lag.to_dict(),
+            'slow-callbacks': self.slow_callbacks,
+            'last-slow-callback': self.last_slow_callback,
+        }
@@ -0,0 +1,95 @@
+# Copyright (c) 2019. All rights reserved.
+
+import bisect
+from typing import Dict, List, Optional, Tuple, Union
+
+from addrservice.changelog import OP_DELETE
+
+Pincode = Union[int, float]
+
+# Sorts after any nickname, to bisect past all entries of a pincode
+_MAX_NICKNAME = chr(0x10ffff)
+
+
+def entry_pincodes(addr: Dict) -> List[Pincode]:
+    return sorted({
+        a['pincode'] for a in addr.get('addresses', []) if 'pincode' in a
+    })
+
+
+class PincodeIndex:
+    '''
+    Sorted array of (pincode, nickname) over all addresses of all entries.
+
+    Range and nearest queries bisect into it: O(log N + k). Updates insert
+    and delete in a contiguous list, which is a fast memmove in practice.
+    '''
+
+    def __init__(self) -> None:
+        self.keys: List[Tuple[Pincode, str]] = []
+        self.entry_pincodes: Dict[str, List[Pincode]] = {}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add(self, nickname: str, addr: Dict) -> None:
+        self.remove(nickname)
+
+        pincodes = entry_pincodes(addr)
+        if pincodes:
+            self.entry_pincodes[nickname] = pincodes
+        for p in pincodes:
+            bisect.insort(self.keys, (p, nickname))
+
+    def remove(self, nickname: str) -> None:
+        for p in self.entry_pincodes.pop(nickname, []):
+            i = bisect.bisect_left(self.keys, (p, nickname))
+            del self.keys[i]
+
+    def on_mutation(
+        self,
+        op: str,
+        nickname: str,
+        old: Optional[Dict],
+        new: Optional[Dict]
+    ) -> None:
+        if op == OP_DELETE or new is None:
+            self.remove(nickname)
+        else:
+            self.add(nickname, new)
+
+    def range(
+        self,
+        low: Pincode,
+        high: Pincode,
+        limit: Optional[int] = None
+    ) -> List[str]:
+        '''Nicknames with a pincode in [low, high], in pincode order.'''
+        start = bisect.bisect_left(self.keys, (low, ''))
+        stop = bisect.bisect_right(self.keys, (high, _MAX_NICKNAME))
+
+        nicknames: Dict[str, None] = {}
+        for i in range(start, stop):
+            nicknames[self.keys[i][1]] = None
+            if limit is not None and len(nicknames) >= limit:
+                break
+        return list(nicknames)
+
+    def nearest(self, pincode: Pincode, k: int) -> List[Tuple[Pincode, str]]:
+        '''k (pincode, nickname) pairs closest to pincode, closest first.'''
+        right = bisect.bisect_left(self.keys, (pincode, ''))
+        left = right - 1
+        result: List[Tuple[Pincode, str]] = []
+
+        while len(result) < k and (left >= 0 or right < len(self.keys)):
+            if right >= len(self.keys) or (
+                left >= 0 and
+                pincode - self.keys[left][0] <= self.keys[right][0] - pincode
+            ):
+                result.append(self.keys[left])
+                left -= 1
+            else:
+                result.append(self.keys[right])
+                right += 1
+
+        return result
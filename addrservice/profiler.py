@@ -0,0 +1,142 @@
+# Copyright (c) 2019. All rights reserved.
+
+import collections
+import signal
+import threading
+import time
+from types import CodeType, FrameType
+from typing import Any, Counter, Dict, List, Optional, Tuple
+
+Stack = Tuple[CodeType, ...]
+
+
+class ProfilerBusyError(RuntimeError):
+    pass
+
+
+class SamplingProfiler:
+    '''
+    Statistical CPU profiler: a SIGPROF interval timer interrupts the main
+    thread every `interval` seconds of CPU time, and the handler records the
+    interrupted Python stack.
+
+    Nothing is installed until start() is called, and stop() removes both
+    the timer and the signal handler, so an idle profiler costs nothing.
+    Only one profiler can run at a time as there is only one SIGPROF.
+    '''
+
+    _lock = threading.Lock()
+    _active: Optional['SamplingProfiler'] = None
+
+    def __init__(self, interval: float = 0.005) -> None:
+        if interval <= 0:
+            raise ValueError('interval must be positive')
+
+        self.interval = interval
+        self.samples: Counter[Stack] = collections.Counter()
+        self.start_time = 0.0
+        self.end_time = 0.0
+        self._prev_handler: Any = None
+
+    @staticmethod
+    def is_supported() -> bool:
+        return hasattr(signal, 'setitimer') and hasattr(signal, 'SIGPROF')
+
+    @classmethod
+    def is_running(cls) -> bool:
+        return cls._active is not None
+
+    def start(self) -> None:
+        if not self.is_supported():
+            raise NotImplementedError('SIGPROF is not available')
+
+        with SamplingProfiler._lock:
+            if SamplingProfiler._active is not None:
+                raise ProfilerBusyError('a profile is already in progress')
+            SamplingProfiler._active = self
+
+        try:
+            self._prev_handler = signal.signal(signal.SIGPROF, self._sample)
+        except ValueError:
+            # Signal handlers can only be set from the main thread
+            SamplingProfiler._active = None
+            raise
+
+        self.start_time = time.time()
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self) -> None:
+        if SamplingProfiler._active is not self:
+            return
+
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._prev_handler or signal.SIG_DFL)
+        self.end_time = time.time()
+        SamplingProfiler._active = None
+
+    def _sample(self, signum: int, frame: Optional[FrameType]) -> None:
+        stack = []
+        while frame is not None:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        # Root first, as expected by flame graph tools
+        stack.reverse()
+        self.samples[tuple(stack)] += 1
+
+    # Output formats
+
+    @staticmethod
+    def frame_name(code: CodeType) -> str:
+        return '{n} ({f}:{lineno})'.format(
+            n=code.co_name,
+            f=code.co_filename,
+            lineno=code.co_firstlineno
+        )
+
+    def collapsed(self) -> str:
+        '''Brendan Gregg's collapsed stacks, input to flamegraph.pl.'''
+        lines = [
+            '{s} {c}'.format(
+                s=';'.join(self.frame_name(code) for code in stack),
+                c=count
+            )
+            for stack, count in self.samples.most_common()
+        ]
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def speedscope(self, name: str = 'addrservice') -> Dict[str, Any]:
+        '''Sampled profile in https://www.speedscope.app file format.'''
+        frame_index: Dict[CodeType, int] = {}
+        frames: List[Dict[str, Any]] = []
+        samples: List[List[int]] = []
+        weights: List[float] = []
+
+        for stack, count in self.samples.items():
+            sample = []
+            for code in stack:
+                if code not in frame_index:
+                    frame_index[code] = len(frames)
+                    frames.append({
+                        'name': code.co_name,
+                        'file': code.co_filename,
+                        'line': code.co_firstlineno,
+                    })
+                sample.append(frame_index[code])
+            samples.append(sample)
+            weights.append(count * self.interval)
+
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': max(self.end_time - self.start_time, 0),
+                'samples': samples,
+                'weights': weights,
+            }],
+            'name': name,
+            'exporter': 'addrservice.profiler',
+        }
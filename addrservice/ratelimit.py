@@ -0,0 +1,231 @@
+# Copyright (c) 2019. All rights reserved.
+
+import asyncio
+import collections
+import re
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+KEY_IP = 'ip'
+KEY_API_KEY = 'api-key'
+
+API_KEY_HEADER = 'X-API-Key'
+
+
+class RateLimitedError(Exception):
+    '''Request exceeds a rate limit; it may be retried after retry_after.'''
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(
+            'Rate limit exceeded, retry after {:.3f}s'.format(retry_after)
+        )
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    '''
+    Allows `rate` requests per second on average, and bursts of up to
+    `burst`. Tokens are refilled lazily, when taken.
+    '''
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float, now: float) -> None:
+        if rate <= 0 or burst < 1:
+            raise ValueError('rate must be positive, and burst at least 1')
+
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now: float, n: float = 1) -> float:
+        '''
+        Takes n tokens if available, and returns 0; else returns seconds
+        until they would be.
+        '''
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+        if self.tokens >= n:
+            self.tokens -= n
+            return 0.0
+        return (n - self.tokens) / self.rate
+
+
+class RateLimitRule:
+    '''
+    Token bucket per client for requests matching path (a regex matched at
+    the start of the request path) and methods (all if empty).
+
+    Buckets are kept in least recently used order, so that a sweep drops
+    idle ones from the front, and stops at the first that is not: a bucket
+    is idle once it would have refilled to burst, as it is then the same as
+    a new one. Every operation is O(1), amortized over the sweeps.
+    '''
+
+    def __init__(
+        self,
+        path: str,
+        rate: float,
+        burst: float = 0,
+        methods: Iterable[str] = ()
+    ) -> None:
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+
+        self.path = re.compile(path)
+        self.methods = {m.upper() for m in methods}
+        self.rate = rate
+        # A burst below 1 would never allow a request
+        self.burst = burst or max(rate, 1)
+        if self.burst < 1:
+            raise ValueError('burst must be at least 1')
+        # Seconds for an empty bucket to refill
+        self.refill_time = self.burst / rate
+        self.buckets: 'collections.OrderedDict[str, TokenBucket]' = (
+            collections.OrderedDict()
+        )
+        self.limited = 0
+
+    def spec(self) -> Tuple[str, FrozenSet[str], float, float]:
+        return (self.path.pattern, frozenset(self.methods), self.rate,
+                self.burst)
+
+    def matches(self, method: str, path: str) -> bool:
+        return (
+            (not self.methods or method in self.methods) and
+            self.path.match(path) is not None
+        )
+
+    def take(self, key: str, now: float) -> float:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst, now)
+            self.buckets[key] = bucket
+        else:
+            self.buckets.move_to_end(key)
+
+        retry_after = bucket.take(now)
+        if retry_after > 0:
+            self.limited += 1
+        return retry_after
+
+    def sweep(self, now: float) -> int:
+        '''Drops idle buckets, returns how many.'''
+        swept = 0
+        while self.buckets:
+            key, bucket = next(iter(self.buckets.items()))
+            if now - bucket.updated < self.refill_time:
+                break
+            del self.buckets[key]
+            swept += 1
+        return swept
+
+
+class RateLimiter:
+    '''
+    Limits the request rate of each client, by the first rule that matches
+    a request. Clients are told apart by IP address, or by API key header
+    (if given, else IP address).
+
+    Config (rate-limit section):
+        key:            ip (default) or api-key
+        sweep-interval: seconds between sweeps of idle buckets, default: 10
+        rules:          list of rules, each:
+            path:       regex matched at the start of the path
+            methods:    list of methods, default: all
+            rate:       requests per second
+            burst:      requests over rate, default: rate (at least 1)
+    '''
+
+    def __init__(
+        self,
+        rules: List[RateLimitRule],
+        key: str = KEY_IP,
+        sweep_interval: float = 10
+    ) -> None:
+        if key not in (KEY_IP, KEY_API_KEY):
+            raise ValueError('Unknown rate limit key: {}'.format(key))
+
+        self.rules = rules
+        self.key = key
+        self.sweep_interval = sweep_interval
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.swept = 0
+
+    @classmethod
+    def from_config(cls, config: Dict) -> 'RateLimiter':
+        return cls(
+            [
+                RateLimitRule(
+                    rule['path'],
+                    float(rule['rate']),
+                    float(rule.get('burst', 0)),
+                    rule.get('methods') or ()
+                )
+                for rule in config.get('rules') or []
+            ],
+            key=config.get('key', KEY_IP),
+            sweep_interval=float(config.get('sweep-interval', 10)),
+        )
+
+    def tune(self, other: 'RateLimiter') -> None:
+        '''
+        Takes the settings and rules of other, e.g. of a reloaded config,
+        keeping the buckets of the rules that are the same.
+        '''
+        rules = {rule.spec(): rule for rule in self.rules}
+        self.rules = [rules.get(rule.spec(), rule) for rule in other.rules]
+        self.key = other.key
+        self.sweep_interval = other.sweep_interval
+
+    def start(self) -> None:
+        self._schedule()
+
+    def stop(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _schedule(self) -> None:
+        loop = asyncio.get_event_loop()
+        self._timer = loop.call_later(self.sweep_interval, self._sweep)
+
+    def _sweep(self) -> None:
+        self.sweep(asyncio.get_event_loop().time())
+        self._schedule()
+
+    def sweep(self, now: float) -> None:
+        for rule in self.rules:
+            self.swept += rule.sweep(now)
+
+    def client_key(self, ip: str, api_key: Optional[str]) -> str:
+        if self.key == KEY_API_KEY and api_key:
+            return 'key:' + api_key
+        return 'ip:' + ip
+
+    def check(
+        self,
+        method: str,
+        path: str,
+        client_key: str,
+        now: Optional[float] = None
+    ) -> None:
+        '''Raises RateLimitedError if the request is over its limit.'''
+        for rule in self.rules:
+            if rule.matches(method, path):
+                if now is None:
+                    now = asyncio.get_event_loop().time()
+                retry_after = rule.take(client_key, now)
+                if retry_after > 0:
+                    raise RateLimitedError(retry_after)
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'clients': sum(len(rule.buckets) for rule in self.rules),
+            'limited': sum(rule.limited for rule in self.rules),
+            'swept': self.swept,
+        }
@@ -0,0 +1,245 @@
+# Copyright (c) 2019. All rights reserved.
+
+import asyncio
+import json
+import logging
+import math
+import os
+import tempfile
+from typing import Any, Dict, List, Optional
+
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+
+from addrservice import LOGGER_NAME
+from addrservice.addressbook_db import (
+    AbstractAddressBookDB,
+    InMemoryAddressBookDB,
+)
+from addrservice.changelog import ResyncRequiredError
+from addrservice.snapshot import Snapshot
+
+ROLE_PRIMARY = 'primary'
+ROLE_FOLLOWER = 'follower'
+
+SNAPSHOT_PATH = '/addressbook/_snapshot'
+CHANGES_PATH = '/addressbook/_changes'
+
+
+class StaleReplicaError(Exception):
+    '''Follower has not heard from its primary within the staleness bound.'''
+    pass
+
+
+class Follower:
+    '''
+    Keeps a local in-memory address book in sync with a primary addrservice.
+
+    It loads a snapshot of the primary, and then applies the primary's
+    change feed (SSE), resuming after the last applied change when the
+    stream ends or breaks. If the primary no longer has those changes, it
+    loads a new snapshot. Changes keep the primary's sequence numbers, so
+    the follower's own change feed can feed other followers.
+
+    The primary sends a heartbeat when idle, so time since the last message
+    bounds how stale the local copy may be.
+
+    Config (replication section):
+        role:            follower
+        primary:         base URL of the primary, e.g. http://host:8080
+        max-staleness:   seconds without a message from the primary after
+                         which reads fail, default: 10
+        heartbeat:       seconds between primary heartbeats, default: 2
+        reconnect-delay: seconds before reconnecting, default: 1
+    '''
+
+    # Streams are reopened after this many seconds, resuming from last seq
+    STREAM_WINDOW = 300
+
+    def __init__(
+        self,
+        addr_db: InMemoryAddressBookDB,
+        primary: str,
+        max_staleness: float = 10,
+        heartbeat: float = 2,
+        reconnect_delay: float = 1,
+        logger: logging.Logger = logging.getLogger(LOGGER_NAME)
+    ) -> None:
+        if heartbeat >= max_staleness:
+            raise ValueError('heartbeat must be less than max-staleness')
+
+        self.addr_db = addr_db
+        self.primary = primary.rstrip('/')
+        self.max_staleness = max_staleness
+        self.heartbeat = heartbeat
+        self.reconnect_delay = reconnect_delay
+        self.logger = logger
+
+        self.synced = False
+        self.last_contact: Optional[float] = None
+        self.bootstraps = 0
+        self.applied = 0
+        self.reconnects = 0
+        self._task: Optional[asyncio.Future] = None
+        self._buffer = ''
+
+    @classmethod
+    def from_config(
+        cls,
+        config: Dict,
+        addr_db: AbstractAddressBookDB
+    ) -> 'Follower':
+        if not isinstance(addr_db, InMemoryAddressBookDB):
+            raise ValueError('Followers need an in-memory address book')
+        return cls(
+            addr_db,
+            config['primary'],
+            max_staleness=float(config.get('max-staleness', 10)),
+            heartbeat=float(config.get('heartbeat', 2)),
+            reconnect_delay=float(config.get('reconnect-delay', 1)),
+        )
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self) -> None:
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        loop = asyncio.get_event_loop()
+        if not loop.is_running():
+            loop.run_until_complete(
+                asyncio.gather(self._task, return_exceptions=True)
+            )
+        self._task = None
+
+    def staleness(self) -> float:
+        '''Seconds since the last message from the primary.'''
+        if not self.synced or self.last_contact is None:
+            return math.inf
+        return asyncio.get_event_loop().time() - self.last_contact
+
+    def check_staleness(self) -> None:
+        if self.staleness() > self.max_staleness:
+            raise StaleReplicaError(
+                'Not in sync with primary {}'.format(self.primary)
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        staleness = self.staleness()
+        return {
+            'role': ROLE_FOLLOWER,
+            'primary': self.primary,
+            'synced': self.synced,
+            'staleness': None if math.isinf(staleness) else staleness,
+            'last-seq': self.addr_db.changelog.last_seq,
+            'bootstraps': self.bootstraps,
+            'applied': self.applied,
+            'reconnects': self.reconnects,
+        }
+
+    def _touch(self) -> None:
+        self.last_contact = asyncio.get_event_loop().time()
+
+    async def _run(self) -> None:
+        client = AsyncHTTPClient()
+        while True:
+            try:
+                if not self.synced:
+                    await self._bootstrap(client)
+                await self._tail(client)
+            except ResyncRequiredError:
+                self.logger.warning('Follower fell behind, resyncing')
+                self.synced = False
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.warning(
+                    'Replication from {} failed: {}'.format(self.primary, e)
+                )
+
+            self.reconnects += 1
+            await asyncio.sleep(self.reconnect_delay)
+
+    async def _bootstrap(self, client: AsyncHTTPClient) -> None:
+        r = await client.fetch(self.primary + SNAPSHOT_PATH)
+
+        # Snapshots are read through a memory map, which needs a file
+        fd, path = tempfile.mkstemp(suffix='.snap')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(r.body)
+            snapshot = Snapshot(path)
+            try:
+                self.addr_db.load(snapshot.items(), snapshot.seq)
+            finally:
+                snapshot.close()
+        finally:
+            os.unlink(path)
+
+        self.synced = True
+        self.bootstraps += 1
+        self._touch()
+        self.logger.info('Loaded snapshot of {} at seq {}'.format(
+            self.primary, self.addr_db.changelog.last_seq
+        ))
+
+    async def _tail(self, client: AsyncHTTPClient) -> None:
+        url = '{}{}?mode=sse&since={}&heartbeat={}&timeout={}'.format(
+            self.primary,
+            CHANGES_PATH,
+            self.addr_db.changelog.last_seq,
+            self.heartbeat,
+            self.STREAM_WINDOW
+        )
+        self._buffer = ''
+        try:
+            await client.fetch(
+                url,
+                streaming_callback=self._on_chunk,
+                request_timeout=self.STREAM_WINDOW + self.max_staleness
+            )
+        except HTTPClientError as e:
+            # Gone: changes no longer retained, or primary restarted
+            if e.code == 410:
+                raise ResyncRequiredError(
+                    self.addr_db.changelog.last_seq, 0, 0
+                ) from None
+            raise
+        # Stream window ended, reconnect right away
+        self._touch()
+
+    def _on_chunk(self, chunk: bytes) -> None:
+        self._buffer += chunk.decode('utf-8')
+        *events, self._buffer = self._buffer.split('\n\n')
+        for event in events:
+            self._on_event(event)
+
+    def _on_event(self, event: str) -> None:
+        fields: Dict[str, List[str]] = {}
+        for line in event.split('\n'):
+            name, _, value = line.partition(': ')
+            fields.setdefault(name, []).append(value)
+        name = fields.get('event', ['message'])[0]
+        data = json.loads('\n'.join(fields.get('data', ['null'])))
+
+        self._touch()
+        if name == 'change':
+            self._apply(data)
+        elif name == 'resync':
+            raise ResyncRequiredError(
+                self.addr_db.changelog.last_seq, 0, data['last_seq']
+            )
+
+    def _apply(self, change: Dict) -> None:
+        last_seq = self.addr_db.changelog.last_seq
+        if change['seq'] <= last_seq:
+            return
+        if change['seq'] != last_seq + 1:
+            raise ResyncRequiredError(last_seq, change['seq'], change['seq'])
+
+        self.addr_db.apply_change(
+            change['op'], change['nickname'], change['address']
+        )
+        self.applied += 1
@@ -0,0 +1,143 @@
+# Copyright (c) 2019. All rights reserved.
+
+import collections
+import heapq
+import math
+import re
+import unicodedata
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from addrservice.changelog import OP_DELETE
+
+ADDRESS_SEARCH_FIELDS = ('city', 'locality', 'streetName')
+
+_NON_WORD_REGEX = re.compile(r'[\W_]+')
+
+
+def normalize(text: str) -> str:
+    '''Case folds, strips accents, and keeps only letters and digits.'''
+    text = unicodedata.normalize('NFKD', text.casefold())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return _NON_WORD_REGEX.sub(' ', text).strip()
+
+
+def trigrams(text: str) -> Set[str]:
+    '''pg_trgm style trigrams of each word, padded to weigh word starts.'''
+    grams: Set[str] = set()
+    for word in normalize(text).split():
+        padded = '  ' + word + ' '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def entry_text(addr: Dict) -> List[str]:
+    texts = [addr.get('name', '')]
+    for a in addr.get('addresses', []):
+        texts.extend(str(a[f]) for f in ADDRESS_SEARCH_FIELDS if f in a)
+    return texts
+
+
+class TrigramIndex:
+    '''
+    In-process inverted index from trigrams to nicknames, over the name and
+    address city, locality and streetName of each entry.
+
+    A match scores the fraction of query trigrams found in an entry, so a
+    misspelt or partial name still matches, and ties rank entries with less
+    text (a more specific match) first. Top-k is kept in a heap.
+    '''
+
+    def __init__(self) -> None:
+        self.postings: Dict[str, Set[str]] = collections.defaultdict(set)
+        self.entry_trigrams: Dict[str, FrozenSet[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.entry_trigrams)
+
+    def add(self, nickname: str, addr: Dict) -> None:
+        self.remove(nickname)
+
+        grams: Set[str] = set()
+        for text in entry_text(addr):
+            grams |= trigrams(text)
+
+        self.entry_trigrams[nickname] = frozenset(grams)
+        for g in grams:
+            self.postings[g].add(nickname)
+
+    def remove(self, nickname: str) -> None:
+        grams = self.entry_trigrams.pop(nickname, None)
+        if grams is None:
+            return
+
+        for g in grams:
+            nicknames = self.postings[g]
+            nicknames.discard(nickname)
+            if not nicknames:
+                del self.postings[g]
+
+    def on_mutation(
+        self,
+        op: str,
+        nickname: str,
+        old: Optional[Dict],
+        new: Optional[Dict]
+    ) -> None:
+        # Old entry is not needed, its trigrams are kept per nickname.
+        if op == OP_DELETE or new is None:
+            self.remove(nickname)
+        else:
+            self.add(nickname, new)
+
+    def search(
+        self,
+        query: str,
+        k: int = 10,
+        min_score: float = 0.3
+    ) -> List[Tuple[str, float]]:
+        '''
+        Top k (nickname, score) matches with score >= min_score, best first.
+
+        Posting lists are visited rarest first, and each new candidate is
+        scored exactly by intersecting trigram sets. A nickname not in any
+        of the first j lists shares at most len(query trigrams) - j of them,
+        so the scan stops as soon as that bound can't beat the current k-th
+        best or reach min_score. Common trigrams are rarely visited.
+        '''
+        query_grams = frozenset(trigrams(query))
+        if not query_grams or k < 1:
+            return []
+
+        n = len(query_grams)
+        threshold = max(1, math.ceil(min_score * n))
+        grams = sorted(
+            query_grams, key=lambda g: len(self.postings.get(g, ()))
+        )
+
+        # Min-heap of the best k: (shared trigrams, -entry size, nickname)
+        top: List[Tuple[int, int, str]] = []
+        seen: Set[str] = set()
+        for j, g in enumerate(grams):
+            bound = n - j
+            if bound < threshold or (len(top) == k and top[0][0] >= bound):
+                break
+
+            for nickname in self.postings.get(g, ()):
+                if nickname in seen:
+                    continue
+                seen.add(nickname)
+
+                entry_grams = self.entry_trigrams[nickname]
+                shared = len(query_grams & entry_grams)
+                if shared < threshold:
+                    continue
+                item = (shared, -len(entry_grams), nickname)
+                if len(top) < k:
+                    heapq.heappush(top, item)
+                elif item > top[0]:
+                    heapq.heapreplace(top, item)
+
+        return [
+            (nickname, shared / n)
+            for shared, _, nickname in sorted(top, reverse=True)
+        ]
@@ -5,9 +5,12 @@ import asyncio
 import logging
 import logging.config
 import signal
-from typing import Dict
+from typing import Any, Dict, Optional
 import yaml
 
+from tornado.httpserver import HTTPServer
+from tornado.iostream import IOStream
+import tornado.netutil
 import tornado.platform.asyncio as tasyncio
 import tornado.web
 
@@ -49,6 +52,97 @@ def parse_args(args=None):
     return args
 
 
+class AddrServiceHTTPServer(HTTPServer):
+    '''
+    HTTPServer that can keep TCP_NODELAY on for the whole connection. By
+    default, Tornado turns it on only while finishing a response, so that
+    chunks flushed before, e.g. change feed events, may wait for ACKs.
+    '''
+
+    def initialize(
+        self,
+        *args: Any,
+        tcp_nodelay: bool = False,
+        **kwargs: Any
+    ) -> None:
+        super().initialize(*args, **kwargs)
+        self.tcp_nodelay = tcp_nodelay
+
+    def handle_stream(self, stream: IOStream, address: Any) -> None:
+        if self.tcp_nodelay:
+            stream.set_nodelay(True)
+            # Ignore Tornado turning it off after each response
+            setattr(stream, 'set_nodelay', lambda value: None)
+        super().handle_stream(stream, address)
+
+
+def make_http_server(
+    app: tornado.web.Application,
+    port: int,
+    server_config: Dict
+) -> HTTPServer:
+    '''
+    HTTP server of the app listening on the port, tuned by the server section
+    of the config (default: Tornado's):
+        address:                 to bind, default: all interfaces
+        backlog:                 pending connections queue, default: 128
+        reuse-port:              SO_REUSEPORT, to run a server per CPU core
+        no-keep-alive:           close connections after each request
+        idle-connection-timeout: seconds before closing an idle keep-alive
+                                 connection
+        body-timeout:            seconds to wait for a request body
+        max-header-size:         bytes
+        max-body-size:           bytes of a request body
+        bulk-max-body-size:      bytes of a _bulk import body, default:
+                                 max-body-size
+        max-buffer-size:         bytes buffered per connection
+        chunk-size:              bytes read at a time
+        decompress-request:      gunzip request bodies, default: true
+        tcp-nodelay:             disable Nagle's algorithm throughout
+    '''
+    def optional(key: str, type_: Any) -> Any:
+        value = server_config.get(key)
+        return None if value is None else type_(value)
+
+    http_server = AddrServiceHTTPServer(
+        app,
+        no_keep_alive=bool(server_config.get('no-keep-alive', False)),
+        decompress_request=bool(
+            server_config.get('decompress-request', True)
+        ),
+        idle_connection_timeout=optional('idle-connection-timeout', float),
+        body_timeout=optional('body-timeout', float),
+        max_header_size=optional('max-header-size', int),
+        max_body_size=optional('max-body-size', int),
+        max_buffer_size=optional('max-buffer-size', int),
+        chunk_size=optional('chunk-size', int),
+        tcp_nodelay=bool(server_config.get('tcp-nodelay', False)),
+    )
+    sockets = tornado.netutil.bind_sockets(
+        port,
+        server_config.get('address', ''),
+        backlog=int(server_config.get('backlog', 128)),
+        reuse_port=bool(server_config.get('reuse-port', False)),
+    )
+    http_server.add_sockets(sockets)
+    return http_server
+
+
+def reload_config(
+    service: AddressBookService,
+    config_path: str,
+    logger: logging.Logger
+) -> None:
+    '''Reloads the config file, on SIGHUP. Errors are logged.'''
+    logger.info('Reloading config from {}'.format(config_path))
+    try:
+        with open(config_path) as f:
+            config = yaml.load(f.read(), Loader=yaml.SafeLoader)
+        service.reload(config)
+    except (OSError, yaml.YAMLError, ValueError) as e:
+        logger.error('Config not reloaded: {}'.format(e))
+
+
 def run_server(
     app: tornado.web.Application,
     service: AddressBookService,
@@ -56,6 +150,7 @@ def run_server(
     port: int,
     logger: logging.Logger,
     debug: bool,
+    config_path: Optional[str] = None,
 ):
     name = config['service']['name']
 
@@ -74,16 +169,16 @@ def run_server(
     loop = asyncio.get_event_loop()
     for sig in (signal.SIGINT, signal.SIGTERM):
         loop.add_signal_handler(sig, loop.stop)
+    if config_path is not None and hasattr(signal, 'SIGHUP'):
+        loop.add_signal_handler(
+            signal.SIGHUP, reload_config, service, config_path, logger
+        )
 
     # Start auth, caller's start_up and server
     service.start()
 
     # Start http server
-    http_server_args = {
-        'decompress_request': True
-    }
-
-    http_server = app.listen(port, '', **http_server_args)
+    http_server = make_http_server(app, port, config.get('server') or {})
     msg = 'Starting {} on port {} ...'.format(name, port)
     logger.info(msg)
 
@@ -96,8 +191,12 @@ def run_server(
     logger.info(msg)
 
     http_server.stop()
+    # End change streams and replication, so that unfinished tasks finish
+    service.drain()
     # Run unfinished tasks and stop event loop
-    loop.run_until_complete(asyncio.gather(*asyncio.Task.all_tasks()))
+    loop.run_until_complete(asyncio.gather(
+        *asyncio.Task.all_tasks(), return_exceptions=True
+    ))
     service.stop()
     loop.close()
 
@@ -126,6 +225,7 @@ def main(args=parse_args()):
         port=args.port,
         logger=logger,
         debug=args.debug,
+        config_path=args.config.name,
     )
 
 
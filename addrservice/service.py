@@ -1,63 +1,614 @@
 # Copyright (c) 2019. All rights reserved.
 
+import asyncio
+import functools
+import json
 import logging
-from typing import Dict
+import logging.config
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from tornado.ioloop import IOLoop
 
 from addrservice import LOGGER_NAME
 from addrservice.addressbook_db import (
     create_addressbook_db,
     AbstractAddressBookDB,
+    Fields,
+    ShardedAddressBookDB,
+    TieredAddressBookDB,
+    tiered_settings,
+    validate_address,
+    TIERED_TUNABLE_KEYS,
+)
+from addrservice.changelog import Change, ResyncRequiredError
+from addrservice.compression import Compression
+from addrservice.dedup import (
+    canonicalize,
+    merge_entries,
+    DedupIndex,
+    DuplicateEntryError,
+    POLICY_MERGE,
+    POLICY_REJECT,
+)
+from addrservice.idempotency import (
+    create_idempotency_store,
+    request_hash,
+    validate_idempotency_key,
+    AbstractIdempotencyStore,
+    IdempotencyKeyReusedError,
+    IdempotencyRecord,
+    PrefixedIdempotencyStore,
 )
+from addrservice.loop_monitor import LoopMonitor
+from addrservice.pincode_index import Pincode
+from addrservice.ratelimit import RateLimiter
+from addrservice.replication import Follower, ROLE_FOLLOWER
+from addrservice.search import TrigramIndex
+from addrservice.snapshot import encode_snapshot
+from addrservice.tenants import TenantAddressBookDB, TenantManager
 import addrservice.tracing as tracing
 from addrservice.utils import unixtime_now_millis
+from addrservice.workers import entry_size, WorkerPool
+
+# Applies a reloaded config section, see AddressBookService.reload
+Applier = Callable[[], None]
 
 
 class AddressBookService:
     def __init__(
         self,
         addr_db: AbstractAddressBookDB,
-        logger: logging.Logger = logging.getLogger(LOGGER_NAME)
+        logger: logging.Logger = logging.getLogger(LOGGER_NAME),
+        loop_monitor: Optional[LoopMonitor] = None,
+        worker_pool: Optional[WorkerPool] = None,
+        idempotency_store: Optional[AbstractIdempotencyStore] = None,
+        search_index: Optional[TrigramIndex] = None,
+        follower: Optional[Follower] = None,
+        tenants: Optional[TenantManager] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        compression: Optional[Compression] = None,
+        dedup: Optional[DedupIndex] = None
     ) -> None:
         self.start_time = unixtime_now_millis()
         self.addr_db = addr_db
         self.logger = logger
+        self.loop_monitor = loop_monitor
+        self.worker_pool = worker_pool
+        self.addr_db.set_worker_pool(worker_pool)
+        self.idempotency_store = idempotency_store
+        # Idempotency key -> (request hash, future of nickname) of POSTs in
+        # progress, so that concurrent retries wait for the first one.
+        self._idempotent_posts: Dict[str, Tuple[str, asyncio.Future]] = {}
+        self.search_index = search_index
+        if search_index is not None:
+            self.addr_db.add_listener(search_index.on_mutation)
+        self.follower = follower
+        self.draining = False
+        self.tenants = tenants
+        self.rate_limiter = rate_limiter
+        self.compression = (
+            compression if compression is not None
+            else Compression.from_config({})
+        )
+        self.dedup = dedup
+        if dedup is not None:
+            self.addr_db.add_listener(dedup.on_mutation)
+        # Fingerprint -> future of nickname of entries being created, so
+        # that concurrent duplicates are found too.
+        self._dedup_posts: Dict[str, asyncio.Future] = {}
+        self._indexing: Optional[asyncio.Future] = None
+        self._indexing_pending = False
+        # Config the service was made from, see reload
+        self.config: Dict = {}
 
     @classmethod
     def from_config(cls, config: Dict):
         tracing.configure_tracing(config.get('tracing', {}))
         addr_db = create_addressbook_db(config['addr-db'])
-        return cls(addr_db)
+        loop_monitor = None
+        if 'loop-monitor' in config:
+            loop_monitor = LoopMonitor.from_config(config['loop-monitor'])
+        worker_pool = None
+        if 'workers' in config:
+            worker_pool = WorkerPool.from_config(config['workers'])
+        idempotency_store = None
+        if 'idempotency' in config:
+            idempotency_store = create_idempotency_store(
+                config['idempotency']
+            )
+        search_index = TrigramIndex() if 'search' in config else None
+        follower = None
+        replication_config = config.get('replication') or {}
+        if replication_config.get('role') == ROLE_FOLLOWER:
+            follower = Follower.from_config(replication_config, addr_db)
+
+        compression = Compression.from_config(config.get('compression'))
+
+        def make_dedup() -> Optional[DedupIndex]:
+            if 'dedup' not in config:
+                return None
+            return DedupIndex.from_config(config['dedup'])
+
+        tenants = None
+        if 'tenants' in config:
+            def make_tenant_service(
+                name: str,
+                db: TenantAddressBookDB
+            ) -> AddressBookService:
+                tenant_idempotency_store = None
+                if idempotency_store is not None:
+                    tenant_idempotency_store = PrefixedIdempotencyStore(
+                        idempotency_store, '{}:'.format(name)
+                    )
+                return cls(
+                    db,
+                    worker_pool=worker_pool,
+                    idempotency_store=tenant_idempotency_store,
+                    search_index=(
+                        TrigramIndex() if 'search' in config else None
+                    ),
+                    compression=compression,
+                    dedup=make_dedup()
+                )
+            tenants = TenantManager.from_config(
+                config['tenants'], make_tenant_service
+            )
+
+        rate_limiter = None
+        if 'rate-limit' in config:
+            rate_limiter = RateLimiter.from_config(config['rate-limit'])
+
+        service = cls(
+            addr_db,
+            loop_monitor=loop_monitor,
+            worker_pool=worker_pool,
+            idempotency_store=idempotency_store,
+            search_index=search_index,
+            follower=follower,
+            tenants=tenants,
+            rate_limiter=rate_limiter,
+            compression=compression,
+            dedup=make_dedup()
+        )
+        service.config = config
+        return service
 
     def start(self):
+        tracing.start_trace_collectors()
+        if self.loop_monitor is not None:
+            self.loop_monitor.start()
+        if self.worker_pool is not None:
+            self.worker_pool.start()
         self.addr_db.start()
+        if self.idempotency_store is not None:
+            self.idempotency_store.start()
+        if self.follower is not None:
+            self.follower.start()
+        if self.tenants is not None:
+            self.tenants.start()
+        if self.rate_limiter is not None:
+            self.rate_limiter.start()
+        if self.search_index is not None or self.dedup is not None:
+            self._indexing_pending = True
+            self._start_indexing()
+
+    def _start_indexing(self) -> None:
+        '''
+        Starts indexing existing entries, if pending, on the event loop
+        serving requests: now if running, else once the current IOLoop (if
+        any) runs, or once a request needing the indexes does.
+        '''
+        if not self._indexing_pending:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            io_loop = IOLoop.current(instance=False)
+            if io_loop is not None:
+                io_loop.add_callback(self._start_indexing)
+            return
+        self._indexing_pending = False
+        self._indexing = loop.create_task(self._build_indexes())
+
+    async def _build_indexes(self) -> None:
+        '''
+        Indexes the entries the address book already has, e.g. of a snapshot
+        or tiered DB, for search and dedup, if the address book can list
+        them. Entries changed meanwhile are left to the mutation listeners.
+        '''
+        indexes = [i for i in (self.search_index, self.dedup) if i is not None]
+        try:
+            while True:
+                seq = self.addr_db.changelog.last_seq
+                values = await self.addr_db.read_all_addresses()
+                try:
+                    changes = self.addr_db.changelog.since(seq)
+                    break
+                except ResyncRequiredError:
+                    continue  # Too many changes meanwhile to tell which
+        except NotImplementedError:
+            return
+        except Exception:
+            self.logger.exception('Indexing existing entries failed')
+            return
+
+        changed = {c.nickname for c in changes}
+        for nickname, value in list(values.items()):
+            if nickname not in changed:
+                for index in indexes:
+                    index.add(nickname, value)
+        self.logger.info('Indexed {} entries'.format(len(values)))
+
+    def drain(self):
+        '''
+        Ends long-lived work (change streams, replication) so that the
+        remaining tasks finish, before stop.
+        '''
+        self.draining = True
+        self.addr_db.changelog.wake()
+        if self.follower is not None:
+            self.follower.stop()
+        if self.tenants is not None:
+            self.tenants.drain()
 
     def stop(self):
+        self._indexing_pending = False
+        if self._indexing is not None:
+            self._indexing.cancel()
+        if self.rate_limiter is not None:
+            self.rate_limiter.stop()
+        if self.tenants is not None:
+            self.tenants.stop()
+        if self.follower is not None:
+            self.follower.stop()
+        if self.idempotency_store is not None:
+            self.idempotency_store.stop()
         self.addr_db.stop()
+        if self.worker_pool is not None:
+            self.worker_pool.stop()
+        if self.loop_monitor is not None:
+            self.loop_monitor.stop()
+        tracing.stop_trace_collectors()
         tracing.trace_log(self.logger)
 
+    def reload(self, config: Dict) -> Dict[str, List[str]]:
+        '''
+        Applies a new config to the running service, e.g. on SIGHUP. All
+        changed sections are made and validated first, then applied with no
+        await in between, so that no request sees only some of them. The
+        running components are tuned, keeping their state: hot entries,
+        rate limit buckets, collected traces, worker processes. Changed
+        sections that can't be applied while running are left as they are,
+        and reported as requiring a restart. The changed sections of the
+        config are updated in place, as handlers share it (e.g. admin).
+
+        Tunable sections: logging, tracing, rate-limit, loop-monitor,
+        workers (but not added or removed), admin, and capacity,
+        flush-interval and max-dirty of a tiered addr-db.
+
+        Raises ValueError, with nothing applied, if the config is invalid.
+        '''
+        if not isinstance(config, dict) or not all(
+            k in config for k in ('service', 'addr-db')
+        ):
+            raise ValueError('Invalid config: service and addr-db required')
+
+        preparers: Dict[str, Callable[[Dict], Optional[Applier]]] = {
+            'tracing': self._prepare_tracing,
+            'rate-limit': self._prepare_rate_limit,
+            'loop-monitor': self._prepare_loop_monitor,
+            'workers': self._prepare_workers,
+            'admin': lambda config: lambda: None,
+            'addr-db': self._prepare_addr_db,
+            # Last, dictConfig validates only while applying
+            'logging': self._prepare_logging,
+        }
+        changed = [
+            section for section in set(config) | set(self.config)
+            if section not in config or section not in self.config or
+            config[section] != self.config[section]
+        ]
+        order = list(preparers)
+        changed.sort(key=lambda section: (
+            order.index(section) if section in preparers else len(order),
+            section
+        ))
+
+        appliers: List[Tuple[str, Applier]] = []
+        restart_required = []
+        for section in changed:
+            prepare = preparers.get(section)
+            try:
+                apply = None if prepare is None else prepare(config)
+            except (AttributeError, KeyError, TypeError, ValueError) as e:
+                raise ValueError(
+                    'Invalid {} config: {}'.format(section, e)
+                ) from None
+            if apply is None:
+                restart_required.append(section)
+            else:
+                appliers.append((section, apply))
+
+        for section, apply in appliers:
+            apply()
+            if section in config:
+                self.config[section] = config[section]
+            else:
+                self.config.pop(section, None)
+
+        reloaded = [section for section, _ in appliers]
+        self.logger.info('Config reloaded: {}'.format(
+            ', '.join(reloaded) or 'no changes'
+        ))
+        if restart_required:
+            self.logger.warning('Config changes require a restart: {}'.format(
+                ', '.join(restart_required)
+            ))
+        return {'reloaded': reloaded, 'restart-required': restart_required}
+
+    def _prepare_logging(self, config: Dict) -> Optional[Applier]:
+        if not isinstance(config.get('logging'), dict):
+            return None
+        return functools.partial(logging.config.dictConfig, config['logging'])
+
+    def _prepare_tracing(self, config: Dict) -> Optional[Applier]:
+        return tracing.prepare_tracing(
+            config.get('tracing') or {}, restart=True
+        )
+
+    def _prepare_rate_limit(self, config: Dict) -> Optional[Applier]:
+        limiter = None
+        if 'rate-limit' in config:
+            limiter = RateLimiter.from_config(config['rate-limit'])
+
+        def apply() -> None:
+            if self.rate_limiter is not None and limiter is not None:
+                self.rate_limiter.tune(limiter)
+                return
+            if self.rate_limiter is not None:
+                self.rate_limiter.stop()
+            self.rate_limiter = limiter
+            if limiter is not None:
+                limiter.start()
+
+        return apply
+
+    def _prepare_loop_monitor(self, config: Dict) -> Optional[Applier]:
+        monitor = None
+        if 'loop-monitor' in config:
+            monitor = LoopMonitor.from_config(config['loop-monitor'])
+
+        def apply() -> None:
+            if self.loop_monitor is not None and monitor is not None:
+                self.loop_monitor.tune(monitor)
+                return
+            if self.loop_monitor is not None:
+                self.loop_monitor.stop()
+            self.loop_monitor = monitor
+            if monitor is not None:
+                monitor.start()
+
+        return apply
+
+    def _prepare_workers(self, config: Dict) -> Optional[Applier]:
+        # Added or removed, it would have to be set in each tenant too
+        if self.worker_pool is None or 'workers' not in config:
+            return None
+        pool = WorkerPool.from_config(config['workers'])
+        return functools.partial(self.worker_pool.tune, pool)
+
+    def _prepare_addr_db(self, config: Dict) -> Optional[Applier]:
+        if not isinstance(self.addr_db, TieredAddressBookDB):
+            return None
+        old = self.config.get('addr-db') or {}
+        new = config['addr-db']
+        if list(old) != ['tiered'] or list(new) != ['tiered']:
+            return None
+
+        def untunable(tiered_config: Dict) -> Dict:
+            return {
+                k: v for k, v in (tiered_config or {}).items()
+                if k not in TIERED_TUNABLE_KEYS
+            }
+
+        if untunable(old['tiered']) != untunable(new['tiered']):
+            return None
+        return functools.partial(
+            self.addr_db.tune, **tiered_settings(new['tiered'] or {})
+        )
+
     def uptime_millis(self) -> int:
         return unixtime_now_millis() - self.start_time
 
     async def status(self):
         # In real world, it checks status of underlying resources (such as
         # database in this case) to set ready flag.
-        return {
+        status: Dict[str, Any] = {
             'ready': True,
             'uptime': self.uptime_millis()
         }
+        if self.loop_monitor is not None:
+            status['event-loop'] = self.loop_monitor.stats()
+        if self.worker_pool is not None:
+            status['workers'] = self.worker_pool.stats()
+        addr_db_stats = self.addr_db.stats()
+        if addr_db_stats is not None:
+            status['addr-db'] = addr_db_stats
+        if self.follower is not None:
+            status['replication'] = self.follower.stats()
+            if self.follower.staleness() > self.follower.max_staleness:
+                status['ready'] = False
+        self._start_indexing()
+        if self._indexing_pending or (
+            self._indexing is not None and not self._indexing.done()
+        ):
+            # Search and dedup would miss existing entries
+            status['ready'] = False
+        if self.tenants is not None:
+            status['tenants'] = self.tenants.stats()
+        if self.rate_limiter is not None:
+            status['rate-limit'] = self.rate_limiter.stats()
+        status['compression'] = self.compression.stats()
+        if self.dedup is not None:
+            status['dedup'] = self.dedup.stats()
+        sampler = tracing.get_sampler()
+        if sampler is not None:
+            status['tracing'] = {'sampling': sampler.stats()}
+        return status
+
+    @tracing.trace()
+    async def post_address(
+        self,
+        value: Dict,
+        idempotency_key: Optional[str] = None,
+        nickname: str = None
+    ) -> str:
+        if idempotency_key is None or self.idempotency_store is None:
+            key = await self._create_address(value, nickname)
+            return key
+
+        validate_idempotency_key(idempotency_key)
+        value_hash = request_hash(value)
+
+        in_progress = self._idempotent_posts.get(idempotency_key)
+        if in_progress is None:
+            record = await self.idempotency_store.get(idempotency_key)
+            if record is not None:
+                # Replay: no validation, no DB access
+                if record.request_hash != value_hash:
+                    raise IdempotencyKeyReusedError(idempotency_key)
+                return record.nickname
+            # Check again, another request may have started while awaiting
+            in_progress = self._idempotent_posts.get(idempotency_key)
+
+        if in_progress is not None:
+            in_progress_hash, nickname_future = in_progress
+            if in_progress_hash != value_hash:
+                raise IdempotencyKeyReusedError(idempotency_key)
+            return await asyncio.shield(nickname_future)
+
+        nickname_future = asyncio.get_event_loop().create_future()
+        self._idempotent_posts[idempotency_key] = (value_hash, nickname_future)
+        try:
+            key = await self._create_address(value, nickname)
+            await self.idempotency_store.put(
+                idempotency_key, IdempotencyRecord(value_hash, key, 201)
+            )
+            nickname_future.set_result(key)
+            return key
+        except Exception as e:
+            # Failures are not recorded, a retry may succeed.
+            nickname_future.set_exception(e)
+            # Retrieve it, in case there was no concurrent retry waiting
+            nickname_future.exception()
+            raise
+        finally:
+            del self._idempotent_posts[idempotency_key]
+
+    async def _validate_address(self, value: Dict) -> None:
+        if self.worker_pool is None:
+            validate_address(value)
+        else:
+            await self.worker_pool.run(
+                'validate', entry_size(value), validate_address, value
+            )
+
+    async def _create_address(self, value: Dict, nickname: str = None) -> str:
+        '''Creates the entry, canonicalized and deduplicated if enabled.'''
+        if self.dedup is None:
+            return await self.addr_db.create_address(value, nickname)
+
+        self._start_indexing()
+        value = canonicalize(value)
+        if not isinstance(value, dict):
+            # Fails validation
+            return await self.addr_db.create_address(value, nickname)
+
+        fp = self.dedup.fingerprint(value)
+        existing = self.dedup.find(fp)
+        if existing is None and fp in self._dedup_posts:
+            existing = await asyncio.shield(self._dedup_posts[fp])
+        if existing is not None:
+            return await self._on_duplicate(existing, value)
+
+        nickname_future = asyncio.get_event_loop().create_future()
+        self._dedup_posts[fp] = nickname_future
+        try:
+            key = await self.addr_db.create_address(value, nickname)
+            nickname_future.set_result(key)
+            return key
+        except Exception as e:
+            nickname_future.set_exception(e)
+            # Retrieve it, in case there was no concurrent duplicate waiting
+            nickname_future.exception()
+            raise
+        finally:
+            del self._dedup_posts[fp]
+
+    async def _on_duplicate(self, existing: str, value: Dict) -> str:
+        assert self.dedup is not None
+        await self._validate_address(value)
+        self.dedup.duplicates += 1
+
+        if self.dedup.policy == POLICY_REJECT:
+            raise DuplicateEntryError(existing)
+        if self.dedup.policy == POLICY_MERGE:
+            old = await self.addr_db.read_address(existing)
+            merged = merge_entries(old, value)
+            if merged != old:
+                await self.addr_db.update_address(existing, merged)
+        return existing
 
     @tracing.trace()
-    async def post_address(self, value: Dict) -> str:
-        key = await self.addr_db.create_address(value)
-        return key
+    async def dedup_addresses(self, apply: bool = True) -> Dict[str, Any]:
+        '''
+        Finds the duplicate entries among existing ones (reindexing them,
+        they may predate this process), and if apply, merges each set into
+        the entry with the least nickname and deletes the others.
+        Returns {nickname kept: [duplicate nicknames]}, and counts.
+        '''
+        if self.dedup is None:
+            raise NotImplementedError('Dedup is not enabled')
+
+        values = await self.addr_db.read_all_addresses()
+        self.dedup.clear()
+        for nickname, value in list(values.items()):
+            self.dedup.add(nickname, value)
+
+        groups = self.dedup.groups()
+        removed = 0
+        for keep, *duplicates in groups if apply else []:
+            try:
+                old = await self.addr_db.read_address(keep)
+                merged = old
+                for nickname in duplicates:
+                    merged = merge_entries(
+                        merged, await self.addr_db.read_address(nickname)
+                    )
+                if merged != old:
+                    await self.addr_db.update_address(keep, merged)
+                for nickname in duplicates:
+                    await self.addr_db.delete_address(nickname)
+                    removed += 1
+            except KeyError:
+                # Changed meanwhile, left for the next run
+                continue
+
+        return {
+            'groups': len(groups),
+            'removed': removed,
+            'duplicates': {keep: rest for keep, *rest in groups},
+        }
 
     @tracing.trace()
-    async def get_address(self, key: str) -> Dict:
-        value = await self.addr_db.read_address(key)
+    async def get_address(self, key: str, fields: Fields = None) -> Dict:
+        value = await self.addr_db.read_address(key, fields)
         return value
 
     @tracing.trace()
     async def put_address(self, key: str, value: Dict) -> None:
+        if self.dedup is not None:
+            value = canonicalize(value)
         await self.addr_db.update_address(key, value)
 
     @tracing.trace()
@@ -65,6 +616,109 @@ class AddressBookService:
         await self.addr_db.delete_address(key)
 
     @tracing.trace()
-    async def get_all_addresses(self) -> Dict[str, Dict]:
+    async def get_all_addresses(
+        self,
+        fields: Fields = None
+    ) -> Dict[str, Dict]:
+        values = await self.addr_db.read_all_addresses(fields)
+        return values
+
+    @tracing.trace()
+    async def get_snapshot(self) -> bytes:
+        '''All entries as a snapshot (see addrservice.snapshot).'''
+        # Seq first: changes made while reading are replayed by followers.
+        seq = self.last_change_seq()
         values = await self.addr_db.read_all_addresses()
+        if self.worker_pool is None:
+            return encode_snapshot(values, seq)
+        # Shallow copy, the store may change while a worker encodes it.
+        return await self.worker_pool.run(
+            'serialize', len(values), encode_snapshot, dict(values), seq
+        )
+
+    async def encode_json(self, value: Dict) -> str:
+        '''JSON encodes a listing, off the event loop if it is large.'''
+        if self.worker_pool is None:
+            return json.dumps(value)
+        # Shallow copy, the store may change while a worker encodes it.
+        return await self.worker_pool.run(
+            'serialize', len(value), json.dumps, dict(value)
+        )
+
+    @tracing.trace()
+    async def get_addresses_by_pincode(
+        self,
+        low: Pincode,
+        high: Pincode,
+        limit: Optional[int] = None
+    ) -> Dict[str, Dict]:
+        values = await self.addr_db.read_addresses_by_pincode(low, high, limit)
         return values
+
+    @tracing.trace()
+    async def get_nearest_pincodes(
+        self,
+        pincode: Pincode,
+        k: int
+    ) -> List[Tuple[Pincode, str]]:
+        return await self.addr_db.nearest_pincodes(pincode, k)
+
+    @tracing.trace()
+    async def get_aggregates(self) -> Dict:
+        return await self.addr_db.read_aggregates()
+
+    @tracing.trace()
+    async def search_addresses(
+        self,
+        query: str,
+        k: int = 10
+    ) -> List[Tuple[str, float, Dict]]:
+        '''Top k (nickname, score, entry) fuzzy matches of the query.'''
+        results = await self.addr_db.search_addresses(query, k)
+        if results is not None:
+            return results
+        if self.search_index is None:
+            raise NotImplementedError('Search is not enabled')
+
+        self._start_indexing()
+        results = []
+        for nickname, score in self.search_index.search(query, k):
+            value = await self.addr_db.read_address(nickname)
+            results.append((nickname, score, value))
+        return results
+
+    def _sharded_db(self) -> ShardedAddressBookDB:
+        if not isinstance(self.addr_db, ShardedAddressBookDB):
+            raise NotImplementedError('Address book is not sharded')
+        return self.addr_db
+
+    def get_shards(self) -> List[str]:
+        return list(self._sharded_db().ring.nodes)
+
+    async def add_shard(self, node: str) -> int:
+        '''Adds a node to a sharded address book, see add_node.'''
+        return await self._sharded_db().add_node(node)
+
+    def get_changes(
+        self,
+        since: int,
+        limit: Optional[int] = None
+    ) -> List[Change]:
+        return self.addr_db.changelog.since(since, limit)
+
+    async def wait_for_changes(
+        self,
+        since: int,
+        timeout: float,
+        limit: Optional[int] = None
+    ) -> List[Change]:
+        return await self.addr_db.changelog.wait(since, timeout, limit)
+
+    def last_change_seq(self) -> int:
+        return self.addr_db.changelog.last_seq
+
+    def content_version(self) -> Optional[int]:
+        '''Version of all entries: the change log seq, None if unknown.'''
+        if not self.addr_db.complete_changelog:
+            return None
+        return self.last_change_seq()
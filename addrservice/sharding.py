@@ -0,0 +1,80 @@
+# Copyright (c) 2019. All rights reserved.
+
+import bisect
+import hashlib
+from typing import Iterable, List
+
+DEFAULT_VIRTUAL_NODES = 64
+
+
+def ring_hash(key: str) -> int:
+    # Stable across processes, unlike hash() of str
+    return int.from_bytes(
+        hashlib.md5(key.encode('utf-8')).digest()[:8], 'big'
+    )
+
+
+class HashRing:
+    '''
+    Consistent hash ring: a key belongs to the node of the first point on
+    the ring at or after the hash of the key.
+
+    Each node has `vnodes` points, so that keys spread evenly, and a new
+    node takes about 1/N of the keys, a few from each other node, while
+    other keys stay where they are.
+    '''
+
+    def __init__(
+        self,
+        nodes: Iterable[str] = (),
+        vnodes: int = DEFAULT_VIRTUAL_NODES
+    ) -> None:
+        if vnodes < 1:
+            raise ValueError('vnodes must be at least 1')
+
+        self.vnodes = vnodes
+        self.nodes: List[str] = []
+        self._hashes: List[int] = []
+        self._owners: List[str] = []
+        for node in nodes:
+            self.add_node(node)
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def __contains__(self, node: object) -> bool:
+        return node in self.nodes
+
+    def copy(self) -> 'HashRing':
+        ring = HashRing(vnodes=self.vnodes)
+        ring.nodes = list(self.nodes)
+        ring._hashes = list(self._hashes)
+        ring._owners = list(self._owners)
+        return ring
+
+    def add_node(self, node: str) -> None:
+        if node in self.nodes:
+            raise ValueError('{} is already in the ring'.format(node))
+
+        self.nodes.append(node)
+        for i in range(self.vnodes):
+            h = ring_hash('{}#{}'.format(node, i))
+            j = bisect.bisect_left(self._hashes, h)
+            self._hashes.insert(j, h)
+            self._owners.insert(j, node)
+
+    def remove_node(self, node: str) -> None:
+        self.nodes.remove(node)
+        points = [
+            (h, owner) for h, owner in zip(self._hashes, self._owners)
+            if owner != node
+        ]
+        self._hashes = [h for h, _ in points]
+        self._owners = [owner for _, owner in points]
+
+    def node_for(self, key: str) -> str:
+        if not self._hashes:
+            raise LookupError('No nodes in the ring')
+
+        i = bisect.bisect_left(self._hashes, ring_hash(key))
+        return self._owners[i % len(self._owners)]
@@ -0,0 +1,210 @@
+# Copyright (c) 2019. All rights reserved.
+
+'''
+Read-optimized on-disk snapshot of an address book.
+
+Layout, all integers little endian:
+
+    header:  magic 'ADDRSNAP', version (u16), 2 pad bytes, entry count (u32),
+             change log seq (u64), offset of the offset table (u64)
+    records: per entry, nickname length (u16), UTF-8 nickname,
+             address length (u32), compact JSON address
+    table:   record offset (u64) per entry, sorted by nickname
+
+A reader memory maps the file and bisects the offset table, so opening it
+costs the same for any size, and an entry is decoded only when read.
+'''
+
+import array
+import io
+import json
+import mmap
+import os
+import struct
+from typing import BinaryIO, Dict, Iterable, Iterator, Optional, Tuple
+
+MAGIC = b'ADDRSNAP'
+VERSION = 1
+
+_HEADER = struct.Struct('<8sHxxIQQ')
+_NICKNAME_LEN = struct.Struct('<H')
+_ADDRESS_LEN = struct.Struct('<I')
+_OFFSET = struct.Struct('<Q')
+
+
+class SnapshotFormatError(ValueError):
+    '''File is not a snapshot, or is of an unsupported version.'''
+    pass
+
+
+def _write(
+    f: BinaryIO,
+    items: Iterable[Tuple[str, Dict]],
+    seq: int
+) -> int:
+    f.write(b'\0' * _HEADER.size)
+
+    offsets = array.array('Q')
+    previous = None
+    for nickname, addr in items:
+        name = nickname.encode('utf-8')
+        if previous is not None and name <= previous:
+            raise ValueError(
+                'Nicknames not in ascending order: {}'.format(nickname)
+            )
+        previous = name
+
+        offsets.append(f.tell())
+        addr_json = json.dumps(addr, separators=(',', ':')).encode('utf-8')
+        f.write(_NICKNAME_LEN.pack(len(name)))
+        f.write(name)
+        f.write(_ADDRESS_LEN.pack(len(addr_json)))
+        f.write(addr_json)
+
+    table_offset = f.tell()
+    for offset in offsets:
+        f.write(_OFFSET.pack(offset))
+
+    f.seek(0)
+    f.write(_HEADER.pack(MAGIC, VERSION, len(offsets), seq, table_offset))
+    return len(offsets)
+
+
+def _sorted_items(entries: Dict[str, Dict]) -> Iterator[Tuple[str, Dict]]:
+    for nickname in sorted(entries, key=lambda n: n.encode('utf-8')):
+        yield nickname, entries[nickname]
+
+
+def write_snapshot(path: str, entries: Dict[str, Dict], seq: int = 0) -> int:
+    '''
+    Writes entries, as of change log sequence number seq, to path.
+
+    The file is written next to path and then renamed over it, so readers
+    never see a partial snapshot. Returns the number of entries written.
+    '''
+    return write_snapshot_items(path, _sorted_items(entries), seq)
+
+
+def write_snapshot_items(
+    path: str,
+    items: Iterable[Tuple[str, Dict]],
+    seq: int = 0
+) -> int:
+    '''
+    As write_snapshot, for (nickname, entry) items in ascending order of
+    UTF-8 nickname, e.g. made as they are written: only record offsets are
+    kept in memory.
+    '''
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            count = _write(f, items, seq)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    os.replace(tmp_path, path)
+    return count
+
+
+def encode_snapshot(entries: Dict[str, Dict], seq: int = 0) -> bytes:
+    '''Snapshot of entries as bytes, e.g. to send to a follower.'''
+    with io.BytesIO() as f:
+        _write(f, _sorted_items(entries), seq)
+        return f.getvalue()
+
+
+class Snapshot:
+    '''Memory mapped, read-only view of a snapshot file.'''
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SnapshotFormatError(
+                    'Empty snapshot file: {}'.format(path)
+                ) from None
+        # The pinned typeshed lacks mmap buffers and memoryview.release()
+        self._view = memoryview(self._mmap)  # type: ignore
+
+        try:
+            magic, version, count, seq, table_offset = _HEADER.unpack_from(
+                self._view, 0
+            )
+        except struct.error:
+            magic, version = b'', 0
+
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise SnapshotFormatError(
+                'Not a version {} snapshot: {}'.format(VERSION, path)
+            )
+        if table_offset + count * _OFFSET.size > len(self._mmap):
+            self.close()
+            raise SnapshotFormatError('Truncated snapshot: {}'.format(path))
+
+        self.count = count
+        self.seq = seq
+        self._table_offset = table_offset
+
+    def close(self) -> None:
+        self._view.release()  # type: ignore
+        self._mmap.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, nickname: object) -> bool:
+        return isinstance(nickname, str) and self._find(nickname) is not None
+
+    def _record_offset(self, i: int) -> int:
+        return _OFFSET.unpack_from(
+            self._view, self._table_offset + i * _OFFSET.size
+        )[0]
+
+    def _nickname(self, offset: int) -> bytes:
+        n = _NICKNAME_LEN.unpack_from(self._view, offset)[0]
+        start = offset + _NICKNAME_LEN.size
+        return self._mmap[start:start + n]
+
+    def _address(self, offset: int) -> Dict:
+        offset += _NICKNAME_LEN.size + len(self._nickname(offset))
+        n = _ADDRESS_LEN.unpack_from(self._view, offset)[0]
+        start = offset + _ADDRESS_LEN.size
+        return json.loads(self._mmap[start:start + n])
+
+    def _find(self, nickname: str) -> Optional[int]:
+        key = nickname.encode('utf-8')
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._nickname(self._record_offset(mid)) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo < self.count:
+            offset = self._record_offset(lo)
+            if self._nickname(offset) == key:
+                return offset
+        return None
+
+    def get(self, nickname: str) -> Optional[Dict]:
+        offset = self._find(nickname)
+        return None if offset is None else self._address(offset)
+
+    def nicknames(self) -> Iterator[str]:
+        for i in range(self.count):
+            yield self._nickname(self._record_offset(i)).decode('utf-8')
+
+    def items(self) -> Iterator[Tuple[str, Dict]]:
+        for i in range(self.count):
+            offset = self._record_offset(i)
+            yield (
+                self._nickname(offset).decode('utf-8'),
+                self._address(offset)
+            )
@@ -0,0 +1,305 @@
+# Copyright (c) 2019. All rights reserved.
+
+import asyncio
+import json
+import logging
+import os
+from typing import (
+    Any, Callable, Dict, Optional, TYPE_CHECKING
+)
+
+from addrservice import LOGGER_NAME
+from addrservice.addressbook_db import InMemoryAddressBookDB
+from addrservice.changelog import DEFAULT_RETENTION
+from addrservice.ratelimit import RateLimitedError, RateLimitRule
+from addrservice.snapshot import Snapshot, write_snapshot
+
+if TYPE_CHECKING:
+    from addrservice.service import AddressBookService  # noqa: F401
+
+TENANT_NAME_MAX_LEN = 64
+
+
+class QuotaExceededError(Exception):
+    '''Mutation would take a tenant over its entry or memory quota.'''
+    pass
+
+
+def entry_bytes(addr: Dict) -> int:
+    '''Memory accounted to an entry: the size of its compact JSON.'''
+    return len(json.dumps(addr, separators=(',', ':')).encode('utf-8'))
+
+
+class TenantAddressBookDB(InMemoryAddressBookDB):
+    '''
+    In-memory address book of a tenant, with its size in entries and bytes
+    (see entry_bytes) kept up to date, and bounded by quotas (0: none).
+    '''
+
+    def __init__(
+        self,
+        max_entries: int = 0,
+        max_bytes: int = 0,
+        changelog_retention: int = DEFAULT_RETENTION
+    ) -> None:
+        super().__init__(changelog_retention)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.entry_bytes: Dict[str, int] = {}
+        self.add_listener(self._account)
+
+    def _account(
+        self,
+        op: str,
+        nickname: str,
+        old: Optional[Dict],
+        new: Optional[Dict]
+    ) -> None:
+        self.bytes -= self.entry_bytes.pop(nickname, 0)
+        if new is not None:
+            size = entry_bytes(new)
+            self.entry_bytes[nickname] = size
+            self.bytes += size
+
+    def _check_quota(self, nickname: Optional[str], addr: Dict) -> None:
+        is_new = nickname is None or nickname not in self.db
+        if is_new and self.max_entries and len(self.db) >= self.max_entries:
+            raise QuotaExceededError(
+                'Quota of {} entries exceeded'.format(self.max_entries)
+            )
+
+        if self.max_bytes:
+            size = self.bytes + entry_bytes(addr)
+            if not is_new:
+                size -= self.entry_bytes.get(nickname or '', 0)
+            if size > self.max_bytes:
+                raise QuotaExceededError(
+                    'Quota of {} bytes exceeded'.format(self.max_bytes)
+                )
+
+    def _check_write(self, nickname: str, addr: Dict) -> None:
+        # Again, as concurrent writes may have been made while validating
+        self._check_quota(nickname, addr)
+
+    async def create_address(self, addr: Dict, nickname: str = None) -> str:
+        self._check_quota(nickname, addr)
+        return await super().create_address(addr, nickname)
+
+    async def update_address(self, nickname: str, addr: Dict) -> None:
+        if nickname in self.db:
+            self._check_quota(nickname, addr)
+        await super().update_address(nickname, addr)
+
+
+class Tenant:
+    def __init__(self, name: str, service: 'AddressBookService') -> None:
+        self.name = name
+        self.service = service
+        # Requests in progress; a tenant is evicted only when there are none
+        self.active = 0
+        self.last_access = 0.0
+
+    @property
+    def addr_db(self) -> TenantAddressBookDB:
+        db = self.service.addr_db
+        assert isinstance(db, TenantAddressBookDB)
+        return db
+
+
+class TenantManager:
+    '''
+    Address books of many tenants, each served by its own service over a
+    TenantAddressBookDB, created on its first request by make_service(name,
+    db).
+
+    Tenants idle for idle-timeout seconds are evicted: their entries are
+    saved to a snapshot file in data-dir, and loaded again on their next
+    request. Least recently used idle tenants are also evicted when the
+    memory of all resident tenants exceeds max-resident-bytes.
+
+    Config (tenants section):
+        data-dir:           directory of snapshots of evicted tenants
+        idle-timeout:       seconds, default: 300
+        max-entries:        entry quota per tenant, default: 0 (none)
+        max-bytes:          memory quota per tenant, default: 0 (none)
+        max-resident-bytes: memory of all resident tenants, default: 0
+        rate:               requests per second per tenant, default: 0
+                            (no limit)
+        burst:              requests over rate, default: rate (at least 1)
+    '''
+
+    def __init__(
+        self,
+        make_service: Callable[
+            [str, TenantAddressBookDB], 'AddressBookService'
+        ],
+        data_dir: str,
+        idle_timeout: float = 300,
+        max_entries: int = 0,
+        max_bytes: int = 0,
+        max_resident_bytes: int = 0,
+        rate: float = 0,
+        burst: float = 0,
+        logger: logging.Logger = logging.getLogger(LOGGER_NAME)
+    ) -> None:
+        self.make_service = make_service
+        self.data_dir = data_dir
+        self.idle_timeout = idle_timeout
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_resident_bytes = max_resident_bytes
+        self.logger = logger
+
+        self.tenants: Dict[str, Tenant] = {}
+        # Kept across evictions, so that evicting doesn't reset limits
+        self.rate_limit = RateLimitRule('', rate, burst) if rate > 0 else None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.loads = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_config(
+        cls,
+        config: Dict,
+        make_service: Callable[
+            [str, TenantAddressBookDB], 'AddressBookService'
+        ]
+    ) -> 'TenantManager':
+        return cls(
+            make_service,
+            config['data-dir'],
+            idle_timeout=float(config.get('idle-timeout', 300)),
+            max_entries=int(config.get('max-entries', 0)),
+            max_bytes=int(config.get('max-bytes', 0)),
+            max_resident_bytes=int(config.get('max-resident-bytes', 0)),
+            rate=float(config.get('rate', 0)),
+            burst=float(config.get('burst', 0)),
+        )
+
+    def start(self) -> None:
+        self._schedule()
+
+    def stop(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for name in list(self.tenants):
+            self.evict(name)
+
+    def drain(self) -> None:
+        for tenant in self.tenants.values():
+            tenant.service.drain()
+
+    def _schedule(self) -> None:
+        loop = asyncio.get_event_loop()
+        self._timer = loop.call_later(self.idle_timeout / 2, self._sweep)
+
+    def _sweep(self) -> None:
+        now = asyncio.get_event_loop().time()
+        if self.rate_limit is not None:
+            self.rate_limit.sweep(now)
+        for tenant in list(self.tenants.values()):
+            if (
+                tenant.active == 0 and
+                now - tenant.last_access >= self.idle_timeout
+            ):
+                self.evict(tenant.name)
+        self._schedule()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.data_dir, name + '.snap')
+
+    def resident_bytes(self) -> int:
+        return sum(t.addr_db.bytes for t in self.tenants.values())
+
+    def acquire(self, name: str) -> 'AddressBookService':
+        '''
+        Service of a tenant, for a request, which must be released. Raises
+        RateLimitedError if the tenant is over its rate, and ValueError if
+        the name is not valid.
+        '''
+        if not 0 < len(name) <= TENANT_NAME_MAX_LEN or not all(
+            c.isalnum() or c == '-' for c in name
+        ):
+            raise ValueError('Invalid tenant name')
+
+        now = asyncio.get_event_loop().time()
+        if self.rate_limit is not None:
+            retry_after = self.rate_limit.take(name, now)
+            if retry_after > 0:
+                raise RateLimitedError(retry_after)
+
+        tenant = self.tenants.get(name)
+        if tenant is None:
+            tenant = self._load(name)
+            self.tenants[name] = tenant
+            self._evict_over_budget(name)
+
+        tenant.active += 1
+        tenant.last_access = now
+        return tenant.service
+
+    def release(self, name: str) -> None:
+        tenant = self.tenants.get(name)
+        if tenant is not None:
+            tenant.active -= 1
+            tenant.last_access = asyncio.get_event_loop().time()
+
+    def _load(self, name: str) -> Tenant:
+        db = TenantAddressBookDB(self.max_entries, self.max_bytes)
+        # Service first, so that its listeners (e.g. indexes) see the entries
+        service = self.make_service(name, db)
+        path = self._path(name)
+        if os.path.exists(path):
+            snapshot = Snapshot(path)
+            try:
+                db.load(snapshot.items(), snapshot.seq)
+            finally:
+                snapshot.close()
+            self.loads += 1
+        return Tenant(name, service)
+
+    def evict(self, name: str) -> None:
+        '''Saves the entries of a tenant to disk, and drops them.'''
+        tenant = self.tenants.pop(name)
+        db = tenant.addr_db
+        if db.db or db.changelog.last_seq or os.path.exists(self._path(name)):
+            os.makedirs(self.data_dir, exist_ok=True)
+            write_snapshot(self._path(name), db.db, db.changelog.last_seq)
+        self.evictions += 1
+
+    def _evict_over_budget(self, keep: str) -> None:
+        if not self.max_resident_bytes:
+            return
+
+        resident = self.resident_bytes()
+        by_last_access = sorted(
+            self.tenants.values(), key=lambda t: t.last_access
+        )
+        for tenant in by_last_access:
+            if resident <= self.max_resident_bytes:
+                break
+            if tenant.name != keep and tenant.active == 0:
+                resident -= tenant.addr_db.bytes
+                self.evict(tenant.name)
+
+    def tenant_stats(self) -> Dict[str, Dict[str, Any]]:
+        now = asyncio.get_event_loop().time()
+        return {
+            t.name: {
+                'entries': len(t.addr_db.db),
+                'bytes': t.addr_db.bytes,
+                'active': t.active,
+                'idle': now - t.last_access,
+            }
+            for t in self.tenants.values()
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'resident': len(self.tenants),
+            'resident-bytes': self.resident_bytes(),
+            'loads': self.loads,
+            'evictions': self.evictions,
+        }
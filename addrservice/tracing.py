@@ -1,10 +1,24 @@
 # Copyright (c) 2019. All rights reserved.
 
 from abc import ABCMeta, abstractmethod
+import asyncio
+import bisect
+import collections
+from contextvars import ContextVar
 from functools import wraps
+import inspect
+import json
 import logging
+import os
+import random
+import re
 import time
-from typing import Any, Callable, Dict, List, Sequence, Tuple
+from typing import (
+    Any, Callable, Deque, Dict, Iterable, List, Optional, Sequence, Tuple,
+    Type
+)
+
+from addrservice.ratelimit import TokenBucket
 
 
 class AbstractTraceCollector(metaclass=ABCMeta):
@@ -13,6 +27,32 @@ class AbstractTraceCollector(metaclass=ABCMeta):
         '''Returns callback to be executed at the end of span.'''
         raise NotImplementedError()
 
+    def start(self) -> None:
+        '''Starts background work (if any), called from service start.'''
+        pass
+
+    def stop(self) -> None:
+        '''Stops background work (if any), called from service stop.'''
+        pass
+
+    def observe(self, name: str, value: float) -> None:
+        '''Records a measurement (e.g. a latency in ms) not tied to a span.'''
+        pass
+
+    def record_span(
+        self,
+        func,
+        end_ns: int,
+        elapsed_ns: int,
+        error: bool
+    ) -> None:
+        '''
+        Records the span of a call after the fact: one not sampled at its
+        start, kept as it failed or was slow (see Sampler). It ended at
+        end_ns (as time.time_ns) and took elapsed_ns.
+        '''
+        pass
+
 
 class CummulativeFunctionTimeProfiler(AbstractTraceCollector):
     def __init__(self, *args, **kwargs):
@@ -28,6 +68,16 @@ class CummulativeFunctionTimeProfiler(AbstractTraceCollector):
 
         return store_time
 
+    def record_span(
+        self,
+        func,
+        end_ns: int,
+        elapsed_ns: int,
+        error: bool
+    ) -> None:
+        t = self.func_times.get(func.__qualname__, 0) + elapsed_ns / 1e9
+        self.func_times[func.__qualname__] = t
+
     def summary(self) -> Sequence[Tuple[str, float]]:
         return sorted(self.func_times.items(), key=lambda kv: kv[1])
 
@@ -35,6 +85,112 @@ class CummulativeFunctionTimeProfiler(AbstractTraceCollector):
         return str(self.summary())
 
 
+# Function ids, assigned to traced functions at decoration time, index the
+# arrays of timing collectors. Same qualname, same id.
+_function_ids: Dict[str, int] = {}
+_function_names: List[str] = []
+
+
+def function_id(func) -> int:
+    fid = _function_ids.get(func.__qualname__)
+    if fid is None:
+        fid = _function_ids[func.__qualname__] = len(_function_names)
+        _function_names.append(func.__qualname__)
+    return fid
+
+
+class AbstractTimingCollector(AbstractTraceCollector):
+    '''
+    Collector of the elapsed time of traced calls only. The trace decorator
+    times the call once for all of them, and hands it over by function id,
+    without a span callback per call.
+    '''
+
+    @abstractmethod
+    def record(self, func_id: int, elapsed_ns: int) -> None:
+        raise NotImplementedError()
+
+    def create_span(self, func) -> Callable[[], None]:
+        fid = function_id(func)
+        start = time.perf_counter_ns()
+        return lambda: self.record(fid, time.perf_counter_ns() - start)
+
+
+class FunctionTimeProfiler(AbstractTimingCollector):
+    '''
+    Cumulative calls and time (ns) per traced function, in arrays indexed
+    by function id: a call costs two additions, no allocation or lookup.
+    Traced functions run on the event loop thread, so no lock is taken.
+
+    Profiles are keyed by function name, so those of several processes,
+    e.g. servers run per CPU core with reuse-port, add up with
+    merge_profiles().
+
+    Config (all optional):
+        export-file: write the profile as JSON here on stop; {pid} is
+                     replaced by the process id
+    '''
+
+    def __init__(self, config: Optional[Dict] = None, *args, **kwargs):
+        config = config or {}
+        self.export_file = config.get('export-file')
+        # Preallocated for the functions decorated so far, grown on demand
+        # for those decorated later.
+        capacity = max(64, 2 * len(_function_names))
+        self.calls = [0] * capacity
+        self.times = [0] * capacity
+
+    def record(self, func_id: int, elapsed_ns: int) -> None:
+        try:
+            self.calls[func_id] += 1
+            self.times[func_id] += elapsed_ns
+        except IndexError:
+            grow = [0] * max(len(self.calls), func_id + 1 - len(self.calls))
+            self.calls += grow
+            self.times += grow
+            self.record(func_id, elapsed_ns)
+
+    def to_dict(self) -> Dict[str, Dict[str, int]]:
+        return {
+            name: {'calls': self.calls[fid], 'total-ns': self.times[fid]}
+            for fid, name in enumerate(_function_names)
+            if fid < len(self.calls) and self.calls[fid]
+        }
+
+    def summary(self) -> Sequence[Tuple[str, int, float]]:
+        '''(name, calls, total seconds), in increasing total time.'''
+        return sorted(
+            (
+                (name, p['calls'], p['total-ns'] / 1e9)
+                for name, p in self.to_dict().items()
+            ),
+            key=lambda x: x[2]
+        )
+
+    def stop(self) -> None:
+        if self.export_file is None:
+            return
+        path = self.export_file.format(pid=os.getpid())
+        with open(path, mode='w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f)
+
+    def __str__(self) -> str:
+        return str(self.summary())
+
+
+def merge_profiles(
+    profiles: Iterable[Dict[str, Dict[str, int]]]
+) -> Dict[str, Dict[str, int]]:
+    '''Sum of FunctionTimeProfiler.to_dict() of several processes.'''
+    merged: Dict[str, Dict[str, int]] = {}
+    for profile in profiles:
+        for name, p in profile.items():
+            m = merged.setdefault(name, {'calls': 0, 'total-ns': 0})
+            m['calls'] += p['calls']
+            m['total-ns'] += p['total-ns']
+    return merged
+
+
 class Timeline(AbstractTraceCollector):
     def __init__(self, *args, **kwargs):
         self._timeline = []
@@ -54,41 +210,837 @@ class Timeline(AbstractTraceCollector):
             n=func.__qualname__,
         ))
 
+    def record_span(
+        self,
+        func,
+        end_ns: int,
+        elapsed_ns: int,
+        error: bool
+    ) -> None:
+        self.timeline.append('{t}: ENTRY {n}'.format(
+            t=(end_ns - elapsed_ns) / 1e9,
+            n=func.__qualname__,
+        ))
+        self.timeline.append('{t}: {e} {n}'.format(
+            t=end_ns / 1e9,
+            e='ERROR' if error else 'EXIT',
+            n=func.__qualname__,
+        ))
+
     def __str__(self) -> str:
         return str(self.timeline)
 
 
+class Histogram:
+    '''Fixed bucket histogram, cheap enough to update on every event.'''
+
+    BUCKET_BOUNDS = (
+        1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000
+    )
+
+    def __init__(self, bounds: Sequence[float] = BUCKET_BOUNDS) -> None:
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q: float) -> float:
+        '''Upper bound of the bucket holding the q-th (0..100) percentile.'''
+        rank = q / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        buckets = {
+            'le_{}'.format(b): n for b, n in zip(self.bounds, self.counts)
+        }
+        buckets['inf'] = self.counts[-1]
+
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'buckets': buckets,
+        }
+
+    def __str__(self) -> str:
+        return str(self.to_dict())
+
+
+class HistogramCollector(AbstractTraceCollector):
+    '''Latency histograms (ms) per traced function and observed metric.'''
+
+    def __init__(self, *args, **kwargs):
+        self.histograms: Dict[str, Histogram] = {}
+
+    def histogram(self, name: str) -> Histogram:
+        h = self.histograms.get(name)
+        if h is None:
+            h = self.histograms[name] = Histogram()
+        return h
+
+    def create_span(self, func) -> Callable[[], None]:
+        start = time.perf_counter()
+        return lambda: self.observe(
+            func.__qualname__, (time.perf_counter() - start) * 1e3
+        )
+
+    def observe(self, name: str, value: float) -> None:
+        self.histogram(name).observe(value)
+
+    def record_span(
+        self,
+        func,
+        end_ns: int,
+        elapsed_ns: int,
+        error: bool
+    ) -> None:
+        self.observe(func.__qualname__, elapsed_ns / 1e6)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        return {k: v.to_dict() for k, v in sorted(self.histograms.items())}
+
+    def __str__(self) -> str:
+        return str(self.summary())
+
+
+# Distributed tracing: W3C trace context and spans
+
+TRACEPARENT_HEADER = 'traceparent'
+
+_TRACEPARENT_REGEX = re.compile(
+    r'^(?P<version>[0-9a-f]{2})-(?P<trace_id>[0-9a-f]{32})-'
+    r'(?P<span_id>[0-9a-f]{16})-(?P<flags>[0-9a-f]{2})(-.*)?$'
+)
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+class SpanContext:
+    '''Identity of a span as carried by the W3C traceparent header.'''
+
+    __slots__ = ('trace_id', 'span_id', 'sampled')
+
+    def __init__(self, trace_id: str, span_id: str, sampled: bool = True):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+    @classmethod
+    def from_traceparent(
+        cls,
+        header: Optional[str]
+    ) -> Optional['SpanContext']:
+        '''Parses traceparent header, returns None if missing or invalid.'''
+        if not header:
+            return None
+
+        m = _TRACEPARENT_REGEX.match(header.strip().lower())
+        if m is None or m.group('version') == 'ff':
+            return None
+        if m.group('version') == '00' and m.group(5) is not None:
+            return None
+        if set(m.group('trace_id')) == {'0'} or set(m.group('span_id')) == {'0'}:  # noqa
+            return None
+
+        return cls(
+            m.group('trace_id'),
+            m.group('span_id'),
+            bool(int(m.group('flags'), 16) & 0x01)
+        )
+
+    def child(self) -> 'SpanContext':
+        return SpanContext(self.trace_id, new_span_id(), self.sampled)
+
+    def traceparent(self) -> str:
+        return '00-{t}-{s}-{f:02x}'.format(
+            t=self.trace_id,
+            s=self.span_id,
+            f=1 if self.sampled else 0
+        )
+
+
+def new_trace_id() -> str:
+    return os.urandom(16).hex()
+
+
+def new_span_id() -> str:
+    return os.urandom(8).hex()
+
+
+_current_span_context: ContextVar[Optional[SpanContext]] = ContextVar(
+    'addrservice_span_context', default=None
+)
+
+
+def current_span_context() -> Optional[SpanContext]:
+    return _current_span_context.get()
+
+
+def current_traceparent() -> Optional[str]:
+    '''Header value to propagate the current trace to downstream calls.'''
+    ctx = _current_span_context.get()
+    return None if ctx is None else ctx.traceparent()
+
+
+class Span:
+    __slots__ = (
+        'name', 'context', 'parent_span_id', 'kind',
+        'start_ns', 'end_ns', 'attributes', 'status'
+    )
+
+    def __init__(
+        self,
+        name: str,
+        context: SpanContext,
+        parent_span_id: Optional[str] = None,
+        kind: int = SPAN_KIND_INTERNAL
+    ) -> None:
+        self.name = name
+        self.context = context
+        self.parent_span_id = parent_span_id
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes: Dict[str, Any] = {}
+        self.status = STATUS_UNSET
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            'traceId': self.context.trace_id,
+            'spanId': self.context.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [
+                {'key': k, 'value': _otlp_value(v)}
+                for k, v in self.attributes.items()
+            ],
+            'status': {'code': self.status},
+        }  # type: Dict[str, Any]
+        if self.parent_span_id is not None:
+            span['parentSpanId'] = self.parent_span_id
+        return span
+
+
+def _otlp_value(v: Any) -> Dict[str, Any]:
+    if isinstance(v, bool):
+        return {'boolValue': v}
+    if isinstance(v, int):
+        return {'intValue': str(v)}
+    if isinstance(v, float):
+        return {'doubleValue': v}
+    return {'stringValue': str(v)}
+
+
+class SpanCollector(AbstractTraceCollector):
+    '''
+    Records a span per traced call, parented through contextvars, and
+    batch-exports finished spans as OTLP/JSON every export-interval.
+
+    Config (all optional):
+        service-name:    resource service.name, default: addrservice
+        export-file:     append OTLP/JSON lines here; if absent, exported
+                         batches are kept in memory (local collector stand-in)
+        batch-size:      max spans per export batch, default: 512
+        export-interval: seconds between exports, default: 2.0
+        max-queue-size:  finished spans buffered before dropping, default: 8192
+    '''
+
+    def __init__(self, config: Optional[Dict] = None, *args, **kwargs):
+        config = config or {}
+        self.service_name = config.get('service-name', 'addrservice')
+        self.export_file = config.get('export-file')
+        self.batch_size = int(config.get('batch-size', 512))
+        self.export_interval = float(config.get('export-interval', 2.0))
+        max_queue_size = int(config.get('max-queue-size', 8192))
+
+        self.queue: Deque[Span] = collections.deque(maxlen=max_queue_size)
+        self.exported: List[Dict[str, Any]] = []
+        self.dropped = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._export_task: Optional[asyncio.Future] = None
+
+    # Span creation
+
+    def start_span(
+        self,
+        name: str,
+        parent: Optional[SpanContext] = None,
+        kind: int = SPAN_KIND_INTERNAL,
+        sampled: bool = True
+    ) -> Span:
+        '''
+        Starts a span and makes it current in the calling context. A span
+        without a parent starts a trace, sampled or not; others are sampled
+        as their parent.
+        '''
+        if parent is None:
+            parent = _current_span_context.get()
+
+        if parent is None:
+            context = SpanContext(new_trace_id(), new_span_id(), sampled)
+            span = Span(name, context, None, kind)
+        else:
+            span = Span(name, parent.child(), parent.span_id, kind)
+
+        _current_span_context.set(span.context)
+        return span
+
+    def end_span(self, span: Span, error: bool = False) -> None:
+        span.end_ns = time.time_ns()
+        if error:
+            span.status = STATUS_ERROR
+        if not span.context.sampled:
+            return
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append(span)
+
+    def create_span(self, func) -> Callable[[], None]:
+        parent = _current_span_context.get()
+        span = self.start_span(func.__qualname__, parent)
+
+        def end():
+            # Restore parent for the remaining part of the caller.
+            _current_span_context.set(parent)
+            self.end_span(span)
+
+        return end
+
+    def record_span(
+        self,
+        func,
+        end_ns: int,
+        elapsed_ns: int,
+        error: bool
+    ) -> None:
+        parent = _current_span_context.get()
+        span = self.start_span(func.__qualname__, parent)
+        _current_span_context.set(parent)
+        # Kept at its end, even if its trace is not sampled
+        span.context.sampled = True
+        span.start_ns = end_ns - elapsed_ns
+        self.end_span(span, error=error)
+        span.end_ns = end_ns
+
+    # Export
+
+    def start(self) -> None:
+        if self._timer is None:
+            self._schedule()
+
+    def stop(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        # Flush leftovers synchronously, event loop may be gone by now.
+        while self.queue:
+            self._write(self._encode_batch(self._next_batch()))
+
+    def _schedule(self) -> None:
+        # A timer rather than a long running task, so that the server's
+        # shutdown, which waits for all pending tasks, doesn't hang on it.
+        self._timer = asyncio.get_event_loop().call_later(
+            self.export_interval, self._tick
+        )
+
+    def _tick(self) -> None:
+        if self.queue and (
+            self._export_task is None or self._export_task.done()
+        ):
+            self._export_task = asyncio.ensure_future(self._export())
+        self._schedule()
+
+    async def _export(self) -> None:
+        loop = asyncio.get_event_loop()
+        while self.queue:
+            payload = self._encode_batch(self._next_batch())
+            # File IO in the default executor, never on the event loop.
+            await loop.run_in_executor(None, self._write, payload)
+
+    def _next_batch(self) -> List[Span]:
+        n = min(self.batch_size, len(self.queue))
+        return [self.queue.popleft() for _ in range(n)]
+
+    def _encode_batch(self, spans: List[Span]) -> Dict[str, Any]:
+        return {
+            'resourceSpans': [{
+                'resource': {
+                    'attributes': [{
+                        'key': 'service.name',
+                        'value': {'stringValue': self.service_name}
+                    }]
+                },
+                'scopeSpans': [{
+                    'scope': {'name': 'addrservice.tracing'},
+                    'spans': [s.to_otlp() for s in spans]
+                }]
+            }]
+        }
+
+    def _write(self, payload: Dict[str, Any]) -> None:
+        if self.export_file is None:
+            self.exported.append(payload)
+            return
+
+        with open(self.export_file, mode='a', encoding='utf-8') as f:
+            f.write(json.dumps(payload))
+            f.write('\n')
+
+    def __str__(self) -> str:
+        return 'queued={q}, dropped={d}'.format(
+            q=len(self.queue),
+            d=self.dropped
+        )
+
+
+# Not a [*a, *b] display, which mypy rejects for abstract classes
+_COLLECTOR_CLASSES: List[Type[AbstractTraceCollector]] = (
+    AbstractTraceCollector.__subclasses__()
+)
+_COLLECTOR_CLASSES.extend(AbstractTimingCollector.__subclasses__())
+
 TRACE_COLLECTORS = {
-    x.__module__ + '.' + x.__qualname__:
-        x for x in AbstractTraceCollector.__subclasses__()
+    x.__module__ + '.' + x.__qualname__: x
+    for x in _COLLECTOR_CLASSES
+    if not inspect.isabstract(x)
 }
 
 
+# Sampling
+
+SAMPLING_CONFIG_KEY = 'sampling'
+
+
+class Sampler:
+    '''
+    Bounds the cost of span collectors (all but timing ones), which see
+    only the calls of traces sampled at their root: each with probability
+    rate, and at most max-per-second of them (a token bucket). The root is
+    the span of a request, else the first traced call without a span
+    context. Its decision is carried by the span context to the calls it
+    makes, and by the traceparent flags to other services; a request with
+    a traceparent is sampled as its flags say.
+
+    A call or request not sampled that fails or is slow is still recorded
+    once it ends (see record_span), so that tail latency and errors are
+    never missed. Such calls are not counted against max-per-second.
+
+    Timing collectors see every call: it is timed anyway.
+
+    Config (sampling key of the tracing section, all optional):
+        rate:              head sampling probability, default: 1.0
+        max-per-second:    sampled traces per second, default: unlimited
+        burst:             sampled traces in a burst, default: max-per-second
+        slow-threshold-ms: record calls at least this slow, default: never
+        errors:            record calls that raise, default: true
+    '''
+
+    def __init__(
+        self,
+        rate: float = 1.0,
+        max_per_second: Optional[float] = None,
+        burst: Optional[float] = None,
+        slow_threshold_ms: Optional[float] = None,
+        errors: bool = True
+    ) -> None:
+        if not 0 <= rate <= 1:
+            raise ValueError('rate must be between 0 and 1')
+
+        self.rate = rate
+        self.bucket = None if max_per_second is None else TokenBucket(
+            max_per_second,
+            burst if burst is not None else max(1.0, max_per_second),
+            time.monotonic()
+        )
+        self.slow_threshold_ns = (
+            None if slow_threshold_ms is None
+            else int(slow_threshold_ms * 1e6)
+        )
+        self.errors = errors
+        # Whether calls not sampled need to be timed
+        self.tail = errors or self.slow_threshold_ns is not None
+
+        self.sampled = 0
+        self.unsampled = 0
+        self.capped = 0
+        self.kept = 0
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict]) -> 'Sampler':
+        # Not narrowed from Optional in the closure if config is reassigned
+        cfg: Dict = config or {}
+
+        def optional(key: str) -> Optional[float]:
+            value = cfg.get(key)
+            return None if value is None else float(value)
+
+        return cls(
+            rate=float(cfg.get('rate', 1.0)),
+            max_per_second=optional('max-per-second'),
+            burst=optional('burst'),
+            slow_threshold_ms=optional('slow-threshold-ms'),
+            errors=bool(cfg.get('errors', True)),
+        )
+
+    def sample(self) -> bool:
+        '''Head decision, at the root of a trace.'''
+        if self.rate < 1 and random.random() >= self.rate:
+            self.unsampled += 1
+            return False
+        if self.bucket is not None and self.bucket.take(time.monotonic()):
+            self.capped += 1
+            return False
+        self.sampled += 1
+        return True
+
+    def keep(self, elapsed_ns: int, error: bool) -> bool:
+        '''Tail decision, at the end of a call of a trace not sampled.'''
+        if (error and self.errors) or (
+            self.slow_threshold_ns is not None and
+            elapsed_ns >= self.slow_threshold_ns
+        ):
+            self.kept += 1
+            return True
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'sampled': self.sampled,
+            'unsampled': self.unsampled,
+            'capped': self.capped,
+            'kept': self.kept,
+        }
+
+
+_sampler: Optional[Sampler] = None
+
+
+def set_sampler(sampler: Optional[Sampler]) -> None:
+    global _sampler
+    _sampler = sampler
+
+
+def get_sampler() -> Optional[Sampler]:
+    return _sampler
+
+
 _trace_collectors: List[AbstractTraceCollector] = []
+# _trace_collectors split into those called per span and those per timing,
+# kept in sync (in place) by set_trace_collectors.
+_span_collectors: List[AbstractTraceCollector] = []
+_timing_collectors: List[AbstractTimingCollector] = []
+
+
+def split_trace_collectors(
+    collectors: Sequence[AbstractTraceCollector]
+) -> Tuple[List[AbstractTraceCollector], List[AbstractTimingCollector]]:
+    spans: List[AbstractTraceCollector] = []
+    timings: List[AbstractTimingCollector] = []
+    for tc in collectors:
+        if isinstance(tc, AbstractTimingCollector):
+            timings.append(tc)
+        else:
+            spans.append(tc)
+    return spans, timings
 
 
 def set_trace_collectors(collectors: Sequence[AbstractTraceCollector]) -> None:
     global _trace_collectors
     _trace_collectors.clear()
     _trace_collectors += collectors
+    spans, timings = split_trace_collectors(collectors)
+    _span_collectors[:] = spans
+    _timing_collectors[:] = timings
+
+
+def get_trace_collectors() -> List[AbstractTraceCollector]:
+    return list(_trace_collectors)
+
+
+# Config key -> (config, collector) of collectors set by prepare_tracing
+_configured_collectors: Dict[str, Tuple[Any, AbstractTraceCollector]] = {}
+
+
+def prepare_tracing(
+    config: Dict[str, Any],
+    restart: bool = False
+) -> Callable[[], None]:
+    '''
+    Makes the sampler and collectors of a tracing config, and returns a
+    function that sets them, e.g. once the rest of a reloaded config is
+    valid too. With restart, for a running service: collectors configured
+    the same as those set are kept, with what they collected, new ones are
+    started when set, and those no longer set are stopped.
+    '''
+    sampler = (
+        Sampler.from_config(config[SAMPLING_CONFIG_KEY])
+        if SAMPLING_CONFIG_KEY in config else None
+    )
+    collectors: Dict[str, AbstractTraceCollector] = {}
+    for k, v in config.items():
+        if k == SAMPLING_CONFIG_KEY:
+            continue
+        configured = _configured_collectors.get(k)
+        if (
+            restart and configured is not None and configured[0] == v and
+            any(tc is configured[1] for tc in _trace_collectors)
+        ):
+            collectors[k] = configured[1]
+        else:
+            collectors[k] = TRACE_COLLECTORS[k](v)  # type: ignore
+
+    def apply() -> None:
+        old = list(_trace_collectors)
+        set_sampler(sampler)
+        set_trace_collectors(list(collectors.values()))
+        _configured_collectors.clear()
+        _configured_collectors.update(
+            (k, (config[k], tc)) for k, tc in collectors.items()
+        )
+        if restart:
+            stop_trace_collectors([
+                tc for tc in old
+                if not any(tc is x for x in _trace_collectors)
+            ])
+            start_trace_collectors([
+                tc for tc in _trace_collectors
+                if not any(tc is x for x in old)
+            ])
+
+    return apply
 
 
 def configure_tracing(config: Dict[str, Any]) -> None:
-    set_trace_collectors([
-        TRACE_COLLECTORS[k](v) for k, v in config.items()  # type: ignore
-    ])
+    prepare_tracing(config)()
+
+
+def start_trace_collectors(
+    collectors: Sequence[AbstractTraceCollector] = _trace_collectors
+) -> None:
+    for tc in collectors:
+        tc.start()
+
+
+def stop_trace_collectors(
+    collectors: Sequence[AbstractTraceCollector] = _trace_collectors
+) -> None:
+    for tc in collectors:
+        tc.stop()
+
+
+def observe(
+    name: str,
+    value: float,
+    collectors: Sequence[AbstractTraceCollector] = _trace_collectors
+) -> None:
+    for tc in collectors:
+        tc.observe(name, value)
+
+
+def start_request_span(
+    name: str,
+    traceparent: Optional[str] = None,
+    collectors: Sequence[AbstractTraceCollector] = _trace_collectors
+) -> Optional[Span]:
+    '''
+    Starts a server span for an incoming request as a child of the remote
+    traceparent (if any), sampled as it is; else as the root of a trace,
+    sampled by the sampler set (if any). Without a SpanCollector configured,
+    only the span context is propagated.
+    '''
+    parent = SpanContext.from_traceparent(traceparent)
+    sampler = _sampler
+    sampled = parent is not None or sampler is None or sampler.sample()
+
+    for tc in collectors:
+        if isinstance(tc, SpanCollector):
+            return tc.start_span(name, parent, SPAN_KIND_SERVER, sampled)
+
+    if parent is None and sampler is not None:
+        # Carries the decision to the traced calls of the request
+        parent = SpanContext(new_trace_id(), new_span_id(), sampled)
+    if parent is not None:
+        _current_span_context.set(parent)
+    return None
+
+
+def end_request_span(
+    span: Optional[Span],
+    status_code: int,
+    collectors: Sequence[AbstractTraceCollector] = _trace_collectors
+) -> None:
+    if span is None:
+        return
+
+    span.attributes['http.status_code'] = status_code
+    error = status_code >= 500
+    sampler = _sampler
+    if not span.context.sampled and sampler is not None and sampler.tail:
+        elapsed_ns = time.time_ns() - span.start_ns
+        span.context.sampled = sampler.keep(elapsed_ns, error)
+    for tc in collectors:
+        if isinstance(tc, SpanCollector):
+            tc.end_span(span, error=error)
+            return
+
+
+def _clear_span_context() -> None:
+    _current_span_context.set(None)
+
+
+def _begin_spans(
+    func,
+    spans: Sequence[AbstractTraceCollector],
+    sampler: Sampler
+) -> Tuple[List[Callable[[], None]], Optional[Sampler]]:
+    '''
+    Span callbacks of a call if its trace is sampled; else none, and the
+    sampler to decide at its end whether to record it late (None if it
+    never would). Decided here only if the call is the root of a trace.
+    '''
+    parent = _current_span_context.get()
+    sampled = sampler.sample() if parent is None else parent.sampled
+    callbacks = [x.create_span(func) for x in spans] if sampled else []
+    if parent is None and _current_span_context.get() is None:
+        # No span of the call is current (not sampled, or no SpanCollector):
+        # a context carries the decision to the calls it makes.
+        _current_span_context.set(
+            SpanContext(new_trace_id(), new_span_id(), sampled)
+        )
+        callbacks.append(_clear_span_context)
+    return callbacks, None if sampled or not sampler.tail else sampler
+
+
+def _record_late_spans(
+    func,
+    spans: Sequence[AbstractTraceCollector],
+    late: Sampler,
+    elapsed_ns: int,
+    error: bool
+) -> None:
+    if late.keep(elapsed_ns, error):
+        end_ns = time.time_ns()
+        for x in spans:
+            x.record_span(func, end_ns, elapsed_ns, error)
 
 
 def trace(collectors: Sequence[AbstractTraceCollector] = _trace_collectors):
+    '''
+    Traces calls of the decorated function, sampled as set by set_sampler.
+    Custom collectors are split into span and timing ones once, here; the
+    global ones as they are set.
+    '''
+    if collectors is _trace_collectors:
+        spans: Sequence[AbstractTraceCollector] = _span_collectors
+        timings: Sequence[AbstractTimingCollector] = _timing_collectors
+    else:
+        spans, timings = split_trace_collectors(collectors)
+
+    perf_counter_ns = time.perf_counter_ns
+
     def tracing_decorator(func):
+        fid = function_id(func)
+
+        if asyncio.iscoroutinefunction(func):
+            # Span must cover the awaited execution, not coroutine creation.
+            @wraps(func)
+            async def with_async_tracing(*args, **kwargs):
+                if not spans:
+                    if not timings:
+                        return await func(*args, **kwargs)
+                    start = perf_counter_ns()
+                    try:
+                        return await func(*args, **kwargs)
+                    finally:
+                        elapsed = perf_counter_ns() - start
+                        for t in timings:
+                            t.record(fid, elapsed)
+
+                sampler = _sampler
+                if sampler is None:
+                    span_callbacks = [x.create_span(func) for x in spans]
+                    late = None
+                else:
+                    span_callbacks, late = _begin_spans(func, spans, sampler)
+                timed = timings or late is not None
+                start = perf_counter_ns() if timed else 0
+                error = False
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    error = True
+                    raise
+                finally:
+                    elapsed = perf_counter_ns() - start if timed else 0
+                    for t in timings:
+                        t.record(fid, elapsed)
+                    # Caller's context back first, to parent late spans
+                    for f in span_callbacks:
+                        f()
+                    if late is not None:
+                        _record_late_spans(func, spans, late, elapsed, error)
+            return with_async_tracing
+
         @wraps(func)
         def with_tracing(*args, **kwargs):
-            span_callbacks = [x.create_span(func) for x in collectors]
+            if not spans:
+                if not timings:
+                    return func(*args, **kwargs)
+                start = perf_counter_ns()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    elapsed = perf_counter_ns() - start
+                    for t in timings:
+                        t.record(fid, elapsed)
+
+            sampler = _sampler
+            if sampler is None:
+                span_callbacks = [x.create_span(func) for x in spans]
+                late = None
+            else:
+                span_callbacks, late = _begin_spans(func, spans, sampler)
+            timed = timings or late is not None
+            start = perf_counter_ns() if timed else 0
+            error = False
             try:
                 return func(*args, **kwargs)
+            except Exception:
+                error = True
+                raise
             finally:
+                elapsed = perf_counter_ns() - start if timed else 0
+                for t in timings:
+                    t.record(fid, elapsed)
+                # Caller's context back first, to parent late spans
                 for f in span_callbacks:
                     f()
+                if late is not None:
+                    _record_late_spans(func, spans, late, elapsed, error)
         return with_tracing
     return tracing_decorator
 
@@ -0,0 +1,133 @@
+# Copyright (c) 2019. All rights reserved.
+
+import asyncio
+import concurrent.futures
+from typing import Any, Callable, Dict, Optional
+
+# Size of an address entry for offloading decisions: number of items in its
+# lists, as validation cost grows with them.
+ENTRY_LIST_FIELDS = ('addresses', 'phoneNumbers', 'faxNumbers', 'emails')
+
+
+def entry_size(addr: Any) -> int:
+    if not isinstance(addr, dict):
+        return 0
+    return sum(len(addr.get(k) or ()) for k in ENTRY_LIST_FIELDS)
+
+
+class WorkerPool:
+    '''
+    Executor for CPU heavy work (JSON Schema validation, JSON encoding of
+    listings) that would otherwise stall the event loop.
+
+    Each operation kind has a size threshold: smaller payloads run inline as
+    the executor hop costs more than the work itself. With a thread pool the
+    work still holds the GIL, but the loop thread gets to run every switch
+    interval; a process pool gives real parallelism at the cost of pickling.
+
+    Config:
+        kind:        thread (default) or process
+        max-workers: executor size, default: Python's default for the kind
+        offload-thresholds:
+            validate:  min entry size (see entry_size) to offload, default: 64
+            serialize: min entries in a listing to offload, default: 1000
+            compress:  min bytes of a response body to offload, default:
+                       65536
+    '''
+
+    DEFAULT_THRESHOLDS = {
+        'validate': 64,
+        'serialize': 1000,
+        'compress': 65536,
+    }
+
+    def __init__(
+        self,
+        kind: str = 'thread',
+        max_workers: Optional[int] = None,
+        thresholds: Optional[Dict[str, int]] = None
+    ) -> None:
+        if kind not in ('thread', 'process'):
+            raise ValueError('Unknown worker pool kind: {}'.format(kind))
+
+        self.kind = kind
+        self.max_workers = max_workers
+        self.thresholds = dict(self.DEFAULT_THRESHOLDS)
+        self.thresholds.update(thresholds or {})
+        self.executor: Optional[concurrent.futures.Executor] = None
+        self.inline_count = 0
+        self.offload_count = 0
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict]) -> 'WorkerPool':
+        config = config or {}
+        max_workers = config.get('max-workers')
+        return cls(
+            kind=config.get('kind', 'thread'),
+            max_workers=None if max_workers is None else int(max_workers),
+            thresholds=config.get('offload-thresholds'),
+        )
+
+    def tune(self, other: 'WorkerPool') -> None:
+        '''
+        Takes the settings of other. A running executor of another kind or
+        size is replaced, and work already in it finishes there.
+        '''
+        self.thresholds = dict(other.thresholds)
+        if (self.kind, self.max_workers) == (other.kind, other.max_workers):
+            return
+
+        self.kind = other.kind
+        self.max_workers = other.max_workers
+        executor, self.executor = self.executor, None
+        if executor is not None:
+            self.start()
+            executor.shutdown(wait=False)
+
+    def start(self) -> None:
+        if self.executor is not None:
+            return
+
+        if self.kind == 'process':
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.max_workers
+            )
+        else:
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix='addrservice-worker'
+            )
+
+    def stop(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def should_offload(self, op: str, size: int) -> bool:
+        return (
+            self.executor is not None and
+            size >= self.thresholds.get(op, 0)
+        )
+
+    async def run(
+        self,
+        op: str,
+        size: int,
+        fn: Callable[..., Any],
+        *args: Any
+    ) -> Any:
+        '''Runs fn(*args) inline or in the executor depending on size.'''
+        if not self.should_offload(op, size):
+            self.inline_count += 1
+            return fn(*args)
+
+        self.offload_count += 1
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'kind': self.kind,
+            'inline': self.inline_count,
+            'offloaded': self.offload_count,
+        }
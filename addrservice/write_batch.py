@@ -0,0 +1,256 @@
+# Copyright (c) 2019. All rights reserved.
+
+import asyncio
+import functools
+import logging
+from typing import (
+    Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+)
+
+from addrservice import LOGGER_NAME
+from addrservice.changelog import OP_CREATE, OP_DELETE, OP_UPDATE
+
+DURABILITY_COMMIT = 'commit'
+DURABILITY_BUFFERED = 'buffered'
+
+# Last queued op of an entry, then a newer op -> single op that succeeds only
+# if both would have, in order. Other pairs (e.g. create then delete, whose
+# create may fail) are applied as is.
+_COALESCED_OPS = {
+    (OP_CREATE, OP_UPDATE): OP_CREATE,
+    (OP_UPDATE, OP_UPDATE): OP_UPDATE,
+    (OP_UPDATE, OP_DELETE): OP_DELETE,
+    (OP_DELETE, OP_CREATE): OP_UPDATE,
+}
+
+# (op, nickname, new entry)
+Write = Tuple[str, str, Optional[Dict]]
+
+
+class _QueuedWrite:
+    def __init__(self, op: str, nickname: str, addr: Optional[Dict]) -> None:
+        self.op = op
+        self.nickname = nickname
+        self.addr = addr
+        # Writes coalesced into this one, each with the future of its caller
+        self.originals: List[Tuple[Write, asyncio.Future]] = []
+
+
+class WriteBatcher:
+    '''
+    Gathers writes from concurrent callers for up to max-delay seconds, or
+    max-rows writes, and applies them with one call to apply_batch, e.g. as
+    one transaction. Queued writes to an entry are coalesced when safe.
+
+    If a batch fails, its writes are applied again one by one, in order,
+    with apply_one, so that each caller gets the outcome its own write would
+    have had. Batches are applied one at a time, in order.
+
+    Config:
+        max-delay:  seconds a write waits for others, default: 0.005
+        max-rows:   writes that flush a batch right away, default: 100
+        durability: commit (default), a write returns once its batch is
+                    committed; or buffered, it returns once queued,
+                    on_applied is called once it is committed, and failures
+                    are only logged
+    '''
+
+    def __init__(
+        self,
+        apply_batch: Callable[[List[Write]], Awaitable[Any]],
+        apply_one: Callable[[str, str, Optional[Dict]], Awaitable[Any]],
+        max_delay: float = 0.005,
+        max_rows: int = 100,
+        durability: str = DURABILITY_COMMIT
+    ) -> None:
+        if durability not in (DURABILITY_COMMIT, DURABILITY_BUFFERED):
+            raise ValueError('Unknown durability: {}'.format(durability))
+
+        self.apply_batch = apply_batch
+        self.apply_one = apply_one
+        self.max_delay = max_delay
+        self.max_rows = max_rows
+        self.durability = durability
+        self.logger = logging.getLogger(LOGGER_NAME)
+
+        self.queue: Dict[str, List[_QueuedWrite]] = {}
+        self.queued = 0
+        # Future of the latest write of each entry not yet applied
+        self._last_write: Dict[str, asyncio.Future] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: Set[asyncio.Future] = set()
+        self._lock: Optional[asyncio.Lock] = None
+
+        self.batches = 0
+        self.writes = 0
+        self.coalesced = 0
+        self.failed_batches = 0
+
+    @classmethod
+    def from_config(
+        cls,
+        config: Optional[Dict],
+        apply_batch: Callable[[List[Write]], Awaitable[Any]],
+        apply_one: Callable[[str, str, Optional[Dict]], Awaitable[Any]]
+    ) -> 'WriteBatcher':
+        config = config or {}
+        return cls(
+            apply_batch,
+            apply_one,
+            max_delay=float(config.get('max-delay', 0.005)),
+            max_rows=int(config.get('max-rows', 100)),
+            durability=config.get('durability', DURABILITY_COMMIT),
+        )
+
+    def stop(self) -> None:
+        if not (self.queue or self._flushes):
+            return
+
+        loop = asyncio.get_event_loop()
+        if loop.is_running():
+            self.logger.warning('Stopped with unapplied writes')
+            self._start_flush()
+        else:
+            loop.run_until_complete(self.flush())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'durability': self.durability,
+            'queued': self.queued,
+            'batches': self.batches,
+            'writes': self.writes,
+            'coalesced': self.coalesced,
+            'failed-batches': self.failed_batches,
+        }
+
+    async def write(
+        self,
+        op: str,
+        nickname: str,
+        addr: Optional[Dict],
+        on_applied: Optional[Callable[[], Any]] = None
+    ) -> None:
+        '''
+        Queues a write, and waits for it if durability is commit. on_applied
+        is called once the write is applied, and not if it fails.
+        '''
+        future = self._queue(op, nickname, addr)
+        if self.durability == DURABILITY_COMMIT:
+            await asyncio.shield(future)
+            if on_applied is not None:
+                on_applied()
+        else:
+            future.add_done_callback(
+                functools.partial(self._buffered_done, on_applied)
+            )
+
+    async def wait(self, nickname: str) -> None:
+        '''Waits until queued writes of an entry (if any) are applied.'''
+        future = self._last_write.get(nickname)
+        if future is not None:
+            await asyncio.wait([future])
+
+    async def flush(self) -> None:
+        '''Applies queued writes, and waits for all batches in progress.'''
+        self._start_flush()
+        if self._flushes:
+            await asyncio.wait(list(self._flushes))
+
+    def _buffered_done(
+        self,
+        on_applied: Optional[Callable[[], Any]],
+        future: asyncio.Future
+    ) -> None:
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self.logger.error(
+                'Buffered write failed: {}'.format(future.exception())
+            )
+        elif on_applied is not None:
+            on_applied()
+
+    def _queue(
+        self,
+        op: str,
+        nickname: str,
+        addr: Optional[Dict]
+    ) -> asyncio.Future:
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+
+        queued = self.queue.setdefault(nickname, [])
+        coalesced_op = (
+            _COALESCED_OPS.get((queued[-1].op, op)) if queued else None
+        )
+        if coalesced_op is None:
+            queued.append(_QueuedWrite(op, nickname, addr))
+            self.queued += 1
+        else:
+            queued[-1].op, queued[-1].addr = coalesced_op, addr
+            self.coalesced += 1
+        queued[-1].originals.append(((op, nickname, addr), future))
+
+        self._last_write[nickname] = future
+        future.add_done_callback(functools.partial(self._applied, nickname))
+
+        if self.queued >= self.max_rows:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._start_flush)
+        return future
+
+    def _applied(self, nickname: str, future: asyncio.Future) -> None:
+        if self._last_write.get(nickname) is future:
+            del self._last_write[nickname]
+
+    def _start_flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self.queue:
+            return
+
+        batch = [w for queued in self.queue.values() for w in queued]
+        self.queue = {}
+        self.queued = 0
+
+        flush = asyncio.ensure_future(self._apply(batch))
+        self._flushes.add(flush)
+        flush.add_done_callback(self._flushes.discard)
+
+    async def _apply(self, batch: List[_QueuedWrite]) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            self.batches += 1
+            self.writes += sum(len(w.originals) for w in batch)
+            try:
+                await self.apply_batch([
+                    (w.op, w.nickname, w.addr) for w in batch
+                ])
+            except Exception:
+                self.failed_batches += 1
+                self.logger.exception(
+                    'Write batch failed, applying its writes one by one'
+                )
+                for w in batch:
+                    for original, future in w.originals:
+                        await self._apply_one(original, future)
+                return
+
+            for w in batch:
+                for _, future in w.originals:
+                    if not future.done():
+                        future.set_result(None)
+
+    async def _apply_one(self, write: Write, future: asyncio.Future) -> None:
+        try:
+            await self.apply_one(*write)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(None)
@@ -0,0 +1 @@
+# Copyright (c) 2019. All rights reserved.
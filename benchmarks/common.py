@@ -0,0 +1,119 @@
+# Copyright (c) 2019. All rights reserved.
+
+import copy
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Sequence, Tuple
+
+import tornado.httpserver
+import tornado.testing
+
+from addrservice import ADDR_SERVICE_ROOT_DIR
+from addrservice.app import make_addrservice_app
+from addrservice.service import AddressBookService
+
+SAMPLE_ADDRESS_FILE = os.path.abspath(os.path.join(
+    ADDR_SERVICE_ROOT_DIR,
+    '../tests/data/addresses/namo.json'
+))
+
+BASE_CONFIG: Dict[str, Any] = {
+    'service': {'name': 'Address Book Benchmark'},
+    'addr-db': {'memory': None},
+}
+
+
+def make_config(**sections: Any) -> Dict[str, Any]:
+    config = copy.deepcopy(BASE_CONFIG)
+    for k, v in sections.items():
+        config[k.replace('_', '-')] = v
+    return config
+
+
+def sample_address() -> Dict:
+    with open(SAMPLE_ADDRESS_FILE, mode='r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def large_address(n: int) -> Dict:
+    '''A valid entry with n addresses, costly to validate and encode.'''
+    addr = sample_address()
+    addr['addresses'] = [
+        dict(addr['addresses'][0], pincode=100000 + i) for i in range(n)
+    ]
+    return addr
+
+
+class AppServer:
+    '''Runs an addrservice app on a local port in the current event loop.'''
+
+    def __init__(self, config: Dict[str, Any]) -> None:
+        self.config = config
+        self.service: AddressBookService
+        self.server: tornado.httpserver.HTTPServer
+        self.port = 0
+
+    def __enter__(self) -> 'AppServer':
+        # Keep per-request logging out of the measurements
+        logging.getLogger('addrservice').setLevel(logging.ERROR)
+        logging.getLogger('tornado.access').setLevel(logging.ERROR)
+
+        self.service, app = make_addrservice_app(self.config, debug=False)
+        self.service.start()
+        sock, self.port = tornado.testing.bind_unused_port()
+        self.server = tornado.httpserver.HTTPServer(app)
+        self.server.add_sockets([sock])
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.server.stop()
+        self.service.stop()
+
+    def url(self, path: str) -> str:
+        return 'http://127.0.0.1:{}{}'.format(self.port, path)
+
+
+class Timer:
+    def __enter__(self) -> 'Timer':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.elapsed = time.perf_counter() - self.start
+
+
+def percentiles(
+    samples: Sequence[float],
+    qs: Sequence[int] = (50, 90, 99)
+) -> Dict[str, float]:
+    if not samples:
+        return {'p{}'.format(q): 0.0 for q in qs}
+
+    ordered = sorted(samples)
+    last = len(ordered) - 1
+    result = {
+        'p{}'.format(q): ordered[min(last, len(ordered) * q // 100)]
+        for q in qs
+    }
+    result['max'] = ordered[-1]
+    return result
+
+
+def print_table(
+    title: str,
+    header: Sequence[str],
+    rows: Sequence[Tuple[Any, ...]]
+) -> None:
+    cells = [list(map(str, header))] + [
+        ['{:.3f}'.format(c) if isinstance(c, float) else str(c) for c in r]
+        for r in rows
+    ]
+    widths = [max(len(r[i]) for r in cells) for i in range(len(header))]
+
+    print('\n' + title)
+    for i, r in enumerate(cells):
+        print('  '.join(c.rjust(w) for c, w in zip(r, widths)))
+        if i == 0:
+            print('  '.join('-' * w for w in widths))
@@ -0,0 +1,232 @@
+# Copyright (c) 2019. All rights reserved.
+
+'''
+Deterministic synthetic address book entries, for scale tests: schema
+valid, with cities skewed by a Zipf distribution, varying numbers of
+addresses, phone numbers and emails, and names in several scripts.
+
+Entry i depends only on the seed and i, so any range of entries can be
+generated on its own, in any process, and a seed always gives the same
+data. Entries are generated lazily, in nickname order, and written as
+they are: as NDJSON in the format of POST /addressbook/_bulk, or as a
+snapshot (see addrservice.snapshot).
+'''
+
+import bisect
+import itertools
+import json
+import random
+from typing import Dict, Iterator, List, Optional, Sequence, TextIO, Tuple
+
+NICKNAME_FORMAT_STR = 'entry-{:010d}'
+
+# (city, state, country, first pincode, country code, area code), most
+# populous first: city i is chosen with weight 1 / (i + 1) ** CITY_SKEW.
+CITIES = [
+    ('Mumbai', 'Maharashtra', 'India', 400001, 91, 22),
+    ('New Delhi', 'Delhi', 'India', 110001, 91, 11),
+    ('Bengaluru', 'Karnataka', 'India', 560001, 91, 80),
+    ('Kolkata', 'West Bengal', 'India', 700001, 91, 33),
+    ('Chennai', 'Tamil Nadu', 'India', 600001, 91, 44),
+    ('Hyderabad', 'Telangana', 'India', 500001, 91, 40),
+    ('Pune', 'Maharashtra', 'India', 411001, 91, 20),
+    ('Ahmedabad', 'Gujarat', 'India', 380001, 91, 79),
+    ('New York', 'New York', 'USA', 10001, 1, 212),
+    ('Jaipur', 'Rajasthan', 'India', 302001, 91, 141),
+    ('Lucknow', 'Uttar Pradesh', 'India', 226001, 91, 522),
+    ('São Paulo', 'São Paulo', 'Brazil', 1001000, 55, 11),
+    ('東京', '東京都', 'Japan', 1000001, 81, 3),
+    ('Kochi', 'Kerala', 'India', 682001, 91, 484),
+    ('Berlin', 'Berlin', 'Germany', 10115, 49, 30),
+    ('Москва', 'Москва', 'Russia', 101000, 7, 495),
+    ('San Francisco', 'California', 'USA', 94102, 1, 415),
+    ('Varanasi', 'Uttar Pradesh', 'India', 221001, 91, 542),
+    ('München', 'Bayern', 'Germany', 80331, 49, 89),
+    ('Guwahati', 'Assam', 'India', 781001, 91, 361),
+    ('Bhopal', 'Madhya Pradesh', 'India', 462001, 91, 755),
+    ('Singapore', 'Singapore', 'Singapore', 18956, 65, 0),
+]
+CITY_SKEW = 1.1
+
+# (name, ASCII form for emails)
+GIVEN_NAMES = [
+    ('Aarav', 'aarav'), ('Priya', 'priya'), ('Rahul', 'rahul'),
+    ('Ananya', 'ananya'), ('Vikram', 'vikram'), ('Lakshmi', 'lakshmi'),
+    ('Arjun', 'arjun'), ('Meera', 'meera'), ('Sanjay', 'sanjay'),
+    ('अनन्या', 'ananya'), ('राहुल', 'rahul'), ('சுப்பிரமணியன்', 'subramanian'),
+    ('John', 'john'), ('Mary', 'mary'), ('Zoë', 'zoe'), ('José', 'jose'),
+    ('François', 'francois'), ('Søren', 'soren'), ('Łukasz', 'lukasz'),
+    ('Mohammed', 'mohammed'), ('محمد', 'muhammad'), ('Fatima', 'fatima'),
+    ('Иван', 'ivan'), ('Анна', 'anna'), ('美咲', 'misaki'),
+    ('翔太', 'shota'), ('Nguyễn Văn', 'van'), ('Ngozi', 'ngozi'),
+]
+FAMILY_NAMES = [
+    ('Sharma', 'sharma'), ('Iyer', 'iyer'), ('Gupta', 'gupta'),
+    ('Patel', 'patel'), ('Reddy', 'reddy'), ('Banerjee', 'banerjee'),
+    ('Singh', 'singh'), ('Khan', 'khan'), ('शर्मा', 'sharma'),
+    ('Smith', 'smith'), ("O'Brien", 'obrien'), ('Müller', 'mueller'),
+    ('García', 'garcia'), ('Da Silva', 'dasilva'), ('Kowalski', 'kowalski'),
+    ('Иванов', 'ivanov'), ('佐藤', 'sato'), ('김', 'kim'),
+    ('Okafor', 'okafor'), ('Nguyễn', 'nguyen'), ('Al-Farsi', 'alfarsi'),
+]
+
+STREET_NAMES = [
+    'MG', 'Station', 'Park', 'Church', 'Temple', 'Market', 'Lake', 'Hill',
+    'Gandhi', 'Nehru', 'Tagore', 'Akbar', 'Tughlak', 'Linking', 'Brigade',
+    'Main', 'Oak', 'Haupt', 'Augusta', 'Mirabeau', 'Tverskaya', 'Ginza',
+]
+STREET_SUFFIXES = ['Road', 'Street', 'Marg', 'Lane', 'Avenue', 'Nagar']
+LOCALITIES = [
+    'Andheri', 'Bandra', 'Connaught Place', 'Karol Bagh', 'Koramangala',
+    'Indiranagar', 'Salt Lake', 'T. Nagar', 'Banjara Hills', 'Kothrud',
+    'Downtown', 'Mitte', 'Shibuya', 'Centro', 'Civil Lines', 'Old Town',
+]
+BUILDING_WORDS = ['Sai', 'Shanti', 'Royal', 'Green', 'Sunrise', 'Tower']
+BUILDING_KINDS = ['Apartments', 'Residency', 'Heights', 'House', 'Plaza']
+
+# (domain, weight, kind of email)
+EMAIL_DOMAINS = [
+    ('gmail.com', 40, 'home'), ('yahoo.co.in', 10, 'home'),
+    ('outlook.com', 10, 'home'), ('rediffmail.com', 5, 'home'),
+    ('example.com', 15, 'work'), ('example.org', 10, 'work'),
+    ('corp.example.in', 10, 'work'),
+]
+
+# Number of addresses, phone numbers, fax numbers and emails: weights of
+# 0, 1, 2, ... of them
+ADDRESSES_WEIGHTS = [0, 60, 25, 10, 4, 1]
+PHONES_WEIGHTS = [20, 50, 20, 10]
+FAXES_WEIGHTS = [90, 8, 2]
+EMAILS_WEIGHTS = [25, 55, 15, 5]
+
+
+def _cum_weights(weights: Sequence[float]) -> List[float]:
+    return list(itertools.accumulate(weights))
+
+
+_CITY_CUM_WEIGHTS = _cum_weights(
+    [1 / (i + 1) ** CITY_SKEW for i in range(len(CITIES))]
+)
+_DOMAIN_CUM_WEIGHTS = _cum_weights([w for _, w, _ in EMAIL_DOMAINS])
+_ADDRESSES_CUM_WEIGHTS = _cum_weights(ADDRESSES_WEIGHTS)
+_PHONES_CUM_WEIGHTS = _cum_weights(PHONES_WEIGHTS)
+_FAXES_CUM_WEIGHTS = _cum_weights(FAXES_WEIGHTS)
+_EMAILS_CUM_WEIGHTS = _cum_weights(EMAILS_WEIGHTS)
+
+
+def _pick(rng: random.Random, cum_weights: List[float]) -> int:
+    '''Index chosen by cumulative weights.'''
+    return bisect.bisect(cum_weights, rng.random() * cum_weights[-1])
+
+
+def _address(rng: random.Random, city: Tuple, kind: str) -> Dict:
+    name, state, country, pincode, _, _ = city
+    addr: Dict = {'kind': kind}
+    if rng.random() < 0.3:
+        addr['buildingName'] = '{} {}'.format(
+            rng.choice(BUILDING_WORDS), rng.choice(BUILDING_KINDS)
+        )
+        if rng.random() < 0.7:
+            addr['unitNumber'] = rng.randrange(1, 2000)
+    if rng.random() < 0.8:
+        addr['streetNumber'] = rng.randrange(1, 400)
+    else:
+        addr['streetNumber'] = '{}{}'.format(
+            rng.randrange(1, 400), rng.choice('ABCD')
+        )
+    addr['streetName'] = '{} {}'.format(
+        rng.choice(STREET_NAMES), rng.choice(STREET_SUFFIXES)
+    )
+    if rng.random() < 0.7:
+        addr['locality'] = rng.choice(LOCALITIES)
+    addr['city'] = name
+    if rng.random() < 0.9:
+        addr['state'] = state
+    addr['pincode'] = pincode + rng.randrange(100)
+    addr['country'] = country
+    return addr
+
+
+def _phone(rng: random.Random, city: Tuple, kind: str) -> Dict:
+    phone: Dict = {'kind': kind, 'countryCode': city[4]}
+    if city[5] and rng.random() < 0.8:
+        phone['areaCode'] = city[5]
+    phone['number'] = rng.randrange(10000000, 100000000)
+    return phone
+
+
+def generate_entry(
+    seed: int,
+    i: int,
+    rng: Optional[random.Random] = None
+) -> Dict:
+    '''Entry i of the data set of seed, made with rng (reseeded) if given.'''
+    if rng is None:
+        rng = random.Random()
+    # Reseeding is half the cost of making a generator
+    rng.seed(seed * 0x100000000 + i)
+
+    given, given_ascii = rng.choice(GIVEN_NAMES)
+    family, family_ascii = rng.choice(FAMILY_NAMES)
+    entry: Dict = {'name': '{} {}'.format(given, family)}
+
+    home = CITIES[_pick(rng, _CITY_CUM_WEIGHTS)]
+    cities = [home]
+    addresses = []
+    for j in range(_pick(rng, _ADDRESSES_CUM_WEIGHTS)):
+        # Mostly in the same city
+        city = home if rng.random() < 0.7 else CITIES[
+            _pick(rng, _CITY_CUM_WEIGHTS)
+        ]
+        cities.append(city)
+        addresses.append(_address(rng, city, 'home' if j == 0 else 'work'))
+    if addresses:
+        entry['addresses'] = addresses
+
+    for field, cum_weights in [
+        ('phoneNumbers', _PHONES_CUM_WEIGHTS),
+        ('faxNumbers', _FAXES_CUM_WEIGHTS),
+    ]:
+        phones = [
+            _phone(rng, rng.choice(cities), rng.choice(['home', 'work']))
+            for _ in range(_pick(rng, cum_weights))
+        ]
+        if phones:
+            entry[field] = phones
+
+    emails = []
+    for j in range(_pick(rng, _EMAILS_CUM_WEIGHTS)):
+        domain, _, kind = EMAIL_DOMAINS[_pick(rng, _DOMAIN_CUM_WEIGHTS)]
+        local = '{}{}{}'.format(
+            given_ascii, rng.choice(['.', '_', '']), family_ascii
+        )
+        if j or rng.random() < 0.5:
+            local += str(rng.randrange(1, 1000))
+        emails.append({'kind': kind, 'value': local + '@' + domain})
+    if emails:
+        entry['emails'] = emails
+
+    return entry
+
+
+def generate_entries(
+    count: int,
+    seed: int = 0,
+    start: int = 0
+) -> Iterator[Tuple[str, Dict]]:
+    '''(nickname, entry) of entries start to start + count, in order.'''
+    rng = random.Random()
+    for i in range(start, start + count):
+        yield NICKNAME_FORMAT_STR.format(i), generate_entry(seed, i, rng)
+
+
+def write_ndjson(f: TextIO, entries: Iterator[Tuple[str, Dict]]) -> int:
+    '''Writes entries as POST /addressbook/_bulk lines, returns count.'''
+    count = 0
+    for nickname, entry in entries:
+        f.write(json.dumps(
+            {'nickname': nickname, 'address': entry}, ensure_ascii=False
+        ))
+        f.write('\n')
+        count += 1
+    return count
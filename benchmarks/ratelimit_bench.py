@@ -0,0 +1,102 @@
+# Copyright (c) 2019. All rights reserved.
+
+'''
+Rate limiter overhead: cost of a check with many distinct clients, cost of
+sweeping idle buckets, and request throughput of the app with and without
+rate limiting (with limits high enough never to reject).
+'''
+
+import argparse
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from tornado.httpclient import AsyncHTTPClient
+
+from addrservice.ratelimit import RateLimiter
+
+from benchmarks.common import AppServer, make_config, print_table, Timer
+
+RATE_LIMIT_CONFIG = {
+    'rules': [
+        {'path': '/addressbook/?$', 'methods': ['POST'], 'rate': 1e6},
+        {'path': '/', 'rate': 1e6},
+    ],
+}
+
+
+def measure_check(clients: int, checks: int) -> Dict[str, float]:
+    limiter = RateLimiter.from_config(RATE_LIMIT_CONFIG)
+    keys = ['ip:10.0.{}.{}'.format(i // 256, i % 256) for i in range(clients)]
+
+    with Timer() as t:
+        for i in range(checks):
+            limiter.check('GET', '/addressbook', keys[i % clients], now=i)
+    check_us = t.elapsed / checks * 1e6
+
+    # All idle by then
+    with Timer() as t:
+        limiter.sweep(now=checks + 1e6)
+    return {'check-us': check_us, 'sweep-ms': t.elapsed * 1e3}
+
+
+async def measure_requests(
+    rate_limit: Optional[Dict[str, Any]],
+    requests: int,
+    concurrency: int
+) -> float:
+    config = make_config() if rate_limit is None else make_config(
+        rate_limit=rate_limit
+    )
+    client = AsyncHTTPClient(force_instance=True, max_clients=concurrency)
+
+    with AppServer(config) as server:
+        url = server.url('/healthz')
+
+        async def worker(n: int) -> None:
+            for _ in range(n):
+                await client.fetch(url)
+
+        with Timer() as t:
+            await asyncio.gather(*[
+                worker(requests // concurrency) for _ in range(concurrency)
+            ])
+
+    client.close()
+    return requests / t.elapsed
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--checks', type=int, default=200000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=20)
+    opts = parser.parse_args(args)
+
+    rows: List[Any] = []
+    for clients in [1, 1000, 100000]:
+        r = measure_check(clients, opts.checks)
+        rows.append((clients, r['check-us'], r['sweep-ms']))
+    print_table(
+        'Rate limiter: check cost (us), and sweep of all clients (ms)',
+        ['clients', 'check-us', 'sweep-ms'],
+        rows
+    )
+
+    loop = asyncio.get_event_loop()
+    rows = []
+    for name, rate_limit in [('off', None), ('on', RATE_LIMIT_CONFIG)]:
+        rps = loop.run_until_complete(
+            measure_requests(rate_limit, opts.requests, opts.concurrency)
+        )
+        rows.append((name, rps))
+    print_table(
+        'GET /healthz throughput, {} concurrent clients'.format(
+            opts.concurrency
+        ),
+        ['rate-limit', 'requests/s'],
+        rows
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+# Copyright (c) 2019. All rights reserved.
+
+'''
+Trigram search index: build time and top-k query latency, for exact,
+partial and misspelt names. Use --entries 1000000 for the 1M measurement.
+'''
+
+import argparse
+import random
+from typing import Dict, List, Optional
+
+from addrservice.search import TrigramIndex
+
+from benchmarks.common import percentiles, print_table, Timer
+
+SYLLABLES = [
+    'ra', 'hul', 'na', 'ren', 'dra', 'mo', 'di', 'san', 'jay', 'pri',
+    'ya', 'an', 'ja', 'li', 'vi', 'kas', 'su', 'nil', 'de', 'vi',
+    'ka', 'mal', 'ro', 'han', 'shi', 'va', 'ar', 'jun', 'me', 'ta',
+]
+
+CITIES = [
+    'New Delhi', 'Mumbai', 'Bengaluru', 'Chennai', 'Kolkata', 'Varanasi',
+    'Pune', 'Hyderabad', 'Jaipur', 'Lucknow', 'Ahmedabad', 'Bhopal',
+]
+
+
+def random_word(rng: random.Random) -> str:
+    return ''.join(
+        rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))
+    ).capitalize()
+
+
+def random_entry(rng: random.Random) -> Dict:
+    return {
+        'name': '{} {}'.format(random_word(rng), random_word(rng)),
+        'addresses': [{
+            'kind': 'home',
+            'streetName': random_word(rng) + ' Road',
+            'locality': random_word(rng),
+            'city': rng.choice(CITIES),
+            'pincode': rng.randint(110000, 860000),
+            'country': 'India',
+        }],
+    }
+
+
+def misspell(rng: random.Random, text: str) -> str:
+    i = rng.randrange(len(text))
+    return text[:i] + text[i + 1:]
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--entries', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    opts = parser.parse_args(args)
+
+    rng = random.Random(opts.seed)
+    entries = [random_entry(rng) for _ in range(opts.entries)]
+
+    index = TrigramIndex()
+    with Timer() as build:
+        for i, entry in enumerate(entries):
+            index.add(str(i), entry)
+
+    query_kinds = {
+        'exact': lambda name: name,
+        'partial': lambda name: name.split()[0][:5],
+        'misspelt': lambda name: misspell(rng, name),
+    }
+
+    rows = []
+    for kind, make_query in query_kinds.items():
+        latencies = []
+        for _ in range(opts.queries):
+            query = make_query(rng.choice(entries)['name'])
+            with Timer() as t:
+                index.search(query, opts.k)
+            latencies.append(t.elapsed * 1e3)
+        p = percentiles(latencies)
+        rows.append((kind, p['p50'], p['p90'], p['p99'], p['max']))
+
+    print_table(
+        'Trigram search, {} entries, {} trigrams, built in {:.1f}s: '
+        'top-{} latency (ms)'.format(
+            len(index), len(index.postings), build.elapsed, opts.k
+        ),
+        ['query', 'p50', 'p90', 'p99', 'max'],
+        rows
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# Copyright (c) 2019. All rights reserved.
+
+'''
+Cold start of an address book: loading entries into the in-memory DB (each
+validated on create) vs. opening a memory mapped snapshot of them, and the
+latency of reads from each.
+'''
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+from typing import List, Optional
+
+from addrservice.addressbook_db import (
+    AbstractAddressBookDB,
+    InMemoryAddressBookDB,
+    SnapshotAddressBookDB,
+)
+from addrservice.snapshot import write_snapshot
+
+from benchmarks.common import percentiles, print_table, Timer
+from benchmarks.datagen import generate_entries
+
+
+async def read_latencies(
+    addr_db: AbstractAddressBookDB,
+    nicknames: List[str],
+) -> List[float]:
+    latencies = []
+    for nickname in nicknames:
+        with Timer() as t:
+            await addr_db.read_address(nickname)
+        latencies.append(t.elapsed * 1e6)
+    return latencies
+
+
+async def measure(entries: int, reads: int, seed: int) -> None:
+    rng = random.Random(seed)
+    data = dict(generate_entries(entries, seed))
+    nicknames = [rng.choice(list(data)) for _ in range(reads)]
+
+    memory_db = InMemoryAddressBookDB()
+    with Timer() as memory_load:
+        for nickname, addr in data.items():
+            await memory_db.create_address(addr, nickname)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'addressbook.snap')
+        with Timer() as export:
+            write_snapshot(path, data)
+
+        with Timer() as snapshot_load:
+            snapshot_db = SnapshotAddressBookDB(path)
+
+        rows = []
+        for name, addr_db, load in [
+            ('memory', memory_db, memory_load),
+            ('snapshot', snapshot_db, snapshot_load),
+        ]:
+            p = percentiles(await read_latencies(addr_db, nicknames))
+            rows.append((name, load.elapsed, p['p50'], p['p99'], p['max']))
+        snapshot_db.stop()
+
+        print_table(
+            'Cold start, {} entries (snapshot of {:.1f} MB exported in '
+            '{:.2f}s): load time (s), read latency (us)'.format(
+                entries, os.path.getsize(path) / 2**20, export.elapsed
+            ),
+            ['db', 'load', 'p50', 'p99', 'max'],
+            rows
+        )
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--entries', type=int, default=5000)
+    parser.add_argument('--reads', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=42)
+    opts = parser.parse_args(args)
+
+    asyncio.get_event_loop().run_until_complete(
+        measure(opts.entries, opts.reads, opts.seed)
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+# Copyright (c) 2019. All rights reserved.
+
+'''
+SQL write throughput and latency with concurrent writers, one round trip
+per write vs. write-behind batches, against a fake connector with a small
+connection pool that sleeps for a round trip latency plus a small cost per
+statement. Validation is skipped, to measure the DB path alone.
+'''
+
+import argparse
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from addrservice.addressbook_db import SQLAddressBookDB
+
+from benchmarks.common import percentiles, print_table, sample_address, Timer
+
+WRITE_BATCH_CONFIGS: Dict[str, Optional[Dict[str, Any]]] = {
+    'unbatched': None,
+    'commit': {'max-delay': 0.002, 'max-rows': 100},
+    'buffered': {
+        'max-delay': 0.002, 'max-rows': 100, 'durability': 'buffered'
+    },
+}
+
+
+class FakeSQLConnector:
+    def __init__(
+        self,
+        latency: float,
+        statement_cost: float,
+        connections: int
+    ) -> None:
+        self.latency = latency
+        self.statement_cost = statement_cost
+        self.pool = asyncio.Semaphore(connections)
+        self.round_trips = 0
+
+    async def execute(self, query: str) -> Any:
+        async with self.pool:
+            self.round_trips += 1
+            await asyncio.sleep(
+                self.latency + self.statement_cost * query.count(';')
+            )
+        return None
+
+
+async def measure(
+    write_batch: Optional[Dict[str, Any]],
+    writers: int,
+    writes: int,
+    latency: float,
+    connections: int,
+) -> Dict[str, Any]:
+    addr_db = SQLAddressBookDB(write_batch=write_batch)
+    connector = FakeSQLConnector(latency, latency / 100, connections)
+    addr_db.db_connector = connector  # type: ignore
+    addr_db.validate_address = lambda addr: None  # type: ignore
+    addr = sample_address()
+    latencies: List[float] = []
+
+    async def writer(w: int) -> None:
+        for i in range(writes):
+            nickname = '{}-{}'.format(w, i)
+            with Timer() as t:
+                await addr_db.create_address(addr, nickname)
+                await addr_db.update_address(nickname, addr)
+            latencies.append(t.elapsed * 1e3)
+
+    with Timer() as total:
+        await asyncio.gather(*[writer(w) for w in range(writers)])
+        if addr_db.write_batcher is not None:
+            await addr_db.write_batcher.flush()
+
+    return {
+        'writes/s': 2 * writers * writes / total.elapsed,
+        'round-trips': connector.round_trips,
+        'latency': percentiles(latencies),
+    }
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--writers', type=int, default=100)
+    parser.add_argument('--writes', type=int, default=20)
+    parser.add_argument(
+        '--latency', type=float, default=0.002,
+        help='round trip latency in seconds, default: %(default)s'
+    )
+    parser.add_argument('--connections', type=int, default=4)
+    opts = parser.parse_args(args)
+
+    loop = asyncio.get_event_loop()
+    rows = []
+    for name, write_batch in WRITE_BATCH_CONFIGS.items():
+        r = loop.run_until_complete(
+            measure(
+                write_batch, opts.writers, opts.writes, opts.latency,
+                opts.connections
+            )
+        )
+        p = r['latency']
+        rows.append((
+            name, r['writes/s'], r['round-trips'], p['p50'], p['p99']
+        ))
+
+    print_table(
+        'SQL writes (create + update per entry), {} writers, {} connections, '
+        '{:.1f} ms round trip: throughput, round trips, latency (ms)'.format(
+            opts.writers, opts.connections, opts.latency * 1e3
+        ),
+        ['mode', 'writes/s', 'round-trips', 'p50', 'p99'],
+        rows
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,531 @@
+# Copyright (c) 2019. All rights reserved.
+
+'''
+Concurrency stress test: hundreds of coroutines running interleaved
+creates, reads, updates and deletes of a few shared entries, against each
+address book DB backend, and against the app (make_addrservice_app) over
+HTTP.
+
+Each operation is recorded with its invocation and completion, and the
+history of each entry is checked to be linearizable, i.e. the same as
+some order of the operations, one at a time, that respects their real
+time order: no lost updates, no stale or phantom reads, no duplicate
+creates. After the run, the change log, pincode index, aggregates and
+the listener indexes of the backend are checked against its entries.
+
+Reports throughput and latency, and the violations found, if any.
+'''
+
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import tempfile
+from typing import (
+    Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple,
+)
+
+from addrservice.addressbook_db import (
+    AbstractAddressBookDB,
+    InMemoryAddressBookDB,
+    ShardedAddressBookDB,
+    SnapshotAddressBookDB,
+    TieredAddressBookDB,
+    WRITE_BACK,
+)
+from addrservice.aggregates import Aggregates, entry_counts
+from addrservice.changelog import OP_DELETE
+from addrservice.dedup import DedupIndex
+from addrservice.pincode_index import entry_pincodes, PincodeIndex
+from addrservice.search import TrigramIndex
+from addrservice.service import AddressBookService
+from addrservice.snapshot import write_snapshot
+from addrservice.workers import WorkerPool
+
+from benchmarks.common import (
+    AppServer,
+    make_config,
+    percentiles,
+    print_table,
+    Timer,
+)
+from benchmarks.datagen import generate_entry
+
+CREATE = 'create'
+READ = 'read'
+UPDATE = 'update'
+DELETE = 'delete'
+
+# Weights of operations, mostly reads
+DEFAULT_MIX = {CREATE: 2, READ: 5, UPDATE: 2, DELETE: 1}
+
+NICKNAME_FORMAT_STR = 'stress-{:03d}'
+
+# Value of a register: version of the entry, None if there is none
+State = Optional[int]
+
+
+class Operation(NamedTuple):
+    nickname: str
+    kind: str
+    # Written by create and update
+    version: Optional[int]
+    # Read: version read (None if missing). Others: whether it succeeded
+    # (False on KeyError, i.e. the entry existed for a create and didn't
+    # for an update or delete)
+    result: Any
+    # Logical times of invocation and completion
+    start: int
+    end: int
+
+
+class History:
+    '''Operations, with their order in real time.'''
+
+    def __init__(self) -> None:
+        self.operations: List[Operation] = []
+        self.errors: List[str] = []
+        self.latencies: List[float] = []
+        self.clock = 0
+
+    def tick(self) -> int:
+        self.clock += 1
+        return self.clock
+
+    async def run(
+        self,
+        addr_db: AbstractAddressBookDB,
+        kind: str,
+        nickname: str,
+        version: Optional[int] = None,
+        seed: int = 0
+    ) -> None:
+        result: Any = True
+        start = self.tick()
+        with Timer() as t:
+            try:
+                if kind == READ:
+                    result = entry_version(
+                        await addr_db.read_address(nickname)
+                    )
+                elif kind == CREATE:
+                    await addr_db.create_address(
+                        versioned_entry(seed, version), nickname
+                    )
+                elif kind == UPDATE:
+                    await addr_db.update_address(
+                        nickname, versioned_entry(seed, version)
+                    )
+                else:
+                    await addr_db.delete_address(nickname)
+            except KeyError:
+                result = None if kind == READ else False
+            except Exception as e:
+                # Outcome unknown, not checked
+                self.errors.append('{} {}: {!r}'.format(kind, nickname, e))
+                return
+        self.operations.append(
+            Operation(nickname, kind, version, result, start, self.tick())
+        )
+        self.latencies.append(t.elapsed * 1e3)
+
+
+def versioned_entry(seed: int, version: Optional[int]) -> Dict:
+    '''Entry with the version in its name, each version different.'''
+    entry = generate_entry(seed, version or 0)
+    entry['name'] += ' #{}'.format(version)
+    return entry
+
+
+def entry_version(entry: Dict) -> int:
+    return int(entry['name'].rsplit('#', 1)[1])
+
+
+def _step(state: State, op: Operation) -> Tuple[bool, State]:
+    '''Whether op returns its result in state, and the state after it.'''
+    if op.kind == READ:
+        return op.result == state, state
+    exists = state is not None
+    if op.kind == CREATE:
+        return (not exists, op.version) if op.result else (exists, state)
+    if op.kind == UPDATE:
+        return (exists, op.version) if op.result else (not exists, state)
+    return (exists, None) if op.result else (not exists, state)
+
+
+def _segments(operations: List[Operation]) -> List[List[Operation]]:
+    '''
+    Operations by start, split where all before completed before all after
+    started: each segment is linearized after the previous one.
+    '''
+    segments: List[List[Operation]] = []
+    last_end = 0
+    for op in sorted(operations, key=lambda op: op.start):
+        if not segments or op.start > last_end:
+            segments.append([])
+        segments[-1].append(op)
+        last_end = max(last_end, op.end)
+    return segments
+
+
+def _final_states(
+    ops: List[Operation],
+    initial: State,
+    max_states: int
+) -> Set[State]:
+    '''
+    States after all of ops (sorted by start) in any linearizable order,
+    searched depth first: an operation can go next if it started before
+    every remaining one completed. Visited (done, state) are not revisited,
+    and operations that don't change the state go first.
+    '''
+    full = (1 << len(ops)) - 1
+    finals: Set[State] = set()
+    seen: Set[Tuple[int, State]] = set()
+    stack = [(0, initial)]
+    while stack:
+        done, state = stack.pop()
+        if (done, state) in seen:
+            continue
+        seen.add((done, state))
+        if len(seen) > max_states:
+            raise RuntimeError('More than {} states'.format(max_states))
+        if done == full:
+            finals.add(state)
+            continue
+
+        remaining = [i for i in range(len(ops)) if not done >> i & 1]
+        horizon = min(ops[i].end for i in remaining)
+        candidates: List[Tuple[int, State]] = []
+        for i in remaining:
+            if ops[i].start > horizon:
+                break
+            ok, next_state = _step(state, ops[i])
+            if ok and next_state == state:
+                # Leaves the state as is, so going next is never worse
+                # than later: no need to try the others.
+                candidates = [(i, state)]
+                break
+            if ok:
+                candidates.append((i, next_state))
+        for i, next_state in candidates:
+            stack.append((done | 1 << i, next_state))
+    return finals
+
+
+def check_linearizable(
+    operations: List[Operation],
+    initial: State = None,
+    max_states: int = 100000
+) -> Optional[str]:
+    '''
+    None if the operations of an entry are linearizable from its initial
+    state, else a description of the first segment that is not.
+    '''
+    states: Set[State] = {initial}
+    for segment in _segments(operations):
+        next_states: Set[State] = set()
+        try:
+            for state in states:
+                next_states |= _final_states(segment, state, max_states)
+        except RuntimeError as e:
+            return 'Too concurrent to check ({}): {}'.format(e, segment)
+        if not next_states:
+            return 'Not linearizable from versions {}: {}'.format(
+                sorted(states, key=str), segment
+            )
+        states = next_states
+    return None
+
+
+def check_history(
+    history: History,
+    initial: Optional[Dict[str, int]] = None
+) -> List[str]:
+    initial = initial or {}
+    by_nickname: Dict[str, List[Operation]] = {}
+    for op in history.operations:
+        by_nickname.setdefault(op.nickname, []).append(op)
+
+    violations = list(history.errors)
+    for nickname, ops in sorted(by_nickname.items()):
+        error = check_linearizable(ops, initial.get(nickname))
+        if error is not None:
+            violations.append('{}: {}'.format(nickname, error))
+    return violations
+
+
+# Listener indexes, and the attributes that must be the same as those of
+# the index made from scratch of the same entries.
+INDEX_STATE: Dict[type, Tuple[str, ...]] = {
+    PincodeIndex: ('keys', 'entry_pincodes'),
+    TrigramIndex: ('entry_trigrams', 'postings'),
+    DedupIndex: ('fingerprints', 'nicknames'),
+}
+
+
+def check_index(name: str, index: Any, entries: Dict[str, Dict]) -> List[str]:
+    if isinstance(index, DedupIndex):
+        fresh = DedupIndex(index.policy, index.fields)
+    else:
+        fresh = type(index)()
+    for nickname, addr in entries.items():
+        fresh.add(nickname, addr)
+
+    return [
+        '{} index: {} differs from the entries'.format(name, attr)
+        for attr in INDEX_STATE[type(index)]
+        if getattr(index, attr) != getattr(fresh, attr)
+    ]
+
+
+async def check_invariants(
+    addr_db: AbstractAddressBookDB,
+    initial: Optional[Dict[str, Dict]] = None,
+    service: Optional[AddressBookService] = None
+) -> List[str]:
+    '''
+    Violations of the invariants of a quiescent address book: its change
+    log, pincode queries, aggregates and indexes agree with its entries.
+    '''
+    violations = []
+    entries = dict(await addr_db.read_all_addresses())
+
+    changelog = addr_db.changelog
+    if changelog.first_seq == 1:
+        replayed: Dict[str, Optional[Dict]] = dict(initial or {})
+        for change in changelog.since(0):
+            if change.op == OP_DELETE:
+                replayed.pop(change.nickname, None)
+            else:
+                replayed[change.nickname] = change.address
+        if replayed != entries:
+            violations.append('Change log differs from the entries')
+
+    pincodes = {
+        nickname: addr for nickname, addr in entries.items()
+        if entry_pincodes(addr)
+    }
+    if pincodes:
+        all_pincodes = [
+            p for addr in pincodes.values() for p in entry_pincodes(addr)
+        ]
+        found = await addr_db.read_addresses_by_pincode(
+            min(all_pincodes), max(all_pincodes)
+        )
+        if dict(found) != pincodes:
+            violations.append('Pincode query differs from the entries')
+
+    aggregates = Aggregates()
+    for addr in entries.values():
+        aggregates.add(entry_counts(addr))
+    if await addr_db.read_aggregates() != aggregates.to_dict():
+        violations.append('Aggregates differ from the entries')
+
+    indexes = [('pincode', getattr(addr_db, 'pincode_index', None))]
+    if service is not None:
+        indexes += [
+            ('search', service.search_index), ('dedup', service.dedup)
+        ]
+    for name, index in indexes:
+        if type(index) in INDEX_STATE:
+            violations += check_index(name, index, entries)
+    return violations
+
+
+class StressResult(NamedTuple):
+    operations: int
+    elapsed: float
+    latencies: List[float]
+    violations: List[str]
+
+
+async def stress(
+    addr_db: AbstractAddressBookDB,
+    workers: int = 200,
+    ops: int = 20,
+    entries: int = 100,
+    mix: Optional[Dict[str, int]] = None,
+    seed: int = 0,
+    initial: Optional[Dict[str, Dict]] = None,
+) -> StressResult:
+    '''
+    Runs workers coroutines, each doing ops random operations (weighted by
+    mix) on random ones of entries nicknames, then reads each entry, and
+    checks the history. initial: entries already in addr_db, if any.
+    '''
+    mix = mix or DEFAULT_MIX
+    kinds = list(mix)
+    weights = list(itertools.accumulate(mix.values()))
+    nicknames = [NICKNAME_FORMAT_STR.format(i) for i in range(entries)]
+    history = History()
+    # Versions of the initial entries are left alone
+    versions = itertools.count(1 + max(
+        [entry_version(a) for a in (initial or {}).values()], default=0
+    ))
+
+    async def worker(rng: random.Random) -> None:
+        for _ in range(ops):
+            kind = rng.choices(kinds, cum_weights=weights)[0]
+            version = next(versions) if kind in (CREATE, UPDATE) else None
+            await history.run(
+                addr_db, kind, rng.choice(nicknames), version, seed
+            )
+
+    with Timer() as t:
+        await asyncio.gather(*[
+            worker(random.Random(seed * 100003 + i)) for i in range(workers)
+        ])
+    for nickname in nicknames:
+        await history.run(addr_db, READ, nickname)
+
+    violations = check_history(history, {
+        nickname: entry_version(addr)
+        for nickname, addr in (initial or {}).items()
+    })
+    return StressResult(
+        len(history.operations), t.elapsed, history.latencies, violations
+    )
+
+
+# App nodes: validation offloaded to threads, so that even in-memory
+# writes yield to other requests
+NODE_SECTIONS: Dict[str, Any] = {
+    'search': None,
+    'dedup': None,
+    'workers': {'kind': 'thread', 'offload-thresholds': {'validate': 0}},
+}
+
+
+# Backends of the DB, made for a number of entries; each is also run with
+# validation offloaded to a thread pool (name + OFFLOADED), so that writes
+# yield to other coroutines half way through.
+DB_BACKENDS: Dict[str, Callable[[int], AbstractAddressBookDB]] = {
+    'memory': lambda entries: InMemoryAddressBookDB(),
+    'tiered-write-through': lambda entries: TieredAddressBookDB(
+        InMemoryAddressBookDB(), capacity=entries // 2
+    ),
+    'tiered-write-back': lambda entries: TieredAddressBookDB(
+        InMemoryAddressBookDB(), capacity=entries // 2,
+        write_policy=WRITE_BACK, flush_interval=0.01,
+        max_dirty=entries // 4
+    ),
+}
+OFFLOADED = '-offloaded'
+
+# The SQL backend needs a DB (SomeSQLdbConnector is a stub), not included.
+BACKENDS = list(DB_BACKENDS) + [name + OFFLOADED for name in DB_BACKENDS] + [
+    'snapshot', 'app', 'sharded',
+]
+
+
+async def run_backend(
+    name: str,
+    workers: int,
+    ops: int,
+    entries: int,
+    seed: int
+) -> StressResult:
+    '''Stress of a backend, checked, and its invariants.'''
+    if name == 'snapshot':
+        # Read only
+        initial = {
+            NICKNAME_FORMAT_STR.format(i): versioned_entry(seed, i)
+            for i in range(entries)
+        }
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'addressbook.snap')
+            write_snapshot(path, initial)
+            addr_db: AbstractAddressBookDB = SnapshotAddressBookDB(path)
+            result = await stress(
+                addr_db, workers, ops, entries, {READ: 1}, seed, initial
+            )
+            violations = await check_invariants(addr_db, initial)
+            addr_db.stop()
+        return result._replace(violations=result.violations + violations)
+
+    if name in ('app', 'sharded'):
+        # The app over HTTP, through a router of 1 or 2 nodes
+        nodes = [
+            AppServer(make_config(**NODE_SECTIONS))
+            for _ in range(1 if name == 'app' else 2)
+        ]
+        for node in nodes:
+            node.__enter__()
+        router = ShardedAddressBookDB([node.url('') for node in nodes])
+        try:
+            result = await stress(router, workers, ops, entries, seed=seed)
+            violations = await check_invariants(router)
+            for node in nodes:
+                violations += await check_invariants(
+                    node.service.addr_db, service=node.service
+                )
+        finally:
+            router.stop()
+            for node in nodes:
+                node.__exit__(None, None, None)
+        return result._replace(violations=result.violations + violations)
+
+    offloaded = name.endswith(OFFLOADED)
+    addr_db = DB_BACKENDS[name[:-len(OFFLOADED)] if offloaded else name](
+        entries
+    )
+    if offloaded:
+        # Writes yield while validating
+        worker_pool = WorkerPool(thresholds={'validate': 0})
+        worker_pool.start()
+        addr_db.set_worker_pool(worker_pool)
+    addr_db.start()
+    try:
+        result = await stress(addr_db, workers, ops, entries, None, seed)
+        violations = await check_invariants(addr_db)
+    finally:
+        addr_db.stop()
+        if addr_db.worker_pool is not None:
+            addr_db.worker_pool.stop()
+    return result._replace(violations=result.violations + violations)
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--backends', nargs='*', choices=BACKENDS)
+    parser.add_argument('--workers', type=int, default=200)
+    parser.add_argument('--ops', type=int, default=20)
+    parser.add_argument('--entries', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    opts = parser.parse_args(args)
+
+    rows = []
+    failures: List[Tuple[str, List[str]]] = []
+    loop = asyncio.get_event_loop()
+    for name in opts.backends or BACKENDS:
+        result = loop.run_until_complete(run_backend(
+            name, opts.workers, opts.ops, opts.entries, opts.seed
+        ))
+        p = percentiles(result.latencies)
+        rows.append((
+            name, result.operations, result.operations / result.elapsed,
+            p['p50'], p['p99'], len(result.violations)
+        ))
+        if result.violations:
+            failures.append((name, result.violations))
+
+    print_table(
+        '{} workers x {} operations on {} entries: throughput (ops/s), '
+        'latency (ms), violations'.format(
+            opts.workers, opts.ops, opts.entries
+        ),
+        ['backend', 'ops', 'ops/s', 'p50', 'p99', 'violations'],
+        rows
+    )
+    for name, violations in failures:
+        print('\n{}:'.format(name))
+        for v in violations[:10]:
+            print('  ' + v)
+        if len(violations) > 10:
+            print('  ... {} more'.format(len(violations) - 10))
+
+
+if __name__ == '__main__':
+    main()
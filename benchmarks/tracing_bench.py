@@ -0,0 +1,130 @@
+# Copyright (c) 2019. All rights reserved.
+
+'''
+Trace decorator overhead per call of a trivial function, sync and async:
+untraced, traced without collectors, and with a profiler, both through the
+previous decorator (a span callback per collector per call) and the
+current one (timing collectors fed by function id); and with a timeline,
+all calls vs. sampled ones.
+'''
+
+import argparse
+import asyncio
+from functools import wraps
+from typing import Callable, List, Optional, Sequence
+
+from addrservice.tracing import (
+    AbstractTraceCollector,
+    CummulativeFunctionTimeProfiler,
+    FunctionTimeProfiler,
+    Sampler,
+    set_sampler,
+    Timeline,
+    trace,
+)
+
+from benchmarks.common import print_table, Timer
+
+
+def previous_trace(collectors: Sequence[AbstractTraceCollector]):
+    '''The trace decorator before timing collectors, for comparison.'''
+    def tracing_decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def with_async_tracing(*args, **kwargs):
+                span_callbacks = [x.create_span(func) for x in collectors]
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    for f in span_callbacks:
+                        f()
+            return with_async_tracing
+
+        @wraps(func)
+        def with_tracing(*args, **kwargs):
+            span_callbacks = [x.create_span(func) for x in collectors]
+            try:
+                return func(*args, **kwargs)
+            finally:
+                for f in span_callbacks:
+                    f()
+        return with_tracing
+    return tracing_decorator
+
+
+def noop(i: int) -> int:
+    return i
+
+
+async def async_noop(i: int) -> int:
+    return i
+
+
+def measure_sync(func: Callable, calls: int) -> float:
+    with Timer() as t:
+        for i in range(calls):
+            func(i)
+    return t.elapsed / calls * 1e9
+
+
+def measure_async(func: Callable, calls: int) -> float:
+    async def run() -> None:
+        for i in range(calls):
+            await func(i)
+
+    loop = asyncio.new_event_loop()
+    try:
+        with Timer() as t:
+            loop.run_until_complete(run())
+    finally:
+        loop.close()
+    return t.elapsed / calls * 1e9
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=200000)
+    opts = parser.parse_args(args)
+
+    cases = [
+        ('untraced', lambda f: f),
+        ('previous, no collectors', previous_trace([])),
+        ('current, no collectors', trace([])),
+        ('previous, cummulative profiler',
+         previous_trace([CummulativeFunctionTimeProfiler()])),
+        ('current, cummulative profiler',
+         trace([CummulativeFunctionTimeProfiler()])),
+        ('current, function time profiler',
+         trace([FunctionTimeProfiler()])),
+        ('current, timeline', trace([Timeline()])),
+        ('current, timeline, 1% sampled', trace([Timeline()])),
+        ('current, timeline, max 1000/s', trace([Timeline()])),
+    ]
+    samplers = {
+        'current, timeline, 1% sampled': Sampler(rate=0.01),
+        'current, timeline, max 1000/s': Sampler(max_per_second=1000),
+    }
+
+    rows = []
+    untraced = None
+    for name, decorator in cases:
+        set_sampler(samplers.get(name))
+        sync_ns = measure_sync(decorator(noop), opts.calls)
+        async_ns = measure_async(decorator(async_noop), opts.calls)
+        set_sampler(None)
+        if untraced is None:
+            untraced = (sync_ns, async_ns)
+        rows.append((
+            name, sync_ns, sync_ns - untraced[0],
+            async_ns, async_ns - untraced[1]
+        ))
+
+    print_table(
+        'Trace decorator cost per call (ns)',
+        ['decorator', 'sync', 'sync overhead', 'async', 'async overhead'],
+        rows
+    )
+
+
+if __name__ == '__main__':
+    main()
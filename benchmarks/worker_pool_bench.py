@@ -0,0 +1,119 @@
+# Copyright (c) 2019. All rights reserved.
+
+'''
+Latency of small GETs while large POSTs are in flight, with validation and
+serialization inline on the event loop vs. offloaded to a worker pool.
+'''
+
+import argparse
+import asyncio
+import json
+from typing import Any, Dict, List, Optional
+
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+
+from benchmarks.common import (
+    AppServer,
+    large_address,
+    make_config,
+    percentiles,
+    print_table,
+    sample_address,
+)
+
+WORKER_CONFIGS: Dict[str, Optional[Dict[str, Any]]] = {
+    'inline': None,
+    'thread': {'kind': 'thread', 'max-workers': 4},
+    'process': {'kind': 'process', 'max-workers': 4},
+}
+
+
+async def measure(
+    workers: Optional[Dict[str, Any]],
+    duration: float,
+    readers: int,
+    writers: int,
+    entry_size: int,
+) -> Dict[str, Any]:
+    config = make_config() if workers is None else make_config(
+        workers=workers
+    )
+    client = AsyncHTTPClient(force_instance=True, max_clients=1000)
+    loop = asyncio.get_event_loop()
+    large_body = json.dumps(large_address(entry_size))
+    latencies: List[float] = []
+    writes = 0
+
+    with AppServer(config) as server:
+        r = await client.fetch(
+            server.url('/addressbook'),
+            method='POST',
+            body=json.dumps(sample_address())
+        )
+        small_url = server.url(r.headers['Location'])
+        end = loop.time() + duration
+
+        async def reader() -> None:
+            while loop.time() < end:
+                start = loop.time()
+                await client.fetch(small_url)
+                latencies.append((loop.time() - start) * 1e3)
+
+        async def writer() -> None:
+            nonlocal writes
+            while loop.time() < end:
+                try:
+                    await client.fetch(
+                        server.url('/addressbook'),
+                        method='POST',
+                        body=large_body,
+                        request_timeout=60
+                    )
+                    writes += 1
+                except HTTPClientError:
+                    pass
+
+        await asyncio.gather(
+            *[reader() for _ in range(readers)],
+            *[writer() for _ in range(writers)]
+        )
+
+    client.close()
+    result = percentiles(latencies)
+    result['reads'] = len(latencies)
+    result['writes'] = writes
+    return result
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--duration', type=float, default=3.0)
+    parser.add_argument('--readers', type=int, default=20)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument(
+        '--entry-size', type=int, default=2000,
+        help='addresses per large entry, default: %(default)s'
+    )
+    opts = parser.parse_args(args)
+
+    loop = asyncio.get_event_loop()
+    rows = []
+    for name, workers in WORKER_CONFIGS.items():
+        r = loop.run_until_complete(measure(
+            workers, opts.duration, opts.readers, opts.writers,
+            opts.entry_size
+        ))
+        rows.append((
+            name, r['reads'], r['writes'],
+            r['p50'], r['p90'], r['p99'], r['max']
+        ))
+
+    print_table(
+        'Small GET latency (ms) under concurrent large POSTs',
+        ['mode', 'reads', 'writes', 'p50', 'p90', 'p99', 'max'],
+        rows
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,19 @@
 #!/usr/bin/env python
 
 import argparse
+import glob
+import importlib
+import json
 import os
 import subprocess
-from typing import List
+import sys
+from typing import Dict, List, Tuple
 import unittest
+import urllib.error
+import urllib.request
 
 SOURCE_CODE = ['addrservice']
-TEST_CODE = ['tests']
+TEST_CODE = ['tests', 'benchmarks']
 ALL_CODE = SOURCE_CODE + TEST_CODE
 
 
@@ -58,6 +64,69 @@ def arg_parser() -> argparse.ArgumentParser:
         help='turn on verbose output'
     )
 
+    bench_cmd_parser = subparsers.add_parser('bench')
+    bench_cmd_parser.add_argument(
+        'names',
+        nargs='*',
+        help='benchmarks to run (e.g. worker_pool), default: all'
+    )
+
+    snapshot_cmd_parser = subparsers.add_parser(
+        'snapshot',
+        help='export and import address book snapshots'
+    )
+    snapshot_cmd_parser.add_argument(
+        'action',
+        choices=['export', 'import'],
+        help='export: entries (JSON file or service URL) to snapshot file, '
+             'import: snapshot file to JSON entries'
+    )
+    snapshot_cmd_parser.add_argument(
+        'source',
+        help='export: JSON file of entries by nickname (as returned by '
+             'GET /addressbook) or URL of a running service, '
+             'import: snapshot file'
+    )
+    snapshot_cmd_parser.add_argument(
+        'destination',
+        help='export: snapshot file, import: JSON file, - for stdout'
+    )
+
+    datagen_cmd_parser = subparsers.add_parser(
+        'datagen',
+        help='generate synthetic entries, e.g. for scale tests'
+    )
+    datagen_cmd_parser.add_argument(
+        'destination',
+        help='NDJSON file (as imported by POST /addressbook/_bulk) or '
+             'snapshot file, - for stdout (NDJSON only)'
+    )
+    datagen_cmd_parser.add_argument(
+        '-n', '--count',
+        type=int,
+        default=1000,
+        help='entries to generate, default: %(default)s'
+    )
+    datagen_cmd_parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='same seed, same entries, default: %(default)s'
+    )
+    datagen_cmd_parser.add_argument(
+        '--start',
+        type=int,
+        default=0,
+        help='index of the first entry, e.g. to generate in parts, '
+             'default: %(default)s'
+    )
+    datagen_cmd_parser.add_argument(
+        '-f', '--format',
+        choices=['ndjson', 'snapshot'],
+        default='ndjson',
+        help='output format, default: %(default)s'
+    )
+
     return parser
 
 
@@ -80,17 +149,119 @@ def run_tests(suite_name: str, verbose: bool) -> None:
     unittest.TextTestRunner(verbosity=verbosity).run(test_suite)
 
 
-def main(args=None) -> None:
-    os.chdir(os.path.abspath(os.path.dirname(__file__)))
+def run_benchmarks(names: List[str]) -> None:
+    if len(names) == 0:
+        names = sorted(
+            os.path.basename(f)[:-len('_bench.py')]
+            for f in glob.glob('benchmarks/*_bench.py')
+        )
+
+    for name in names:
+        # Each benchmark module runs with its defaults, for other options
+        # run it directly, e.g.: python -m benchmarks.worker_pool_bench -h
+        module = importlib.import_module('benchmarks.{}_bench'.format(name))
+        module.main([])  # type: ignore
 
+
+def fetch_entries(url: str) -> Tuple[Dict[str, Dict], int]:
+    # Change log seq is read first: the snapshot may have changes after it,
+    # which a consumer replaying changes after seq applies again.
+    url = url.rstrip('/')
+    try:
+        r = urllib.request.urlopen(url + '/addressbook/_changes?limit=1')
+    except urllib.error.HTTPError as e:
+        if e.code != 410:
+            raise
+        r = e
+    seq = json.loads(r.read().decode('utf-8'))['last_seq']
+
+    r = urllib.request.urlopen(url + '/addressbook')
+    return json.loads(r.read().decode('utf-8')), seq
+
+
+def run_snapshot(action: str, source: str, destination: str) -> None:
+    from addrservice.addressbook_db import validate_address
+    from addrservice.snapshot import Snapshot, write_snapshot
+
+    if action == 'export':
+        if source.startswith(('http://', 'https://')):
+            entries, seq = fetch_entries(source)
+        else:
+            with open(source) as f:
+                entries, seq = json.load(f), 0
+
+        # Validated once here, not when the snapshot is served
+        for nickname, addr in entries.items():
+            try:
+                validate_address(addr)
+            except ValueError as e:
+                sys.exit('{}: {}'.format(nickname, e))
+
+        count = write_snapshot(destination, entries, seq)
+        print('Exported {} entries at seq {} to {}'.format(
+            count, seq, destination
+        ))
+    else:
+        snapshot = Snapshot(source)
+        entries = dict(snapshot.items())
+        snapshot.close()
+
+        if destination == '-':
+            json.dump(entries, sys.stdout, indent=2)
+        else:
+            with open(destination, 'w') as f:
+                json.dump(entries, f, indent=2)
+
+
+def run_datagen(
+    destination: str,
+    fmt: str,
+    count: int,
+    seed: int,
+    start: int
+) -> None:
+    from addrservice.snapshot import write_snapshot_items
+    from benchmarks.datagen import generate_entries, write_ndjson
+
+    # Entries are generated as they are written, not held in memory.
+    entries = generate_entries(count, seed, start)
+    if fmt == 'snapshot':
+        if destination == '-':
+            sys.exit('Snapshots are written to a file')
+        n = write_snapshot_items(destination, entries)
+    elif destination == '-':
+        write_ndjson(sys.stdout, entries)
+        return
+    else:
+        with open(destination, 'w', encoding='utf-8') as f:
+            n = write_ndjson(f, entries)
+
+    print('Generated {} entries (seed {}) to {}'.format(
+        n, seed, destination
+    ))
+
+
+def main(args=None) -> None:
     parser = arg_parser()
     args = parser.parse_args(args)
     # print(args)
 
+    # Checks, tests and benchmarks run on the code, files of snapshot and
+    # datagen are where the caller is.
+    if args.func in ('typecheck', 'lint', 'test', 'bench'):
+        os.chdir(os.path.abspath(os.path.dirname(__file__)))
+
     actions = {
         'typecheck': lambda: run_checker(args.checker, args.paths),
         'lint': lambda: run_checker(args.linter, args.paths),
         'test': lambda: run_tests(args.suite, args.verbose),
+        'bench': lambda: run_benchmarks(args.names),
+        'snapshot': lambda: run_snapshot(
+            args.action, args.source, args.destination
+        ),
+        'datagen': lambda: run_datagen(
+            args.destination, args.format, args.count, args.seed, args.start
+        ),
     }
 
     actions.get(args.func, parser.print_help)()
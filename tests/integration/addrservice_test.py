@@ -1,13 +1,35 @@
 # Copyright (c) 2019. All rights reserved.
 
 import asynctest  # type: ignore
+import json
 import unittest
 
-from addrservice.addressbook_db import InMemoryAddressBookDB
+import asyncio
+from unittest import mock
+
+from addrservice.addressbook_db import (
+    InMemoryAddressBookDB,
+    TieredAddressBookDB,
+)
+from addrservice.dedup import (
+    canonicalize,
+    DedupIndex,
+    DuplicateEntryError,
+    POLICY_EXISTING,
+    POLICY_MERGE,
+    POLICY_REJECT,
+)
+from addrservice.idempotency import (
+    IdempotencyKeyReusedError,
+    InMemoryIdempotencyStore,
+)
+from addrservice.search import TrigramIndex
 from addrservice.service import AddressBookService
 import addrservice.tracing as tracing
+from addrservice.workers import WorkerPool
 
 from tests.unit.address_data_test import address_data_suite
+from tests.unit.dedup_test import near_duplicate
 
 
 class AddressBookServiceWithInMemoryDBTest(asynctest.TestCase):
@@ -66,6 +88,231 @@ class AddressBookServiceWithInMemoryDBTest(asynctest.TestCase):
         with self.assertRaises(KeyError):
             await self.service.get_address(key)
 
+    @asynctest.fail_on(active_handles=True)
+    async def test_encode_json(self) -> None:
+        all_addr = await self.service.get_all_addresses()
+        encoded = await self.service.encode_json(all_addr)
+        self.assertEqual(json.loads(encoded), self.address_data)
+
+
+class AddressBookServiceWithWorkerPoolTest(asynctest.TestCase):
+    async def setUp(self) -> None:
+        self.addr_db = InMemoryAddressBookDB()
+        self.worker_pool = WorkerPool(thresholds={
+            'validate': 0, 'serialize': 0
+        })
+        self.service = AddressBookService(
+            self.addr_db,
+            worker_pool=self.worker_pool
+        )
+        self.service.start()
+        self.address_data = address_data_suite()
+
+    async def tearDown(self) -> None:
+        self.service.stop()
+
+    async def test_offloaded_operations(self) -> None:
+        for nickname, addr in self.address_data.items():
+            await self.addr_db.create_address(addr, nickname)
+        with self.assertRaises(ValueError):
+            await self.service.post_address({})
+
+        all_addr = await self.service.get_all_addresses()
+        encoded = await self.service.encode_json(all_addr)
+        self.assertEqual(json.loads(encoded), self.address_data)
+
+        status = await self.service.status()
+        self.assertEqual(
+            status['workers']['offloaded'], len(self.address_data) + 2
+        )
+
+
+class AddressBookServiceIdempotencyTest(asynctest.TestCase):
+    async def setUp(self) -> None:
+        self.addr_db = InMemoryAddressBookDB()
+        self.service = AddressBookService(
+            self.addr_db,
+            idempotency_store=InMemoryIdempotencyStore()
+        )
+        self.service.start()
+        address_data = list(address_data_suite().values())
+        self.addr0, self.addr1 = address_data[0], address_data[1]
+
+    async def tearDown(self) -> None:
+        self.service.stop()
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_replay(self) -> None:
+        key = await self.service.post_address(self.addr0, 'key-0')
+
+        with mock.patch.object(
+            self.addr_db, 'create_address', wraps=self.addr_db.create_address
+        ) as create_address:
+            self.assertEqual(
+                await self.service.post_address(self.addr0, 'key-0'), key
+            )
+            self.assertEqual(create_address.call_count, 0)
+
+            with self.assertRaises(IdempotencyKeyReusedError):
+                await self.service.post_address(self.addr1, 'key-0')
+
+            # Without a key, or with another key, creates new entries
+            await self.service.post_address(self.addr0)
+            await self.service.post_address(self.addr0, 'key-1')
+            self.assertEqual(create_address.call_count, 2)
+
+        self.assertEqual(len(await self.service.get_all_addresses()), 3)
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_concurrent_retries(self) -> None:
+        keys = await asyncio.gather(*[
+            self.service.post_address(self.addr0, 'key-0') for _ in range(5)
+        ])
+        self.assertEqual(len(set(keys)), 1)
+        self.assertEqual(len(await self.service.get_all_addresses()), 1)
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_failure_not_recorded(self) -> None:
+        with self.assertRaises(ValueError):
+            await self.service.post_address({}, 'key-0')
+        # The key is free for a corrected request
+        key = await self.service.post_address(self.addr0, 'key-0')
+        self.assertIsNotNone(key)
+
+
+class AddressBookServiceDedupTest(asynctest.TestCase):
+    async def setUp(self) -> None:
+        self.addr_db = InMemoryAddressBookDB()
+        self.address_data = address_data_suite()
+        self.raga = canonicalize(self.address_data['raga'])
+        self.namo = self.address_data['namo']
+
+    def make_service(self, policy: str) -> AddressBookService:
+        service = AddressBookService(
+            self.addr_db,
+            dedup=DedupIndex(policy)
+        )
+        service.start()
+        self.addCleanup(service.stop)
+        return service
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_existing(self) -> None:
+        service = self.make_service(POLICY_EXISTING)
+        key = await service.post_address(self.address_data['raga'])
+        # Stored canonicalized
+        self.assertEqual(await service.get_address(key), self.raga)
+
+        dup = near_duplicate(self.raga)
+        self.assertEqual(await service.post_address(dup), key)
+        # Concurrent duplicates, also by another nickname
+        keys = await asyncio.gather(*[
+            service.post_address(self.namo, nickname=nickname)
+            for nickname in ['namo-1', 'namo-2', None]
+        ])
+        self.assertEqual(keys, ['namo-1'] * 3)
+        self.assertEqual(len(await service.get_all_addresses()), 2)
+
+        with self.assertRaises(ValueError):
+            await service.post_address(dict(dup, age=42))
+
+        status = await service.status()
+        self.assertEqual(status['dedup']['duplicates'], 3)
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_reject_and_merge(self) -> None:
+        service = self.make_service(POLICY_REJECT)
+        key = await service.post_address(self.raga)
+        with self.assertRaises(DuplicateEntryError) as cm:
+            await service.post_address(near_duplicate(self.raga))
+        self.assertEqual(cm.exception.nickname, key)
+
+        assert service.dedup is not None
+        service.dedup.policy = POLICY_MERGE
+        dup = near_duplicate(self.raga)
+        dup['addresses'] = self.namo['addresses']
+        self.assertEqual(await service.post_address(dup), key)
+        merged = await service.get_address(key)
+        self.assertEqual(
+            merged['addresses'],
+            self.raga['addresses'] + self.namo['addresses']
+        )
+        self.assertEqual(merged['name'], self.raga['name'])
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_dedup_existing_entries(self) -> None:
+        # Created before dedup was enabled
+        await self.addr_db.create_address(self.raga, 'raga-2')
+        dup = canonicalize(near_duplicate(self.raga))
+        dup['addresses'] = self.namo['addresses']
+        await self.addr_db.create_address(dup, 'raga-1')
+        await self.addr_db.create_address(self.raga, 'raga-3')
+        await self.addr_db.create_address(self.namo, 'namo')
+
+        service = self.make_service(POLICY_EXISTING)
+        result = await service.dedup_addresses(apply=False)
+        self.assertEqual(result, {
+            'groups': 1,
+            'removed': 0,
+            'duplicates': {'raga-1': ['raga-2', 'raga-3']},
+        })
+        self.assertEqual(len(await service.get_all_addresses()), 4)
+
+        result = await service.dedup_addresses()
+        self.assertEqual(result['removed'], 2)
+        values = await service.get_all_addresses()
+        self.assertEqual(set(values), {'raga-1', 'namo'})
+        self.assertEqual(
+            values['raga-1']['addresses'],
+            self.namo['addresses'] + self.raga['addresses']
+        )
+        self.assertEqual(
+            (await service.dedup_addresses())['groups'], 0
+        )
+
+        with self.assertRaises(NotImplementedError):
+            await AddressBookService(self.addr_db).dedup_addresses()
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_index_existing_entries(self) -> None:
+        addr_db = TieredAddressBookDB(self.addr_db)
+        await addr_db.create_address(self.raga, 'raga')
+        await addr_db.create_address(self.namo, 'namo')
+
+        service = AddressBookService(
+            addr_db, search_index=TrigramIndex(), dedup=DedupIndex()
+        )
+        service.start()
+        self.addCleanup(service.stop)
+        self.assertFalse((await service.status())['ready'])
+        await addr_db.delete_address('namo')
+        while not (await service.status())['ready']:
+            await asyncio.sleep(0.01)
+
+        results = await service.search_addresses(self.raga['name'])
+        self.assertEqual([r[0] for r in results], ['raga'])
+        self.assertEqual(await service.search_addresses(self.namo['name']), [])
+        self.assertEqual(
+            await service.post_address(near_duplicate(self.raga)), 'raga'
+        )
+
+    def test_index_on_serving_loop(self) -> None:
+        service = AddressBookService(self.addr_db, search_index=TrigramIndex())
+        # No running loop yet: indexed once the service is used on one
+        service.start()
+        self.addCleanup(service.stop)
+        self.assertIsNone(service._indexing)
+
+        async def search() -> list:
+            self.assertFalse((await service.status())['ready'])
+            await self.addr_db.create_address(self.raga, 'raga')
+            while not (await service.status())['ready']:
+                await asyncio.sleep(0.01)
+            return await service.search_addresses(self.raga['name'])
+
+        results = self.loop.run_until_complete(search())
+        self.assertEqual([r[0] for r in results], ['raga'])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,11 +1,14 @@
 # Copyright (c) 2019. All rights reserved.
 
 import atexit
+import copy
+import gzip
 from io import StringIO
 import json
 import unittest
 import yaml
 
+from tornado.escape import url_escape
 from tornado.ioloop import IOLoop
 import tornado.testing
 
@@ -13,6 +16,8 @@ from addrservice.app import (
     make_addrservice_app,
     ADDRESSBOOK_ENTRY_URI_FORMAT_STR
 )
+from addrservice.ratelimit import API_KEY_HEADER
+from addrservice.tracing import SpanContext
 
 from tests.unit.address_data_test import address_data_suite
 
@@ -24,9 +29,33 @@ service:
 addr-db:
   memory: null
 
+admin:
+  token: test-admin-token
+
+idempotency:
+  memory:
+    max-entries: 100
+
+search: null
+
+compression:
+  routes:
+    - path: /addressbook/?$
+      encodings: [gzip]
+      min-size: 100
+
+rate-limit:
+  key: api-key
+  rules:
+    - path: /addressbook/_snapshot
+      methods: [GET]
+      rate: 0.01
+      burst: 2
+
 tracing:
   addrservice.tracing.CummulativeFunctionTimeProfiler: null
   addrservice.tracing.Timeline: null
+  addrservice.tracing.SpanCollector: null
 '''
 
 with StringIO(IN_MEMORY_CFG_TXT) as f:
@@ -44,8 +73,9 @@ class TestAddressServiceApp(tornado.testing.AsyncHTTPTestCase):
         self.addr1 = address_data[keys[1]]
 
     def get_app(self) -> tornado.web.Application:
+        # Copy, config reloads update it
         addr_service, app = make_addrservice_app(
-            config=TEST_CONFIG,
+            config=copy.deepcopy(TEST_CONFIG),
             debug=True
         )
 
@@ -82,6 +112,403 @@ class TestAddressServiceApp(tornado.testing.AsyncHTTPTestCase):
         self.assertTrue(info['ready'])
         self.assertGreater(info['uptime'], 0)
 
+    def test_trace_context_propagation(self):
+        trace_id = '0af7651916cd43dd8448eb211c80319c'
+        traceparent = '00-{}-b7ad6b7169203331-01'.format(trace_id)
+        r = self.fetch(
+            '/readiness',
+            method='GET',
+            headers={'traceparent': traceparent},
+        )
+        self.assertEqual(r.code, 200)
+
+        ctx = SpanContext.from_traceparent(r.headers['traceparent'])
+        self.assertEqual(ctx.trace_id, trace_id)
+        self.assertNotEqual(ctx.span_id, 'b7ad6b7169203331')
+
+        # Without incoming context, a new trace is started
+        r = self.fetch('/healthz', method='GET', headers=None)
+        ctx = SpanContext.from_traceparent(r.headers['traceparent'])
+        self.assertIsNotNone(ctx)
+        self.assertNotEqual(ctx.trace_id, trace_id)
+
+    def test_profile_endpoint(self):
+        r = self.fetch('/debug/profile?seconds=0.05', method='GET')
+        self.assertEqual(r.code, 403)
+
+        admin_headers = {'X-Admin-Token': 'test-admin-token'}
+        r = self.fetch(
+            '/debug/profile?seconds=0.05&interval=0.001',
+            method='GET',
+            headers=admin_headers,
+        )
+        self.assertEqual(r.code, 200)
+        self.assertTrue(r.headers['Content-Type'].startswith('text/plain'))
+
+        r = self.fetch(
+            '/debug/profile?seconds=0.05&format=speedscope',
+            method='GET',
+            headers=admin_headers,
+        )
+        self.assertEqual(r.code, 200)
+        info = json.loads(r.body.decode('utf-8'))
+        self.assertEqual(info['profiles'][0]['type'], 'sampled')
+
+        for query in ['seconds=-1', 'seconds=abc', 'seconds=1000']:
+            r = self.fetch(
+                '/debug/profile?' + query,
+                method='GET',
+                headers=admin_headers,
+            )
+            self.assertEqual(r.code, 400, query)
+
+    def test_idempotent_post(self):
+        headers = dict(self.headers)
+        headers['Idempotency-Key'] = 'test-idempotent-post'
+
+        locations = set()
+        for _ in range(3):
+            r = self.fetch(
+                ADDRESSBOOK_ENTRY_URI_FORMAT_STR.format(id=''),
+                method='POST',
+                headers=headers,
+                body=json.dumps(self.addr0),
+            )
+            self.assertEqual(r.code, 201)
+            locations.add(r.headers['Location'])
+        self.assertEqual(len(locations), 1)
+
+        r = self.fetch(
+            ADDRESSBOOK_ENTRY_URI_FORMAT_STR.format(id=''),
+            method='POST',
+            headers=headers,
+            body=json.dumps(self.addr1),
+        )
+        self.assertEqual(r.code, 422)
+
+        headers['Idempotency-Key'] = "'bad key'"
+        r = self.fetch(
+            ADDRESSBOOK_ENTRY_URI_FORMAT_STR.format(id=''),
+            method='POST',
+            headers=headers,
+            body=json.dumps(self.addr0),
+        )
+        self.assertEqual(r.code, 400)
+
+    def test_change_feed(self):
+        changes_uri = '/addressbook/_changes'
+
+        r = self.fetch(changes_uri, method='GET')
+        self.assertEqual(r.code, 200)
+        feed = json.loads(r.body.decode('utf-8'))
+        since = feed['last_seq']
+
+        # Long-poll times out without changes
+        r = self.fetch(
+            changes_uri + '?mode=longpoll&timeout=0.05&since={}'.format(since),
+            method='GET',
+        )
+        self.assertEqual(r.code, 200)
+        self.assertEqual(json.loads(r.body.decode('utf-8'))['changes'], [])
+
+        r = self.fetch(
+            ADDRESSBOOK_ENTRY_URI_FORMAT_STR.format(id=''),
+            method='POST',
+            headers=self.headers,
+            body=json.dumps(self.addr0),
+        )
+        addr_uri = r.headers['Location']
+        self.fetch(addr_uri, method='DELETE')
+
+        r = self.fetch(
+            changes_uri + '?since={}'.format(since),
+            method='GET',
+        )
+        feed = json.loads(r.body.decode('utf-8'))
+        self.assertEqual(
+            [c['op'] for c in feed['changes']], ['create', 'delete']
+        )
+        self.assertEqual(feed['changes'][0]['address'], self.addr0)
+        self.assertEqual(feed['next_since'], since + 2)
+        self.assertEqual(feed['last_seq'], since + 2)
+
+        # Server-sent events
+        chunks = []
+        r = self.fetch(
+            changes_uri + '?mode=sse&timeout=0.2&heartbeat=0.05&since={}'
+            .format(since),
+            method='GET',
+            streaming_callback=chunks.append,
+        )
+        self.assertEqual(r.code, 200)
+        self.assertEqual(r.headers['Content-Type'], 'text/event-stream')
+        events = b''.join(chunks).decode('utf-8').strip().split('\n\n')
+        self.assertEqual(events[0].split('\n')[:2], [
+            'id: {}'.format(since + 1), 'event: change'
+        ])
+        self.assertEqual(events[1].split('\n')[1], 'event: change')
+        self.assertIn('event: heartbeat', events[2])
+
+        # Errors
+        for query in ['since=-1', 'since=x', 'mode=x']:
+            r = self.fetch(changes_uri + '?' + query, method='GET')
+            self.assertEqual(r.code, 400, query)
+        # Ahead of the log, e.g. after a restart
+        r = self.fetch(changes_uri + '?since=1000000', method='GET')
+        self.assertEqual(r.code, 410)
+        self.assertEqual(
+            json.loads(r.body.decode('utf-8'))['last_seq'], since + 2
+        )
+
+    def test_search(self):
+        r = self.fetch(
+            ADDRESSBOOK_ENTRY_URI_FORMAT_STR.format(id=''),
+            method='POST',
+            headers=self.headers,
+            body=json.dumps(self.addr0),
+        )
+        addr_uri = r.headers['Location']
+        nickname = addr_uri.rsplit('/', 1)[1]
+
+        query = url_escape(self.addr0['name'][:-1])
+        r = self.fetch(
+            '/addressbook/_search?k=1&q=' + query,
+            method='GET',
+        )
+        self.assertEqual(r.code, 200)
+        results = json.loads(r.body.decode('utf-8'))['results']
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['nickname'], nickname)
+        self.assertEqual(results[0]['address'], self.addr0)
+
+        for query in ['', 'q=', 'q=x&k=0', 'q=x&k=abc']:
+            r = self.fetch('/addressbook/_search?' + query, method='GET')
+            self.assertEqual(r.code, 400, query)
+
+        self.fetch(addr_uri, method='DELETE')
+
+    def test_projection(self):
+        r = self.fetch(
+            ADDRESSBOOK_ENTRY_URI_FORMAT_STR.format(id=''),
+            method='POST',
+            headers=self.headers,
+            body=json.dumps(self.addr0),
+        )
+        addr_uri = r.headers['Location']
+        nickname = addr_uri.rsplit('/', 1)[1]
+        fields = {'name', 'emails'}
+        expected = {k: v for k, v in self.addr0.items() if k in fields}
+
+        r = self.fetch(addr_uri + '?fields=name,emails')
+        self.assertEqual(r.code, 200)
+        self.assertEqual(json.loads(r.body.decode('utf-8')), expected)
+
+        r = self.fetch('/addressbook?fields=name,emails')
+        self.assertEqual(r.code, 200)
+        self.assertEqual(
+            json.loads(r.body.decode('utf-8')), {nickname: expected}
+        )
+
+        r = self.fetch(addr_uri + '?fields=name,salary')
+        self.assertEqual(r.code, 400)
+
+    def test_compression(self):
+        for addr in [self.addr0, self.addr1]:
+            self.fetch(
+                ADDRESSBOOK_ENTRY_URI_FORMAT_STR.format(id=''),
+                method='POST',
+                headers=self.headers,
+                body=json.dumps(addr),
+            )
+
+        bodies = []
+        for _ in range(2):
+            r = self.fetch(
+                '/addressbook',
+                headers={'Accept-Encoding': 'br, gzip'},
+                decompress_response=False,
+            )
+            self.assertEqual(r.code, 200)
+            self.assertEqual(r.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(r.headers['Vary'], 'Accept-Encoding')
+            bodies.append(r.body)
+        addrs = json.loads(gzip.decompress(bodies[0]).decode('utf-8'))
+        self.assertEqual(
+            sorted(addrs.values(), key=lambda a: a['name']),
+            sorted([self.addr0, self.addr1], key=lambda a: a['name'])
+        )
+        # The second from the cache
+        self.assertEqual(bodies[0], bodies[1])
+        r = self.fetch('/readiness')
+        compression = json.loads(r.body.decode('utf-8'))['compression']
+        self.assertEqual(compression['cache-hits'], 1)
+
+        r = self.fetch('/addressbook', decompress_response=False)
+        self.assertNotIn('Content-Encoding', r.headers)
+        self.assertEqual(json.loads(r.body.decode('utf-8')), addrs)
+
+    def test_bulk(self):
+        lines = [
+            json.dumps({'address': self.addr0}),
+            json.dumps({'nickname': 'bulk1', 'address': self.addr1}),
+            '',
+            '{"address": ',
+            json.dumps({'address': {'nickname': 'No Name'}}),
+            json.dumps({'nickname': 'bulk1', 'address': self.addr1}),
+            json.dumps([self.addr0]),
+            json.dumps({'address': self.addr1}),
+            json.dumps({'nickname': 7, 'address': self.addr1}),
+            json.dumps({'nickname': ['x'], 'address': self.addr1}),
+            json.dumps({'nickname': "a/b'c d", 'address': self.addr1}),
+            json.dumps({'nickname': '', 'address': self.addr1}),
+        ]
+        body = '\n'.join(lines).encode('utf-8')
+
+        async def body_producer(write):
+            # Chunks split lines
+            for i in range(0, len(body), 100):
+                await write(body[i:i + 100])
+
+        r = self.fetch(
+            '/addressbook/_bulk', method='POST', body_producer=body_producer
+        )
+        self.assertEqual(r.code, 200)
+        result = json.loads(r.body.decode('utf-8'))
+        self.assertEqual(result['created'], 3)
+        self.assertEqual(result['failed'], 8)
+        self.assertEqual(
+            [e['line'] for e in result['errors']],
+            [4, 5, 6, 7, 9, 10, 11, 12]
+        )
+        self.assertEqual(
+            result['errors'][-2]['reason'], 'Invalid nickname: "a/b\'c d"'
+        )
+
+        r = self.fetch('/addressbook/bulk1')
+        self.assertEqual(json.loads(r.body.decode('utf-8')), self.addr1)
+        r = self.fetch('/addressbook')
+        self.assertEqual(len(json.loads(r.body.decode('utf-8'))), 3)
+
+    def test_stats(self):
+        r = self.fetch('/addressbook/_stats')
+        self.assertEqual(r.code, 200)
+        self.assertEqual(json.loads(r.body.decode('utf-8'))['entries'], 0)
+
+        for addr in [self.addr0, self.addr1]:
+            self.fetch(
+                ADDRESSBOOK_ENTRY_URI_FORMAT_STR.format(id=''),
+                method='POST',
+                headers=self.headers,
+                body=json.dumps(addr),
+            )
+        r = self.fetch('/addressbook/_stats')
+        aggregates = json.loads(r.body.decode('utf-8'))
+        self.assertEqual(aggregates['entries'], 2)
+        self.assertEqual(aggregates['countries'], {'India': 2})
+        self.assertEqual(aggregates['cities']['New Delhi'], 2)
+
+    def test_pincodes(self):
+        r = self.fetch(
+            ADDRESSBOOK_ENTRY_URI_FORMAT_STR.format(id=''),
+            method='POST',
+            headers=self.headers,
+            body=json.dumps(self.addr0),
+        )
+        addr_uri = r.headers['Location']
+        nickname = addr_uri.rsplit('/', 1)[1]
+        pincode = self.addr0['addresses'][0]['pincode']
+
+        r = self.fetch(
+            '/addressbook/_pincodes?min={p}&max={p}'.format(p=pincode),
+            method='GET',
+        )
+        self.assertEqual(r.code, 200)
+        addrs = json.loads(r.body.decode('utf-8'))
+        self.assertEqual(addrs, {nickname: self.addr0})
+
+        r = self.fetch(
+            '/addressbook/_pincodes?k=1&near={}'.format(pincode + 1),
+            method='GET',
+        )
+        self.assertEqual(r.code, 200)
+        results = json.loads(r.body.decode('utf-8'))['results']
+        self.assertEqual(results, [{'pincode': pincode, 'nickname': nickname}])
+
+        for query in [
+            '', 'min=1', 'min=2&max=1', 'min=x&max=2', 'min=1&max=2&limit=0',
+            'near=1&k=0', 'near=1&min=1&max=2'
+        ]:
+            r = self.fetch('/addressbook/_pincodes?' + query, method='GET')
+            self.assertEqual(r.code, 400, query)
+
+        self.fetch(addr_uri, method='DELETE')
+
+    def test_rate_limit(self):
+        uri = '/addressbook/_snapshot'
+        for _ in range(2):
+            self.assertEqual(self.fetch(uri).code, 200)
+        r = self.fetch(uri)
+        self.assertEqual(r.code, 429)
+        self.assertGreaterEqual(int(r.headers['Retry-After']), 1)
+
+        # Limited per API key, and on matching routes only
+        r = self.fetch(uri, headers={API_KEY_HEADER: 'other'})
+        self.assertEqual(r.code, 200)
+        self.assertEqual(self.fetch('/addressbook').code, 200)
+
+    def test_config_reload(self):
+        uri = '/debug/config'
+        admin_headers = {'X-Admin-Token': 'test-admin-token'}
+        snapshot_uri = '/addressbook/_snapshot'
+        stats_uri = '/addressbook/_stats'
+
+        config = copy.deepcopy(TEST_CONFIG)
+        r = self.fetch(uri, method='POST', body=json.dumps(config))
+        self.assertEqual(r.code, 403)
+
+        for _ in range(2):
+            self.assertEqual(self.fetch(snapshot_uri).code, 200)
+
+        config['rate-limit']['rules'].append(
+            {'path': stats_uri, 'rate': 'slow'}
+        )
+        for body in ['rate-limit: [', '[]', json.dumps(config)]:
+            r = self.fetch(
+                uri, method='POST', headers=admin_headers, body=body
+            )
+            self.assertEqual(r.code, 400, body)
+        # Nothing applied
+        for _ in range(2):
+            self.assertEqual(self.fetch(stats_uri).code, 200)
+
+        config['rate-limit']['rules'][-1].update(rate=0.01, burst=1)
+        config['loop-monitor'] = {'interval': 0.05}
+        del config['search']
+        r = self.fetch(
+            uri, method='POST', headers=admin_headers, body=yaml.dump(config)
+        )
+        self.assertEqual(r.code, 200)
+        self.assertEqual(json.loads(r.body.decode('utf-8')), {
+            'reloaded': ['rate-limit', 'loop-monitor'],
+            'restart-required': ['search'],
+        })
+        # Applied changes are not reloaded again
+        r = self.fetch(
+            uri, method='POST', headers=admin_headers, body=json.dumps(config)
+        )
+        self.assertEqual(json.loads(r.body.decode('utf-8')), {
+            'reloaded': [], 'restart-required': ['search'],
+        })
+
+        # Buckets of unchanged rules are kept
+        self.assertEqual(self.fetch(snapshot_uri).code, 429)
+        self.assertEqual(self.fetch(stats_uri).code, 200)
+        self.assertEqual(self.fetch(stats_uri).code, 429)
+
+        r = self.fetch('/readiness')
+        info = json.loads(r.body.decode('utf-8'))
+        self.assertIn('event-loop', info)
+
     def test_default_handler(self):
         r = self.fetch(
             '/does-not-exist',
@@ -102,8 +529,7 @@ class TestAddressServiceApp(tornado.testing.AsyncHTTPTestCase):
         # self.assertEqual(info['code'], 404)
         # self.assertEqual(info['message'], 'Unknown Endpoint')
 
-    # TODO: Exercise: rename this function to test_address_book_endpoints
-    def no_test_address_book_endpoints(self):
+    def test_address_book_endpoints(self):
         # Get all addresses in the address book, must be ZERO
         r = self.fetch(
             ADDRESSBOOK_ENTRY_URI_FORMAT_STR.format(id=''),
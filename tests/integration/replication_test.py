@@ -0,0 +1,206 @@
+# Copyright (c) 2019. All rights reserved.
+
+import asyncio
+import copy
+import json
+import unittest
+
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+import tornado.testing
+
+from addrservice.app import (
+    make_addrservice_app,
+    ADDRESSBOOK_ENTRY_URI_FORMAT_STR
+)
+from addrservice.snapshot import encode_snapshot
+
+from tests.unit.address_data_test import address_data_suite
+
+
+TEST_CONFIG = {
+    'service': {'name': 'Address Book Replication Test'},
+    'addr-db': {'memory': None},
+}
+
+
+class ReplicationTest(tornado.testing.AsyncHTTPTestCase):
+    '''Primary (the test app) and a follower, in process.'''
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.headers = {'Content-Type': 'application/json; charset=UTF-8'}
+        self.address_data = address_data_suite()
+        for nickname, addr in self.address_data.items():
+            self.io_loop.run_sync(
+                lambda: self.primary.addr_db.create_address(addr, nickname)
+            )
+
+        config = copy.deepcopy(TEST_CONFIG)
+        config['replication'] = {
+            'role': 'follower',
+            'primary': self.get_url(''),
+            'max-staleness': 1,
+            'heartbeat': 0.1,
+            'reconnect-delay': 0.05,
+        }
+        self.follower, follower_app = make_addrservice_app(config, False)
+        self.follower.start()
+
+        sock, self.follower_port = tornado.testing.bind_unused_port()
+        self.follower_server = HTTPServer(follower_app)
+        self.follower_server.add_sockets([sock])
+
+    def tearDown(self) -> None:
+        self.follower_server.stop()
+        self.follower.drain()
+        self.primary.drain()
+        # Let change streams end
+        self.io_loop.run_sync(lambda: asyncio.sleep(0.1))
+        self.follower.stop()
+        self.primary.stop()
+        super().tearDown()
+
+    def get_app(self) -> tornado.web.Application:
+        self.primary, app = make_addrservice_app(
+            config=copy.deepcopy(TEST_CONFIG),
+            debug=True
+        )
+        self.primary.start()
+        return app
+
+    def get_new_ioloop(self):
+        IOLoop.configure('tornado.platform.asyncio.AsyncIOLoop')
+        instance = IOLoop.instance()
+        return instance
+
+    def follower_url(self, path: str) -> str:
+        return 'http://127.0.0.1:{}{}'.format(self.follower_port, path)
+
+    async def until(self, condition, timeout: float = 5) -> None:
+        deadline = self.io_loop.time() + timeout
+        while not condition():
+            self.assertLess(self.io_loop.time(), deadline)
+            await asyncio.sleep(0.02)
+
+    def in_sync(self) -> bool:
+        follower = self.follower.follower
+        assert follower is not None
+        return (
+            follower.synced and
+            self.follower.last_change_seq() == self.primary.last_change_seq()
+        )
+
+    def test_snapshot_endpoint(self):
+        r = self.fetch('/addressbook/_snapshot')
+        self.assertEqual(r.code, 200)
+        self.assertEqual(r.headers['Content-Type'], 'application/octet-stream')
+        self.assertEqual(r.body, encode_snapshot(
+            self.address_data, self.primary.last_change_seq()
+        ))
+
+    @tornado.testing.gen_test
+    async def test_bootstrap_and_replicate(self):
+        await self.until(self.in_sync)
+        r = await self.http_client.fetch(self.follower_url('/addressbook'))
+        self.assertEqual(
+            json.loads(r.body.decode('utf-8')), self.address_data
+        )
+
+        nicknames = list(self.address_data.keys())
+        r = await self.http_client.fetch(
+            self.get_url(ADDRESSBOOK_ENTRY_URI_FORMAT_STR.format(id='')),
+            method='POST',
+            headers=self.headers,
+            body=json.dumps(self.address_data[nicknames[0]]),
+        )
+        new_uri = r.headers['Location']
+        await self.http_client.fetch(
+            self.get_url(ADDRESSBOOK_ENTRY_URI_FORMAT_STR.format(
+                id=nicknames[1]
+            )),
+            method='DELETE',
+        )
+        await self.until(self.in_sync)
+
+        r = await self.http_client.fetch(self.follower_url(new_uri))
+        self.assertEqual(
+            json.loads(r.body.decode('utf-8')),
+            self.address_data[nicknames[0]]
+        )
+        r = await self.http_client.fetch(
+            self.follower_url(ADDRESSBOOK_ENTRY_URI_FORMAT_STR.format(
+                id=nicknames[1]
+            )),
+            raise_error=False,
+        )
+        self.assertEqual(r.code, 404)
+
+        # Follower's change feed has the primary's sequence numbers
+        r = await self.http_client.fetch(self.follower_url(
+            '/addressbook/_changes?since={}'.format(
+                self.primary.last_change_seq() - 2
+            )
+        ))
+        changes = json.loads(r.body.decode('utf-8'))['changes']
+        self.assertEqual([c['op'] for c in changes], ['create', 'delete'])
+
+        r = await self.http_client.fetch(self.follower_url('/readiness'))
+        info = json.loads(r.body.decode('utf-8'))
+        self.assertEqual(info['replication']['bootstraps'], 1)
+        self.assertEqual(info['replication']['applied'], 2)
+
+    @tornado.testing.gen_test
+    async def test_primary_restart(self):
+        await self.until(self.in_sync)
+        # As after a restart: same entries, sequence numbers from 0
+        self.primary.addr_db.changelog.reset(0)
+        await self.until(lambda: self.follower.follower.bootstraps == 2)
+        await self.until(self.in_sync)
+        self.assertEqual(self.follower.last_change_seq(), 0)
+
+    @tornado.testing.gen_test
+    async def test_writes_redirect_to_primary(self):
+        await self.until(self.in_sync)
+        nickname = list(self.address_data.keys())[0]
+
+        for method, path, body in [
+            ('POST', '/addressbook', json.dumps(self.address_data[nickname])),
+            ('DELETE', '/addressbook/{}'.format(nickname), None),
+        ]:
+            r = await self.http_client.fetch(
+                self.follower_url(path),
+                method=method,
+                body=body,
+                follow_redirects=False,
+                raise_error=False,
+            )
+            self.assertEqual(r.code, 307, method)
+            self.assertEqual(r.headers['Location'], self.get_url(path))
+
+        # Nothing changed
+        self.assertEqual(
+            self.primary.last_change_seq(), len(self.address_data)
+        )
+
+    @tornado.testing.gen_test
+    async def test_stale_follower(self):
+        await self.until(self.in_sync)
+
+        # As if nothing came from the primary for a while
+        replica = self.follower.follower
+        replica.last_contact -= replica.max_staleness + 1
+        for path in ['/addressbook', '/readiness']:
+            r = await self.http_client.fetch(
+                self.follower_url(path), raise_error=False
+            )
+            self.assertEqual(r.code, 503, path)
+
+        # Heartbeats bring it back
+        await self.until(lambda: replica.staleness() < replica.max_staleness)
+        r = await self.http_client.fetch(self.follower_url('/addressbook'))
+        self.assertEqual(r.code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,297 @@
+# Copyright (c) 2019. All rights reserved.
+
+import json
+from typing import List, Optional, Tuple
+import unittest
+
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+import tornado.testing
+
+from addrservice import tracing
+from addrservice.addressbook_db import InMemoryAddressBookDB
+from addrservice.app import make_addrservice_app, ADMIN_TOKEN_HEADER
+from addrservice.service import AddressBookService
+
+NODE_CONFIG = {
+    'service': {'name': 'Address Book Shard'},
+    'addr-db': {'memory': None},
+    'search': None,
+}
+
+
+def make_entry(i: int) -> dict:
+    return {
+        'name': 'Person {}'.format(i),
+        'addresses': [{
+            'kind': 'home',
+            'streetName': 'Street {}'.format(i),
+            'pincode': 100000 + 10 * i,
+            'country': 'India',
+        }],
+    }
+
+
+class ShardingTest(tornado.testing.AsyncHTTPTestCase):
+    '''Router (the test app) over nodes, all in process.'''
+
+    ENTRIES = 40
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.headers = {'Content-Type': 'application/json; charset=UTF-8'}
+        self.admin_headers = {ADMIN_TOKEN_HEADER: 'test-admin-token'}
+
+    def tearDown(self) -> None:
+        self.router.stop()
+        for server in self.node_servers:
+            server.stop()
+        for service, _ in self.nodes:
+            service.stop()
+        super().tearDown()
+
+    def start_nodes(self) -> None:
+        # On the IOLoop of the test, once it exists
+        self.nodes: List[Tuple[AddressBookService, str]] = []
+        self.node_servers: List[HTTPServer] = []
+        for _ in range(3):
+            service, app = make_addrservice_app(NODE_CONFIG, False)
+            service.start()
+            sock, port = tornado.testing.bind_unused_port()
+            server = HTTPServer(app)
+            server.add_sockets([sock])
+            self.nodes.append((service, 'http://127.0.0.1:{}'.format(port)))
+            self.node_servers.append(server)
+
+    def get_app(self) -> tornado.web.Application:
+        self.start_nodes()
+        config = {
+            'service': {'name': 'Address Book Router'},
+            'addr-db': {
+                # Third node is added by tests
+                'sharded': {'nodes': [url for _, url in self.nodes[:2]]},
+            },
+            'admin': {'token': 'test-admin-token'},
+        }
+        self.router, app = make_addrservice_app(config, False)
+        self.router.start()
+        return app
+
+    def get_new_ioloop(self):
+        IOLoop.configure('tornado.platform.asyncio.AsyncIOLoop')
+        instance = IOLoop.instance()
+        return instance
+
+    def post_entries(self) -> dict:
+        entries = {}
+        for i in range(self.ENTRIES):
+            r = self.fetch(
+                '/addressbook/',
+                method='POST',
+                headers=self.headers,
+                body=json.dumps(make_entry(i)),
+            )
+            self.assertEqual(r.code, 201)
+            nickname = r.headers['Location'].rsplit('/', 1)[1]
+            entries[nickname] = make_entry(i)
+        return entries
+
+    def node_sizes(self) -> list:
+        sizes = []
+        for service, _ in self.nodes:
+            assert isinstance(service.addr_db, InMemoryAddressBookDB)
+            sizes.append(len(service.addr_db.db))
+        return sizes
+
+    def test_crud(self):
+        entries = self.post_entries()
+        sizes = self.node_sizes()
+        self.assertEqual(sum(sizes), self.ENTRIES)
+        self.assertTrue(all(sizes[:2]), sizes)
+
+        for nickname, addr in entries.items():
+            r = self.fetch('/addressbook/{}'.format(nickname))
+            self.assertEqual(r.code, 200)
+            self.assertEqual(json.loads(r.body.decode('utf-8')), addr)
+
+        # Entries with a given nickname go to its node too
+        r = self.fetch(
+            '/addressbook/some-one',
+            method='POST',
+            headers=self.headers,
+            body=json.dumps(make_entry(0)),
+        )
+        self.assertEqual(r.code, 201)
+        r = self.fetch(
+            '/addressbook/some-one',
+            method='POST',
+            headers=self.headers,
+            body=json.dumps(make_entry(0)),
+        )
+        self.assertEqual(r.code, 409)
+        r = self.fetch(
+            '/addressbook/',
+            method='POST',
+            headers=self.headers,
+            body=json.dumps({'nickname': 'No Name'}),
+        )
+        self.assertEqual(r.code, 400)
+
+        # Updates go to the node of the entry
+        r = self.fetch(
+            '/addressbook/some-one',
+            method='PUT',
+            headers=self.headers,
+            body=json.dumps(make_entry(1)),
+        )
+        self.assertEqual(r.code, 204)
+        r = self.fetch('/addressbook/some-one')
+        self.assertEqual(r.code, 200)
+        self.assertEqual(json.loads(r.body.decode('utf-8')), make_entry(1))
+        r = self.fetch(
+            '/addressbook/some-one',
+            method='PUT',
+            headers=self.headers,
+            body=json.dumps({'nickname': 'No Name'}),
+        )
+        self.assertEqual(r.code, 400)
+        r = self.fetch(
+            '/addressbook/no-one',
+            method='PUT',
+            headers=self.headers,
+            body=json.dumps(make_entry(1)),
+        )
+        self.assertEqual(r.code, 404)
+
+        r = self.fetch('/addressbook/some-one', method='DELETE')
+        self.assertEqual(r.code, 204)
+        for method in ['GET', 'DELETE']:
+            r = self.fetch('/addressbook/some-one', method=method)
+            self.assertEqual(r.code, 404, method)
+
+    def test_scatter_gather(self):
+        entries = self.post_entries()
+
+        r = self.fetch('/addressbook')
+        self.assertEqual(r.code, 200)
+        self.assertEqual(json.loads(r.body.decode('utf-8')), entries)
+
+        # Pincode range, merged in pincode order across nodes
+        r = self.fetch('/addressbook/_pincodes?min=100050&max=100200&limit=5')
+        self.assertEqual(r.code, 200)
+        addrs = json.loads(r.body.decode('utf-8'))
+        self.assertEqual(
+            [a['addresses'][0]['pincode'] for a in addrs.values()],
+            [100050, 100060, 100070, 100080, 100090]
+        )
+
+        r = self.fetch('/addressbook/_pincodes?near=100101&k=3')
+        results = json.loads(r.body.decode('utf-8'))['results']
+        self.assertEqual(
+            [x['pincode'] for x in results], [100100, 100110, 100090]
+        )
+
+        r = self.fetch('/addressbook/_search?q=Person+17&k=3')
+        self.assertEqual(r.code, 200)
+        results = json.loads(r.body.decode('utf-8'))['results']
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0]['address'], make_entry(17))
+        scores = [x['score'] for x in results]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+        # Projection, pushed down to the nodes
+        r = self.fetch('/addressbook?fields=name')
+        self.assertEqual(json.loads(r.body.decode('utf-8')), {
+            nickname: {'name': addr['name']}
+            for nickname, addr in entries.items()
+        })
+        nickname, addr = next(iter(entries.items()))
+        r = self.fetch('/addressbook/{}?fields=name'.format(nickname))
+        self.assertEqual(
+            json.loads(r.body.decode('utf-8')), {'name': addr['name']}
+        )
+
+        # Aggregates, summed across nodes
+        r = self.fetch('/addressbook/_stats')
+        self.assertEqual(r.code, 200)
+        aggregates = json.loads(r.body.decode('utf-8'))
+        self.assertEqual(aggregates['entries'], self.ENTRIES)
+        self.assertEqual(aggregates['countries'], {'India': self.ENTRIES})
+
+        # Written on a node, not through this router: listed too
+        service, _ = self.nodes[0]
+        self.io_loop.run_sync(
+            lambda: service.post_address(make_entry(0), nickname='some-one')
+        )
+        entries['some-one'] = make_entry(0)
+        r = self.fetch('/addressbook')
+        self.assertEqual(json.loads(r.body.decode('utf-8')), entries)
+
+    def test_trace_context(self):
+        traceparents: List[Optional[str]] = []
+        for service, _ in self.nodes:
+            service.addr_db.add_listener(
+                lambda *args: traceparents.append(
+                    tracing.current_traceparent()
+                )
+            )
+
+        traceparent = '00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01'
+        r = self.fetch(
+            '/addressbook/some-one',
+            method='POST',
+            headers=dict(self.headers, traceparent=traceparent),
+            body=json.dumps(make_entry(0)),
+        )
+        self.assertEqual(r.code, 201)
+        self.assertEqual(traceparents, [traceparent])
+
+    def test_node_failure(self):
+        self.post_entries()
+        self.node_servers[1].stop()
+
+        # Listings are all or nothing
+        for uri in ['/addressbook', '/addressbook/_stats']:
+            r = self.fetch(uri)
+            self.assertEqual(r.code, 500, uri)
+
+    def test_add_node(self):
+        entries = self.post_entries()
+        new_node = self.nodes[2][1]
+
+        r = self.fetch('/debug/shards', headers=self.admin_headers)
+        self.assertEqual(
+            json.loads(r.body.decode('utf-8'))['nodes'],
+            [url for _, url in self.nodes[:2]]
+        )
+
+        r = self.fetch(
+            '/debug/shards',
+            method='POST',
+            headers=self.admin_headers,
+            body=json.dumps({'node': new_node}),
+        )
+        self.assertEqual(r.code, 200)
+        moved = json.loads(r.body.decode('utf-8'))['moved']
+        sizes = self.node_sizes()
+        self.assertEqual(sizes[2], moved)
+        self.assertGreater(moved, 0)
+        self.assertEqual(sum(sizes), self.ENTRIES)
+
+        r = self.fetch('/addressbook')
+        self.assertEqual(json.loads(r.body.decode('utf-8')), entries)
+        for nickname, addr in entries.items():
+            r = self.fetch('/addressbook/{}'.format(nickname))
+            self.assertEqual(json.loads(r.body.decode('utf-8')), addr)
+
+        r = self.fetch(
+            '/debug/shards',
+            method='POST',
+            headers=self.admin_headers,
+            body=json.dumps({'node': new_node}),
+        )
+        self.assertEqual(r.code, 409)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# Copyright (c) 2019. All rights reserved.
+
+import asynctest  # type: ignore
+import logging
+import unittest
+from typing import Any, Optional
+
+from benchmarks.stress_bench import (
+    BACKENDS,
+    check_linearizable,
+    CREATE,
+    DELETE,
+    Operation,
+    READ,
+    run_backend,
+    UPDATE,
+)
+
+
+def op(
+    kind: str,
+    start: int,
+    end: int,
+    version: Optional[int] = None,
+    result: Any = True
+) -> Operation:
+    return Operation('x', kind, version, result, start, end)
+
+
+class LinearizabilityTest(unittest.TestCase):
+    def test_sequential(self) -> None:
+        self.assertIsNone(check_linearizable([
+            op(READ, 1, 2, result=None),
+            op(CREATE, 3, 4, 1),
+            op(CREATE, 5, 6, 2, result=False),
+            op(UPDATE, 7, 8, 3),
+            op(READ, 9, 10, result=3),
+            op(DELETE, 11, 12),
+            op(UPDATE, 13, 14, 4, result=False),
+            op(READ, 15, 16, result=None),
+        ]))
+        self.assertIsNone(
+            check_linearizable([op(READ, 1, 2, result=7)], initial=7)
+        )
+
+    def test_concurrent(self) -> None:
+        # Read overlapping an update sees either version
+        for version in [1, 2]:
+            self.assertIsNone(check_linearizable([
+                op(CREATE, 1, 2, 1),
+                op(UPDATE, 3, 6, 2),
+                op(READ, 4, 5, result=version),
+            ]))
+        # One of concurrent creates succeeds, and the last one read wins
+        self.assertIsNone(check_linearizable([
+            op(CREATE, 1, 4, 1, result=False),
+            op(CREATE, 2, 3, 2),
+            op(READ, 5, 6, result=2),
+        ]))
+
+    def test_violations(self) -> None:
+        for history in [
+            # Stale read
+            [op(CREATE, 1, 2, 1), op(UPDATE, 3, 4, 2),
+             op(READ, 5, 6, result=1)],
+            # Lost update
+            [op(CREATE, 1, 2, 1), op(UPDATE, 3, 6, 2), op(UPDATE, 4, 5, 3),
+             op(READ, 7, 8, result=1)],
+            # Both concurrent creates succeed
+            [op(CREATE, 1, 3, 1), op(CREATE, 2, 4, 2)],
+            # Phantom read
+            [op(READ, 1, 2, result=9)],
+        ]:
+            self.assertIsNotNone(check_linearizable(history), history)
+        error = check_linearizable(
+            [op(UPDATE, 1, 100, i) for i in range(20)], 0, max_states=100
+        )
+        assert error is not None
+        self.assertIn('Too concurrent', error)
+
+
+class StressTest(asynctest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.WARNING)
+
+    def tearDown(self) -> None:
+        logging.disable(logging.NOTSET)
+
+    async def test_backends(self) -> None:
+        for name in BACKENDS:
+            result = await run_backend(
+                name, workers=20, ops=10, entries=4, seed=1
+            )
+            # Plus a read of each entry in the end
+            self.assertEqual(result.operations, 20 * 10 + 4, name)
+            self.assertEqual(result.violations, [], name)
+
+
+if __name__ == '__main__':
+    asynctest.main()
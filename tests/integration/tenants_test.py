@@ -0,0 +1,120 @@
+# Copyright (c) 2019. All rights reserved.
+
+import json
+import tempfile
+import unittest
+
+from tornado.ioloop import IOLoop
+import tornado.testing
+
+from addrservice.app import make_addrservice_app, ADMIN_TOKEN_HEADER
+
+from tests.unit.address_data_test import address_data_suite
+
+
+class TenantsAppTest(tornado.testing.AsyncHTTPTestCase):
+    def setUp(self) -> None:
+        self.data_dir = tempfile.TemporaryDirectory()
+        super().setUp()
+        self.headers = {'Content-Type': 'application/json; charset=UTF-8'}
+        self.addr0 = next(iter(address_data_suite().values()))
+
+    def tearDown(self) -> None:
+        self.service.stop()
+        super().tearDown()
+        self.data_dir.cleanup()
+
+    def get_app(self) -> tornado.web.Application:
+        config = {
+            'service': {'name': 'Address Book Tenants Test'},
+            'addr-db': {'memory': None},
+            'admin': {'token': 'test-admin-token'},
+            'idempotency': {'memory': None},
+            'tenants': {
+                'data-dir': self.data_dir.name,
+                'max-entries': 2,
+                'rate': 1,
+                'burst': 8,
+            },
+        }
+        self.service, app = make_addrservice_app(config, False)
+        self.service.start()
+        return app
+
+    def get_new_ioloop(self):
+        IOLoop.configure('tornado.platform.asyncio.AsyncIOLoop')
+        instance = IOLoop.instance()
+        return instance
+
+    def post(self, uri: str):
+        return self.fetch(
+            uri, method='POST', headers=self.headers,
+            body=json.dumps(self.addr0)
+        )
+
+    def test_tenant_routes(self):
+        r = self.post('/t/acme/addressbook/')
+        self.assertEqual(r.code, 201)
+        addr_uri = r.headers['Location']
+        self.assertTrue(addr_uri.startswith('/t/acme/addressbook/'))
+
+        r = self.fetch(addr_uri)
+        self.assertEqual(r.code, 200)
+        self.assertEqual(json.loads(r.body.decode('utf-8')), self.addr0)
+
+        # Isolated from other tenants, and from the global address book
+        for uri in ['/t/other/addressbook', '/addressbook']:
+            r = self.fetch(uri)
+            self.assertEqual(json.loads(r.body.decode('utf-8')), {}, uri)
+
+        # Entry quota
+        self.assertEqual(self.post('/t/acme/addressbook/').code, 201)
+        r = self.post('/t/acme/addressbook/')
+        self.assertEqual(r.code, 403)
+
+        r = self.fetch(
+            '/debug/tenants', headers={ADMIN_TOKEN_HEADER: 'test-admin-token'}
+        )
+        info = json.loads(r.body.decode('utf-8'))
+        self.assertEqual(info['tenants']['acme']['entries'], 2)
+        self.assertGreater(info['tenants']['acme']['bytes'], 0)
+        self.assertEqual(info['total']['resident'], 2)
+
+    def test_idempotent_post(self):
+        headers = dict(self.headers)
+        headers['Idempotency-Key'] = 'test-idempotent-post'
+
+        def post(uri: str):
+            return self.fetch(
+                uri, method='POST', headers=headers,
+                body=json.dumps(self.addr0)
+            )
+
+        # Retries of a tenant get its entry created once
+        locations = [post('/t/acme/addressbook/') for _ in range(3)]
+        self.assertEqual([r.code for r in locations], [201] * 3)
+        self.assertEqual(len(set(r.headers['Location'] for r in locations)), 1)
+        r = self.fetch('/t/acme/addressbook')
+        self.assertEqual(len(json.loads(r.body.decode('utf-8'))), 1)
+
+        # Keys of other tenants, and of the global address book, are their own
+        for uri in ['/t/other/addressbook/', '/addressbook/']:
+            r = post(uri)
+            self.assertEqual(r.code, 201, uri)
+            self.assertTrue(r.headers['Location'].startswith(uri), uri)
+
+    def test_rate_limit(self):
+        codes = [self.fetch('/t/acme/addressbook').code for _ in range(10)]
+        self.assertEqual(codes[:8], [200] * 8)
+        self.assertEqual(codes[-1], 429)
+
+        r = self.fetch('/t/acme/addressbook')
+        self.assertEqual(r.code, 429)
+        self.assertGreaterEqual(int(r.headers['Retry-After']), 1)
+
+        # Other tenants are not limited
+        self.assertEqual(self.fetch('/t/other/addressbook').code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
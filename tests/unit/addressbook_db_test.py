@@ -1,14 +1,27 @@
 # Copyright (c) 2019. All rights reserved.
 
+import asyncio
 import asynctest  # type: ignore
 from io import StringIO
+import os
+import tempfile
 from typing import Dict
 import unittest
 import yaml
 
 from addrservice.addressbook_db import (
-    create_addressbook_db, InMemoryAddressBookDB, SQLAddressBookDB
+    create_addressbook_db,
+    InMemoryAddressBookDB,
+    project_address,
+    ShardedAddressBookDB,
+    SnapshotAddressBookDB,
+    SQLAddressBookDB,
+    TieredAddressBookDB,
 )
+from addrservice.aggregates import entry_counts
+from addrservice.pincode_index import entry_pincodes
+from addrservice.snapshot import write_snapshot
+from addrservice.workers import WorkerPool
 
 from tests.unit.address_data_test import address_data_suite
 
@@ -40,6 +53,51 @@ addr-db:
         db = create_addressbook_db(cfg['addr-db'])
         self.assertEqual(type(db), SQLAddressBookDB)
 
+    def test_tiered_db_config(self):
+        cfg = self.read_config('''
+addr-db:
+  tiered:
+    capacity: 100
+    write-policy: write-back
+    flush-interval: 0.5
+    cold:
+      memory: null
+        ''')
+
+        db = create_addressbook_db(cfg['addr-db'])
+        self.assertEqual(type(db), TieredAddressBookDB)
+        self.assertEqual(type(db.cold), InMemoryAddressBookDB)
+        self.assertEqual(db.hot.capacity, 100)
+        self.assertEqual(db.write_policy, 'write-back')
+        self.assertEqual(db.flush_interval, 0.5)
+
+    def test_sharded_db_config(self):
+        cfg = self.read_config('''
+addr-db:
+  sharded:
+    nodes:
+      - http://node0:8080/
+      - http://node1:8080
+    virtual-nodes: 16
+        ''')
+
+        db = create_addressbook_db(cfg['addr-db'])
+        self.assertEqual(type(db), ShardedAddressBookDB)
+        self.assertEqual(
+            db.ring.nodes, ['http://node0:8080', 'http://node1:8080']
+        )
+        self.assertEqual(db.ring.vnodes, 16)
+
+    def test_changelog_config(self):
+        cfg = self.read_config('''
+addr-db:
+  memory:
+    changelog-retention: 5
+        ''')
+
+        db = create_addressbook_db(cfg['addr-db'])
+        self.assertEqual(db.changelog.retention, 5)
+
 
 class InMemoryAddressBookDBTest(asynctest.TestCase):
     def setUp(self) -> None:
@@ -95,6 +153,147 @@ class InMemoryAddressBookDBTest(asynctest.TestCase):
         await self.addr_db.delete_address(new_nickname)
         self.assertEqual(len(self.addr_db.db), 0)
 
+        # Change log recorded every successful mutation, in order
+        changes = self.addr_db.changelog.since(0)
+        self.assertEqual(
+            [c.op for c in changes],
+            ['create'] * 2 + ['update', 'create'] + ['delete'] * 3
+        )
+        self.assertEqual([c.seq for c in changes], list(range(1, 8)))
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_concurrent_creates(self) -> None:
+        # Both validating (offloaded) at once: only one may create
+        worker_pool = WorkerPool(thresholds={'validate': 0})
+        worker_pool.start()
+        self.addr_db.set_worker_pool(worker_pool)
+        try:
+            results = await asyncio.gather(*[
+                self.addr_db.create_address(addr, 'x')
+                for addr in self.address_data.values()
+            ], return_exceptions=True)
+        finally:
+            worker_pool.stop()
+
+        self.assertEqual(results[0], 'x')
+        for r in results[1:]:
+            self.assertIsInstance(r, KeyError)
+        self.assertEqual(len(self.addr_db.changelog.since(0)), 1)
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_mutation_listeners(self) -> None:
+        events = []
+        self.addr_db.add_listener(lambda *args: events.append(args))
+
+        nickname, addr = next(iter(self.address_data.items()))
+        await self.addr_db.create_address(addr, nickname)
+        await self.addr_db.update_address(nickname, addr)
+        await self.addr_db.delete_address(nickname)
+
+        self.assertEqual(events, [
+            ('create', nickname, None, addr),
+            ('update', nickname, addr, addr),
+            ('delete', nickname, addr, None),
+        ])
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_load_and_apply_change(self) -> None:
+        nicknames = list(self.address_data.keys())
+        addr0 = self.address_data[nicknames[0]]
+        await self.addr_db.create_address(addr0, 'old')
+
+        events = []
+        self.addr_db.add_listener(lambda *args: events.append(args))
+
+        # Replaces all entries, and continues the change log from seq
+        self.addr_db.load(self.address_data.items(), 10)
+        self.assertEqual(self.addr_db.db, self.address_data)
+        self.assertEqual(events[0], ('delete', 'old', addr0, None))
+        self.assertEqual(
+            sorted(e[1] for e in events[1:] if e[0] == 'create'),
+            sorted(nicknames)
+        )
+        self.assertEqual(self.addr_db.changelog.last_seq, 10)
+        self.assertEqual(self.addr_db.changelog.since(10), [])
+        self.assertEqual(
+            len(self.addr_db.pincode_index),
+            sum(len(entry_pincodes(a)) for a in self.address_data.values())
+        )
+
+        # Upserts and deletes, without validation
+        self.addr_db.apply_change('update', 'new', {'name': 'N'})
+        self.addr_db.apply_change('update', 'new', {'name': 'NN'})
+        self.addr_db.apply_change('delete', nicknames[0], None)
+        self.assertEqual(await self.addr_db.read_address('new'), {
+            'name': 'NN'
+        })
+        self.assertNotIn(nicknames[0], self.addr_db.db)
+        self.assertEqual(
+            [(c.seq, c.op) for c in self.addr_db.changelog.since(10)],
+            [(11, 'create'), (12, 'update'), (13, 'delete')]
+        )
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_pincode_queries(self) -> None:
+        for nickname, addr in self.address_data.items():
+            await self.addr_db.create_address(addr, nickname)
+
+        addrs = await self.addr_db.read_addresses_by_pincode(110000, 111000)
+        self.assertEqual(set(addrs), {'namo', 'raga'})
+        self.assertEqual(addrs['namo'], self.address_data['namo'])
+
+        addrs = await self.addr_db.read_addresses_by_pincode(200000, 300000)
+        self.assertEqual(list(addrs), ['namo'])
+
+        nearest = await self.addr_db.nearest_pincodes(221000, 1)
+        self.assertEqual(nearest, [(221005, 'namo')])
+
+        await self.addr_db.delete_address('namo')
+        addrs = await self.addr_db.read_addresses_by_pincode(200000, 300000)
+        self.assertEqual(addrs, {})
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_projection(self) -> None:
+        for nickname, addr in self.address_data.items():
+            await self.addr_db.create_address(addr, nickname)
+
+        addr = await self.addr_db.read_address('namo', ['name', 'emails'])
+        self.assertEqual(addr, {
+            'name': self.address_data['namo']['name'],
+            'emails': self.address_data['namo']['emails'],
+        })
+        addrs = await self.addr_db.read_all_addresses({'name'})
+        self.assertEqual(addrs, {
+            nickname: {'name': addr['name']}
+            for nickname, addr in self.address_data.items()
+        })
+        # Unprojected reads are not copied
+        self.assertIs(
+            await self.addr_db.read_address('namo'), self.addr_db.db['namo']
+        )
+        self.assertEqual(project_address({'name': 'N'}, ['emails']), {})
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_aggregates(self) -> None:
+        namo = self.address_data['namo']
+        raga = self.address_data['raga']
+
+        await self.addr_db.create_address(namo, 'a')
+        await self.addr_db.create_address(raga, 'b')
+        aggregates = await self.addr_db.read_aggregates()
+        self.assertEqual(aggregates['entries'], 2)
+        self.assertEqual(aggregates['emails'], 3)
+        self.assertEqual(aggregates['kinds'], {'home': 2, 'work': 2})
+
+        await self.addr_db.update_address('a', raga)
+        await self.addr_db.delete_address('b')
+        aggregates = await self.addr_db.read_aggregates()
+        self.assertEqual(aggregates['entries'], 1)
+        self.assertEqual(aggregates['cities'], {'New Delhi': 1})
+
+        self.addr_db.load([('x', namo)], 10)
+        self.assertEqual(self.addr_db.aggregates.counts, entry_counts(namo))
+
 
 async def mock_sql_execute_query(qyery: str) -> str:
     return '{}'
@@ -119,6 +318,144 @@ class SQLAddressBookDBTest(asynctest.TestCase):
 
         self.assertEqual(sql_execute_fn.call_count, 4)
 
+    @asynctest.fail_on(active_handles=True)
+    @asynctest.patch('addrservice.addressbook_db.SomeSQLdbConnector.execute', side_effect=mock_sql_execute_query)  # noqa
+    async def test_write_batch(self, sql_execute_fn) -> None:
+        addr_db = create_addressbook_db({
+            'sql': {'write-batch': {'max-delay': 0.01}}
+        })
+        addr = self.address_data['namo']
+
+        await asyncio.gather(
+            addr_db.create_address(addr, 'a'),
+            addr_db.create_address(addr, 'b'),
+            addr_db.update_address('a', addr),
+            addr_db.delete_address('b'),
+        )
+
+        self.assertEqual(sql_execute_fn.call_count, 1)
+        query = sql_execute_fn.call_args[0][0]
+        self.assertTrue(query.startswith('BEGIN;'))
+        self.assertIn('COMMIT;', query)
+        self.assertEqual(query.count('ADDRESSES (NICKNAME, ADDRESS)'), 2)
+        self.assertEqual(query.count('DELETE FROM ADDRESSES'), 1)
+        # In the order applied: writes of an entry together
+        self.assertEqual(
+            [(c.op, c.nickname) for c in addr_db.changelog.since(0)],
+            [
+                ('create', 'a'), ('update', 'a'),
+                ('create', 'b'), ('delete', 'b')
+            ]
+        )
+        stats = addr_db.stats()
+        assert stats is not None
+        self.assertEqual(stats['write-batch']['coalesced'], 1)
+
+    @asynctest.fail_on(active_handles=True)
+    @asynctest.patch('addrservice.addressbook_db.SomeSQLdbConnector.execute')  # noqa
+    async def test_buffered_write_batch_failure(self, sql_execute_fn) -> None:
+        queries = []
+
+        async def execute(query: str) -> None:
+            queries.append(query)
+            if query.startswith('BEGIN;') or "'b'" in query:
+                raise RuntimeError('write failed')
+
+        sql_execute_fn.side_effect = execute
+        addr_db = create_addressbook_db({
+            'sql': {'write-batch': {'max-delay': 0.01, 'durability': 'buffered'}}  # noqa
+        })
+        assert isinstance(addr_db, SQLAddressBookDB)
+        assert addr_db.write_batcher is not None
+        addr = self.address_data['namo']
+
+        await addr_db.create_address(addr, 'a')
+        await addr_db.create_address(addr, 'b')
+        # Not applied yet: not in the change log
+        self.assertEqual(addr_db.changelog.last_seq, 0)
+
+        with self.assertLogs('addrservice', level='ERROR'):
+            await addr_db.write_batcher.flush()
+
+        self.assertTrue(queries[0].startswith('BEGIN;'))
+        self.assertEqual(queries[1], 'ROLLBACK;')
+        self.assertEqual(len(queries), 4)
+        # Only the write applied is in the change log
+        self.assertEqual(
+            [(c.op, c.nickname) for c in addr_db.changelog.since(0)],
+            [('create', 'a')]
+        )
+
+    @asynctest.fail_on(active_handles=True)
+    @asynctest.patch('addrservice.addressbook_db.SomeSQLdbConnector.execute')  # noqa
+    async def test_pincode_queries(self, sql_execute_fn) -> None:
+        addr = self.address_data['namo']
+        sql_execute_fn.return_value = '{"namo": {}}'
+
+        addrs = await self.addr_db.read_addresses_by_pincode(1, 2, limit=5)
+        self.assertEqual(addrs, {'namo': {}})
+        query = sql_execute_fn.call_args[0][0]
+        self.assertIn('BETWEEN 1 AND 2', query)
+        self.assertIn('LIMIT 5', query)
+
+        sql_execute_fn.return_value = '[[110011, "namo"], [110061, "namo"]]'
+        nearest = await self.addr_db.nearest_pincodes(110000, 1)
+        self.assertEqual(nearest, [(110011, 'namo')])
+
+        sql_execute_fn.return_value = None
+        await self.addr_db.create_address(addr, 'namo')
+        query = sql_execute_fn.call_args[0][0]
+        self.assertIn('ADDRESS_PINCODES', query)
+        self.assertIn("('namo', 221005)", query)
+
+    @asynctest.fail_on(active_handles=True)
+    @asynctest.patch('addrservice.addressbook_db.SomeSQLdbConnector.execute')  # noqa
+    async def test_projection(self, sql_execute_fn) -> None:
+        sql_execute_fn.return_value = '{"name": "N"}'
+
+        addr = await self.addr_db.read_address('namo', ['name', 'x'])
+        self.assertEqual(addr, {'name': 'N'})
+        query = sql_execute_fn.call_args[0][0]
+        self.assertIn(
+            "SELECT JSONB_STRIP_NULLS(JSONB_BUILD_OBJECT("
+            "'name', ADDRESS->'name'))",
+            query
+        )
+
+    @asynctest.fail_on(active_handles=True)
+    @asynctest.patch('addrservice.addressbook_db.SomeSQLdbConnector.execute')  # noqa
+    async def test_aggregates(self, sql_execute_fn) -> None:
+        addr = self.address_data['namo']
+        sql_execute_fn.return_value = None
+
+        await self.addr_db.create_address(addr, 'namo')
+        query = sql_execute_fn.call_args[0][0]
+        self.assertIn('INSERT INTO\n              ADDRESS_AGGREGATES', query)
+        self.assertIn("('cities', 'Varanasi', 1)", query)
+
+        # Counts of the old entry are subtracted before adding the new ones
+        await self.addr_db.update_address('namo', addr)
+        query = sql_execute_fn.call_args[0][0]
+        self.assertLess(
+            query.index('SET N = A.N - C.N'),
+            query.index('ADDRESS_COUNTS (NICKNAME, AGG, VAL, N)')
+        )
+
+        await self.addr_db.delete_address('namo')
+        query = sql_execute_fn.call_args[0][0]
+        self.assertLess(
+            query.index('SET N = A.N - C.N'),
+            query.index('DELETE FROM ADDRESSES')
+        )
+
+        sql_execute_fn.return_value = (
+            '[["entries", "", 2], ["countries", "India", 2]]'
+        )
+        aggregates = await self.addr_db.read_aggregates()
+        self.assertEqual(aggregates['entries'], 2)
+        self.assertEqual(aggregates['emails'], 0)
+        self.assertEqual(aggregates['countries'], {'India': 2})
+
     @asynctest.fail_on(active_handles=True)
     async def test_read_all_addresses(self) -> None:
         # TODO: Exercise: implement this function and update mock/patch
@@ -127,5 +464,263 @@ class SQLAddressBookDBTest(asynctest.TestCase):
         pass
 
 
+class SnapshotAddressBookDBTest(asynctest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.address_data = address_data_suite()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp_dir.name, 'addressbook.snap')
+        write_snapshot(path, self.address_data, seq=7)
+        self.addr_db = create_addressbook_db({'snapshot': {'path': path}})
+
+    def tearDown(self) -> None:
+        self.addr_db.stop()
+        self.tmp_dir.cleanup()
+
+    def test_snapshot_db_config(self) -> None:
+        self.assertEqual(type(self.addr_db), SnapshotAddressBookDB)
+        self.assertEqual(self.addr_db.changelog.last_seq, 7)
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_read_only(self) -> None:
+        for nickname, addr in self.address_data.items():
+            self.assertEqual(await self.addr_db.read_address(nickname), addr)
+        with self.assertRaises(KeyError):
+            await self.addr_db.read_address('unknown')
+
+        all_addrs = await self.addr_db.read_all_addresses()
+        self.assertEqual(all_addrs, self.address_data)
+
+        nickname, addr = next(iter(self.address_data.items()))
+        with self.assertRaises(PermissionError):
+            await self.addr_db.create_address(addr)
+        with self.assertRaises(PermissionError):
+            await self.addr_db.update_address(nickname, addr)
+        with self.assertRaises(PermissionError):
+            await self.addr_db.delete_address(nickname)
+        self.assertEqual(self.addr_db.changelog.since(7), [])
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_pincode_queries(self) -> None:
+        addrs = await self.addr_db.read_addresses_by_pincode(200000, 300000)
+        self.assertEqual(addrs, {'namo': self.address_data['namo']})
+
+        nearest = await self.addr_db.nearest_pincodes(221000, 1)
+        self.assertEqual(nearest, [(221005, 'namo')])
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_aggregates(self) -> None:
+        aggregates = await self.addr_db.read_aggregates()
+        self.assertEqual(aggregates['entries'], 2)
+        self.assertEqual(
+            aggregates['cities'], {'New Delhi': 2, 'Varanasi': 1}
+        )
+
+
+class TieredAddressBookDBTest(asynctest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.address_data = address_data_suite()
+        self.cold_db = InMemoryAddressBookDB()
+
+    async def crud_lifecycle(self, addr_db: TieredAddressBookDB) -> None:
+        for nickname, addr in self.address_data.items():
+            await addr_db.create_address(addr, nickname)
+        with self.assertRaises(KeyError):
+            await addr_db.create_address(addr, nickname)
+
+        namo = self.address_data['namo']
+        raga = self.address_data['raga']
+        await addr_db.update_address('namo', raga)
+        self.assertEqual(await addr_db.read_address('namo'), raga)
+        await addr_db.delete_address('raga')
+        with self.assertRaises(KeyError):
+            await addr_db.read_address('raga')
+        with self.assertRaises(KeyError):
+            await addr_db.update_address('raga', namo)
+        with self.assertRaises(KeyError):
+            await addr_db.delete_address('raga')
+        with self.assertRaises(ValueError):
+            await addr_db.create_address({'nickname': 'No Name'}, 'x')
+
+        self.assertEqual(
+            [c.op for c in addr_db.changelog.since(0)],
+            ['create', 'create', 'update', 'delete']
+        )
+        self.assertEqual(
+            await addr_db.read_all_addresses(), {'namo': raga}
+        )
+        self.assertEqual(self.cold_db.db, {'namo': raga})
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_write_through(self) -> None:
+        addr_db = TieredAddressBookDB(self.cold_db, capacity=10)
+        await self.crud_lifecycle(addr_db)
+        self.assertEqual(addr_db.stats()['flushes'], 0)
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_write_back(self) -> None:
+        addr_db = TieredAddressBookDB(
+            self.cold_db, capacity=10, write_policy='write-back'
+        )
+        await self.crud_lifecycle(addr_db)
+
+        # Created then deleted before a flush: cold DB never sees it
+        await addr_db.create_address(self.address_data['raga'], 'tmp')
+        await addr_db.update_address('tmp', self.address_data['namo'])
+        await addr_db.delete_address('tmp')
+        self.assertEqual(addr_db.dirty, {})
+
+        await addr_db.update_address('namo', self.address_data['namo'])
+        self.assertEqual(
+            self.cold_db.db['namo'], self.address_data['raga']
+        )
+        await addr_db.flush()
+        self.assertEqual(
+            self.cold_db.db['namo'], self.address_data['namo']
+        )
+        self.assertEqual(addr_db.stats()['dirty'], 0)
+        # Lifecycle flushed as one create, as raga was created and deleted
+        self.assertEqual(
+            [c.op for c in self.cold_db.changelog.since(0)],
+            ['create', 'update']
+        )
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_write_back_scheduled_flush(self) -> None:
+        addr_db = TieredAddressBookDB(
+            self.cold_db, write_policy='write-back', flush_interval=0.01
+        )
+        addr_db.start()
+        nickname, addr = next(iter(self.address_data.items()))
+        await addr_db.create_address(addr, nickname)
+        self.assertEqual(self.cold_db.db, {})
+
+        await asyncio.sleep(0.1)
+        addr_db.stop()
+        self.assertEqual(self.cold_db.db, {nickname: addr})
+        self.assertEqual(addr_db.stats()['flushes'], 1)
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_tune(self) -> None:
+        addr_db = TieredAddressBookDB(
+            self.cold_db, write_policy='write-back', flush_interval=10
+        )
+        addr_db.start()
+        for nickname, addr in self.address_data.items():
+            await addr_db.create_address(addr, nickname)
+
+        # Takes effect now, not after the scheduled flush
+        addr_db.tune(capacity=1, flush_interval=0.01, max_dirty=1000)
+        self.assertEqual(len(addr_db.hot.items), 1)
+        await asyncio.sleep(0.1)
+        addr_db.stop()
+        self.assertEqual(self.cold_db.db, self.address_data)
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_write_back_stop(self) -> None:
+        addr_db = TieredAddressBookDB(
+            self.cold_db, write_policy='write-back', flush_interval=10
+        )
+        addr_db.start()
+        for nickname, addr in self.address_data.items():
+            await addr_db.create_address(addr, nickname)
+
+        flushed_on_stop = []
+        with asynctest.patch.object(
+            self.cold_db, 'stop',
+            side_effect=lambda: flushed_on_stop.append(dict(self.cold_db.db))
+        ):
+            # Loop running: cold DB is stopped once flushed
+            addr_db.stop()
+            self.assertEqual(flushed_on_stop, [])
+            await asyncio.sleep(0.05)
+        self.assertEqual(flushed_on_stop, [self.address_data])
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_write_back_flush_error(self) -> None:
+        addr_db = TieredAddressBookDB(
+            self.cold_db, capacity=10, write_policy='write-back'
+        )
+        nickname, addr = next(iter(self.address_data.items()))
+        await addr_db.create_address(addr, nickname)
+
+        with asynctest.patch.object(
+            self.cold_db, 'create_address', side_effect=RuntimeError()
+        ):
+            with self.assertRaises(RuntimeError):
+                await addr_db.flush()
+        self.assertEqual(addr_db.stats()['flush-errors'], 1)
+
+        # Failed change is kept, and coalesced with newer ones
+        await addr_db.update_address(nickname, addr)
+        self.assertEqual(addr_db.dirty, {nickname: ('create', addr)})
+        await addr_db.flush()
+        self.assertEqual(self.cold_db.db, {nickname: addr})
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_write_back_concurrent_creates(self) -> None:
+        addr_db = TieredAddressBookDB(
+            self.cold_db, capacity=10, write_policy='write-back'
+        )
+        namo = self.address_data['namo']
+
+        # Both miss, and share a cold read: only one may create
+        results = await asyncio.gather(
+            addr_db.create_address(namo, 'x'),
+            addr_db.create_address(self.address_data['raga'], 'x'),
+            return_exceptions=True
+        )
+        self.assertEqual(results[0], 'x')
+        self.assertEqual(results[1].args, ('x already exists',))
+        self.assertEqual(addr_db.dirty, {'x': ('create', namo)})
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_write_during_cold_read(self) -> None:
+        addr_db = TieredAddressBookDB(self.cold_db, capacity=10)
+        await self.cold_db.create_address(self.address_data['namo'], 'x')
+        cold_read = self.cold_db.read_address
+
+        async def slow_read(nickname, fields=None):
+            addr = await cold_read(nickname, fields)
+            await asyncio.sleep(0.02)
+            return addr
+
+        with asynctest.patch.object(self.cold_db, 'read_address', slow_read):
+            first = asyncio.ensure_future(addr_db.read_address('x'))
+            await asyncio.sleep(0.01)
+            await addr_db.delete_address('x')
+            # Started after the delete: must not get the entry read before
+            with self.assertRaises(KeyError):
+                await addr_db.read_address('x')
+            with self.assertRaises(KeyError):
+                await first
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_promotion(self) -> None:
+        for i in range(5):
+            await self.cold_db.create_address(
+                self.address_data['namo'], str(i)
+            )
+
+        addr_db = TieredAddressBookDB(self.cold_db, capacity=2)
+        for _ in range(3):
+            await addr_db.read_address('0')
+            await addr_db.read_address('1')
+        # One-off reads don't evict the frequently read entries
+        for i in range(2, 5):
+            await addr_db.read_address(str(i))
+        with self.assertRaises(KeyError):
+            await addr_db.read_address('unknown')
+
+        self.assertEqual(set(addr_db.hot.items), {'0', '1'})
+        stats = addr_db.stats()
+        self.assertEqual(stats['hits'], 4)
+        self.assertEqual(stats['misses'], 6)
+        self.assertEqual(stats['promotions'], 2)
+        self.assertEqual(stats['rejections'], 3)
+        self.assertAlmostEqual(stats['hit-ratio'], 0.4)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,72 @@
+# Copyright (c) 2019. All rights reserved.
+
+import unittest
+
+from addrservice.aggregates import (
+    aggregate_counts,
+    Aggregates,
+    count_changes,
+    entry_counts,
+)
+
+from tests.unit.address_data_test import address_data_suite
+
+
+class AggregatesTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.address_data = address_data_suite()
+
+    def test_entry_counts(self) -> None:
+        counts = entry_counts(self.address_data['namo'])
+        self.assertEqual(counts[('entries', '')], 1)
+        self.assertEqual(counts[('addresses', '')], 3)
+        self.assertEqual(counts[('emails', '')], 2)
+        # Entries, not addresses, by value
+        self.assertEqual(counts[('cities', 'New Delhi')], 1)
+        self.assertEqual(counts[('cities', 'Varanasi')], 1)
+        self.assertEqual(counts[('kinds', 'home')], 1)
+
+        self.assertEqual(entry_counts({'name': 'N'}), {('entries', ''): 1})
+
+    def test_count_changes(self) -> None:
+        namo = self.address_data['namo']
+        raga = self.address_data['raga']
+
+        self.assertEqual(count_changes(namo, namo), {})
+        self.assertEqual(count_changes(namo, raga), {
+            ('addresses', ''): -1,
+            ('emails', ''): -1,
+            ('cities', 'Varanasi'): -1,
+        })
+        self.assertEqual(count_changes(None, raga), entry_counts(raga))
+
+    def test_mutations(self) -> None:
+        namo = self.address_data['namo']
+        raga = self.address_data['raga']
+
+        aggregates = Aggregates()
+        aggregates.on_mutation('create', 'a', None, namo)
+        aggregates.on_mutation('create', 'b', None, raga)
+        stats = aggregates.to_dict()
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(stats['faxNumbers'], 4)
+        self.assertEqual(stats['countries'], {'India': 2})
+        self.assertEqual(
+            stats['cities'], {'New Delhi': 2, 'Varanasi': 1}
+        )
+
+        aggregates.on_mutation('update', 'a', namo, raga)
+        aggregates.on_mutation('delete', 'b', raga, None)
+        self.assertEqual(aggregates.counts, entry_counts(raga))
+        self.assertEqual(
+            aggregate_counts(aggregates.to_dict()), aggregates.counts
+        )
+
+        aggregates.on_mutation('delete', 'a', raga, None)
+        self.assertEqual(aggregates.counts, {})
+        self.assertEqual(aggregates.to_dict()['entries'], 0)
+        self.assertEqual(aggregates.to_dict()['cities'], {})
+
+
+if __name__ == '__main__':
+    unittest.main()
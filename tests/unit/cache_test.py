@@ -0,0 +1,99 @@
+# Copyright (c) 2019. All rights reserved.
+
+import unittest
+
+from addrservice.cache import CountMinSketch, TinyLFUCache
+
+
+class CountMinSketchTest(unittest.TestCase):
+    def test_estimate(self) -> None:
+        sketch = CountMinSketch(width=1024, sample_size=10000)
+        for i in range(100):
+            for _ in range(i % 10):
+                sketch.increment(i)
+
+        for i in range(100):
+            # Never under estimates, and rarely over with few keys
+            self.assertGreaterEqual(sketch.estimate(i), i % 10)
+        self.assertLessEqual(
+            sum(sketch.estimate(i) - i % 10 for i in range(100)), 10
+        )
+
+        sketch.increment('hot')
+        for _ in range(100):
+            sketch.increment('hot')
+        self.assertEqual(sketch.estimate('hot'), CountMinSketch.MAX_COUNT)
+
+    def test_reset(self) -> None:
+        sketch = CountMinSketch(width=16, sample_size=20)
+        for _ in range(10):
+            sketch.increment('a')
+        self.assertEqual(sketch.estimate('a'), 10)
+
+        for _ in range(10):
+            sketch.increment('b')
+        # Halved on the 20th increment
+        self.assertEqual(sketch.estimate('a'), 5)
+        self.assertEqual(sketch.increments, 10)
+
+
+class TinyLFUCacheTest(unittest.TestCase):
+    def test_lru(self) -> None:
+        cache: TinyLFUCache[str, int] = TinyLFUCache(2)
+        self.assertTrue(cache.put('a', 1))
+        self.assertTrue(cache.put('b', 2))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('c'))
+
+        # 'c' seen twice beats LRU 'b' seen once
+        cache.put('c', 3)
+        self.assertTrue(cache.put('c', 3))
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.peek('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+        self.assertEqual(cache.pop('a'), 1)
+        self.assertIsNone(cache.pop('a'))
+        self.assertEqual(len(cache), 1)
+
+    def test_admission(self) -> None:
+        cache: TinyLFUCache[str, int] = TinyLFUCache(100)
+        for _ in range(3):
+            for i in range(100):
+                cache.put('hot{}'.format(i), i)
+                cache.get('hot{}'.format(i))
+
+        # A scan of one-off keys doesn't evict frequently used ones, but for
+        # the odd key whose sketch counters all collide with hot ones.
+        for i in range(100):
+            cache.put('cold{}'.format(i), i)
+        self.assertEqual(len(cache), 100)
+        self.assertGreaterEqual(
+            sum('hot{}'.format(i) in cache for i in range(100)), 95
+        )
+        self.assertGreaterEqual(cache.stats()['rejections'], 95)
+
+    def test_capacity(self) -> None:
+        with self.assertRaises(ValueError):
+            TinyLFUCache(0)
+
+    def test_resize(self) -> None:
+        cache: TinyLFUCache[str, int] = TinyLFUCache(4)
+        for k in 'abcd':
+            cache.put(k, 1)
+        cache.get('a')
+
+        cache.resize(2)
+        self.assertEqual(sorted(cache.items), ['a', 'd'])
+        self.assertEqual(cache.evictions, 2)
+        cache.resize(3)
+        cache.put('e', 1)
+        self.assertEqual(len(cache.items), 3)
+
+        with self.assertRaises(ValueError):
+            cache.resize(0)
+
+
+if __name__ == '__main__':
+    unittest.main()
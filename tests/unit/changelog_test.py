@@ -0,0 +1,83 @@
+# Copyright (c) 2019. All rights reserved.
+
+import asyncio
+import asynctest  # type: ignore
+import unittest
+
+from addrservice.changelog import (
+    ChangeLog,
+    ResyncRequiredError,
+    OP_CREATE,
+    OP_DELETE,
+    OP_UPDATE,
+)
+
+
+class ChangeLogTest(asynctest.TestCase):
+    def test_since(self) -> None:
+        log = ChangeLog(retention=3)
+        self.assertEqual(log.since(0), [])
+        with self.assertRaises(ValueError):
+            log.since(-1)
+        # Ahead of the log, e.g. of a restarted primary
+        with self.assertRaises(ResyncRequiredError) as cm:
+            log.since(1)
+        self.assertEqual(cm.exception.last_seq, 0)
+
+        log.append(OP_CREATE, 'a', {'name': 'A'})
+        log.append(OP_UPDATE, 'a', {'name': 'AA'})
+        log.append(OP_DELETE, 'a')
+        self.assertEqual([c.seq for c in log.since(0)], [1, 2, 3])
+        self.assertEqual([c.op for c in log.since(1)], [OP_UPDATE, OP_DELETE])
+        self.assertEqual([c.seq for c in log.since(0, limit=2)], [1, 2])
+        self.assertEqual(log.since(3), [])
+
+        # Retention exceeded: consumer at 0 has missed seq 1
+        log.append(OP_CREATE, 'b', {'name': 'B'})
+        self.assertEqual(log.first_seq, 2)
+        with self.assertRaises(ResyncRequiredError) as cm:
+            log.since(0)
+        self.assertEqual(cm.exception.last_seq, 4)
+        self.assertEqual([c.seq for c in log.since(1)], [2, 3, 4])
+
+        self.assertEqual(log.since(3)[0].to_dict()['address'], {'name': 'B'})
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_reset(self) -> None:
+        log = ChangeLog()
+        log.append(OP_CREATE, 'a', {'name': 'A'})
+
+        waiter = asyncio.ensure_future(log.wait(1, timeout=5))
+        await asyncio.sleep(0)
+        log.reset(10)
+        # Waiters wake up, and must resync too
+        with self.assertRaises(ResyncRequiredError):
+            await waiter
+
+        self.assertEqual(log.first_seq, 11)
+        self.assertEqual(log.since(10), [])
+        with self.assertRaises(ResyncRequiredError):
+            log.since(1)
+        self.assertEqual(log.append(OP_DELETE, 'a').seq, 11)
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_wait(self) -> None:
+        log = ChangeLog()
+
+        # Times out without changes
+        self.assertEqual(await log.wait(0, 0.01), [])
+
+        async def append_later():
+            await asyncio.sleep(0.01)
+            log.append(OP_CREATE, 'a', {'name': 'A'})
+
+        changes, _ = await asyncio.gather(log.wait(0, 5), append_later())
+        self.assertEqual([c.nickname for c in changes], ['a'])
+
+        # Returns right away when there are changes already
+        changes = await log.wait(0, 5)
+        self.assertEqual(len(changes), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+# Copyright (c) 2019. All rights reserved.
+
+import asynctest  # type: ignore
+import gzip
+import json
+import unittest
+
+from tornado.httputil import HTTPHeaders, HTTPServerRequest
+
+from addrservice.compression import (
+    available_encodings,
+    BROTLI,
+    compress,
+    Compression,
+    GZIP,
+    parse_accept_encoding,
+    StreamCompressor,
+    ZSTD,
+)
+
+try:
+    import brotli  # type: ignore
+except ImportError:
+    brotli = None
+try:
+    import zstandard  # type: ignore
+except ImportError:
+    zstandard = None  # type: ignore
+
+
+def decompress(body: bytes, encoding: str) -> bytes:
+    if encoding == BROTLI:
+        return brotli.decompress(body)
+    if encoding == ZSTD:
+        return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    return gzip.decompress(body)
+
+
+def make_request(uri: str, accept_encoding: str) -> HTTPServerRequest:
+    return HTTPServerRequest(
+        method='GET', uri=uri,
+        headers=HTTPHeaders({'Accept-Encoding': accept_encoding})
+    )
+
+
+class CompressionTest(asynctest.TestCase):
+    def setUp(self) -> None:
+        self.compression = Compression.from_config({
+            'encodings': [GZIP],
+            'routes': [
+                {'path': '/addressbook/?$', 'encodings': [BROTLI, GZIP],
+                 'levels': {GZIP: 9}, 'min-size': 10},
+            ],
+        })
+        self.body = json.dumps({str(i): 'x' * i for i in range(100)}).encode()
+
+    def test_accept_encoding(self) -> None:
+        self.assertEqual(
+            parse_accept_encoding('gzip, br;q=0.5 , *;q=0, zstd;q=x'),
+            {'gzip': 1.0, 'br': 0.5, '*': 0.0, 'zstd': 0.0}
+        )
+        self.assertEqual(parse_accept_encoding(''), {})
+
+    def test_negotiate(self) -> None:
+        rule = self.compression.rule_for('/addressbook')
+        self.assertEqual(rule.levels[GZIP], 9)
+        self.assertEqual(rule.min_size, 10)
+        # Client preference by q, else server preference
+        self.assertEqual(rule.negotiate('gzip;q=0.9, br;q=0.1'), GZIP)
+        self.assertEqual(rule.negotiate('identity'), None)
+        self.assertEqual(rule.negotiate('gzip;q=0'), None)
+        if BROTLI in available_encodings():
+            self.assertEqual(rule.negotiate('gzip, br'), BROTLI)
+            self.assertEqual(rule.negotiate('*'), BROTLI)
+        else:
+            self.assertEqual(rule.negotiate('gzip, br'), GZIP)
+
+        # Default rule
+        rule = self.compression.rule_for('/addressbook/_changes')
+        self.assertEqual(rule.negotiate('br'), None)
+        self.assertEqual(rule.min_size, 1024)
+
+        with self.assertRaises(ValueError):
+            Compression.from_config({'encodings': ['lzma']})
+
+    def test_compressors(self) -> None:
+        for encoding in available_encodings():
+            self.assertEqual(
+                decompress(compress(self.body, encoding, 1), encoding),
+                self.body,
+                encoding
+            )
+
+            # Chunks are flushed, so each can be decoded as it arrives
+            c = StreamCompressor(encoding, 1)
+            chunks = [c.compress(self.body[:100], False)]
+            chunks.append(c.compress(self.body[100:], True))
+            self.assertTrue(chunks[0], encoding)
+            self.assertEqual(
+                decompress(b''.join(chunks), encoding), self.body, encoding
+            )
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_cache(self) -> None:
+        made = []
+
+        async def make_body() -> bytes:
+            made.append(1)
+            return self.body
+
+        request = make_request('/addressbook', 'gzip')
+        for version in [1, 1, 2]:
+            encoding, body = await self.compression.encode(
+                request, version, make_body, None
+            )
+            self.assertEqual(encoding, GZIP)
+            self.assertEqual(gzip.decompress(body), self.body)
+        self.assertEqual(len(made), 2)
+
+        # Cached per encoding
+        encoding, body = await self.compression.encode(
+            make_request('/addressbook', 'identity'), 2, make_body, None
+        )
+        self.assertEqual((encoding, body), (None, self.body))
+        self.assertEqual(len(made), 3)
+        stats = self.compression.stats()
+        self.assertEqual((stats['cache-hits'], stats['cache-misses']), (1, 3))
+
+        # Unknown version: not cached
+        for _ in range(2):
+            encoding, body = await self.compression.encode(
+                request, None, make_body, None
+            )
+            self.assertEqual(gzip.decompress(body), self.body)
+        self.assertEqual(len(made), 5)
+        stats = self.compression.stats()
+        self.assertEqual((stats['cache-hits'], stats['cache-misses']), (1, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
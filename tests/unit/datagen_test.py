@@ -0,0 +1,44 @@
+# Copyright (c) 2019. All rights reserved.
+
+import io
+import json
+import unittest
+
+from addrservice.addressbook_db import validate_address
+
+from benchmarks.datagen import generate_entries, generate_entry, write_ndjson
+
+
+class DatagenTest(unittest.TestCase):
+    def test_deterministic(self) -> None:
+        entries = list(generate_entries(50, seed=3))
+        self.assertEqual(list(generate_entries(50, seed=3)), entries)
+        self.assertNotEqual(list(generate_entries(50, seed=4)), entries)
+
+        # Any range on its own
+        self.assertEqual(
+            list(generate_entries(10, seed=3, start=20)), entries[20:30]
+        )
+        self.assertEqual(generate_entry(3, 42), entries[42][1])
+
+        nicknames = [nickname for nickname, _ in entries]
+        self.assertEqual(nicknames, sorted(set(nicknames)))
+
+    def test_valid(self) -> None:
+        for _, entry in generate_entries(200, seed=1):
+            validate_address(entry)
+
+    def test_ndjson(self) -> None:
+        entries = list(generate_entries(20))
+        f = io.StringIO()
+        self.assertEqual(write_ndjson(f, iter(entries)), len(entries))
+
+        lines = f.getvalue().splitlines()
+        self.assertEqual(
+            [(x['nickname'], x['address']) for x in map(json.loads, lines)],
+            entries
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
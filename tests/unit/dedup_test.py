@@ -0,0 +1,122 @@
+# Copyright (c) 2019. All rights reserved.
+
+import copy
+import unittest
+
+from addrservice.dedup import (
+    canonicalize,
+    DedupIndex,
+    fingerprint,
+    merge_entries,
+    DEFAULT_FINGERPRINT_FIELDS,
+)
+
+from tests.unit.address_data_test import address_data_suite
+
+
+def near_duplicate(addr):
+    '''Same contact, as typed by someone else.'''
+    dup = copy.deepcopy(addr)
+    dup['name'] = '  ' + addr['name'].upper().replace(' ', '   ') + '.'
+    dup['emails'] = list(reversed(dup['emails']))
+    for e in dup['emails']:
+        e['value'] = e['value'].upper()
+    for p in dup['phoneNumbers']:
+        p['countryCode'] = '+{}'.format(p['countryCode'])
+        p['number'] = '{}-{}'.format(
+            str(p['number'])[:4], str(p['number'])[4:]
+        )
+    return dup
+
+
+class DedupTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.address_data = address_data_suite()
+        self.raga = self.address_data['raga']
+        self.namo = self.address_data['namo']
+
+    def test_canonicalize(self) -> None:
+        entry = canonicalize({
+            'name': ' Rahul \t Gandhi ',
+            'phoneNumbers': [
+                {'kind': 'Work', 'countryCode': '+91', 'number': '2379 5161'},
+                {'kind': 'work', 'countryCode': 91, 'number': 23795161},
+            ],
+            'emails': [{'kind': 'work', 'value': 'Office@RahulGandhi.in'}],
+            'addresses': [{'kind': 'home', 'pincode': '110 011'}],
+        })
+        self.assertEqual(entry, {
+            'name': 'Rahul Gandhi',
+            'phoneNumbers': [
+                {'kind': 'work', 'countryCode': 91, 'number': 23795161},
+            ],
+            'emails': [{'kind': 'work', 'value': 'office@rahulgandhi.in'}],
+            'addresses': [{'kind': 'home', 'pincode': 110011}],
+        })
+        self.assertEqual(canonicalize(self.namo), self.namo)
+        self.assertEqual(len(canonicalize(self.raga)['faxNumbers']), 1)
+        # Left to validation
+        self.assertEqual(canonicalize([]), [])  # type: ignore
+        self.assertEqual(
+            canonicalize({'phoneNumbers': 'x'}), {'phoneNumbers': 'x'}
+        )
+
+    def test_fingerprint(self) -> None:
+        fields = DEFAULT_FINGERPRINT_FIELDS
+        fp = fingerprint(self.raga, fields)
+        dup = canonicalize(near_duplicate(self.raga))
+        self.assertEqual(fingerprint(dup, fields), fp)
+        # Fields not fingerprinted don't matter
+        dup['addresses'] = dup['addresses'][:1]
+        self.assertEqual(fingerprint(dup, fields), fp)
+
+        self.assertNotEqual(fingerprint(self.namo, fields), fp)
+        dup['emails'][0]['value'] = 'rahul@rahulgandhi.in'
+        self.assertNotEqual(fingerprint(dup, fields), fp)
+        self.assertNotEqual(fingerprint(self.raga, ['name', 'addresses']), fp)
+
+    def test_merge(self) -> None:
+        new = copy.deepcopy(self.raga)
+        del new['faxNumbers']
+        new['addresses'][0]['streetName'] = 'AKBAR RD.'
+        new['addresses'].append(self.namo['addresses'][0])
+        new['emails'] = self.namo['emails']
+
+        merged = merge_entries(self.raga, new)
+        # Near-identical items aren't duplicated
+        self.assertEqual(
+            merged['addresses'],
+            self.raga['addresses'] + [self.namo['addresses'][0]]
+        )
+        self.assertEqual(merged['faxNumbers'], self.raga['faxNumbers'])
+        self.assertEqual(
+            merged['emails'], self.raga['emails'] + self.namo['emails']
+        )
+        self.assertEqual(merge_entries(self.raga, self.raga), self.raga)
+
+    def test_index(self) -> None:
+        index = DedupIndex()
+        index.on_mutation('create', 'b', None, self.raga)
+        index.on_mutation(
+            'create', 'a', None, canonicalize(near_duplicate(self.raga))
+        )
+        index.on_mutation('create', 'c', None, self.namo)
+        self.assertEqual(len(index), 3)
+
+        fp = index.fingerprint(canonicalize(self.raga))
+        self.assertEqual(index.find(fp), 'a')
+        self.assertEqual(index.groups(), [['a', 'b']])
+
+        index.on_mutation('update', 'a', None, self.namo)
+        self.assertEqual(index.find(fp), 'b')
+        self.assertEqual(index.groups(), [['a', 'c']])
+        index.on_mutation('delete', 'b', self.raga, None)
+        self.assertIsNone(index.find(fp))
+        self.assertEqual(index.stats()['fingerprints'], 1)
+
+        with self.assertRaises(ValueError):
+            DedupIndex.from_config({'policy': 'ignore'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+# Copyright (c) 2019. All rights reserved.
+
+import asynctest  # type: ignore
+import json
+import unittest
+
+from addrservice.idempotency import (
+    create_idempotency_store,
+    request_hash,
+    validate_idempotency_key,
+    IdempotencyRecord,
+    InMemoryIdempotencyStore,
+    SQLIdempotencyStore,
+)
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class IdempotencyTest(unittest.TestCase):
+    def test_request_hash(self) -> None:
+        self.assertEqual(
+            request_hash({'a': 1, 'b': [1, 2]}),
+            request_hash(json.loads('{ "b": [1, 2],  "a": 1 }'))
+        )
+        self.assertNotEqual(request_hash({'a': 1}), request_hash({'a': 2}))
+
+    def test_validate_key(self) -> None:
+        validate_idempotency_key('8e03978e-40d5-43e8-bc93-6894a57f9324')
+        for key in ['', 'x' * 256, "'; DROP TABLE ADDRESSES; --"]:
+            with self.assertRaises(ValueError):
+                validate_idempotency_key(key)
+
+    def test_config(self) -> None:
+        store = create_idempotency_store({'memory': {'max-entries': 10}})
+        self.assertEqual(type(store), InMemoryIdempotencyStore)
+        self.assertEqual(store.max_entries, 10)  # type: ignore
+
+        store = create_idempotency_store({'sql': None})
+        self.assertEqual(type(store), SQLIdempotencyStore)
+
+
+class InMemoryIdempotencyStoreTest(asynctest.TestCase):
+    @asynctest.fail_on(active_handles=True)
+    async def test_ttl_and_bound(self) -> None:
+        clock = FakeClock()
+        store = InMemoryIdempotencyStore(max_entries=2, ttl=10, clock=clock)
+        record = IdempotencyRecord('hash', 'nickname', 201)
+
+        self.assertIsNone(await store.get('k1'))
+        await store.put('k1', record)
+        self.assertEqual(await store.get('k1'), record)
+
+        # Bounded: least recently used key is evicted
+        await store.put('k2', record)
+        await store.get('k1')
+        await store.put('k3', record)
+        self.assertIsNone(await store.get('k2'))
+        self.assertEqual(await store.get('k1'), record)
+        self.assertEqual(len(store.records), 2)
+
+        # Expired after ttl
+        clock.now += 10
+        self.assertIsNone(await store.get('k1'))
+        self.assertEqual(len(store.records), 1)
+
+
+async def mock_sql_execute_query(query: str) -> str:
+    if query.strip().startswith('SELECT'):
+        return json.dumps({
+            'REQUEST_HASH': 'hash', 'NICKNAME': 'nickname', 'STATUS': 201
+        })
+    return ''
+
+
+class SQLIdempotencyStoreTest(asynctest.TestCase):
+    @asynctest.fail_on(active_handles=True)
+    @asynctest.patch('addrservice.addressbook_db.SomeSQLdbConnector.execute', side_effect=mock_sql_execute_query)  # noqa
+    async def test_get_put(self, sql_execute_fn) -> None:
+        store = SQLIdempotencyStore()
+        record = IdempotencyRecord('hash', 'nickname', 201)
+        await store.put('k1', record)
+        self.assertEqual(await store.get('k1'), record)
+        self.assertEqual(sql_execute_fn.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+# Copyright (c) 2019. All rights reserved.
+
+import asyncio
+import time
+import unittest
+
+from addrservice.loop_monitor import (
+    LoopMonitor,
+    LAG_METRIC,
+    SLOW_CALLBACK_METRIC,
+)
+from addrservice.tracing import HistogramCollector, set_trace_collectors
+
+
+class LoopMonitorTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.histograms = HistogramCollector()
+        set_trace_collectors([self.histograms])
+
+    def tearDown(self) -> None:
+        set_trace_collectors([])
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def test_config(self):
+        monitor = LoopMonitor.from_config({'slow-callback-threshold': 0.5})
+        self.assertEqual(monitor.interval, 0.1)
+        self.assertEqual(monitor.slow_callback_threshold, 0.5)
+
+    def test_slow_callback(self):
+        monitor = LoopMonitor(interval=0.01, slow_callback_threshold=0.05)
+
+        async def workload():
+            await asyncio.sleep(0.05)
+            time.sleep(0.2)  # blocks the event loop
+            await asyncio.sleep(0.05)
+
+        monitor.start()
+        with self.assertLogs('addrservice', level='WARNING') as logs:
+            self.loop.run_until_complete(workload())
+        monitor.stop()
+
+        self.assertIn('Event loop blocked', logs.output[0])
+        self.assertIn('workload', logs.output[0])
+
+        stats = monitor.stats()
+        self.assertGreaterEqual(stats['slow-callbacks'], 1)
+        self.assertGreaterEqual(stats['last-slow-callback']['duration'], 100)
+        self.assertGreater(stats['lag']['count'], 2)
+        self.assertGreaterEqual(stats['lag']['max'], 100)
+
+        # Exported through the tracing collectors
+        summary = self.histograms.summary()
+        self.assertEqual(summary[LAG_METRIC]['count'], stats['lag']['count'])
+        self.assertEqual(
+            summary[SLOW_CALLBACK_METRIC]['count'], stats['slow-callbacks']
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+# Copyright (c) 2019. All rights reserved.
+
+import unittest
+
+from addrservice.pincode_index import entry_pincodes, PincodeIndex
+
+from tests.unit.address_data_test import address_data_suite
+
+
+def entry(*pincodes):
+    return {'addresses': [{'pincode': p} for p in pincodes]}
+
+
+class PincodeIndexTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.index = PincodeIndex()
+        self.index.add('a', entry(100, 300))
+        self.index.add('b', entry(200))
+        self.index.add('c', entry(200, 200, 400))
+        self.index.add('d', {'addresses': [{'city': 'Nowhere'}]})
+
+    def test_entry_pincodes(self) -> None:
+        self.assertEqual(entry_pincodes(entry(3, 1, 3)), [1, 3])
+        self.assertEqual(entry_pincodes({}), [])
+
+        addrs = address_data_suite()
+        self.assertEqual(entry_pincodes(addrs['raga']), [110011])
+
+    def test_range(self) -> None:
+        self.assertEqual(len(self.index), 5)
+        self.assertEqual(self.index.range(100, 400), ['a', 'b', 'c'])
+        self.assertEqual(self.index.range(150, 350), ['b', 'c', 'a'])
+        self.assertEqual(self.index.range(200, 200), ['b', 'c'])
+        self.assertEqual(self.index.range(401, 500), [])
+        self.assertEqual(self.index.range(400, 100), [])
+        self.assertEqual(self.index.range(0, 1000, limit=2), ['a', 'b'])
+
+    def test_nearest(self) -> None:
+        nearest = self.index.nearest(290, 3)
+        self.assertEqual(nearest[0], (300, 'a'))
+        self.assertEqual(set(nearest[1:]), {(200, 'b'), (200, 'c')})
+        self.assertEqual(self.index.nearest(0, 1), [(100, 'a')])
+        self.assertEqual(self.index.nearest(1000, 1), [(400, 'c')])
+        self.assertEqual(len(self.index.nearest(250, 100)), 5)
+        self.assertEqual(PincodeIndex().nearest(250, 3), [])
+
+    def test_mutations(self) -> None:
+        self.index.on_mutation('update', 'a', entry(100, 300), entry(500))
+        self.assertEqual(self.index.range(0, 1000), ['b', 'c', 'a'])
+
+        self.index.on_mutation('delete', 'c', entry(200, 400), None)
+        self.assertEqual(self.index.range(0, 1000), ['b', 'a'])
+        self.assertEqual(len(self.index), 2)
+
+        self.index.remove('unknown')
+        self.assertEqual(len(self.index), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
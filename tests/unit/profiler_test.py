@@ -0,0 +1,60 @@
+# Copyright (c) 2019. All rights reserved.
+
+import signal
+import time
+import unittest
+
+from addrservice.profiler import ProfilerBusyError, SamplingProfiler
+
+
+def busy_loop(seconds: float) -> int:
+    n = 0
+    end = time.process_time() + seconds
+    while time.process_time() < end:
+        n += 1
+    return n
+
+
+@unittest.skipUnless(SamplingProfiler.is_supported(), 'needs SIGPROF')
+class SamplingProfilerTest(unittest.TestCase):
+    def test_sampling(self):
+        handler = signal.getsignal(signal.SIGPROF)
+
+        profiler = SamplingProfiler(interval=0.001)
+        profiler.start()
+        self.assertTrue(SamplingProfiler.is_running())
+        with self.assertRaises(ProfilerBusyError):
+            SamplingProfiler().start()
+        try:
+            busy_loop(0.2)
+        finally:
+            profiler.stop()
+
+        # Idle profiler leaves nothing behind
+        self.assertFalse(SamplingProfiler.is_running())
+        self.assertEqual(signal.getsignal(signal.SIGPROF), handler)
+        self.assertEqual(signal.getitimer(signal.ITIMER_PROF), (0.0, 0.0))
+
+        self.assertGreater(sum(profiler.samples.values()), 0)
+        collapsed = profiler.collapsed()
+        self.assertIn('busy_loop', collapsed)
+        for line in collapsed.splitlines():
+            stack, count = line.rsplit(' ', 1)
+            self.assertGreater(int(count), 0)
+
+        speedscope = profiler.speedscope()
+        frames = speedscope['shared']['frames']
+        profile = speedscope['profiles'][0]
+        self.assertEqual(profile['type'], 'sampled')
+        self.assertEqual(len(profile['samples']), len(profile['weights']))
+        self.assertIn('busy_loop', [f['name'] for f in frames])
+        for sample in profile['samples']:
+            self.assertTrue(all(0 <= i < len(frames) for i in sample))
+
+    def test_invalid_interval(self):
+        with self.assertRaises(ValueError):
+            SamplingProfiler(interval=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+# Copyright (c) 2019. All rights reserved.
+
+import unittest
+
+from addrservice.ratelimit import (
+    RateLimitedError,
+    RateLimiter,
+    RateLimitRule,
+    TokenBucket,
+)
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_take(self) -> None:
+        bucket = TokenBucket(rate=10, burst=2, now=0)
+        self.assertEqual(bucket.take(0), 0)
+        self.assertEqual(bucket.take(0), 0)
+        self.assertAlmostEqual(bucket.take(0), 0.1)
+
+        # Refilled lazily, up to burst
+        self.assertEqual(bucket.take(0.1), 0)
+        self.assertAlmostEqual(bucket.take(0.1), 0.1)
+        self.assertEqual(bucket.take(10), 0)
+        self.assertEqual(bucket.take(10), 0)
+        self.assertGreater(bucket.take(10), 0)
+
+        with self.assertRaises(ValueError):
+            TokenBucket(rate=0, burst=1, now=0)
+
+
+class RateLimitRuleTest(unittest.TestCase):
+    def test_sweep(self) -> None:
+        rule = RateLimitRule('/addressbook', rate=1, burst=2)
+        self.assertEqual(rule.refill_time, 2)
+
+        rule.take('a', now=0)
+        rule.take('b', now=1)
+        rule.take('a', now=1.5)
+        # Least recently used first
+        self.assertEqual(list(rule.buckets), ['b', 'a'])
+
+        self.assertEqual(rule.sweep(now=2.9), 0)
+        self.assertEqual(rule.sweep(now=3), 1)
+        self.assertEqual(list(rule.buckets), ['a'])
+        self.assertEqual(rule.sweep(now=10), 1)
+        self.assertEqual(len(rule.buckets), 0)
+
+        # Slower than a request per second: a burst of one by default
+        rule = RateLimitRule('/addressbook', rate=0.5)
+        self.assertEqual(rule.burst, 1)
+        self.assertEqual(rule.take('a', now=0), 0)
+        self.assertEqual(rule.take('a', now=1), 1)
+        self.assertEqual(rule.take('a', now=2), 0)
+
+        with self.assertRaises(ValueError):
+            RateLimitRule('/addressbook', rate=0.1, burst=0.5)
+
+
+class RateLimiterTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.limiter = RateLimiter.from_config({
+            'key': 'api-key',
+            'rules': [
+                {'path': '/addressbook/?$', 'methods': ['post'], 'rate': 1},
+                {'path': '/addressbook', 'rate': 100, 'burst': 200},
+            ],
+        })
+
+    def test_rules(self) -> None:
+        self.limiter.check('POST', '/addressbook', 'ip:a', now=0)
+        with self.assertRaises(RateLimitedError) as cm:
+            self.limiter.check('POST', '/addressbook/', 'ip:a', now=0.5)
+        self.assertAlmostEqual(cm.exception.retry_after, 0.5)
+
+        # Other clients, and requests of other rules
+        self.limiter.check('POST', '/addressbook', 'ip:b', now=0.5)
+        self.limiter.check('GET', '/addressbook', 'ip:a', now=0.5)
+        self.limiter.check('POST', '/addressbook/x', 'ip:a', now=0.5)
+        # No rule, no limit
+        for _ in range(3):
+            self.limiter.check('POST', '/healthz', 'ip:a', now=0.5)
+
+        self.assertEqual(self.limiter.stats(), {
+            'clients': 3, 'limited': 1, 'swept': 0
+        })
+        self.limiter.sweep(now=100)
+        self.assertEqual(self.limiter.stats()['clients'], 0)
+
+    def test_tune(self) -> None:
+        self.limiter.check('POST', '/addressbook', 'ip:a', now=0)
+        self.limiter.tune(RateLimiter.from_config({
+            'rules': [
+                {'path': '/addressbook/?$', 'methods': ['post'], 'rate': 1},
+                {'path': '/addressbook', 'rate': 1},
+            ],
+        }))
+        self.assertEqual(self.limiter.key, 'ip')
+        # Bucket of the same rule is kept
+        with self.assertRaises(RateLimitedError):
+            self.limiter.check('POST', '/addressbook', 'ip:a', now=0.5)
+        self.limiter.check('GET', '/addressbook', 'ip:a', now=0.5)
+        with self.assertRaises(RateLimitedError):
+            self.limiter.check('GET', '/addressbook', 'ip:a', now=0.5)
+
+    def test_client_key(self) -> None:
+        self.assertEqual(self.limiter.client_key('1.2.3.4', 'k'), 'key:k')
+        self.assertEqual(
+            self.limiter.client_key('1.2.3.4', None), 'ip:1.2.3.4'
+        )
+        limiter = RateLimiter([], key='ip')
+        self.assertEqual(limiter.client_key('1.2.3.4', 'k'), 'ip:1.2.3.4')
+        with self.assertRaises(ValueError):
+            RateLimiter([], key='cookie')
+
+
+if __name__ == '__main__':
+    unittest.main()
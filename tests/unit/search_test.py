@@ -0,0 +1,63 @@
+# Copyright (c) 2019. All rights reserved.
+
+import unittest
+
+from addrservice.search import normalize, trigrams, TrigramIndex
+
+from tests.unit.address_data_test import address_data_suite
+
+
+class TrigramTest(unittest.TestCase):
+    def test_normalize(self) -> None:
+        self.assertEqual(normalize('  Élodie  O’Brien-Smith '), 'elodie o brien smith')  # noqa
+        self.assertEqual(normalize('___'), '')
+
+    def test_trigrams(self) -> None:
+        self.assertEqual(trigrams('Ab'), {'  a', ' ab', 'ab '})
+        self.assertEqual(trigrams('ab AB'), trigrams('ab'))
+        self.assertEqual(trigrams(''), set())
+
+
+class TrigramIndexTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.address_data = address_data_suite()
+        self.index = TrigramIndex()
+        for nickname, addr in self.address_data.items():
+            self.index.on_mutation('create', nickname, None, addr)
+
+    def test_search(self) -> None:
+        self.assertEqual(len(self.index), len(self.address_data))
+
+        for nickname, addr in self.address_data.items():
+            results = self.index.search(addr['name'], k=1)
+            self.assertEqual(results, [(nickname, 1.0)])
+
+        # Partial and misspelt names
+        self.assertEqual(self.index.search('narendr')[0][0], 'namo')
+        self.assertEqual(self.index.search('Rahul Gandi')[0][0], 'raga')
+        # Address fields
+        self.assertEqual(self.index.search('varanasi')[0][0], 'namo')
+
+        self.assertEqual(self.index.search('zzzzqqqq'), [])
+        self.assertEqual(self.index.search(''), [])
+        self.assertEqual(self.index.search('narendra', k=0), [])
+
+    def test_incremental_updates(self) -> None:
+        namo = self.address_data['namo']
+        renamed = dict(namo, name='Someone Else')
+
+        self.index.on_mutation('update', 'namo', None, renamed)
+        self.assertNotEqual(
+            [n for n, _ in self.index.search('narendra modi')], ['namo']
+        )
+        self.assertEqual(self.index.search('someone else')[0][0], 'namo')
+
+        self.index.on_mutation('delete', 'namo', None, None)
+        self.index.on_mutation('delete', 'raga', None, None)
+        self.assertEqual(len(self.index), 0)
+        self.assertEqual(len(self.index.postings), 0)
+        self.assertEqual(self.index.search('someone'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
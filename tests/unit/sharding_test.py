@@ -0,0 +1,57 @@
+# Copyright (c) 2019. All rights reserved.
+
+import collections
+import unittest
+
+from addrservice.sharding import HashRing
+
+
+class HashRingTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.nodes = ['http://node{}'.format(i) for i in range(4)]
+        self.keys = ['nickname-{}'.format(i) for i in range(4000)]
+
+    def test_empty(self) -> None:
+        with self.assertRaises(LookupError):
+            HashRing().node_for('a')
+        with self.assertRaises(ValueError):
+            HashRing(vnodes=0)
+
+    def test_balance(self) -> None:
+        ring = HashRing(self.nodes)
+        counts = collections.Counter(ring.node_for(k) for k in self.keys)
+        self.assertEqual(set(counts), set(self.nodes))
+        for node in self.nodes:
+            # Perfectly even is 1000 each
+            self.assertGreater(counts[node], 600, node)
+            self.assertLess(counts[node], 1400, node)
+
+        # Same placement in any process, for any node order
+        other = HashRing(reversed(self.nodes))
+        for k in self.keys:
+            self.assertEqual(ring.node_for(k), other.node_for(k))
+
+    def test_add_and_remove_node(self) -> None:
+        ring = HashRing(self.nodes)
+        before = {k: ring.node_for(k) for k in self.keys}
+
+        bigger = ring.copy()
+        bigger.add_node('http://node4')
+        self.assertNotIn('http://node4', ring)
+        with self.assertRaises(ValueError):
+            bigger.add_node('http://node4')
+
+        # Only keys taken by the new node move
+        moved = [k for k in self.keys if bigger.node_for(k) != before[k]]
+        self.assertEqual({bigger.node_for(k) for k in moved}, {'http://node4'})
+        self.assertGreater(len(moved), 400)
+        self.assertLess(len(moved), 1200)
+
+        bigger.remove_node('http://node4')
+        self.assertEqual(len(bigger), 4)
+        for k in self.keys:
+            self.assertEqual(bigger.node_for(k), before[k])
+
+
+if __name__ == '__main__':
+    unittest.main()
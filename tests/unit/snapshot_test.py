@@ -0,0 +1,91 @@
+# Copyright (c) 2019. All rights reserved.
+
+import os
+import tempfile
+import unittest
+
+from addrservice.snapshot import (
+    Snapshot,
+    SnapshotFormatError,
+    write_snapshot,
+    write_snapshot_items,
+)
+
+from tests.unit.address_data_test import address_data_suite
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'addressbook.snap')
+        self.address_data = address_data_suite()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self) -> None:
+        entries = dict(self.address_data)
+        entries['zürich'] = entries['namo']
+        entries['Zulu'] = entries['raga']
+
+        count = write_snapshot(self.path, entries, seq=42)
+        self.assertEqual(count, len(entries))
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+
+        snapshot = Snapshot(self.path)
+        self.assertEqual(len(snapshot), len(entries))
+        self.assertEqual(snapshot.seq, 42)
+
+        for nickname, addr in entries.items():
+            self.assertIn(nickname, snapshot)
+            self.assertEqual(snapshot.get(nickname), addr)
+        for nickname in ['', 'a', 'namox', 'zz', 'ÿ']:
+            self.assertNotIn(nickname, snapshot)
+            self.assertIsNone(snapshot.get(nickname))
+
+        self.assertEqual(
+            list(snapshot.nicknames()),
+            sorted(entries, key=lambda n: n.encode('utf-8'))
+        )
+        self.assertEqual(dict(snapshot.items()), entries)
+        snapshot.close()
+
+    def test_empty(self) -> None:
+        write_snapshot(self.path, {})
+        snapshot = Snapshot(self.path)
+        self.assertEqual(len(snapshot), 0)
+        self.assertIsNone(snapshot.get('namo'))
+        self.assertEqual(list(snapshot.items()), [])
+        snapshot.close()
+
+    def test_write_items(self) -> None:
+        items = sorted(self.address_data.items())
+        count = write_snapshot_items(self.path, iter(items), seq=7)
+        self.assertEqual(count, len(items))
+
+        snapshot = Snapshot(self.path)
+        self.assertEqual(snapshot.seq, 7)
+        self.assertEqual(list(snapshot.items()), items)
+        snapshot.close()
+
+        # Must be in order, without duplicates; existing file is kept
+        for bad in [list(reversed(items)), items[:1] + items]:
+            with self.assertRaises(ValueError):
+                write_snapshot_items(self.path, iter(bad))
+            self.assertFalse(os.path.exists(self.path + '.tmp'))
+            self.assertEqual(len(Snapshot(self.path)), len(items))
+
+    def test_invalid_files(self) -> None:
+        write_snapshot(self.path, self.address_data)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+
+        for content in [b'', b'ADDRSNAP', b'x' * 100, data[:-1]]:
+            with open(self.path, 'wb') as f:
+                f.write(content)
+            with self.assertRaises(SnapshotFormatError):
+                Snapshot(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
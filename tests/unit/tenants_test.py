@@ -0,0 +1,204 @@
+# Copyright (c) 2019. All rights reserved.
+
+import asyncio
+import asynctest  # type: ignore
+import os
+import tempfile
+import unittest
+
+from addrservice.ratelimit import RateLimitedError
+from addrservice.search import TrigramIndex
+from addrservice.service import AddressBookService
+from addrservice.tenants import (
+    entry_bytes,
+    QuotaExceededError,
+    TenantAddressBookDB,
+    TenantManager,
+)
+
+from tests.unit.address_data_test import address_data_suite
+
+
+class TenantAddressBookDBTest(asynctest.TestCase):
+    def setUp(self) -> None:
+        self.address_data = address_data_suite()
+        self.nicknames = list(self.address_data.keys())
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_memory_accounting(self) -> None:
+        db = TenantAddressBookDB()
+        addr0 = self.address_data[self.nicknames[0]]
+        addr1 = self.address_data[self.nicknames[1]]
+
+        await db.create_address(addr0, 'a')
+        self.assertEqual(db.bytes, entry_bytes(addr0))
+        await db.create_address(addr1, 'b')
+        await db.update_address('a', addr1)
+        self.assertEqual(db.bytes, 2 * entry_bytes(addr1))
+        await db.delete_address('b')
+        self.assertEqual(db.bytes, entry_bytes(addr1))
+
+        db.load(self.address_data.items(), 5)
+        self.assertEqual(
+            db.bytes, sum(entry_bytes(a) for a in self.address_data.values())
+        )
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_quotas(self) -> None:
+        addr0 = self.address_data[self.nicknames[0]]
+        addr1 = self.address_data[self.nicknames[1]]
+
+        db = TenantAddressBookDB(max_entries=1)
+        await db.create_address(addr0, 'a')
+        with self.assertRaises(QuotaExceededError):
+            await db.create_address(addr0, 'b')
+        # Same nickname: not over quota, but exists
+        with self.assertRaises(KeyError):
+            await db.create_address(addr0, 'a')
+        await db.update_address('a', addr1)
+
+        small, big = sorted([addr0, addr1], key=entry_bytes)
+        db = TenantAddressBookDB(max_bytes=entry_bytes(big))
+        await db.create_address(small, 'a')
+        with self.assertRaises(QuotaExceededError):
+            await db.create_address(small, 'b')
+        # Replacing an entry counts its new size only
+        await db.update_address('a', big)
+        self.assertEqual(db.bytes, entry_bytes(big))
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_concurrent_quota(self) -> None:
+        addr = self.address_data[self.nicknames[0]]
+
+        async def validate(addr) -> None:
+            # Yields, e.g. when offloaded to workers
+            await asyncio.sleep(0)
+
+        db = TenantAddressBookDB(max_entries=1)
+        with asynctest.patch.object(db, '_validate_address', validate):
+            results = await asyncio.gather(
+                db.create_address(addr, 'a'),
+                db.create_address(addr, 'b'),
+                return_exceptions=True
+            )
+        self.assertEqual(results[0], 'a')
+        self.assertIsInstance(results[1], QuotaExceededError)
+        self.assertEqual(list(db.db), ['a'])
+
+
+class TenantManagerTest(asynctest.TestCase):
+    def setUp(self) -> None:
+        self.data_dir = tempfile.TemporaryDirectory()
+        self.address_data = address_data_suite()
+        self.nicknames = list(self.address_data.keys())
+
+    def tearDown(self) -> None:
+        self.data_dir.cleanup()
+
+    def make_manager(self, **kwargs) -> TenantManager:
+        return TenantManager(
+            lambda name, db: AddressBookService(db),
+            self.data_dir.name,
+            **kwargs
+        )
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_isolation_and_eviction(self) -> None:
+        tenants = self.make_manager(idle_timeout=60)
+        a = tenants.acquire('a')
+        b = tenants.acquire('b')
+        self.assertIsNot(a, b)
+        self.assertIs(tenants.acquire('a'), a)
+
+        addr = self.address_data[self.nicknames[0]]
+        await a.post_address(addr, nickname='x')
+        with self.assertRaises(KeyError):
+            await b.get_address('x')
+
+        # Evicted to disk, and loaded again with the same change log seq
+        tenants.release('a')
+        tenants.release('a')
+        tenants.evict('a')
+        self.assertNotIn('a', tenants.tenants)
+        self.assertTrue(os.path.exists(os.path.join(
+            self.data_dir.name, 'a.snap'
+        )))
+        a = tenants.acquire('a')
+        self.assertEqual(await a.get_address('x'), addr)
+        self.assertEqual(a.last_change_seq(), 1)
+        self.assertEqual(tenants.stats()['loads'], 1)
+
+        for name in ['', 'a/b', 'x' * 65]:
+            with self.assertRaises(ValueError):
+                tenants.acquire(name)
+
+        # Stop saves all
+        tenants.stop()
+        self.assertEqual(tenants.tenants, {})
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_load_indexes(self) -> None:
+        tenants = TenantManager(
+            lambda name, db: AddressBookService(
+                db, search_index=TrigramIndex()
+            ),
+            self.data_dir.name
+        )
+        nickname, addr = next(iter(self.address_data.items()))
+        await tenants.acquire('a').post_address(addr, nickname=nickname)
+        tenants.release('a')
+        tenants.evict('a')
+
+        # Entries loaded from disk are indexed
+        results = await tenants.acquire('a').search_addresses(addr['name'])
+        self.assertEqual([r[0] for r in results], [nickname])
+        tenants.stop()
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_idle_sweep(self) -> None:
+        tenants = self.make_manager(idle_timeout=0.05)
+        tenants.start()
+        tenants.acquire('busy')
+        tenants.acquire('idle')
+        tenants.release('idle')
+
+        await asyncio.sleep(0.15)
+        self.assertEqual(list(tenants.tenants), ['busy'])
+        tenants.stop()
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_resident_budget(self) -> None:
+        addr = self.address_data[self.nicknames[0]]
+        tenants = self.make_manager(max_resident_bytes=entry_bytes(addr))
+
+        for name in ['a', 'b']:
+            service = tenants.acquire(name)
+            await service.post_address(addr)
+            tenants.release(name)
+        # Loading c evicts a, least recently used, to fit the budget
+        tenants.acquire('c')
+        self.assertEqual(sorted(tenants.tenants), ['b', 'c'])
+        tenants.stop()
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_rate_limit(self) -> None:
+        tenants = self.make_manager(rate=1, burst=2)
+        tenants.acquire('a')
+        tenants.acquire('a')
+        with self.assertRaises(RateLimitedError) as cm:
+            tenants.acquire('a')
+        self.assertGreater(cm.exception.retry_after, 0)
+        # Other tenants are not limited
+        tenants.acquire('b')
+        tenants.stop()
+
+        # Burst of 0 (as in config without it) is the default
+        tenants = self.make_manager(rate=0.5, burst=0)
+        tenants.acquire('a')
+        with self.assertRaises(RateLimitedError):
+            tenants.acquire('a')
+        tenants.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,15 +1,43 @@
 # Copyright (c) 2019. All rights reserved.
 
+import asyncio
+import contextvars
+import json
+import os
+import tempfile
 import unittest
 
 from addrservice.tracing import (
+    configure_tracing,
+    current_span_context,
+    current_traceparent,
+    end_request_span,
+    get_sampler,
+    get_trace_collectors,
+    prepare_tracing,
+    Sampler,
+    set_sampler,
     set_trace_collectors,
+    start_request_span,
     trace,
     CummulativeFunctionTimeProfiler,
-    Timeline
+    FunctionTimeProfiler,
+    Histogram,
+    HistogramCollector,
+    SpanCollector,
+    SpanContext,
+    STATUS_ERROR,
+    Timeline,
+    merge_profiles,
 )
 
 
+def current_span_id() -> str:
+    ctx = current_span_context()
+    assert ctx is not None
+    return ctx.span_id
+
+
 class TraceTest(unittest.TestCase):
     def test_trace_decorator(self):
         profiler = CummulativeFunctionTimeProfiler()
@@ -43,6 +71,330 @@ class TraceTest(unittest.TestCase):
 
         set_trace_collectors([])
 
+    def test_function_time_profiler(self):
+        profiler = FunctionTimeProfiler()
+        timeline = Timeline()
+        set_trace_collectors([profiler, timeline])
+
+        @trace()
+        def factorial(n: int) -> int:
+            return 1 if n <= 1 else n * factorial(n-1)
+
+        @trace()
+        async def wait() -> None:
+            await asyncio.sleep(0.01)
+
+        self.assertEqual(factorial(5), 120)
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(wait())
+        finally:
+            loop.close()
+            set_trace_collectors([])
+
+        # Span collectors are still called alongside
+        self.assertEqual(len(timeline.timeline), 5*2 + 2)
+
+        prefix = 'TraceTest.test_function_time_profiler.<locals>.'
+        profile = profiler.to_dict()
+        self.assertEqual(set(profile), {prefix + 'factorial', prefix + 'wait'})
+        self.assertEqual(profile[prefix + 'factorial']['calls'], 5)
+        self.assertEqual(profile[prefix + 'wait']['calls'], 1)
+        self.assertGreaterEqual(profile[prefix + 'wait']['total-ns'], 1e7)
+        self.assertEqual(profiler.summary()[-1][:2], (prefix + 'wait', 1))
+
+        # Functions decorated after the profiler was made
+        late_id = len(profiler.calls) + 10
+        profiler.record(late_id, 7)
+        self.assertEqual(profiler.times[late_id], 7)
+
+        merged = merge_profiles(
+            [profile, profile, {'f': profile[prefix + 'wait']}]
+        )
+        self.assertEqual(merged[prefix + 'factorial']['calls'], 10)
+        self.assertEqual(merged['f'], profile[prefix + 'wait'])
+
+        with tempfile.TemporaryDirectory() as d:
+            profiler.export_file = os.path.join(d, 'profile-{pid}.json')
+            profiler.stop()
+            path = os.path.join(d, 'profile-{}.json'.format(os.getpid()))
+            with open(path) as f:
+                self.assertEqual(json.load(f), profile)
+
+    def test_histogram(self):
+        h = Histogram(bounds=[1, 10, 100])
+        self.assertEqual(h.percentile(50), 0)
+        for v in [0.5, 5, 5, 50, 500]:
+            h.observe(v)
+
+        self.assertEqual(h.count, 5)
+        self.assertEqual(h.max, 500)
+        self.assertEqual(h.percentile(50), 10)
+        self.assertEqual(h.percentile(100), 500)
+        self.assertEqual(
+            h.to_dict()['buckets'],
+            {'le_1': 1, 'le_10': 2, 'le_100': 1, 'inf': 1}
+        )
+
+        collector = HistogramCollector()
+        set_trace_collectors([collector])
+
+        @trace()
+        def noop() -> None:
+            pass
+
+        noop()
+        noop()
+        collector.observe('metric', 3)
+        set_trace_collectors([])
+
+        summary = collector.summary()
+        self.assertEqual(summary['metric']['count'], 1)
+        noop_qualname = 'TraceTest.test_histogram.<locals>.noop'
+        self.assertEqual(summary[noop_qualname]['count'], 2)
+
+    def test_traceparent(self):
+        header = '00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01'
+        ctx = SpanContext.from_traceparent(header)
+        self.assertIsNotNone(ctx)
+        self.assertEqual(ctx.trace_id, '0af7651916cd43dd8448eb211c80319c')
+        self.assertEqual(ctx.span_id, 'b7ad6b7169203331')
+        self.assertTrue(ctx.sampled)
+        self.assertEqual(ctx.traceparent(), header)
+
+        for invalid in [
+            None,
+            '',
+            'not a traceparent',
+            'ff-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01',
+            '00-00000000000000000000000000000000-b7ad6b7169203331-01',
+            '00-0af7651916cd43dd8448eb211c80319c-0000000000000000-01',
+            '00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01-xyz',
+        ]:
+            self.assertIsNone(SpanContext.from_traceparent(invalid), invalid)
+
+    def test_span_collector(self):
+        spans = SpanCollector({'batch-size': 2})
+        set_trace_collectors([spans])
+
+        @trace()
+        async def child() -> str:
+            await asyncio.sleep(0)
+            return current_span_id()
+
+        @trace()
+        async def parent() -> str:
+            await child()
+            return current_span_id()
+
+        loop = asyncio.new_event_loop()
+        try:
+            parent_span_id = loop.run_until_complete(parent())
+        finally:
+            loop.close()
+            set_trace_collectors([])
+
+        self.assertEqual(len(spans.queue), 2)
+        child_span, parent_span = spans.queue
+        self.assertEqual(child_span.parent_span_id, parent_span_id)
+        self.assertEqual(
+            child_span.context.trace_id, parent_span.context.trace_id
+        )
+        self.assertIsNone(parent_span.parent_span_id)
+        self.assertGreaterEqual(child_span.end_ns, child_span.start_ns)
+        self.assertIsNone(current_span_context())
+
+        # stop() flushes the queue in batches to the in-memory stand-in
+        spans.stop()
+        self.assertEqual(len(spans.queue), 0)
+        self.assertEqual(len(spans.exported), 1)
+        otlp_spans = spans.exported[0]['resourceSpans'][0]['scopeSpans'][0]['spans']  # noqa
+        self.assertEqual(
+            [s['spanId'] for s in otlp_spans],
+            [child_span.context.span_id, parent_span_id]
+        )
+
+    def test_sampler(self):
+        timeline = Timeline()
+        spans = SpanCollector()
+        profiler = FunctionTimeProfiler()
+        set_trace_collectors([timeline, spans, profiler])
+        # Nothing sampled at the start; failing and slow calls kept
+        sampler = Sampler(rate=0, slow_threshold_ms=20)
+        set_sampler(sampler)
+
+        @trace()
+        def fast(fail: bool) -> None:
+            if fail:
+                raise ValueError()
+
+        @trace()
+        async def slow() -> None:
+            await asyncio.sleep(0.03)
+
+        loop = asyncio.new_event_loop()
+        try:
+            for _ in range(10):
+                fast(False)
+            with self.assertRaises(ValueError):
+                fast(True)
+            loop.run_until_complete(slow())
+        finally:
+            loop.close()
+            set_sampler(None)
+            set_trace_collectors([])
+
+        self.assertEqual(sampler.stats(), {
+            'sampled': 0, 'unsampled': 12, 'capped': 0, 'kept': 2
+        })
+        self.assertEqual(len(timeline.timeline), 4)
+        self.assertTrue(timeline.timeline[1].endswith(
+            'ERROR TraceTest.test_sampler.<locals>.fast'
+        ))
+        failed, slow_span = spans.queue
+        self.assertEqual(failed.status, STATUS_ERROR)
+        self.assertGreaterEqual(
+            slow_span.end_ns - slow_span.start_ns, 20 * 1000000
+        )
+        self.assertIsNone(current_span_context())
+        # Timing collectors see every call
+        fast_profile = profiler.to_dict()[
+            'TraceTest.test_sampler.<locals>.fast'
+        ]
+        self.assertEqual(fast_profile['calls'], 11)
+
+    def test_sampled_traces(self):
+        spans = SpanCollector()
+        set_trace_collectors([spans])
+        # Only the first trace sampled, decided at its root
+        sampler = Sampler(max_per_second=1, burst=1, errors=False)
+        set_sampler(sampler)
+        traceparents = []
+
+        @trace()
+        def child() -> None:
+            traceparents.append(current_traceparent())
+
+        @trace()
+        def root() -> None:
+            child()
+            child()
+
+        try:
+            root()
+            root()
+        finally:
+            set_sampler(None)
+            set_trace_collectors([])
+
+        self.assertEqual(sampler.stats(), {
+            'sampled': 1, 'unsampled': 0, 'capped': 1, 'kept': 0
+        })
+        self.assertEqual(len(spans.queue), 3)
+        self.assertEqual(
+            len(set(s.context.trace_id for s in spans.queue)), 1
+        )
+        self.assertEqual(
+            [t[-2:] for t in traceparents], ['01', '01', '00', '00']
+        )
+        self.assertIsNone(current_span_context())
+
+    def test_sampled_requests(self):
+        spans = SpanCollector()
+        set_trace_collectors([spans])
+        sampler = Sampler(rate=0)
+        set_sampler(sampler)
+
+        @trace()
+        def handle() -> None:
+            pass
+
+        def handle_request(traceparent, status_code: int) -> None:
+            span = start_request_span('GET', traceparent)
+            handle()
+            end_request_span(span, status_code)
+
+        def request(traceparent, status_code: int = 200) -> None:
+            # In a context of its own, as a request handler task is
+            contextvars.copy_context().run(
+                handle_request, traceparent, status_code
+            )
+
+        header = '00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-{}'
+        try:
+            # Sampled as the incoming traceparent says, else by the sampler
+            request(header.format('01'))
+            request(header.format('00'))
+            request(None)
+            # Unless it fails
+            request(None, 500)
+        finally:
+            set_sampler(None)
+            set_trace_collectors([])
+
+        handle_span, request_span, failed_span = spans.queue
+        self.assertEqual(handle_span.parent_span_id, request_span.context.span_id)  # noqa
+        self.assertEqual(request_span.parent_span_id, 'b7ad6b7169203331')
+        self.assertEqual(failed_span.status, STATUS_ERROR)
+        self.assertEqual(sampler.stats(), {
+            'sampled': 0, 'unsampled': 2, 'capped': 0, 'kept': 1
+        })
+
+    def test_sampler_cap(self):
+        sampler = Sampler(max_per_second=1, burst=3, errors=False)
+        self.assertFalse(sampler.tail)
+        self.assertEqual(
+            [sampler.sample() for _ in range(5)], [True] * 3 + [False] * 2
+        )
+        self.assertEqual(sampler.capped, 2)
+        self.assertFalse(sampler.keep(10**10, True))
+
+        with self.assertRaises(ValueError):
+            Sampler(rate=2)
+
+        configure_tracing({
+            'sampling': {'rate': 0.5, 'max-per-second': 100},
+            'addrservice.tracing.Timeline': None,
+        })
+        sampler = get_sampler()
+        self.assertIsNotNone(sampler)
+        self.assertEqual(sampler.rate, 0.5)
+        self.assertEqual(sampler.bucket.burst, 100)
+        configure_tracing({})
+        self.assertIsNone(get_sampler())
+
+    def test_prepare_tracing(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'profile.json')
+            prepare_tracing({
+                'addrservice.tracing.Timeline': None,
+                'addrservice.tracing.FunctionTimeProfiler': {
+                    'export-file': path
+                },
+            })()
+            timeline, profiler = get_trace_collectors()
+
+            apply = prepare_tracing({
+                'sampling': {'rate': 0.5},
+                'addrservice.tracing.Timeline': None,
+                'addrservice.tracing.FunctionTimeProfiler': None,
+            }, restart=True)
+            # Nothing set until applied
+            self.assertIsNone(get_sampler())
+            self.assertIs(get_trace_collectors()[1], profiler)
+            apply()
+            self.assertEqual(get_sampler().rate, 0.5)
+            # Same config, same collector; the replaced one is stopped
+            self.assertIs(get_trace_collectors()[0], timeline)
+            self.assertIsNot(get_trace_collectors()[1], profiler)
+            self.assertTrue(os.path.exists(path))
+
+        with self.assertRaises(KeyError):
+            prepare_tracing({'addrservice.tracing.Nothing': None})
+        prepare_tracing({}, restart=True)()
+        self.assertEqual(get_trace_collectors(), [])
+        self.assertIsNone(get_sampler())
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,101 @@
+# Copyright (c) 2019. All rights reserved.
+
+import asynctest  # type: ignore
+import json
+import threading
+import unittest
+
+from addrservice.addressbook_db import validate_address
+from addrservice.workers import entry_size, WorkerPool
+
+from tests.unit.address_data_test import address_data_suite
+
+
+def current_thread_name(*args) -> str:
+    return threading.current_thread().name
+
+
+class WorkerPoolTest(asynctest.TestCase):
+    def setUp(self) -> None:
+        self.address_data = address_data_suite()
+
+    def test_config(self) -> None:
+        pool = WorkerPool.from_config({
+            'kind': 'process',
+            'max-workers': 2,
+            'offload-thresholds': {'validate': 10},
+        })
+        self.assertEqual(pool.kind, 'process')
+        self.assertEqual(pool.max_workers, 2)
+        self.assertEqual(pool.thresholds['validate'], 10)
+        self.assertEqual(pool.thresholds['serialize'], 1000)
+
+        with self.assertRaises(ValueError):
+            WorkerPool.from_config({'kind': 'fibers'})
+
+    def test_entry_size(self) -> None:
+        self.assertEqual(entry_size({}), 0)
+        self.assertEqual(entry_size('not a dict'), 0)
+        for addr in self.address_data.values():
+            self.assertGreater(entry_size(addr), 0)
+
+    async def test_thread_pool(self) -> None:
+        pool = WorkerPool(thresholds={'op': 10})
+
+        # Not started: always inline
+        name = await pool.run('op', 100, current_thread_name)
+        self.assertEqual(name, threading.current_thread().name)
+
+        pool.start()
+        try:
+            name = await pool.run('op', 1, current_thread_name)
+            self.assertEqual(name, threading.current_thread().name)
+
+            name = await pool.run('op', 10, current_thread_name)
+            self.assertTrue(name.startswith('addrservice-worker'))
+        finally:
+            pool.stop()
+
+        self.assertEqual(pool.stats()['inline'], 2)
+        self.assertEqual(pool.stats()['offloaded'], 1)
+
+    async def test_tune(self) -> None:
+        pool = WorkerPool(max_workers=2, thresholds={'op': 10})
+        pool.start()
+        try:
+            executor = pool.executor
+            pool.tune(WorkerPool(max_workers=2, thresholds={'op': 1}))
+            self.assertEqual(pool.thresholds['op'], 1)
+            self.assertIs(pool.executor, executor)
+
+            # Resized: replaced
+            pool.tune(WorkerPool(max_workers=1, thresholds={'op': 1}))
+            self.assertIsNot(pool.executor, executor)
+            name = await pool.run('op', 10, current_thread_name)
+            self.assertTrue(name.startswith('addrservice-worker'))
+        finally:
+            pool.stop()
+
+    async def test_process_pool(self) -> None:
+        pool = WorkerPool(kind='process', max_workers=1, thresholds={
+            'validate': 0, 'serialize': 0
+        })
+        pool.start()
+        try:
+            for addr in self.address_data.values():
+                await pool.run('validate', 0, validate_address, addr)
+            with self.assertRaises(ValueError):
+                await pool.run('validate', 0, validate_address, {})
+
+            encoded = await pool.run(
+                'serialize', 0, json.dumps, self.address_data
+            )
+            self.assertEqual(json.loads(encoded), self.address_data)
+        finally:
+            pool.stop()
+
+        self.assertEqual(pool.stats()['offloaded'], 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+# Copyright (c) 2019. All rights reserved.
+
+import asyncio
+import asynctest  # type: ignore
+from typing import Dict, List, Optional
+import unittest
+
+from addrservice.write_batch import Write, WriteBatcher
+
+
+class FakeStore:
+    def __init__(self) -> None:
+        self.batches: List[List[Write]] = []
+        self.ones: List[Write] = []
+        self.fail_batches = False
+        self.fail_nicknames: List[str] = []
+
+    async def apply_batch(self, writes: List[Write]) -> None:
+        await asyncio.sleep(0)
+        self.batches.append(writes)
+        if self.fail_batches:
+            raise RuntimeError('batch failed')
+
+    async def apply_one(
+        self,
+        op: str,
+        nickname: str,
+        addr: Optional[Dict]
+    ) -> None:
+        self.ones.append((op, nickname, addr))
+        if nickname in self.fail_nicknames:
+            raise KeyError(nickname)
+
+
+class WriteBatcherTest(asynctest.TestCase):
+    def setUp(self) -> None:
+        self.store = FakeStore()
+
+    def batcher(self, **kwargs) -> WriteBatcher:
+        return WriteBatcher(
+            self.store.apply_batch, self.store.apply_one, **kwargs
+        )
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_batching(self) -> None:
+        batcher = self.batcher(max_delay=0.01)
+        await asyncio.gather(*[
+            batcher.write('create', str(i), {'i': i}) for i in range(10)
+        ])
+
+        self.assertEqual(len(self.store.batches), 1)
+        self.assertEqual(
+            self.store.batches[0],
+            [('create', str(i), {'i': i}) for i in range(10)]
+        )
+        self.assertEqual(batcher.stats()['writes'], 10)
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_coalescing(self) -> None:
+        batcher = self.batcher(max_delay=0.01)
+        await asyncio.gather(
+            batcher.write('create', 'a', {'v': 1}),
+            batcher.write('update', 'a', {'v': 2}),
+            batcher.write('update', 'b', {'v': 1}),
+            batcher.write('delete', 'b', None),
+            batcher.write('create', 'c', {'v': 1}),
+            batcher.write('delete', 'c', None),
+        )
+
+        self.assertEqual(self.store.batches, [[
+            ('create', 'a', {'v': 2}),
+            ('delete', 'b', None),
+            ('create', 'c', {'v': 1}),
+            ('delete', 'c', None),
+        ]])
+        self.assertEqual(batcher.stats()['coalesced'], 2)
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_max_rows(self) -> None:
+        batcher = self.batcher(max_delay=60, max_rows=3)
+        await asyncio.gather(*[
+            batcher.write('create', str(i), None) for i in range(6)
+        ])
+        self.assertEqual([len(b) for b in self.store.batches], [3, 3])
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_failed_batch(self) -> None:
+        batcher = self.batcher(max_delay=0.01)
+        self.store.fail_batches = True
+        self.store.fail_nicknames = ['b']
+
+        with self.assertLogs('addrservice', level='ERROR'):
+            results = await asyncio.gather(
+                batcher.write('create', 'a', {'v': 1}),
+                batcher.write('update', 'a', {'v': 2}),
+                batcher.write('update', 'b', {'v': 1}),
+                return_exceptions=True
+            )
+
+        # Each write applied on its own, with its own outcome
+        self.assertEqual(results[:2], [None, None])
+        self.assertIsInstance(results[2], KeyError)
+        self.assertEqual(self.store.ones, [
+            ('create', 'a', {'v': 1}),
+            ('update', 'a', {'v': 2}),
+            ('update', 'b', {'v': 1}),
+        ])
+        self.assertEqual(batcher.stats()['failed-batches'], 1)
+
+    @asynctest.fail_on(active_handles=True)
+    async def test_buffered(self) -> None:
+        batcher = self.batcher(max_delay=0.01, durability='buffered')
+        await batcher.write('create', 'a', {'v': 1})
+        self.assertEqual(self.store.batches, [])
+        self.assertEqual(batcher.stats()['queued'], 1)
+
+        await batcher.wait('a')
+        self.assertEqual(self.store.batches, [[('create', 'a', {'v': 1})]])
+        await batcher.wait('a')
+
+        await batcher.write('create', 'b', {'v': 1})
+        batcher.stop()
+        await batcher.flush()
+        self.assertEqual(len(self.store.batches), 2)
+
+    def test_durability_config(self) -> None:
+        with self.assertRaises(ValueError):
+            self.batcher(durability='eventually')
+
+        batcher = WriteBatcher.from_config(
+            {'max-delay': 0.5, 'max-rows': 10, 'durability': 'buffered'},
+            self.store.apply_batch,
+            self.store.apply_one
+        )
+        self.assertEqual(batcher.max_delay, 0.5)
+        self.assertEqual(batcher.max_rows, 10)
+        self.assertEqual(batcher.durability, 'buffered')
+
+
+if __name__ == '__main__':
+    unittest.main()